@@ -0,0 +1,53 @@
+"""add bundle_search table
+
+Revision ID: 5c2e9a7d41b3
+Revises: db3ca94867b3
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5c2e9a7d41b3'
+down_revision = 'db3ca94867b3'
+
+
+def upgrade():
+    op.create_table(
+        'bundle_search',
+        sa.Column('bundle_uuid', sa.String(length=63), nullable=False),
+        sa.Column('name', sa.Text(), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('created', sa.BigInteger(), nullable=True),
+        sa.Column('data_size', sa.BigInteger(), nullable=True),
+        sa.ForeignKeyConstraint(['bundle_uuid'], ['bundle.uuid']),
+        sa.PrimaryKeyConstraint('bundle_uuid'),
+        mysql_charset='utf8',
+    )
+    op.create_index('bundle_search_name_index', 'bundle_search', ['name'], mysql_length=63)
+    op.create_index('bundle_search_created_index', 'bundle_search', ['created'])
+    op.create_index('bundle_search_data_size_index', 'bundle_search', ['data_size'])
+
+    # Backfill one row per existing bundle from its metadata.
+    op.execute(
+        '''
+        INSERT INTO bundle_search (bundle_uuid, name, description, created, data_size)
+        SELECT
+            bundle.uuid,
+            MAX(CASE WHEN m.metadata_key = 'name' THEN m.metadata_value END),
+            MAX(CASE WHEN m.metadata_key = 'description' THEN m.metadata_value END),
+            MAX(CASE WHEN m.metadata_key = 'created' THEN CAST(m.metadata_value AS SIGNED) END),
+            MAX(CASE WHEN m.metadata_key = 'data_size' THEN CAST(m.metadata_value AS SIGNED) END)
+        FROM bundle
+        LEFT JOIN bundle_metadata m
+            ON m.bundle_uuid = bundle.uuid
+            AND m.metadata_key IN ('name', 'description', 'created', 'data_size')
+        GROUP BY bundle.uuid
+        '''
+    )
+
+
+def downgrade():
+    op.drop_table('bundle_search')
@@ -0,0 +1,94 @@
+"""add bundle_memo table
+
+Revision ID: 8f1d3b6a92c4
+Revises: 5c2e9a7d41b3
+Create Date: 2026-10-16 13:00:00.000000
+
+"""
+
+import hashlib
+import json
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8f1d3b6a92c4'
+down_revision = '5c2e9a7d41b3'
+
+# Number of bundles whose memo keys are computed and inserted at once.
+BATCH_SIZE = 10000
+
+
+def get_memo_key(command, dependencies):
+    # Frozen copy of codalab.model.bundle_model.get_memo_key at the time of this migration.
+    normalized = json.dumps([command, sorted(set(map(tuple, dependencies)))])
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def upgrade():
+    op.create_table(
+        'bundle_memo',
+        sa.Column('id', sa.BigInteger(), nullable=False, autoincrement=True),
+        sa.Column('bundle_uuid', sa.String(length=63), nullable=False),
+        sa.Column('owner_id', sa.String(length=255), nullable=True),
+        sa.Column('memo_key', sa.String(length=64), nullable=False),
+        sa.ForeignKeyConstraint(['bundle_uuid'], ['bundle.uuid']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('bundle_uuid', name='uix_1'),
+        mysql_charset='utf8',
+    )
+    op.create_index('bundle_memo_key_index', 'bundle_memo', ['memo_key', 'owner_id'])
+
+    # Backfill the memo keys of existing bundles with a command, in the order they were created.
+    bundle = sa.table(
+        'bundle', sa.column('id'), sa.column('uuid'), sa.column('owner_id'), sa.column('command')
+    )
+    bundle_dependency = sa.table(
+        'bundle_dependency',
+        sa.column('child_uuid'),
+        sa.column('child_path'),
+        sa.column('parent_uuid'),
+    )
+    bundle_memo = sa.table(
+        'bundle_memo', sa.column('bundle_uuid'), sa.column('owner_id'), sa.column('memo_key')
+    )
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([bundle.c.id, bundle.c.uuid, bundle.c.owner_id, bundle.c.command])
+            .where(sa.and_(bundle.c.id > last_id, bundle.c.command.isnot(None)))
+            .order_by(bundle.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        dependencies = defaultdict(list)
+        for dep in connection.execute(
+            sa.select(
+                [
+                    bundle_dependency.c.child_uuid,
+                    bundle_dependency.c.child_path,
+                    bundle_dependency.c.parent_uuid,
+                ]
+            ).where(bundle_dependency.c.child_uuid.in_([row.uuid for row in rows]))
+        ):
+            dependencies[dep.child_uuid].append((dep.child_path, dep.parent_uuid))
+        connection.execute(
+            bundle_memo.insert(),
+            [
+                {
+                    'bundle_uuid': row.uuid,
+                    'owner_id': row.owner_id,
+                    'memo_key': get_memo_key(row.command, dependencies[row.uuid]),
+                }
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_table('bundle_memo')
@@ -0,0 +1,24 @@
+"""add dependencies_version to worker_dependency
+
+Revision ID: 3a7c5e1f9b20
+Revises: 8f1d3b6a92c4
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a7c5e1f9b20'
+down_revision = '8f1d3b6a92c4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        'worker_dependency', sa.Column('dependencies_version', sa.String(length=63), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column('worker_dependency', 'dependencies_version')
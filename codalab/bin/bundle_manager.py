@@ -19,9 +19,52 @@ def main():
         type=int,
         default=60,
     )
+    parser.add_argument(
+        '--incremental-scheduling',
+        help='Whether to keep staged bundles in an in-memory queue that is updated from state '
+        'changes, instead of reloading all staged bundles from the database on every iteration '
+        '(True or False)',
+        type=lambda value: value.lower() == 'true',
+        default=False,
+    )
+    parser.add_argument(
+        '--reconcile-interval-seconds',
+        help='Number of seconds between full reloads of the staged bundle queue from the database '
+        'when --incremental-scheduling is set',
+        type=int,
+        default=60,
+    )
+    parser.add_argument(
+        '--max-make-bundle-threads',
+        help='Maximum number of make bundles that are made at the same time',
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        '--max-dependency-copy-threads',
+        help='Maximum number of dependencies of a single make bundle that are copied at the same time',
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        '--make-bundle-link-mode',
+        help='How to materialize make bundle dependencies that are on the same partition as the '
+        'bundle: copy, reflink (copy-on-write clone, falls back to copy if unsupported) or '
+        'hardlink (the bundle shares files with its dependencies)',
+        choices=['copy', 'reflink', 'hardlink'],
+        default='copy',
+    )
     args = parser.parse_args()
 
-    manager = BundleManager(CodaLabManager(), args.worker_timeout_seconds)
+    manager = BundleManager(
+        CodaLabManager(),
+        args.worker_timeout_seconds,
+        incremental_scheduling=args.incremental_scheduling,
+        reconcile_interval_seconds=args.reconcile_interval_seconds,
+        max_make_bundle_threads=args.max_make_bundle_threads,
+        max_dependency_copy_threads=args.max_dependency_copy_threads,
+        make_bundle_link_mode=args.make_bundle_link_mode,
+    )
     # Register a signal handler to ensure safe shutdown.
     for sig in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]:
         signal.signal(sig, lambda signup, frame: manager.signal())
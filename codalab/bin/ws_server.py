@@ -15,19 +15,35 @@ worker_to_ws: Dict[str, Any] = {}
 
 async def rest_server_handler(websocket):
     """Handles routes of the form: /main. This route is called by the rest-server
-    whenever a worker needs to be pinged (to ask it to check in). The body of the
+    whenever a worker needs to be pinged (to ask it to check in). The body of each
     message is the worker id to ping. This function sends a message to the worker
     with that worker id through an appropriate websocket.
-    """
-    # Got a message from the rest server.
-    worker_id = await websocket.recv()
-    logger.warning(f"Got a message from the rest server, to ping worker: {worker_id}.")
 
+    The rest-server keeps the connection open and sends many messages on it, so
+    messages are handled until the connection is closed.
+    """
+    try:
+        async for worker_id in websocket:
+            # Got a message from the rest server.
+            logger.info(f"Got a message from the rest server, to ping worker: {worker_id}.")
+            try:
+                worker_ws = worker_to_ws[worker_id]
+            except KeyError:
+                logger.error(f"Websocket not found for worker: {worker_id}")
+                continue
+            # Don't wait for the worker, so that a slow worker doesn't hold up the pings to
+            # the other workers that are sent on this connection.
+            asyncio.ensure_future(ping_worker(worker_ws, worker_id))
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+async def ping_worker(worker_ws, worker_id):
+    """Sends a message to the worker with the given worker id to ask it to check in."""
     try:
-        worker_ws = worker_to_ws[worker_id]
         await worker_ws.send(worker_id)
-    except KeyError:
-        logger.error(f"Websocket not found for worker: {worker_id}")
+    except websockets.exceptions.ConnectionClosed:
+        logger.error(f"Socket connection closed with worker {worker_id}.")
 
 
 async def worker_handler(websocket, worker_id):
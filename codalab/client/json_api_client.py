@@ -418,6 +418,24 @@ class JsonApiClient(RestClient):
             )
         )
 
+    @wrap_exception('Unable to fetch {1}')
+    def fetch_page(self, resource_type, params=None):
+        """
+        Same as JsonApiClient.fetch for a list of resources, but also returns the
+        document meta, which holds e.g. the `next_cursor` token of paginated
+        bundle searches.
+
+        :param resource_type: resource type as string
+        :param params: dict of query parameters
+        :return: tuple of (list of fetched objects, meta dict)
+        """
+        document = self._make_request(
+            method='GET',
+            path=self._get_resource_path(resource_type),
+            query_params=self._pack_params(params),
+        )
+        return self._unpack_document(document), (document or {}).get('meta', {})
+
     def fetch_one(self, resource_type, resource_id=None, params=None):
         """
         Same as JsonApiClient.fetch, but always returns exactly one resource
@@ -632,6 +650,31 @@ class JsonApiClient(RestClient):
             'GET', request_path, headers=headers, query_params=params, return_response=True
         )
 
+    @wrap_exception('Unable to follow contents of bundle {1}')
+    def follow_contents_blob(self, target, offset=0, timeout=20):
+        """
+        Returns a file-like object that streams the target file of a running bundle from
+        offset, including what is appended to it, until the bundle is no longer running or for
+        at most timeout seconds. Use read1() to get the data as soon as it arrives.
+
+        :param target: A worker.download_util.BundleTarget
+        :param offset: byte offset in the file to start at
+        :param timeout: maximum number of seconds the server keeps the response open
+        :return: file-like object streaming the file
+        """
+        request_path = '/bundles/%s/contents/follow/%s' % (
+            target.bundle_uuid,
+            urllib.parse.quote(target.subpath),
+        )
+        return self._make_request(
+            'GET',
+            request_path,
+            query_params={'offset': offset, 'timeout': timeout},
+            return_response=True,
+            # The server doesn't send anything while no data is written.
+            timeout_seconds=timeout + 30,
+        )
+
     @wrap_exception('Unable to upload contents of bundle {1}')
     def upload_contents_blob(
         self,
@@ -1,24 +1,36 @@
-import time
-
 from io import BytesIO, SEEK_SET, SEEK_END
-from threading import Lock
+from threading import Condition
+
+
 class MultiReaderFileStream(BytesIO):
     """
     FileStream that takes an input stream fileobj, and supports N readers with the following features and constraints:
         - Each reader's postion is tracked
-        - A buffer of bytes() is stored which stores bytes from the position of the slowest reader
+        - A preallocated ring buffer of MAX_THRESHOLD bytes stores bytes from the position of the slowest reader
           minus a LOOKBACK_LENGTH (default 32 MiB) to the fastest reader
         - The fastest reader can be at most MAX_THRESHOLD (default 64 MiB) ahead of the slowest reader, reads made
-          further than 64MiB will sleep until the slowest reader catches up
+          further than 64MiB will block until the slowest reader catches up
+        - A closed reader no longer holds back the other readers
     """
     NUM_READERS = 2
 
-    def __init__(self, fileobj, lookback_length=32*1024*1024):
-        self._buffer = bytes() # Buffer of bytes read from the file object within the limits defined
-        self._buffer_start_pos = 0 # start position of buffer in the fileobj (min reader position - LOOKBACK LENGTH)
-        self._pos = [0 for _ in range(self.NUM_READERS)] # position of each reader in the fileobj
-        self._fileobj = fileobj # The original file object the readers are reading from
-        self._lock = Lock()  # lock to ensure one does not concurrently read self._fileobj / write to the buffer.
+    def __init__(self, fileobj, lookback_length=32*1024*1024, num_readers=None):
+        if num_readers is None:
+            num_readers = self.NUM_READERS
+        self.LOOKBACK_LENGTH = lookback_length
+        self.MAX_THRESHOLD = self.LOOKBACK_LENGTH * 2
+        self._buffer = bytearray(self.MAX_THRESHOLD)  # Ring buffer; byte at position p of the fileobj is stored at p % MAX_THRESHOLD
+        self._view = memoryview(self._buffer)
+        self._buffer_start_pos = 0  # start position of buffer in the fileobj (min reader position - LOOKBACK LENGTH)
+        self._buffer_end_pos = 0  # number of bytes read from the fileobj so far
+        self._eof = False  # whether the fileobj has been read to the end
+        self._filling = False  # whether a reader is currently reading from the fileobj
+        self._pos = [0 for _ in range(num_readers)]  # position of each reader in the fileobj
+        self._closed = [False for _ in range(num_readers)]  # readers that are done reading
+        self._fileobj = fileobj  # The original file object the readers are reading from
+        # Condition guarding all of the state above. Readers wait on it until they are within MAX_THRESHOLD
+        # of the buffer start, or until another reader has finished reading from the fileobj.
+        self._cond = Condition()
         class FileStreamReader(BytesIO):
             def __init__(s, index):
                 s._index = index
@@ -26,67 +38,142 @@ class MultiReaderFileStream(BytesIO):
             def read(s, num_bytes=None):
                 return self.read(s._index, num_bytes)
 
+            def readinto(s, b):
+                return self.readinto(s._index, b)
+
             def peek(s, num_bytes):
                 return self.peek(s._index, num_bytes)
-            
+
             def seek(s, offset, whence=SEEK_SET):
                 return self.seek(s._index, offset, whence)
 
-        self.readers = [FileStreamReader(i) for i in range(0, self.NUM_READERS)]
-        self.LOOKBACK_LENGTH = lookback_length
-        self.MAX_THRESHOLD = self.LOOKBACK_LENGTH * 2
+            def close(s):
+                self.close_reader(s._index)
 
-    def _fill_buf_bytes(self, num_bytes=0):
+        self.readers = [FileStreamReader(i) for i in range(0, num_readers)]
+
+    def _fill_buf_bytes(self, new_end_pos: int):
         """
-        Fills the buffer with bytes from the fileobj
+        Fills the buffer with bytes from the fileobj until it reaches new_end_pos or the end of the fileobj.
+        Must be called with self._cond held; the condition is released while reading from the fileobj
+        so that other readers can keep copying already-buffered bytes.
         """
-        s = self._fileobj.read(num_bytes)
-        if not s:
-            return
-        self._buffer += s
+        self._filling = True
+        try:
+            while self._buffer_end_pos < new_end_pos and not self._eof:
+                self._cond.release()
+                try:
+                    s = self._fileobj.read(new_end_pos - self._buffer_end_pos)
+                finally:
+                    self._cond.acquire()
+                if not s:
+                    self._eof = True
+                    break
+                # Copy into the ring, wrapping around to the start of the buffer if needed.
+                s = memoryview(s).cast('B')
+                offset = self._buffer_end_pos % self.MAX_THRESHOLD
+                first = min(len(s), self.MAX_THRESHOLD - offset)
+                self._view[offset:offset + first] = s[:first]
+                if first < len(s):
+                    self._view[:len(s) - first] = s[first:]
+                self._buffer_end_pos += len(s)
+        finally:
+            self._filling = False
+            self._cond.notify_all()
 
+    def _fetch(self, index: int, num_bytes: int):
+        """
+        Waits until the next num_bytes bytes of the given reader are buffered, and returns the
+        range of fileobj positions that can be copied out of the buffer. Must be called with self._cond held.
+        """
+        start = self._pos[index]
+        new_pos = start + num_bytes
+        # Block while this reader is too far ahead of the slowest reader, or while it needs bytes that
+        # another reader is currently reading from the fileobj.
+        while (self._filling and new_pos > self._buffer_end_pos) or (
+            min(new_pos, self._buffer_end_pos if self._eof else new_pos) - self._buffer_start_pos
+            > self.MAX_THRESHOLD
+        ):
+            self._cond.wait()
+        if new_pos > self._buffer_end_pos:
+            self._fill_buf_bytes(new_pos)
+        return start, max(start, min(new_pos, self._buffer_end_pos))
+
+    def _copy_into(self, dest, start: int, end: int):
+        """
+        Copies the bytes between fileobj positions start and end from the ring buffer into dest.
+        """
+        offset = start % self.MAX_THRESHOLD
+        first = min(end - start, self.MAX_THRESHOLD - offset)
+        dest[:first] = self._view[offset:offset + first]
+        if first < end - start:
+            dest[first:end - start] = self._view[:end - start - first]
+
+    def _get_bytes(self, start: int, end: int):
+        """
+        Returns the bytes between fileobj positions start and end, copied once out of the ring buffer.
+        """
+        offset = start % self.MAX_THRESHOLD
+        if offset + end - start <= self.MAX_THRESHOLD:
+            return self._view[offset:offset + end - start].tobytes()
+        s = bytearray(end - start)
+        self._copy_into(s, start, end)
+        return bytes(s)
+
+    def _advance(self, index: int, num_bytes: int):
+        """
+        Moves the given reader forward, dropping bytes from the start of the buffer that are no longer
+        within LOOKBACK_LENGTH of the slowest reader. Must be called with self._cond held.
+        """
+        self._pos[index] += num_bytes
+        open_pos = [pos for pos, closed in zip(self._pos, self._closed) if not closed]
+        min_pos = min(open_pos) if open_pos else self._buffer_end_pos
+        # NOTE: it's possible for this to be behind the buffer start if seek backwards occur
+        new_start_pos = min(min_pos - self.LOOKBACK_LENGTH, self._buffer_end_pos)
+        if new_start_pos > self._buffer_start_pos:
+            self._buffer_start_pos = new_start_pos
+            self._cond.notify_all()
 
     def read(self, index: int, num_bytes: int):  # type: ignore
         """Read the specified number of bytes from the associated file.
         index: index that specifies which reader is reading.
         """
-        s = self.peek(index, num_bytes)
-        with self._lock:
-            # Modify reader position in fileobj
-            self._pos[index] += len(s)
-
-            # If this reader is the minimum reader, we can remove some bytes from the beginning of the buffer
-            # Calculated min position of buffer minus current min position of buffer
-            diff = (min(self._pos) - self.LOOKBACK_LENGTH) - self._buffer_start_pos 
-            # NOTE: it's possible for diff < 0 if seek backwards occur
-            if diff > 0:
-                self._buffer = self._buffer[diff:]
-                self._buffer_start_pos += diff
+        with self._cond:
+            start, end = self._fetch(index, num_bytes)
+            s = self._get_bytes(start, end)
+            self._advance(index, end - start)
         return s
 
-    def peek(self, index: int, num_bytes: int):   # type: ignore
-        new_pos = self._pos[index] + num_bytes
-        while new_pos - self._buffer_start_pos > self.MAX_THRESHOLD:
-            time.sleep(.1) # 100 ms
-        
-        with self._lock:
-            # Calculate how many new bytes need to be read
-            new_bytes_needed = new_pos - max(self._pos)
-            if new_bytes_needed > 0:
-                self._fill_buf_bytes(new_bytes_needed)
-
-            # Get the bytes in the buffer that correspond to the read function call
-            buffer_index = self._pos[index] - self._buffer_start_pos
-            s = self._buffer[buffer_index:buffer_index + num_bytes]
+    def readinto(self, index: int, b):  # type: ignore
+        """Read bytes from the associated file directly into the writable buffer b.
+        index: index that specifies which reader is reading.
+        """
+        with self._cond:
+            start, end = self._fetch(index, len(b))
+            self._copy_into(memoryview(b).cast('B'), start, end)
+            self._advance(index, end - start)
+        return end - start
 
+    def peek(self, index: int, num_bytes: int):   # type: ignore
+        with self._cond:
+            start, end = self._fetch(index, num_bytes)
+            s = self._get_bytes(start, end)
         return s
 
     def seek(self, index: int, offset: int, whence=SEEK_SET):
         if whence == SEEK_END:
             super().seek(offset, whence)
         else:
-            assert offset >= self._buffer_start_pos
-            self._pos[index] = offset
-            
+            with self._cond:
+                assert offset >= self._buffer_start_pos
+                self._pos[index] = offset
+                self._cond.notify_all()
+
+    def close_reader(self, index: int):
+        """Marks the given reader as done, so that it no longer holds back the other readers."""
+        with self._cond:
+            self._closed[index] = True
+            self._advance(index, 0)
+
     def close(self):
-        self.__input.close()
+        self._fileobj.close()
@@ -98,6 +98,8 @@ class SQLiteIndexedTar(MountSource):
         verifyModificationTime     : bool                = False,
         parallelization            : int                 = 1,
         printDebug                 : int                 = 0,
+        readOnlyIndex              : bool                = False,
+        gzipBufferSize             : Optional[int]       = None,
         # pylint: disable=unused-argument
         **kwargs
         # fmt: on
@@ -132,6 +134,12 @@ class SQLiteIndexedTar(MountSource):
                                      tar will be mounted at <file>/ instead of <file>.tar/.
         verifyModificationTime : If true, then the index will be recreated automatically if the TAR archive has a more
                                  recent modification time than the index file.
+        gzipBufferSize : Size of the buffer of decompressed data for gzip archives. Every seek outside of the buffer
+                         decompresses this many bytes, so random reads of small files are faster with a smaller
+                         buffer. Defaults to 4 * gzipSeekPointSpacing.
+        readOnlyIndex : If true, then an existing index file is opened with a read-only SQLite connection, so that
+                        the same index file can be shared by several processes. The index must already contain
+                        the compression offsets.
         kwargs : Unused. Only for compatibility with generic MountSource interface.
         """
 
@@ -150,6 +158,7 @@ class SQLiteIndexedTar(MountSource):
         self.parallelization            = parallelization
         self.printDebug                 = printDebug
         self.isFileObject               = fileObject is not None
+        self.readOnlyIndex              = readOnlyIndex
         # fmt: on
 
         # Determine an archive file name to show for debug output
@@ -177,7 +186,8 @@ class SQLiteIndexedTar(MountSource):
         # compression   : Stores what kind of compression the originally specified TAR file uses.
         # isTar         : Can be false for the degenerated case of only a bz2 or gz file not containing a TAR
         self.tarFileObject, self.rawFileObject, self.compression, self.isTar = SQLiteIndexedTar._openCompressedFile(
-            fileObject, gzipSeekPointSpacing, encoding, self.parallelization, printDebug=self.printDebug, filename=self.tarFileName
+            fileObject, gzipSeekPointSpacing, encoding, self.parallelization, printDebug=self.printDebug, filename=self.tarFileName,
+            gzipBufferSize=gzipBufferSize,
         )
 
         if not self.isTar and not self.rawFileObject:
@@ -255,6 +265,9 @@ class SQLiteIndexedTar(MountSource):
             self._reloadIndexReadOnly()
             return
 
+        if self.readOnlyIndex:
+            raise InvalidIndexError("Could not load the read-only index in " + str(possibleIndexFilePaths))
+
         # Find a suitable (writable) location for the index database
         if writeIndex and indexFilePath != ':memory:':
             for indexPath in possibleIndexFilePaths:
@@ -533,7 +546,8 @@ class SQLiteIndexedTar(MountSource):
             return
 
         self.sqlConnection.close()
-        self.sqlConnection = SQLiteIndexedTar._openSqlDb(f"file:{self.indexFilePath}?mode=rw", uri=True)
+        mode = "ro" if self.readOnlyIndex else "rw"
+        self.sqlConnection = SQLiteIndexedTar._openSqlDb(f"file:{self.indexFilePath}?mode={mode}", uri=True)
 
     @staticmethod
     def _tarInfoFullMode(tarInfo: tarfile.TarInfo) -> int:
@@ -1166,7 +1180,10 @@ class SQLiteIndexedTar(MountSource):
             return
 
         t0 = time.time()
-        self.sqlConnection = self._openSqlDb(indexFilePath)
+        if self.readOnlyIndex:
+            self.sqlConnection = self._openSqlDb(f"file:{indexFilePath}?mode=ro", uri=True)
+        else:
+            self.sqlConnection = self._openSqlDb(indexFilePath)
         tables = [x[0] for x in self.sqlConnection.execute('SELECT name FROM sqlite_master WHERE type="table"')]
         versions = None
         try:
@@ -1303,10 +1320,11 @@ class SQLiteIndexedTar(MountSource):
             print("       and mounting is slow, try to find out why loading fails repeatedly,")
             print("       e.g., by opening an issue on the public github page.")
 
-            try:
-                os.remove(indexFilePath)
-            except OSError:
-                print("[Warning] Failed to remove corrupted old cached index file:", indexFilePath)
+            if not self.readOnlyIndex:
+                try:
+                    os.remove(indexFilePath)
+                except OSError:
+                    print("[Warning] Failed to remove corrupted old cached index file:", indexFilePath)
 
         if self.printDebug >= 3 and self.indexIsLoaded():
             print("Loaded index", indexFilePath)
@@ -1371,6 +1389,7 @@ class SQLiteIndexedTar(MountSource):
     @staticmethod
     def _openCompressedFile(
         fileobj: IO[bytes], gzipSeekPointSpacing: int, encoding: str, parallelization: int, printDebug: int = 0, filename = None,
+        gzipBufferSize: Optional[int] = None,
     ) -> Any:
         """
         Opens a file possibly undoing the compression.
@@ -1390,7 +1409,12 @@ class SQLiteIndexedTar(MountSource):
 
         if compression == 'gz':
             # drop_handles keeps a file handle opening as is required to call tell() during decoding
-            tar_file = indexed_gzip.IndexedGzipFile(fileobj=fileobj, drop_handles=False, spacing=gzipSeekPointSpacing)
+            tar_file = indexed_gzip.IndexedGzipFile(
+                fileobj=fileobj,
+                drop_handles=False,
+                spacing=gzipSeekPointSpacing,
+                buffer_size=gzipBufferSize if gzipBufferSize else 4 * gzipSeekPointSpacing,
+            )
         elif compression == 'bz2':
             tar_file = indexed_bzip2.open(fileobj, parallelization=parallelization)
         else:
@@ -1443,6 +1467,8 @@ class SQLiteIndexedTar(MountSource):
                 offsets = dict(db.execute(f"SELECT blockoffset,dataoffset FROM {table_name};"))
                 fileObject.set_block_offsets(offsets)
             except Exception:
+                if self.readOnlyIndex:
+                    return
                 if self.printDebug >= 2:
                     print(f"[Info] Could not load {self.compression} block offset data. Will create it from scratch.")
 
@@ -1504,6 +1530,11 @@ class SQLiteIndexedTar(MountSource):
                 finally:
                     self._uncheckedRemove(gzindex)
 
+            if self.readOnlyIndex:
+                # A read-only index can't store new offsets. Seek points will be created on the fly instead.
+                print("[Warning] Could not load GZip Block offset data from the read-only index.")
+                return
+
             # Store the offsets into a temporary file and then into the SQLite database
             if self.printDebug >= 2:
                 print("[Info] Could not load GZip Block offset data. Will create it from scratch.")
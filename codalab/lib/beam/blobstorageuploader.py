@@ -7,25 +7,35 @@ from apache_beam.io.azure.blobstorageio import parse_azfs_path
 import base64
 from codalab.worker.un_gzip_stream import BytesBuffer
 from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
 
 class BlobStorageUploader(Uploader):
   """An improved version of apache_beam.io.azure.blobstorageio.BlobStorageUploader
   that handles multipart streaming (block-by-block) uploads.
+
+  Blocks are staged by NUM_UPLOAD_THREADS concurrent requests. At most MAX_BUFFERED_BYTES of
+  blocks are held in memory while they wait to be staged; put() blocks until enough of them
+  have been staged, so a fast producer (e.g. compression) can't outrun the uploads. An error
+  staging a block is raised by the next call to put() or finish().
   TODO (Ashwin): contribute this back upstream to Apache Beam (https://github.com/codalab/codalab-worksheets/issues/3475).
   """
   # Note that Blob Storage currently can hold a maximum of 100,000 uncommitted blocks.
   # This means that with this current implementation, we can upload a file with a maximum
   # size of 10 TiB to Blob Storage. To exceed that limit, we must either increase MIN_WRITE_SIZE
   # or modify the implementation of this class to call commit_block_list more often (and not
-  # just at the end of the upload). 
-  
-  # Set MIN_WRITE_SIZE to 20 MiB to prevent first put blob request timeout when uploading 
+  # just at the end of the upload).
+
+  # Set MIN_WRITE_SIZE to 20 MiB to prevent first put blob request timeout when uploading
   MIN_WRITE_SIZE = 20 * 1024 * 1024
   # Maximum block size is 4000 MiB (https://docs.microsoft.com/en-us/rest/api/storageservices/put-block#remarks).
   # Set MAX_WRITE_SIZE to 50 MiB to prevent first put blob request timeout when uploading (https://github.com/Azure/azure-sdk-for-python/issues/12166)
   MAX_WRITE_SIZE = 50 * 1024 * 1024
+  # Number of blocks that are staged concurrently.
+  NUM_UPLOAD_THREADS = 8
+  # Maximum number of bytes of blocks that are being staged or waiting to be staged.
+  MAX_BUFFERED_BYTES = 256 * 1024 * 1024
 
-  def __init__(self, client, path, mime_type='application/octet-stream'):
+  def __init__(self, client, path, mime_type='application/octet-stream', num_upload_threads=None, max_buffered_bytes=None):
     self._client = client
     self._path = path
     self._container, self._blob = parse_azfs_path(path)
@@ -37,10 +47,15 @@ class BlobStorageUploader(Uploader):
     self.block_number = 1
     self.buffer = BytesBuffer()
     self.block_list = []
-    self.thread_pool = ThreadPoolExecutor(8)
+    self.thread_pool = ThreadPoolExecutor(num_upload_threads or BlobStorageUploader.NUM_UPLOAD_THREADS)
     self.all_tasks = []
+    self.max_buffered_bytes = max_buffered_bytes or BlobStorageUploader.MAX_BUFFERED_BYTES
+    self._buffered_bytes = 0 # bytes of blocks submitted to the thread pool that haven't been staged yet
+    self._error = None # first error raised while staging a block
+    self._cond = Condition()
 
   def put(self, data):
+    self._raise_error()
     self.buffer.write(data.tobytes())
 
     while len(self.buffer) >= BlobStorageUploader.MIN_WRITE_SIZE:
@@ -48,11 +63,43 @@ class BlobStorageUploader(Uploader):
       chunk = self.buffer.read(BlobStorageUploader.MAX_WRITE_SIZE)
       self._write_to_blob(chunk)
 
+  def _raise_error(self):
+    with self._cond:
+      error = self._error
+    if error is not None:
+      self.thread_pool.shutdown(wait=False)
+      raise error
+
+  def _stage_block(self, block_id, data):
+    try:
+      self._blob_to_upload.stage_block(block_id, data)
+    except Exception as e:
+      with self._cond:
+        if self._error is None:
+          self._error = e
+      raise
+    finally:
+      with self._cond:
+        self._buffered_bytes -= len(data)
+        self._cond.notify_all()
+
   def _write_to_blob(self, data):
+    # Wait until the blocks in flight leave room for this one. A block is always let through when
+    # nothing is in flight, so that a block larger than the budget can't block forever.
+    with self._cond:
+      while (
+        self._error is None
+        and self._buffered_bytes > 0
+        and self._buffered_bytes + len(data) > self.max_buffered_bytes
+      ):
+        self._cond.wait()
+      if self._error is None:
+        self._buffered_bytes += len(data)
+    self._raise_error()
     # block_id's have to be base-64 strings normalized to have the same length.
     block_id = base64.b64encode('{0:-32d}'.format(self.block_number).encode()).decode()
     # put the blob content to server in parallel, but blob is uncommitted
-    self.all_tasks.append(self.thread_pool.submit(self._blob_to_upload.stage_block, block_id, data))
+    self.all_tasks.append(self.thread_pool.submit(self._stage_block, block_id, data))
     self.block_list.append(BlobBlock(block_id))
     self.block_number = self.block_number + 1
 
@@ -60,4 +107,7 @@ class BlobStorageUploader(Uploader):
     # The buffer will have a size smaller than MIN_WRITE_SIZE, so its contents can fit into memory.
     self._write_to_blob(self.buffer.read())
     self.thread_pool.shutdown(wait=True)
+    for task in self.all_tasks:
+      # Raises the error of any block that failed to be staged.
+      task.result()
     self._blob_to_upload.commit_block_list(self.block_list, content_settings=self._content_settings)
@@ -17,6 +17,7 @@ results in the following:
 import argparse
 import codecs
 import datetime
+import http.client
 import inspect
 import itertools
 import os
@@ -25,6 +26,7 @@ import shutil
 import sys
 import time
 import textwrap
+import threading
 import json
 from collections import defaultdict
 from contextlib import closing
@@ -80,7 +82,7 @@ from codalab.lib.cli_util import (
     UUID_POST_FUNC,
 )
 from codalab.objects.permission import group_permissions_str, parse_permission, permission_str
-from codalab.client.json_api_client import JsonApiRelationship
+from codalab.client.json_api_client import JsonApiException, JsonApiRelationship
 from codalab.lib.formatting import contents_str
 from codalab.lib.completers import (
     AddressesCompleter,
@@ -2143,6 +2145,8 @@ class BundleCLI(object):
             '',
             '  search .limit=<limit>                  : Limit the number of results to the top <limit> (e.g., 50).',
             '  search .offset=<offset>                : Return results starting at <offset>.',
+            '  search .cursor                         : Page through results at a constant cost per page; prints the cursor of the next page.',
+            '  search .cursor=<cursor>                : Return the page of results after <cursor>.',
             '',
             '  search .before=<datetime>              : Returns bundles created before (inclusive) given ISO 8601 timestamp (e.g., .before=2042-03-14).',
             '  search .after=<datetime>               : Returns bundles created after (inclusive) given ISO 8601 timestamp (e.g., .after=2120-10-15T00:00:00-08).',
@@ -2181,10 +2185,13 @@ class BundleCLI(object):
     def do_search_command(self, args):
         client, worksheet_uuid = self.parse_client_worksheet_uuid(args.worksheet_spec)
 
-        bundles = client.fetch(
-            'bundles',
-            params={'worksheet': worksheet_uuid, 'keywords': args.keywords, 'include': ['owner']},
-        )
+        params = {'worksheet': worksheet_uuid, 'keywords': args.keywords, 'include': ['owner']}
+        next_cursor = None
+        if any(keyword.split('=')[0] == '.cursor' for keyword in args.keywords):
+            bundles, meta = client.fetch_page('bundles', params=params)
+            next_cursor = meta.get('next_cursor')
+        else:
+            bundles = client.fetch('bundles', params=params)
 
         # Print direct numeric result
         if 'meta' in bundles:
@@ -2198,6 +2205,8 @@ class BundleCLI(object):
             )
         elif not args.uuid_only:
             print(NO_RESULTS_FOUND, file=self.stderr)
+        if next_cursor:
+            print('Next page: .cursor=%s' % next_cursor, file=self.stderr)
 
         # Add the bundles to the current worksheet
         if args.append:
@@ -2764,29 +2773,46 @@ class BundleCLI(object):
                     continue
                 break
 
+        # If the subpaths we're interested in appeared, check if they are
+        # files and if so, initialize the offsets.
+        for i in range(0, len(subpaths)):
+            target_info = client.fetch_contents_info(BundleTarget(bundle_uuid, subpaths[i]), 0)
+            subpath_targets[i] = target_info['resolved_target']
+            if target_info['type'] == 'file':
+                subpath_is_file[i] = True
+                if from_start:
+                    subpath_offset[i] = 0
+                else:
+                    # Go to near the end of the file (TODO: make this match up with lines)
+                    subpath_offset[i] = max(target_info['size'] - 64, 0)
+            else:
+                subpath_is_file[i] = False
+
+        # While the bundle runs, have the server push the new data of each file as it is
+        # written. This returns once the bundle finished, or if the server can't follow files,
+        # in which case we fall back to polling below.
+        if run_state not in State.FINAL_STATES:
+            output_lock = threading.Lock()
+            follow_threads = [
+                threading.Thread(
+                    target=self._follow_file,
+                    args=(client, bundle_uuid, subpath_targets, subpath_offset, i, output_lock),
+                    daemon=True,
+                )
+                for i in range(0, len(subpaths))
+                if subpath_is_file[i]
+            ]
+            for thread in follow_threads:
+                thread.start()
+            for thread in follow_threads:
+                thread.join()
+
         while True:
             if run_state not in State.FINAL_STATES:
                 run_state = client.fetch('bundles', bundle_uuid)['state']
 
             # Read data.
             for i in range(0, len(subpaths)):
-                # If the subpath we're interested in appears, check if it's a
-                # file and if so, initialize the offset.
-                if subpath_is_file[i] is None:
-                    target_info = client.fetch_contents_info(
-                        BundleTarget(bundle_uuid, subpaths[i]), 0
-                    )
-                    subpath_targets[i] = target_info['resolved_target']
-                    if target_info['type'] == 'file':
-                        subpath_is_file[i] = True
-                        if from_start:
-                            subpath_offset[i] = 0
-                        else:
-                            # Go to near the end of the file (TODO: make this match up with lines)
-                            subpath_offset[i] = max(target_info['size'] - 64, 0)
-                    else:
-                        subpath_is_file[i] = False
-
                 if not subpath_is_file[i]:
                     continue
 
@@ -2817,6 +2843,36 @@ class BundleCLI(object):
 
         return run_state
 
+    def _follow_file(self, client, bundle_uuid, targets, offsets, i, output_lock):
+        """
+        Prints the data appended to the file targets[i] of the running bundle, starting at
+        offsets[i], as the server streams it, and keeps offsets[i] up to date. Returns once the
+        bundle is in a final state, or if the server (or the worker running the bundle) can't
+        follow files, including when the server is already following too many files.
+        """
+        SLEEP_PERIOD = 1.0
+        while True:
+            received = False
+            try:
+                with closing(client.follow_contents_blob(targets[i], offsets[i])) as contents:
+                    while True:
+                        result = contents.read1(16384)
+                        if not result:
+                            break
+                        received = True
+                        offsets[i] += len(result)
+                        with output_lock:
+                            self.stdout.write(ensure_str(result))
+                            self.stdout.flush()
+            except (UsageError, JsonApiException, OSError, http.client.HTTPException):
+                return
+            if client.fetch('bundles', bundle_uuid)['state'] in State.FINAL_STATES:
+                return
+            if not received:
+                # The stream ended without data, e.g. while the bundle was being staged on a
+                # worker, so don't ask again right away.
+                time.sleep(SLEEP_PERIOD)
+
     @Commands.command(
         'mimic',
         help=[
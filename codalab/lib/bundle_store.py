@@ -331,7 +331,7 @@ class _MultiDiskBundleStoreBase(BundleStore):
             other_paths = set(entries) - set(bundle_paths)
 
             uuids = list(map(_get_uuid, bundle_paths))
-            db_bundles = model.batch_get_bundles(uuid=uuids)
+            db_bundles = model.batch_get_bundles(columns=('state',), metadata_keys=(), uuid=uuids)
             db_bundle_by_uuid = dict()
             for bundle in db_bundles:
                 db_bundle_by_uuid[bundle.uuid] = bundle
@@ -365,6 +365,7 @@ class CodaLabManager(object):
                 default_user_info=self.default_user_info(),
                 root_user_id=self.root_user_id(),
                 system_user_id=self.system_user_id(),
+                use_search_index=self.config['server'].get('use_search_index', False),
             )
         elif model_class == 'SQLiteModel':
             from codalab.model.sqlite_model import SQLiteModel
@@ -373,6 +374,7 @@ class CodaLabManager(object):
                 default_user_info=self.default_user_info(),
                 root_user_id=self.root_user_id(),
                 system_user_id=self.system_user_id(),
+                use_search_index=self.config['server'].get('use_search_index', False),
             )
         else:
             raise UsageError('Unexpected model class: %s, expected MySQLModel' % (model_class,))
@@ -384,7 +386,11 @@ class CodaLabManager(object):
 
     @cached
     def upload_manager(self):
-        return UploadManager(self.model(), self.bundle_store())
+        return UploadManager(
+            self.model(),
+            self.bundle_store(),
+            staging_dir=os.path.join(self.codalab_home, 'partial_uploads'),
+        )
 
     @cached
     def download_manager(self):
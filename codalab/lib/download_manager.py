@@ -1,5 +1,7 @@
+import io
 import logging
 import os
+import time
 from contextlib import closing
 
 from codalab.common import (
@@ -11,6 +13,7 @@ from codalab.common import (
 )
 from codalab.worker import download_util
 from codalab.worker.bundle_state import State
+from codalab.worker.file_watcher import FileFollower
 from codalab.worker.un_gzip_stream import un_gzip_stream
 
 logger = logging.getLogger(__name__)
@@ -253,6 +256,55 @@ class DownloadManager(object):
                 bytestring = self.file_util.un_gzip_bytestring(bytestring)
             return bytestring
 
+    def follow_file(self, target, offset, timeout):
+        """
+        Returns a file-like object reading the given file from offset that, like tail -f, keeps
+        returning what is appended to the file while the bundle is running, for at most timeout
+        seconds. Its read() returns b'' once the bundle is no longer running or at the timeout;
+        the rest of the file can then be read with read_file_section.
+        """
+        if not self._is_running(target.bundle_uuid):
+            return io.BytesIO()
+        if self._is_available_locally(target):
+            try:
+                return FileFollower(
+                    self._get_target_path(target),
+                    offset,
+                    lambda: self._is_running(target.bundle_uuid),
+                    timeout,
+                )
+            except FileNotFoundError as e:
+                raise NotFoundError(str(e))
+        return WorkerFileFollower(self, target, offset, timeout)
+
+    def _follow_file_section(self, target, offset, length, timeout):
+        """
+        Reads at most length bytes of the file at the given path in the bundle, starting at
+        offset, from the worker running the bundle. If the file doesn't extend past offset yet,
+        the worker first waits up to timeout seconds for data to be appended to it.
+        """
+        worker = self._bundle_model.get_bundle_worker(target.bundle_uuid)
+        response_socket_id = self._worker_model.allocate_socket(
+            worker['user_id'], worker['worker_id']
+        )
+        try:
+            read_args = {
+                'type': 'follow_file',
+                'offset': offset,
+                'length': length,
+                'timeout': timeout,
+            }
+            self._send_read_message(worker, response_socket_id, target, read_args)
+            bytestring = self._get_read_response(response_socket_id)
+        finally:
+            self._worker_model.deallocate_socket(response_socket_id)
+
+        # Note: all data from the worker is gzipped (see `local_reader.py`).
+        return self.file_util.un_gzip_bytestring(bytestring)
+
+    def _is_running(self, uuid):
+        return self._bundle_model.get_bundle_state(uuid) in [State.RUNNING, State.PREPARING]
+
     @retry_if_no_longer_running
     def summarize_file(
         self, target, num_head_lines, num_tail_lines, max_line_length, truncation_text, gzipped
@@ -417,3 +469,61 @@ class Deallocating(object):
     def close(self):
         self._fileobj.close()
         self._worker_model.deallocate_socket(self._socket_id)
+
+
+class WorkerFileFollower(object):
+    """
+    File-like object that follows a file of a bundle running on a worker that doesn't share its
+    file system with the server, like FileFollower does for local files. Each read() sends the
+    worker a follow_file read message, which the worker answers as soon as the file extends past
+    the current offset, so data is returned as it is written instead of being polled for.
+    """
+
+    # Maximum number of bytes read at once.
+    SECTION_LENGTH = 1024 * 1024
+    # Maximum time the worker waits for data before answering a follow_file message, so that
+    # the end of the bundle is noticed even if the worker no longer answers.
+    SECTION_TIMEOUT_SECONDS = 10
+
+    def __init__(self, download_manager, target, offset, timeout):
+        self._download_manager = download_manager
+        self._target = target
+        self._offset = offset
+        self._deadline = time.time() + timeout
+        self._done = False
+        # Read what is already there right away, so that errors (for instance, from workers that
+        # don't support following files) are raised before the response is sent.
+        self._pending = self._read_section(0)
+
+    def _read_section(self, timeout):
+        data = self._download_manager._follow_file_section(
+            self._target, self._offset, self.SECTION_LENGTH, timeout
+        )
+        self._offset += len(data)
+        return data
+
+    def read(self, num_bytes=-1):
+        while not self._pending and not self._done:
+            remaining = self._deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                self._pending = self._read_section(min(remaining, self.SECTION_TIMEOUT_SECONDS))
+            except Exception:
+                if self._download_manager._is_running(self._target.bundle_uuid):
+                    raise
+                # The bundle finished while the message was sent.
+                self._pending = b''
+            if not self._pending and not self._download_manager._is_running(
+                self._target.bundle_uuid
+            ):
+                self._done = True
+        if num_bytes is None or num_bytes < 0:
+            num_bytes = len(self._pending)
+        data, self._pending = self._pending[:num_bytes], self._pending[num_bytes:]
+        return data
+
+    read1 = read
+
+    def close(self):
+        self._done = True
@@ -12,7 +12,7 @@ There are a few classes of methods provided here:
     getmtime, get_size, hash_directory, hash_file_contents
 
   Functions that modify that filesystem in controlled ways:
-    copy, make_directory, set_write_permissions, rename, remove
+    copy, link_or_copy, make_directory, set_write_permissions, rename, remove
 """
 import errno
 import hashlib
@@ -33,6 +33,9 @@ BLOCK_SIZE = 0x40000
 FILE_PREFIX = 'file'
 LINK_PREFIX = 'link'
 
+# Ways link_or_copy can materialize a path on the same partition.
+LINK_MODES = ('copy', 'reflink', 'hardlink')
+
 
 def path_error(message, path):
     """
@@ -276,6 +279,43 @@ def copy(source_path: str, dest_path: str, follow_symlinks: Optional[bool] = Fal
             raise path_error('Unable to copy %s to' % source_path, dest_path)
 
 
+def link_or_copy(source_path: str, dest_path: str, mode: str = 'copy') -> str:
+    """
+    Copy |source_path| to |dest_path| without following symlinks, like copy().
+    If both paths are on the same partition, first try to share the data instead of duplicating it:
+      'reflink': clone files copy-on-write, on filesystems that support it (e.g. btrfs, XFS).
+      'hardlink': hard link every file under |dest_path| to the file under |source_path|. The
+                  files then share permissions and contents, so neither may be modified in place.
+    Falls back to copy() if this is not possible. Returns the mode that was actually used.
+    Note: this only works in Linux.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError('Invalid link mode: %s' % mode)
+    if (
+        mode != 'copy'
+        and not os.path.lexists(dest_path)
+        and not os.path.islink(source_path)
+        and os.path.exists(source_path)
+        and os.stat(source_path).st_dev == os.stat(os.path.dirname(dest_path)).st_dev
+    ):
+        command = [
+            'cp',
+            '-R',
+            '--no-dereference',
+            '--preserve=mode',
+            '--link' if mode == 'hardlink' else '--reflink=always',
+            source_path,
+            dest_path,
+        ]
+        if subprocess.call(command, stderr=subprocess.DEVNULL) == 0:
+            return mode
+        # Clean up anything that was partially linked before falling back to a regular copy.
+        if os.path.lexists(dest_path):
+            remove(dest_path)
+    copy(source_path, dest_path, follow_symlinks=False)
+    return 'copy'
+
+
 def make_directory(path):
     """
     Create the directory at the given path.
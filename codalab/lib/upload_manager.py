@@ -1,15 +1,20 @@
+import fcntl
+import hashlib
 import os
+import re
 import shutil
+import tarfile
 import tempfile
+import time
 
 from apache_beam.io.filesystem import CompressionTypes
 from apache_beam.io.filesystems import FileSystems
-from typing import Any, Dict, Union, Tuple, IO, cast
+from typing import Any, Callable, Dict, List, Optional, Union, Tuple, IO, cast
 from codalab.lib.beam.SQLiteIndexedTar import SQLiteIndexedTar  # type: ignore
 from codalab.lib.beam.MultiReaderFileStream import MultiReaderFileStream
 from contextlib import closing
-from codalab.worker.upload_util import upload_with_chunked_encoding
-from threading import Thread
+from codalab.worker.upload_util import upload_with_chunked_encoding, DiskQuotaLease
+from threading import Event, Thread
 
 from codalab.common import (
     StorageURLScheme,
@@ -18,15 +23,25 @@ from codalab.common import (
     urlopen_with_retry,
     parse_linked_bundle_url,
 )
-from codalab.worker.file_util import tar_gzip_directory, GzipStream, update_file_size
+from codalab.worker.file_util import (
+    tar_gzip_directory,
+    GzipStream,
+    update_file_size,
+    GZIP_SEEK_POINT_SPACING,
+)
 from codalab.worker.bundle_state import State
-from codalab.lib import file_util, path_util, zip_util
+from codalab.lib import file_util, path_util, spec_util, zip_util
 from codalab.objects.bundle import Bundle
 from codalab.lib.zip_util import ARCHIVE_EXTS_DIR
 from codalab.lib.print_util import FileTransferProgress
 
 Source = Union[str, Tuple[str, IO[bytes]]]
 
+# Maximum number of bytes that can be staged for a delta upload of the contents of one bundle.
+MAX_STAGED_BYTES_PER_BUNDLE = 64 * 1024 ** 3
+# Name of the file, in the staging directory of a bundle, that holds the number of bytes staged.
+STAGED_BYTES_FILE = '.staged_bytes'
+
 
 class Uploader:
     """Uploader base class. Subclasses should extend this class and implement the
@@ -258,58 +273,66 @@ class BlobStorageUploader(Uploader):
             # Chunk size set to 1MiB for performance
             CHUNK_SIZE = 1024 * 1024
 
+            # Set once the archive file has been opened for writing, after which the connection
+            # string can be switched to the index's.
+            content_upload_started = Event()
+
             def upload_file_content():
-                iteration = 0
-                ITERATIONS_PER_DISK_CHECK = 32
                 bytes_uploaded = 0
 
-                with FileSystems.create(
-                    bundle_path, compression_type=CompressionTypes.UNCOMPRESSED
-                ) as out:
-                    while True:
-                        iteration += 1
-                        to_send = file_reader.read(CHUNK_SIZE)
-                        if not to_send:
-                            break
-                        out.write(to_send)
-
-                        # Update disk and check if client has gone over disk usage.
-                        if self._client and iteration % ITERATIONS_PER_DISK_CHECK == 0:
-                            self._client.update(
-                                'user/increment_disk_used',
-                                {'disk_used_increment': len(to_send), 'bundle_uuid': bundle_uuid},
-                            )
-                            user_info = self._client.fetch('user')
-                            if user_info['disk_used'] >= user_info['disk_quota']:
-                                raise Exception(
-                                    'Upload aborted. User disk quota exceeded. '
-                                    'To apply for more quota, please visit the following link: '
-                                    'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/'
-                                    '#how-do-i-request-more-disk-quota-or-time-quota'
-                                )
-
-                        bytes_uploaded += len(to_send)
-                        if progress_callback is not None:
-                            should_resume = progress_callback(bytes_uploaded)
-                            if not should_resume:
-                                raise Exception('Upload aborted by client')
+                try:
+                    # Check if client has gone over disk usage, and update it.
+                    quota_lease = (
+                        DiskQuotaLease(self._client, bundle_uuid) if self._client else None
+                    )
+                    with FileSystems.create(
+                        bundle_path, compression_type=CompressionTypes.UNCOMPRESSED
+                    ) as out:
+                        content_upload_started.set()
+                        while True:
+                            to_send = file_reader.read(CHUNK_SIZE)
+                            if not to_send:
+                                break
+                            if quota_lease:
+                                quota_lease.consume(len(to_send))
+                            out.write(to_send)
+
+                            bytes_uploaded += len(to_send)
+                            if progress_callback is not None:
+                                should_resume = progress_callback(bytes_uploaded)
+                                if not should_resume:
+                                    raise Exception('Upload aborted by client')
+                    if quota_lease:
+                        quota_lease.finish()
+                finally:
+                    content_upload_started.set()
+                    # Don't hold back indexing if the upload stopped before the end of the stream.
+                    file_reader.close()
 
             # temporary file that used to store index file
             tmp_index_file = tempfile.NamedTemporaryFile(suffix=".sqlite")
 
             def create_index():
                 is_dir = parse_linked_bundle_url(bundle_path).is_archive_dir
-                SQLiteIndexedTar(
-                    fileObject=index_reader,
-                    tarFileName="contents.tar.gz"
-                    if is_dir
-                    else "contents.gz",  # If saving a single file as a .gz archive, this file can be accessed by the "/contents" entry in the index.
-                    writeIndex=True,
-                    clearIndexCache=True,
-                    indexFilePath=tmp_index_file.name,
-                )
+                try:
+                    SQLiteIndexedTar(
+                        fileObject=index_reader,
+                        tarFileName="contents.tar.gz"
+                        if is_dir
+                        else "contents.gz",  # If saving a single file as a .gz archive, this file can be accessed by the "/contents" entry in the index.
+                        writeIndex=True,
+                        clearIndexCache=True,
+                        indexFilePath=tmp_index_file.name,
+                        gzipSeekPointSpacing=GZIP_SEEK_POINT_SPACING,
+                    )
+                finally:
+                    # Don't hold back the file upload if indexing stopped before the end of the stream.
+                    index_reader.close()
+                # Upload the index while the last blocks of the archive file are being uploaded.
+                upload_index()
 
             def upload_index():
+                content_upload_started.wait()
                 if bundle_conn_str is not None:
                     os.environ['AZURE_STORAGE_CONNECTION_STRING'] = index_conn_str
                 with FileSystems.create(
@@ -322,8 +345,8 @@ class BlobStorageUploader(Uploader):
                             break
                         out_index_file.write(to_send)
 
+            def update_indexed_file_size():
                 # call API to update the indexed file size
-
                 if not parse_linked_bundle_url(bundle_path).is_archive_dir and hasattr(
                     output_fileobj, "tell"
                 ):
@@ -353,7 +376,7 @@ class BlobStorageUploader(Uploader):
             for thread in threads:
                 thread.join()
 
-            upload_index()
+            update_indexed_file_size()
 
         except Exception as err:
             raise err
@@ -362,16 +385,81 @@ class BlobStorageUploader(Uploader):
                 os.environ['AZURE_STORAGE_CONNECTION_STRING'] = conn_str if conn_str != '' else None  # type: ignore
 
 
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class _ThreadOutputReader(object):
+    """
+    Reads what a thread writes to a pipe. If the thread fails, reading raises its exception
+    instead of returning the end of the truncated output.
+    """
+
+    def __init__(self, target: Callable[[IO[bytes]], None]):
+        """target: function that writes the output to the file object it is called with."""
+        read_fd, write_fd = os.pipe()
+        self._input = os.fdopen(read_fd, 'rb')
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._thread = Thread(target=self._write, args=(target, write_fd), daemon=True)
+        self._thread.start()
+
+    def _write(self, target, write_fd):
+        out = os.fdopen(write_fd, 'wb')
+        try:
+            target(out)
+        except BrokenPipeError as e:
+            if not self._closed:
+                self._error = e
+        except BaseException as e:
+            self._error = e
+        finally:
+            try:
+                out.close()
+            except BrokenPipeError:
+                pass
+
+    def read(self, num_bytes=-1):
+        data = self._input.read(num_bytes)
+        if not data:
+            self.check()
+        return data
+
+    def check(self):
+        """Raises the exception of the thread if it failed once it is done writing."""
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._closed = True
+        self._input.close()
+
+
 class UploadManager(object):
     """
     Contains logic for uploading bundle data to the bundle store and updating
     the associated bundle metadata in the database.
     """
 
-    def __init__(self, bundle_model, bundle_store, json_api_client=None):
+    def __init__(
+        self,
+        bundle_model,
+        bundle_store,
+        json_api_client=None,
+        staging_dir=None,
+        max_staged_bytes_per_bundle=MAX_STAGED_BYTES_PER_BUNDLE,
+    ):
+        """
+        staging_dir: directory where files uploaded for delta uploads are staged, in a
+                     subdirectory per bundle, until the bundle's contents are assembled.
+        max_staged_bytes_per_bundle: maximum number of bytes that can be staged for one bundle.
+        """
         self._client = json_api_client
         self._bundle_model = bundle_model
         self._bundle_store = bundle_store
+        self._staging_dir = staging_dir or os.path.join(tempfile.gettempdir(), 'partial_uploads')
+        self._max_staged_bytes_per_bundle = max_staged_bytes_per_bundle
 
     def upload_to_bundle_store(
         self,
@@ -415,6 +503,226 @@ class UploadManager(object):
             json_api_client=None,
         ).upload_to_bundle_store(bundle, source, git, unpack)
 
+    def _get_staged_files_dir(self, bundle: Bundle) -> str:
+        return os.path.join(self._staging_dir, bundle.uuid)
+
+    def _get_staged_file_path(self, bundle: Bundle, sha256: str) -> str:
+        if not re.fullmatch('[0-9a-f]{64}', sha256):
+            raise UsageError('Invalid SHA-256 hash: %s' % sha256)
+        return os.path.join(self._get_staged_files_dir(bundle), sha256)
+
+    def get_missing_staged_files(self, bundle: Bundle, hashes: List[str]) -> List[str]:
+        """
+        Returns the hashes among the given SHA-256 hashes of files that haven't been staged for
+        a delta upload of the contents of the given bundle yet.
+        """
+        missing = [
+            sha256
+            for sha256 in dict.fromkeys(hashes)
+            if not os.path.exists(self._get_staged_file_path(bundle, sha256))
+        ]
+        # Mark the staged files as in use, see cleanup_stale_staged_files().
+        try:
+            os.utime(self._get_staged_files_dir(bundle))
+        except FileNotFoundError:
+            pass
+        return missing
+
+    def _get_staged_bytes(self, bundle_uuid: str) -> int:
+        """Returns the number of bytes staged for the bundle with the given uuid."""
+        try:
+            with open(os.path.join(self._staging_dir, bundle_uuid, STAGED_BYTES_FILE)) as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, NotADirectoryError):
+            return 0
+
+    def _get_staging_bytes_left(self, bundle: Bundle) -> int:
+        """
+        Returns the number of bytes that can still be staged for the given bundle: staged files
+        count against the disk quota of the owner of the bundle, together with the files staged
+        for the owner's other bundles, and against the limit of bytes staged per bundle.
+        """
+        try:
+            uuids = [
+                uuid for uuid in os.listdir(self._staging_dir) if spec_util.UUID_REGEX.match(uuid)
+            ]
+        except FileNotFoundError:
+            uuids = []
+        owner_uuids = (
+            self._bundle_model.batch_get_bundle_uuids(uuid=uuids, owner_id=bundle.owner_id)
+            if uuids
+            else []
+        )
+        disk_left = self._bundle_model.get_user_disk_quota_left(bundle.owner_id) - sum(
+            self._get_staged_bytes(uuid) for uuid in owner_uuids
+        )
+        return min(
+            disk_left, self._max_staged_bytes_per_bundle - self._get_staged_bytes(bundle.uuid)
+        )
+
+    def stage_file(self, bundle: Bundle, sha256: str, fileobj: IO[bytes]):
+        """
+        Stores the contents of fileobj for a delta upload of the contents of the given bundle.
+        Raises UsageError if the contents don't match the given SHA-256 hash, or if staging them
+        would exceed the disk quota of the owner of the bundle or the limit of bytes staged per
+        bundle (see _get_staging_bytes_left()).
+        """
+        path = self._get_staged_file_path(bundle, sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        bytes_left = self._get_staging_bytes_left(bundle)
+        if os.path.exists(path):
+            # The file replaces the same file, which was already counted.
+            bytes_left += os.path.getsize(path)
+        h = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            try:
+                while True:
+                    chunk = fileobj.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > bytes_left:
+                        raise UsageError(
+                            "Can't stage file, it would exceed the user's disk quota or the "
+                            "staging limit of the bundle (%s bytes left)" % bytes_left
+                        )
+                    h.update(chunk)
+                    f.write(chunk)
+            except Exception:
+                os.remove(f.name)
+                raise
+        if h.hexdigest() != sha256:
+            os.remove(f.name)
+            raise UsageError('Contents of staged file do not match its hash %s' % sha256)
+        # Count the file under a lock, so that concurrent uploads of the bundle don't lose counts.
+        with open(os.path.join(os.path.dirname(path), STAGED_BYTES_FILE), 'a+') as counter:
+            fcntl.flock(counter, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                counter.seek(0)
+                staged_bytes = int(counter.read() or 0) + size
+                counter.seek(0)
+                counter.truncate()
+                counter.write(str(staged_bytes))
+            os.rename(f.name, path)
+
+    def _open_staged_archive(self, bundle: Bundle, manifest: List[Dict]) -> '_ThreadOutputReader':
+        """
+        Returns a stream of a .tar archive of the bundle contents described by manifest (see
+        build_upload_manifest), built from the staged files.
+        """
+        # Check the whole manifest before the archive is streamed, so that an invalid manifest
+        # fails the upload instead of producing a truncated archive.
+        for entry in manifest:
+            if not isinstance(entry.get('path'), str):
+                raise UsageError('Invalid entry in manifest: %s' % entry)
+            path = os.path.normpath(entry['path'])
+            if os.path.isabs(path) or path.split(os.sep)[0] == '..':
+                raise UsageError('Invalid path in manifest: %s' % entry['path'])
+            for key in ('mode', 'mtime'):
+                if not _is_int(entry.get(key)):
+                    raise UsageError('Invalid %s in manifest for %s' % (key, entry['path']))
+            if entry.get('type') == 'file':
+                if not isinstance(entry.get('sha256'), str) or not _is_int(entry.get('size')):
+                    raise UsageError('Invalid file in manifest: %s' % entry['path'])
+                staged_path = self._get_staged_file_path(bundle, entry['sha256'])
+                if not os.path.exists(staged_path):
+                    # Not a UsageError, so that the bundle isn't failed and the upload can be retried.
+                    raise IOError('File %s has not been staged' % entry['path'])
+                if os.path.getsize(staged_path) != entry['size']:
+                    raise UsageError(
+                        'Size of %s in manifest does not match the staged file' % entry['path']
+                    )
+            elif entry.get('type') == 'link':
+                if not isinstance(entry.get('target'), str):
+                    raise UsageError('Invalid link in manifest: %s' % entry['path'])
+            elif entry.get('type') != 'directory':
+                raise UsageError('Invalid type in manifest: %s' % entry.get('type'))
+
+        def write_archive(out):
+            with tarfile.open(fileobj=out, mode='w|') as tf:
+                for entry in manifest:
+                    tarinfo = tarfile.TarInfo(
+                        '.' if entry['path'] == '.' else './' + os.path.normpath(entry['path'])
+                    )
+                    tarinfo.mode = entry['mode']
+                    tarinfo.mtime = entry['mtime']
+                    if entry['type'] == 'directory':
+                        tarinfo.type = tarfile.DIRTYPE
+                        tf.addfile(tarinfo)
+                    elif entry['type'] == 'link':
+                        tarinfo.type = tarfile.SYMTYPE
+                        tarinfo.linkname = entry['target']
+                        tf.addfile(tarinfo)
+                    else:
+                        tarinfo.size = entry['size']
+                        with open(self._get_staged_file_path(bundle, entry['sha256']), 'rb') as f:
+                            tf.addfile(tarinfo, f)
+
+        return _ThreadOutputReader(write_archive)
+
+    def upload_staged_contents_to_bundle_store(
+        self,
+        bundle: Bundle,
+        manifest: List[Dict],
+        use_azure_blob_beta: bool,
+        destination_bundle_store=None,
+    ):
+        """
+        Uploads the contents of the given bundle described by manifest to the bundle store,
+        assembling them from the files staged with stage_file(). The staged files are kept until
+        cleanup_staged_files() is called once the bundle is finalized, so that uploading the
+        contents again (e.g. when the response to this upload was lost) only sends new files.
+        """
+        archive = self._open_staged_archive(bundle, manifest)
+        source = ('contents.tar.gz', GzipStream(cast(IO[bytes], archive)))
+        try:
+            with closing(source[1]):
+                self.upload_to_bundle_store(
+                    bundle,
+                    source,
+                    git=False,
+                    unpack=True,
+                    use_azure_blob_beta=use_azure_blob_beta,
+                    destination_bundle_store=destination_bundle_store,
+                )
+        finally:
+            # GzipStream ends the stream when reading its input fails, so the upload may have
+            # stored a truncated archive, or failed because of it: raise the error that stopped
+            # the archive instead. The archive is closed first, so that the thread writing it
+            # can't block if it wasn't read entirely.
+            archive.check()
+
+    def cleanup_staged_files(self, bundle_uuid: str):
+        """Removes the files staged for a delta upload of the contents of the given bundle."""
+        shutil.rmtree(os.path.join(self._staging_dir, bundle_uuid), ignore_errors=True)
+
+    def cleanup_stale_staged_files(self, max_age_seconds: float) -> List[str]:
+        """
+        Removes the files staged for the bundles that were finalized or deleted, which are
+        normally removed when that happens, and for the bundles whose uploads haven't staged or
+        checked for files for max_age_seconds. Returns the uuids of these bundles.
+        """
+        try:
+            uuids = [
+                uuid for uuid in os.listdir(self._staging_dir) if spec_util.UUID_REGEX.match(uuid)
+            ]
+        except FileNotFoundError:
+            return []
+        states = self._bundle_model.get_bundle_states(uuids) if uuids else {}
+        now = time.time()
+        stale_uuids = []
+        for uuid in uuids:
+            path = os.path.join(self._staging_dir, uuid)
+            try:
+                age = now - os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if uuid not in states or states[uuid] in State.FINAL_STATES or age > max_age_seconds:
+                self.cleanup_staged_files(uuid)
+                stale_uuids.append(uuid)
+        return stale_uuids
+
     def has_contents(self, bundle):
         # TODO: make this non-fs-specific.
         bundle_location = self._bundle_store.get_bundle_location(bundle.uuid)
@@ -647,27 +955,36 @@ class ClientUploadManager(object):
 
         def upload_file_content():
             # Write archive file.
-            upload_with_chunked_encoding(
-                method='PUT',
-                base_url=bundle_conn_str,
-                headers={'Content-type': 'application/octet-stream'},
-                fileobj=file_reader,
-                query_params={},
-                progress_callback=None,
-                bundle_uuid=bundle_uuid,
-                json_api_client=self._client,
-            )
+            try:
+                upload_with_chunked_encoding(
+                    method='PUT',
+                    base_url=bundle_conn_str,
+                    headers={'Content-type': 'application/octet-stream'},
+                    fileobj=file_reader,
+                    query_params={},
+                    progress_callback=None,
+                    bundle_uuid=bundle_uuid,
+                    json_api_client=self._client,
+                )
+            finally:
+                # Don't hold back indexing if the upload stopped before the end of the stream.
+                file_reader.close()
 
         def create_upload_index():
             # upload the index file
             with tempfile.NamedTemporaryFile(suffix=".sqlite") as tmp_index_file:
-                SQLiteIndexedTar(
-                    fileObject=index_reader,
-                    tarFileName="contents",
-                    writeIndex=True,
-                    clearIndexCache=True,
-                    indexFilePath=tmp_index_file.name,
-                )
+                try:
+                    SQLiteIndexedTar(
+                        fileObject=index_reader,
+                        tarFileName="contents",
+                        writeIndex=True,
+                        clearIndexCache=True,
+                        indexFilePath=tmp_index_file.name,
+                        gzipSeekPointSpacing=GZIP_SEEK_POINT_SPACING,
+                    )
+                finally:
+                    # Don't hold back the file upload if indexing stopped before the end of the stream.
+                    index_reader.close()
                 upload_with_chunked_encoding(
                     method='PUT',
                     base_url=index_conn_str,
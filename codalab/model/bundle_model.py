@@ -2,8 +2,10 @@
 BundleModel is a wrapper around database calls to save and load bundle metadata.
 """
 
+import base64
 import collections
 import datetime
+import hashlib
 import os
 import re
 import time
@@ -32,6 +34,8 @@ from codalab.model.tables import (
     bundle as cl_bundle,
     bundle_dependency as cl_bundle_dependency,
     bundle_metadata as cl_bundle_metadata,
+    bundle_search as cl_bundle_search,
+    bundle_memo as cl_bundle_memo,
     bundle_store as cl_bundle_store,
     bundle_location as cl_bundle_location,
     group as cl_group,
@@ -59,6 +63,7 @@ from codalab.objects.worksheet import item_sort_key, Worksheet
 from codalab.objects.oauth2 import OAuth2AuthCode, OAuth2Client, OAuth2Token
 from codalab.objects.user import User
 from codalab.objects.dependency import Dependency
+from codalab.objects.metadata import Metadata
 from codalab.rest.util import get_group_info
 from codalab.worker.bundle_state import State
 from codalab.worker.worker_run_state import RunStage
@@ -68,9 +73,41 @@ logger = logging.getLogger(__name__)
 
 SEARCH_KEYWORD_REGEX = re.compile('^([\.\w/]*)=(.*)$')
 SEARCH_RESULTS_LIMIT = 10
+# Metadata keys that are copied into the bundle_search table.
+SEARCH_INDEX_KEYS = ('name', 'description', 'created', 'data_size')
 EDU_USER_REGEXES = re.compile('@[\w\.-]+\.(edu|edu\.[a-z]{2}|ac\.[a-z]{2})$')
 
 
+def encode_search_cursor(sort_value, bundle_id):
+    """
+    Returns an opaque token for the .cursor search keyword, pointing after the bundle with the
+    given id and value of the sort field.
+    """
+    return base64.urlsafe_b64encode(json.dumps([sort_value, bundle_id]).encode()).decode()
+
+
+def decode_search_cursor(token):
+    """
+    Returns the (sort value, bundle id) tuple encoded in a .cursor token.
+    """
+    try:
+        sort_value, bundle_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return sort_value, int(bundle_id)
+    except (ValueError, TypeError):
+        raise UsageError('Invalid search cursor: %s' % token)
+
+
+def get_memo_key(command, dependencies):
+    """
+    Returns the key under which a bundle with the given command and dependencies is memoized:
+    a hash of the command and of its sorted, deduplicated (child_path, parent_uuid) pairs.
+    The command is hashed verbatim, since memoization only reuses bundles with the exact command.
+    :param dependencies: an iterable of (child_path, parent_uuid) tuples.
+    """
+    normalized = json.dumps([command, sorted(set(map(tuple, dependencies)))])
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
 def str_key_dict(row):
     """
     row comes out of an element of a database query.
@@ -104,14 +141,19 @@ class Join:
 
 
 class BundleModel(object):
-    def __init__(self, engine, default_user_info, root_user_id, system_user_id):
+    def __init__(
+        self, engine, default_user_info, root_user_id, system_user_id, use_search_index=False
+    ):
         """
         Initialize a BundleModel with the given SQLAlchemy engine.
+        If use_search_index is True, bundle searches on the metadata keys in SEARCH_INDEX_KEYS
+        query the bundle_search table instead of joining bundle_metadata.
         """
         self.engine = engine
         self.default_user_info = default_user_info
         self.root_user_id = root_user_id
         self.system_user_id = system_user_id
+        self.use_search_index = use_search_index
         self.public_group_uuid = ''
         self.create_tables()
 
@@ -385,6 +427,9 @@ class BundleModel(object):
         - .floating: return bundles not in any worksheet
         - .offset=<int>: return bundles starting at this offset
         - .limit=<int>: maximum number of bundles to return
+        - .cursor: return pages of bundles with keyset pagination: the result dict also has a
+                   next_cursor token, which is None on the last page
+        - .cursor=<token>: return the page of bundles following the page that returned <token>
         - .count: just return the number of bundles
         - .shared: shared with me through a group
         - .mine: sugar for owner_id=user_id
@@ -428,11 +473,13 @@ class BundleModel(object):
                 if is_numeric(key):
                     field = field * 1
                 sort_key[0] = field
+                sort_field[0], sort_descending[0] = field, False
             elif value == '.sort-':
                 aux_fields.append(field)
                 if is_numeric(key):
                     field = field * 1
                 sort_key[0] = desc(field)
+                sort_field[0], sort_descending[0] = field, True
             elif value == '.sum':
                 sum_key[0] = field * 1
             else:
@@ -450,6 +497,18 @@ class BundleModel(object):
             """
             joins.append(Join(table, condition, left_outer_join))
 
+        def search_index_column(key):
+            """
+            Return the bundle_search column for the metadata key, joining bundle_search once,
+            or None if key should be looked up in bundle_metadata.
+            """
+            if not self.use_search_index or key not in SEARCH_INDEX_KEYS:
+                return None
+            if not search_index_joined[0]:
+                add_join(cl_bundle_search, cl_bundle.c.uuid == cl_bundle_search.c.bundle_uuid)
+                search_index_joined[0] = True
+            return cl_bundle_search.c[key]
+
         shortcuts = {'type': 'bundle_type', 'size': 'data_size', 'worksheet': 'host_worksheet'}
 
         offset = 0
@@ -457,7 +516,12 @@ class BundleModel(object):
         format_func = None
         count = False
         sort_key = [None]
+        sort_field = [None]  # Sort expression, without the direction
+        sort_descending = [False]
         sum_key = [None]
+        use_cursor = False
+        cursor = None  # (sort value, id) of the last bundle of the previous page
+        search_index_joined = [False]
         aux_fields = []  # Fields (e.g., sorting) that we need to include in the query
 
         joins: List[Join] = list()
@@ -478,6 +542,9 @@ class BundleModel(object):
                 count = True
                 limit = None
                 continue
+            elif keyword == '.cursor':
+                use_cursor = True
+                continue
             elif keyword == '.floating':
                 add_join(
                     cl_worksheet_item,
@@ -500,6 +567,9 @@ class BundleModel(object):
             # Special functions
             if key == '.offset':
                 offset = int(value)
+            elif key == '.cursor':
+                use_cursor = True
+                cursor = decode_search_cursor(value)
             elif key == '.limit':
                 limit = int(value)
             elif key == '.format':
@@ -577,21 +647,31 @@ class BundleModel(object):
                         "Unable to parse datetime. Datetime must be specified as an ISO-8601 datetime string such as YYYY-MM-DD."
                     )
 
-                subclause = None
-                aliased_bundle_metadata = aliased(cl_bundle_metadata)
-                if key == '.before':
-                    subclause = aliased_bundle_metadata.c.metadata_value <= int(
-                        target_datetime.timestamp()
-                    )
-                if key == '.after':
-                    subclause = aliased_bundle_metadata.c.metadata_value >= int(
-                        target_datetime.timestamp()
+                created = search_index_column('created')
+                if created is not None:
+                    timestamp = int(target_datetime.timestamp())
+                    conjunct = created <= timestamp if key == '.before' else created >= timestamp
+                else:
+                    subclause = None
+                    aliased_bundle_metadata = aliased(cl_bundle_metadata)
+                    if key == '.before':
+                        subclause = aliased_bundle_metadata.c.metadata_value <= int(
+                            target_datetime.timestamp()
+                        )
+                    if key == '.after':
+                        subclause = aliased_bundle_metadata.c.metadata_value >= int(
+                            target_datetime.timestamp()
+                        )
+                    add_join(
+                        aliased_bundle_metadata,
+                        cl_bundle.c.uuid == aliased_bundle_metadata.c.bundle_uuid,
                     )
-                add_join(
-                    aliased_bundle_metadata,
-                    cl_bundle.c.uuid == aliased_bundle_metadata.c.bundle_uuid,
+                    conjunct = and_(aliased_bundle_metadata.c.metadata_key == 'created', subclause)
+            elif key == 'uuid_name' and search_index_column('name') is not None:
+                conjunct = or_(
+                    cl_bundle.c.uuid.like('%' + value + '%'),
+                    cl_bundle_search.c.name.like('%' + value + '%'),
                 )
-                conjunct = and_(aliased_bundle_metadata.c.metadata_key == 'created', subclause)
             elif key == 'uuid_name':  # Search uuid and name by default
                 aliased_bundle_metadata = aliased(cl_bundle_metadata)
                 add_join(
@@ -618,6 +698,14 @@ class BundleModel(object):
                     cl_bundle.c.command.like('%' + value + '%'),
                     aliased_bundle_metadata.c.metadata_value.like('%' + value + '%'),
                 )
+            # Metadata that is in the search index.
+            elif search_index_column(key) is not None:
+                column = search_index_column(key)
+                condition = make_condition(key, column, value)
+                if condition is None:  # top-level
+                    conjunct = column.isnot(None)
+                else:
+                    conjunct = condition
             # Otherwise, assume metadata.
             else:
                 aliased_bundle_metadata = aliased(cl_bundle_metadata)
@@ -677,6 +765,17 @@ class BundleModel(object):
             )
             # Sum the numbers
             query = select([func.sum(query.c.num)])
+        elif use_cursor and not count:
+            return self._search_bundles_page(
+                table,
+                where_clause,
+                aux_fields,
+                sort_field[0],
+                sort_descending[0],
+                cursor,
+                offset,
+                limit,
+            )
         else:
             query = select([cl_bundle.c.uuid] + aux_fields).select_from(table)
             query = query.distinct().where(where_clause).offset(offset).limit(limit)
@@ -694,6 +793,65 @@ class BundleModel(object):
             return {'result': result, 'is_aggregate': True}
         return {'result': result, 'is_aggregate': False}
 
+    def _search_bundles_page(
+        self, table, where_clause, aux_fields, sort_field, sort_descending, cursor, offset, limit
+    ):
+        """
+        Returns a page of the bundle search result with keyset pagination: bundles are ordered by
+        (sort_field, id), and a page seeks past the (sort value, id) of the last bundle of the
+        previous page instead of skipping rows with OFFSET, so every page costs the same.
+        """
+        if offset:
+            raise UsageError('.offset cannot be combined with .cursor')
+        if cursor is not None:
+            last_value, last_id = cursor
+            if sort_field is None:
+                seek = cl_bundle.c.id > last_id
+            elif sort_descending:
+                seek = or_(
+                    sort_field < last_value,
+                    and_(sort_field == last_value, cl_bundle.c.id < last_id),
+                )
+            else:
+                seek = or_(
+                    sort_field > last_value,
+                    and_(sort_field == last_value, cl_bundle.c.id > last_id),
+                )
+            where_clause = and_(where_clause, seek)
+
+        columns = [cl_bundle.c.uuid, cl_bundle.c.id]
+        if sort_field is None:
+            order_by = [cl_bundle.c.id]
+        else:
+            columns.append(sort_field.label('sort_value'))
+            order_by = (
+                [desc(sort_field), desc(cl_bundle.c.id)]
+                if sort_descending
+                else [sort_field, cl_bundle.c.id]
+            )
+        query = (
+            select(columns + aux_fields)
+            .select_from(table)
+            .distinct()
+            .where(where_clause)
+            .order_by(*order_by)
+            .limit(limit)
+        )
+        with self.engine.begin() as connection:
+            rows = connection.execute(query).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) == limit:
+            last_row = rows[-1]
+            next_cursor = encode_search_cursor(
+                last_row.sort_value if sort_field is not None else None, last_row.id
+            )
+        return {
+            'result': [row.uuid for row in rows],
+            'is_aggregate': False,
+            'next_cursor': next_cursor,
+        }
+
     def get_bundle_uuids(self, conditions, max_results):
         """
         Returns a list of bundle_uuids that have match the conditions.
@@ -760,91 +918,98 @@ class BundleModel(object):
         """
         # Decode json formatted dependencies string to a list of key value pairs
         dependencies = json.loads(dependencies)
-        # When there is no dependency to be matched, the target memoized bundle
-        # should only exist in the bundle table but not in the bundle_dependency table.
-        if len(dependencies) == 0:
-            query = (
-                select([cl_bundle.c.uuid])
-                .select_from(cl_bundle)
-                .where(
-                    and_(
-                        cl_bundle.c.command == command,
-                        cl_bundle.c.owner_id == user_id,
-                        cl_bundle.c.uuid.notin_(
-                            select([cl_bundle_dependency.c.child_uuid]).select_from(
-                                cl_bundle_dependency
-                            )
-                        ),
-                    )
-                )
-                .order_by(cl_bundle.c.id)
-            )
-        else:
-            # The following matching logic contains two aggregations. In the first aggregation, we select those records
-            # that have the same number of dependencies as specified in input. In the second aggregation, we operate on
-            # records that returned from the first aggregation. We first select those records that match with all
-            # (child_path, parent_uuid) dependency pairs from the input. Then, we aggregate on child_uuid and match
-            # the total the number of unique dependencies per child_uuid with input dependencies.
-            clause = []
-            for dep in dependencies:
-                clause.append(
-                    and_(
-                        cl_bundle_dependency.c.child_path == dep['child_path'],
-                        cl_bundle_dependency.c.parent_uuid == dep['parent_uuid'],
-                    )
-                )
-            # Step 1: filter by input command and the number of dependencies
-            command_filter = (
-                select([cl_bundle_dependency.c.child_uuid])
-                .select_from(
-                    cl_bundle.join(
-                        cl_bundle_dependency, cl_bundle.c.uuid == cl_bundle_dependency.c.child_uuid
-                    )
-                )
-                .where(and_(cl_bundle.c.command == command, cl_bundle.c.owner_id == user_id))
-                # child_path is unique across all dependencies, aggregate on child_uuid
-                # and COUNT the total the number of unique dependencies per child_uuid
-                .group_by(cl_bundle_dependency.c.child_uuid)
-                .having(func.count(cl_bundle_dependency.c.child_path) == len(dependencies))
-            )
-            uuids = self._execute_query(command_filter)
-
-            # Step 2: filter by each dependency (child_path, parent_uuid) pair in the bundle_dependency table
-            query = (
-                select([cl_bundle_dependency.c.child_uuid])
-                .select_from(cl_bundle_dependency)
-                .where(and_(cl_bundle_dependency.c.child_uuid.in_(uuids), or_(*clause)))
-                # child_path is unique across all dependencies, aggregate on child_uuid
-                # and COUNT the total the number of unique dependencies per child_uuid
-                .group_by(cl_bundle_dependency.c.child_uuid)
-                .having(func.count(cl_bundle_dependency.c.child_path) == len(dependencies))
-                # Ensure the order of the returning bundles will be in the order of they were created.
-                .order_by(cl_bundle_dependency.c.id)
+        memo_key = get_memo_key(
+            command, [(dep['child_path'], dep['parent_uuid']) for dep in dependencies]
+        )
+        query = (
+            select([cl_bundle_memo.c.bundle_uuid]).where(
+                and_(cl_bundle_memo.c.memo_key == memo_key, cl_bundle_memo.c.owner_id == user_id)
             )
-
+            # Ensure the order of the returning bundles will be in the order of they were created.
+            .order_by(cl_bundle_memo.c.id)
+        )
         return self._execute_query(query)
 
-    def batch_get_bundles(self, **kwargs):
+    def batch_get_bundles(self, columns=None, metadata_keys=None, load_dependencies=True, **kwargs):
         """
         Return a list of bundles given a SQLAlchemy clause on the cl_bundle table.
+
+        The bundles can be projected onto the fields a caller needs; the projection is pushed down
+        into the SQL queries, and when metadata keys are whitelisted, bundles and their metadata
+        are loaded with a single query.
+        :param columns: if not None, only load these cl_bundle columns. The id, uuid and
+                        bundle_type columns are always loaded.
+        :param metadata_keys: if not None, only load these metadata keys. Other keys are not set.
+        :param load_dependencies: if False, don't load dependencies; bundle.dependencies is empty.
+        Projected bundles are incomplete, so they are only meant to be read, not updated.
         """
         clause = self.make_kwargs_clause(cl_bundle, kwargs)
-        with self.engine.begin() as connection:
-            bundle_rows = connection.execute(cl_bundle.select().where(clause)).fetchall()
+        if columns is None:
+            bundle_columns = list(cl_bundle.c)
+        else:
+            bundle_columns = [
+                cl_bundle.c[column]
+                for column in ['id', 'uuid', 'bundle_type']
+                + [column for column in columns if column not in ('id', 'uuid', 'bundle_type')]
+            ]
+        metadata_columns = [cl_bundle_metadata.c.metadata_key, cl_bundle_metadata.c.metadata_value]
+        with self.engine.begin() as connection:
+            if metadata_keys:
+                # Join the whitelisted metadata rows, and split each row into its bundle part and
+                # metadata part.
+                rows = connection.execute(
+                    select(bundle_columns + metadata_columns)
+                    .select_from(
+                        cl_bundle.outerjoin(
+                            cl_bundle_metadata,
+                            and_(
+                                cl_bundle_metadata.c.bundle_uuid == cl_bundle.c.uuid,
+                                cl_bundle_metadata.c.metadata_key.in_(metadata_keys),
+                            ),
+                        )
+                    )
+                    .where(clause)
+                ).fetchall()
+                bundle_rows = []
+                metadata_rows = []
+                seen_uuids = set()
+                for row in rows:
+                    if row.uuid not in seen_uuids:
+                        seen_uuids.add(row.uuid)
+                        bundle_rows.append(
+                            {str(column.name): row[column.name] for column in bundle_columns}
+                        )
+                    if row.metadata_key is not None:
+                        metadata_rows.append(
+                            {
+                                'bundle_uuid': row.uuid,
+                                'metadata_key': row.metadata_key,
+                                'metadata_value': row.metadata_value,
+                            }
+                        )
+            else:
+                bundle_rows = [
+                    str_key_dict(row)
+                    for row in connection.execute(select(bundle_columns).where(clause)).fetchall()
+                ]
+                metadata_rows = []
             if not bundle_rows:
                 return []
-            uuids = set(bundle_row.uuid for bundle_row in bundle_rows)
-            dependency_rows = connection.execute(
-                cl_bundle_dependency.select()
-                .where(cl_bundle_dependency.c.child_uuid.in_(uuids))
-                .order_by(cl_bundle_dependency.c.id)
-            ).fetchall()
-            metadata_rows = connection.execute(
-                cl_bundle_metadata.select().where(cl_bundle_metadata.c.bundle_uuid.in_(uuids))
-            ).fetchall()
+            uuids = set(bundle_row['uuid'] for bundle_row in bundle_rows)
+            dependency_rows = []
+            if load_dependencies:
+                dependency_rows = connection.execute(
+                    cl_bundle_dependency.select()
+                    .where(cl_bundle_dependency.c.child_uuid.in_(uuids))
+                    .order_by(cl_bundle_dependency.c.id)
+                ).fetchall()
+            if metadata_keys is None:
+                metadata_rows = connection.execute(
+                    cl_bundle_metadata.select().where(cl_bundle_metadata.c.bundle_uuid.in_(uuids))
+                ).fetchall()
 
         # Make a dictionary for each bundle with both data and metadata.
-        bundle_values = {row.uuid: str_key_dict(row) for row in bundle_rows}
+        bundle_values = {row['uuid']: row for row in bundle_rows}
         for bundle_value in bundle_values.values():
             bundle_value['dependencies'] = []
             bundle_value['metadata'] = []
@@ -853,19 +1018,39 @@ class BundleModel(object):
                 raise IntegrityError('Got dependency %s without bundle' % (dep_row,))
             bundle_values[dep_row.child_uuid]['dependencies'].append(dep_row)
         for metadata_row in metadata_rows:
-            if metadata_row.bundle_uuid not in bundle_values:
+            if metadata_row['bundle_uuid'] not in bundle_values:
                 raise IntegrityError('Got metadata %s without bundle' % (metadata_row,))
-            bundle_values[metadata_row.bundle_uuid]['metadata'].append(metadata_row)
+            bundle_values[metadata_row['bundle_uuid']]['metadata'].append(metadata_row)
 
         # Construct and validate all of the retrieved bundles.
         sorted_values = sorted(bundle_values.values(), key=lambda r: r['id'])
-        bundles = [
-            #
-            get_bundle_subclass(bundle_value['bundle_type'])(bundle_value)
-            for bundle_value in sorted_values
-        ]
+        bundles = []
+        for bundle_value in sorted_values:
+            bundle_class = get_bundle_subclass(bundle_value['bundle_type'])
+            if metadata_keys is not None:
+                # Only set the requested keys, instead of defaults for all user-defined keys.
+                metadata = Metadata.collapse_dicts(
+                    bundle_class.METADATA_SPECS, bundle_value['metadata']
+                )
+                bundle_value['metadata'] = {
+                    key: metadata[key] for key in metadata_keys if key in metadata
+                }
+            bundles.append(bundle_class(bundle_value, strict=columns is None))
         return bundles
 
+    def batch_get_bundle_uuids(self, limit=None, **kwargs):
+        """
+        Return the uuids of the bundles matching a SQLAlchemy clause on the cl_bundle table,
+        in the order they were created. Unlike batch_get_bundles, no dependency or metadata
+        rows are loaded, so this is cheap enough to call on every bundle manager iteration.
+        :param limit: if not None, only return the uuids of the first limit bundles.
+        """
+        clause = self.make_kwargs_clause(cl_bundle, kwargs)
+        query = select([cl_bundle.c.uuid]).where(clause).order_by(cl_bundle.c.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return self._execute_query(query)
+
     # ==========================================================================
     # Server-side bundle state machine methods
     # ==========================================================================
@@ -884,6 +1069,9 @@ class BundleModel(object):
             if not row:
                 # The user deleted the bundle.
                 return False
+            if row.state != State.STAGED:
+                # The bundle was killed, or started by another pass of the bundle manager.
+                return False
 
             # Check if the designated worker is going to be terminated soon
             row = connection.execute(
@@ -996,6 +1184,23 @@ class BundleModel(object):
             worker_run_row = {'user_id': user_id, 'worker_id': worker_id, 'run_uuid': bundle.uuid}
             connection.execute(cl_worker_run.insert().values(worker_run_row))
 
+        bundle_update, time_increment, disk_increment = self._get_running_update(
+            bundle, worker_run, row, user_id
+        )
+        # Increment user time and disk as we go to ensure user doesn't go over quota.
+        if user_id == self.root_user_id:
+            self.increment_user_time_used(bundle.owner_id, time_increment)
+        self.increment_user_disk_used(bundle.owner_id, disk_increment)
+
+        self.update_bundle(bundle, bundle_update, connection)
+
+        return True
+
+    def _get_running_update(self, bundle, worker_run, row, user_id):
+        """
+        Returns the update of a bundle checked in by a worker in the PREPARING, RUNNING or
+        FINALIZING state, and the time and disk used by the bundle since the last checkin.
+        """
         cpu_usage: float = 0.0
         if 'cpu_usage' in worker_run.as_dict:
             cpu_usage = worker_run.cpu_usage
@@ -1014,22 +1219,20 @@ class BundleModel(object):
             'cpu_usage': cpu_usage,
             'memory_usage': memory_usage,
         }
-        if self.get_bundle_state(bundle.uuid) != State.FAILED:
+        if row.state != State.FAILED:
             # If the bundle state is failed, it means it failed on uploading_results and data_size was wiped.
             metadata_update['data_size'] = worker_run.disk_utilization
 
-        # Increment user time and disk as we go to ensure user doesn't go over quota.
         # time increment is the change in running time for this bundle since the last checkin.
         # disk increment is the change in disk quota used for this bundle since the last checkin.
+        time_increment = 0
         if user_id == self.root_user_id:
             time_increment = worker_run.container_time_total
             if hasattr(bundle.metadata, 'time'):
                 time_increment -= bundle.metadata.time
-            self.increment_user_time_used(bundle.owner_id, time_increment)
         disk_increment = worker_run.disk_utilization
         if hasattr(bundle.metadata, 'data_size'):
             disk_increment -= bundle.metadata.data_size
-        self.increment_user_disk_used(bundle.owner_id, disk_increment)
 
         if worker_run.docker_image is not None:
             metadata_update['docker_image'] = worker_run.docker_image
@@ -1048,11 +1251,8 @@ class BundleModel(object):
                 RunStage.UPLOADING_RESULTS
             ]['elapsed']
 
-        self.update_bundle(
-            bundle, {'state': worker_run.state, 'metadata': metadata_update}, connection
-        )
-
-        return True
+        bundle_update = {'state': worker_run.state, 'metadata': metadata_update}
+        return bundle_update, time_increment, disk_increment
 
     def transition_bundle_worker_offline(self, bundle):
         """
@@ -1101,6 +1301,14 @@ class BundleModel(object):
             If the user running the bundle was the CodaLab root user,
             increments the time used by the bundle owner.
         """
+        self.update_bundle(bundle, self._get_finalizing_update(worker_run), connection)
+        return True
+
+    @staticmethod
+    def _get_finalizing_update(worker_run):
+        """
+        Returns the update of a bundle checked in by a worker in the FINALIZING state.
+        """
         failure_message, exitcode = worker_run.failure_message, worker_run.exitcode
         if failure_message is None and exitcode is not None and exitcode != 0:
             failure_message = 'Exit code %d' % exitcode
@@ -1112,10 +1320,7 @@ class BundleModel(object):
         if exitcode is not None:
             metadata['exitcode'] = exitcode
 
-        bundle_update = {'state': State.FINALIZING, 'metadata': metadata}
-
-        self.update_bundle(bundle, bundle_update, connection)
-        return True
+        return {'state': State.FINALIZING, 'metadata': metadata}
 
     def transition_bundle_finished(self, bundle, bundle_location):
         """
@@ -1209,6 +1414,141 @@ class BundleModel(object):
             # State isn't one we can check in for
             return False
 
+    def batch_bundle_checkin(self, worker_runs, user_id, worker_id):
+        """
+        Equivalent to calling bundle_checkin() for each of the given BundleCheckinStates, but
+        loads all the bundles with one query and applies all the updates in a single
+        transaction with a few multi-row statements, adding the time and disk used by the bundles
+        to each owner once. Runs of bundles that no longer exist are skipped.
+        Returns the bundles that were checked in.
+        """
+        if not worker_runs:
+            return []
+        bundles = {
+            bundle.uuid: bundle
+            for bundle in self.batch_get_bundles(
+                uuid=[worker_run.uuid for worker_run in worker_runs]
+            )
+        }
+        checked_in = []
+        staged = []
+        bundle_updates = []
+        worker_run_rows = []
+        usage_increments = {}  # owner_id -> [time increment, disk increment]
+        with self.engine.begin() as connection:
+            rows = {
+                row.uuid: row
+                for row in connection.execute(
+                    cl_bundle.select().where(cl_bundle.c.uuid.in_(list(bundles)))
+                ).fetchall()
+            }
+            for worker_run in worker_runs:
+                bundle = bundles.get(worker_run.uuid)
+                row = rows.get(worker_run.uuid)
+                if bundle is None or row is None:
+                    # The user deleted the bundle.
+                    continue
+                checked_in.append(bundle)
+                if worker_run.state == State.STAGED:
+                    staged.append(bundle)
+                    continue
+                if worker_run.state not in [State.PREPARING, State.RUNNING, State.FINALIZING]:
+                    continue
+                if row.state == State.WORKER_OFFLINE:
+                    worker_run_rows.append(
+                        {'user_id': user_id, 'worker_id': worker_id, 'run_uuid': bundle.uuid}
+                    )
+                bundle_update, time_increment, disk_increment = self._get_running_update(
+                    bundle, worker_run, row, user_id
+                )
+                if worker_run.state == State.FINALIZING:
+                    finalizing_update = self._get_finalizing_update(worker_run)
+                    bundle_update['state'] = finalizing_update['state']
+                    bundle_update['metadata'].update(finalizing_update['metadata'])
+                bundle_updates.append((bundle, bundle_update))
+                increments = usage_increments.setdefault(bundle.owner_id, [0, 0])
+                increments[0] += time_increment
+                increments[1] += disk_increment
+
+            if worker_run_rows:
+                run_uuids = [worker_run_row['run_uuid'] for worker_run_row in worker_run_rows]
+                run_row = connection.execute(
+                    cl_worker_run.select().where(cl_worker_run.c.run_uuid.in_(run_uuids))
+                ).fetchone()
+                if run_row:
+                    # we should never get to this point: panic
+                    raise IntegrityError(
+                        'worker_run row exists for a bundle in WORKER_OFFLINE state, uuid %s'
+                        % (run_row.run_uuid,)
+                    )
+                self.do_multirow_insert(connection, cl_worker_run, worker_run_rows)
+            for owner_id, (time_increment, disk_increment) in usage_increments.items():
+                connection.execute(
+                    cl_user.update()
+                    .where(cl_user.c.user_id == owner_id)
+                    .values(
+                        time_used=cl_user.c.time_used + time_increment,
+                        disk_used=cl_user.c.disk_used + disk_increment,
+                    )
+                )
+            self._batch_update_bundles(connection, bundle_updates)
+        for bundle in staged:
+            self.transition_bundle_staged(bundle)
+        return checked_in
+
+    def _batch_update_bundles(self, connection, bundle_updates):
+        """
+        Equivalent to calling update_bundle() for each (bundle, update) pair, but writes the
+        bundles whose updates set the same columns to the same values and the same metadata keys
+        with one statement per group. Updates can't delete metadata keys, or change the command
+        or owner of a bundle.
+        """
+        groups = {}  # (column updates, metadata keys) -> uuids
+        metadata_values = []
+        search_index_bundles = []
+        for bundle, update in bundle_updates:
+            update = dict(update)
+            message = 'Illegal update: %s' % (update,)
+            precondition(set(update).isdisjoint(['id', 'uuid', 'command', 'owner_id']), message)
+            metadata_update = update.pop('metadata', {})
+            bundle.update_in_memory(update)
+            for key, value in metadata_update.items():
+                bundle.metadata.set_metadata_key(key, value)
+            bundle.validate()
+            group = (tuple(sorted(update.items())), tuple(sorted(metadata_update)))
+            groups.setdefault(group, []).append(bundle.uuid)
+            metadata_values.extend(
+                row_dict
+                for row_dict in bundle.to_dict().pop('metadata')
+                if row_dict['metadata_key'] in metadata_update
+            )
+            search_index_keys = set(SEARCH_INDEX_KEYS).intersection(metadata_update)
+            if search_index_keys:
+                search_index_bundles.append((bundle, search_index_keys))
+
+        try:
+            for (column_updates, metadata_keys), uuids in groups.items():
+                if column_updates:
+                    connection.execute(
+                        cl_bundle.update()
+                        .where(cl_bundle.c.uuid.in_(uuids))
+                        .values(dict(column_updates))
+                    )
+                if metadata_keys:
+                    connection.execute(
+                        cl_bundle_metadata.delete().where(
+                            and_(
+                                cl_bundle_metadata.c.bundle_uuid.in_(uuids),
+                                cl_bundle_metadata.c.metadata_key.in_(metadata_keys),
+                            )
+                        )
+                    )
+            self.do_multirow_insert(connection, cl_bundle_metadata, metadata_values)
+            for bundle, search_index_keys in search_index_bundles:
+                self._update_search_index(connection, bundle, search_index_keys)
+        except UnicodeError:
+            raise UsageError("Invalid character detected; use ascii characters only.")
+
     def save_bundle(self, bundle, bundle_store_uuid=None):
         """
         Save a bundle. On success, sets the Bundle object's id from the result.
@@ -1227,6 +1567,11 @@ class BundleModel(object):
             result = connection.execute(cl_bundle.insert().values(bundle_value))
             self.do_multirow_insert(connection, cl_bundle_dependency, dependency_values)
             self.do_multirow_insert(connection, cl_bundle_metadata, metadata_values)
+            self.do_multirow_insert(
+                connection, cl_bundle_search, [self._get_search_index_row(bundle)]
+            )
+            if getattr(bundle, 'command', None) is not None:
+                connection.execute(cl_bundle_memo.insert().values(self._get_memo_row(bundle)))
             if bundle_store_uuid:
                 bundle_location_value = {
                     'bundle_uuid': bundle.uuid,
@@ -1284,6 +1629,10 @@ class BundleModel(object):
                 cl_bundle_metadata.c.bundle_uuid == bundle.uuid,
                 cl_bundle_metadata.c.metadata_key.in_(metadata_delete_keys),
             )
+        search_index_keys = set(SEARCH_INDEX_KEYS).intersection(
+            list(metadata_update) + metadata_delete_keys
+        )
+        update_memo = 'command' in update or 'owner_id' in update
 
         # Perform the actual updates and deletes.
         def do_update(connection):
@@ -1295,6 +1644,16 @@ class BundleModel(object):
                     self.do_multirow_insert(connection, cl_bundle_metadata, metadata_update_values)
                 if metadata_delete_keys:
                     connection.execute(cl_bundle_metadata.delete().where(metadata_delete_clause))
+                if search_index_keys:
+                    self._update_search_index(connection, bundle, search_index_keys)
+                if update_memo:
+                    connection.execute(
+                        cl_bundle_memo.delete().where(cl_bundle_memo.c.bundle_uuid == bundle.uuid)
+                    )
+                    if getattr(bundle, 'command', None) is not None:
+                        connection.execute(
+                            cl_bundle_memo.insert().values(self._get_memo_row(bundle))
+                        )
             except UnicodeError:
                 raise UsageError("Invalid character detected; use ascii characters only.")
 
@@ -1304,6 +1663,85 @@ class BundleModel(object):
             with self.engine.begin() as connection:
                 do_update(connection)
 
+    @staticmethod
+    def _get_search_index_row(bundle):
+        """
+        Return the bundle_search row of a bundle, from its metadata in memory.
+        """
+        row = {key: getattr(bundle.metadata, key, None) for key in SEARCH_INDEX_KEYS}
+        row['bundle_uuid'] = bundle.uuid
+        return row
+
+    def _update_search_index(self, connection, bundle, keys):
+        """
+        Update the given columns of the bundle_search row of the bundle with its metadata in
+        memory. The other columns are left alone, since the bundle may have been loaded with only
+        some of its metadata. Insert the row if it is missing.
+        """
+        result = connection.execute(
+            cl_bundle_search.update()
+            .where(cl_bundle_search.c.bundle_uuid == bundle.uuid)
+            .values({key: getattr(bundle.metadata, key, None) for key in keys})
+        )
+        if result.rowcount == 0:
+            connection.execute(cl_bundle_search.insert().values(self._get_search_index_row(bundle)))
+
+    @staticmethod
+    def _get_memo_row(bundle):
+        """
+        Return the bundle_memo row of a bundle with a command.
+        """
+        return {
+            'bundle_uuid': bundle.uuid,
+            'owner_id': bundle.owner_id,
+            'memo_key': get_memo_key(
+                bundle.command, [(dep.child_path, dep.parent_uuid) for dep in bundle.dependencies]
+            ),
+        }
+
+    def batch_fail_bundles(self, bundle_failure_messages):
+        """
+        Moves the given bundles to the FAILED state and saves their failure messages. This is
+        equivalent to calling update_bundle() with a state and failure_message update for each
+        bundle, but uses a single multi-row UPDATE and a single bulk metadata insert.
+        :param bundle_failure_messages: a list of (bundle, failure_message) tuples.
+        """
+        if not bundle_failure_messages:
+            return
+
+        # Apply the updates in memory and validate the result, like update_bundle does.
+        uuids = []
+        metadata_values = []
+        for bundle, failure_message in bundle_failure_messages:
+            bundle.update_in_memory({'state': State.FAILED})
+            bundle.metadata.set_metadata_key('failure_message', failure_message)
+            bundle.validate()
+            uuids.append(bundle.uuid)
+            metadata_values.extend(
+                dict(row_dict, bundle_uuid=bundle.uuid)
+                for row_dict in bundle.metadata.to_dicts(bundle.METADATA_SPECS)
+                if row_dict['metadata_key'] == 'failure_message'
+            )
+
+        with self.engine.begin() as connection:
+            try:
+                connection.execute(
+                    cl_bundle.update()
+                    .where(cl_bundle.c.uuid.in_(uuids))
+                    .values({'state': State.FAILED})
+                )
+                connection.execute(
+                    cl_bundle_metadata.delete().where(
+                        and_(
+                            cl_bundle_metadata.c.bundle_uuid.in_(uuids),
+                            cl_bundle_metadata.c.metadata_key == 'failure_message',
+                        )
+                    )
+                )
+                self.do_multirow_insert(connection, cl_bundle_metadata, metadata_values)
+            except UnicodeError:
+                raise UsageError("Invalid character detected; use ascii characters only.")
+
     def get_bundle_dependencies(self, uuid):
         with self.engine.begin() as connection:
             dependency_rows = connection.execute(
@@ -1369,6 +1807,12 @@ class BundleModel(object):
             connection.execute(
                 cl_bundle_metadata.delete().where(cl_bundle_metadata.c.bundle_uuid.in_(uuids))
             )
+            connection.execute(
+                cl_bundle_search.delete().where(cl_bundle_search.c.bundle_uuid.in_(uuids))
+            )
+            connection.execute(
+                cl_bundle_memo.delete().where(cl_bundle_memo.c.bundle_uuid.in_(uuids))
+            )
             connection.execute(
                 cl_bundle_dependency.delete().where(cl_bundle_dependency.c.child_uuid.in_(uuids))
             )
@@ -2728,6 +3172,25 @@ class BundleModel(object):
                 del user_info['last_login']
         return user_info
 
+    def batch_get_user_info(self, user_ids):
+        """
+        Return a dict mapping each of the given user IDs to its user info, as returned by
+        get_user_info(). Users that don't exist are omitted.
+        """
+        if not user_ids:
+            return {}
+        with self.engine.begin() as connection:
+            rows = connection.execute(
+                select([cl_user]).where(cl_user.c.user_id.in_(list(user_ids)))
+            ).fetchall()
+        user_infos = {}
+        for row in rows:
+            user_info = str_key_dict(row)
+            del user_info['date_joined']
+            del user_info['last_login']
+            user_infos[user_info['user_id']] = user_info
+        return user_infos
+
     def update_user_info(self, user_info):
         """
         Update the given user's info with |user_info|.
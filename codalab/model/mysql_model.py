@@ -38,7 +38,9 @@ def ping_connection(dbapi_connection, connection_record, connection_proxy):
 
 
 class MySQLModel(BundleModel):
-    def __init__(self, engine_url, default_user_info, root_user_id, system_user_id):
+    def __init__(
+        self, engine_url, default_user_info, root_user_id, system_user_id, use_search_index=False
+    ):
         if not engine_url.startswith('mysql://'):
             raise UsageError('Engine URL should start with mysql://')
         engine = create_engine(
@@ -49,7 +51,9 @@ class MySQLModel(BundleModel):
             pool_recycle=3600,
             encoding='utf-8',
         )
-        super(MySQLModel, self).__init__(engine, default_user_info, root_user_id, system_user_id)
+        super(MySQLModel, self).__init__(
+            engine, default_user_info, root_user_id, system_user_id, use_search_index
+        )
 
     def do_multirow_insert(self, connection, table, values):
         # MySQL allows for more efficient multi-row insertions.
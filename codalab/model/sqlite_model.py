@@ -9,7 +9,7 @@ from codalab.model.bundle_model import BundleModel
 
 
 class SQLiteModel(BundleModel):
-    def __init__(self, default_user_info, root_user_id, system_user_id):
+    def __init__(self, default_user_info, root_user_id, system_user_id, use_search_index=False):
         # Use an in-memory database in multiple threads -- see
         # https://docs.sqlalchemy.org/en/13/dialects/sqlite.html#threading-pooling-behavior
         engine = create_engine(
@@ -19,4 +19,6 @@ class SQLiteModel(BundleModel):
             connect_args={'check_same_thread': False},
             poolclass=StaticPool,
         )
-        super(SQLiteModel, self).__init__(engine, default_user_info, root_user_id, system_user_id)
+        super(SQLiteModel, self).__init__(
+            engine, default_user_info, root_user_id, system_user_id, use_search_index
+        )
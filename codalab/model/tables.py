@@ -77,6 +77,44 @@ bundle_metadata = Table(
     mysql_charset=TABLE_DEFAULT_CHARSET,
 )
 
+# Denormalized copy of the commonly searched bundle metadata, with one row per bundle and typed
+# columns, so that bundle searches can filter and sort on these without joining bundle_metadata
+# once per keyword. Kept in sync by BundleModel.save_bundle and update_bundle.
+bundle_search = Table(
+    'bundle_search',
+    db_metadata,
+    Column('bundle_uuid', String(63), ForeignKey(bundle.c.uuid), primary_key=True, nullable=False),
+    Column('name', Text, nullable=True),
+    Column('description', Text, nullable=True),
+    Column('created', BigInteger, nullable=True),
+    Column('data_size', BigInteger, nullable=True),
+    Index('bundle_search_name_index', 'name', mysql_length=63),
+    Index('bundle_search_created_index', 'created'),
+    Index('bundle_search_data_size_index', 'data_size'),
+    mysql_charset=TABLE_DEFAULT_CHARSET,
+)
+
+# Memoization keys of bundles with a command, so that bundles with the same command and
+# dependencies can be looked up with a single indexed query (see BundleModel.get_memoized_bundles).
+bundle_memo = Table(
+    'bundle_memo',
+    db_metadata,
+    Column(
+        'id',
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        nullable=False,
+        autoincrement=True,
+    ),
+    Column('bundle_uuid', String(63), ForeignKey(bundle.c.uuid), nullable=False),
+    Column('owner_id', String(255), nullable=True),
+    # Hex SHA-256 digest computed by codalab.model.bundle_model.get_memo_key.
+    Column('memo_key', String(64), nullable=False),
+    UniqueConstraint('bundle_uuid', name='uix_1'),
+    Index('bundle_memo_key_index', 'memo_key', 'owner_id'),
+    mysql_charset=TABLE_DEFAULT_CHARSET,
+)
+
 # For each child_uuid, we have: key = child_path, target = (parent_uuid, parent_path)
 bundle_dependency = Table(
     'bundle_dependency',
@@ -555,5 +593,8 @@ worker_dependency = Table(
     # Serialized list of dependencies for the user/worker combination.
     # See WorkerModel for the serialization method.
     Column('dependencies', LargeBinary, nullable=False),
+    # Version of the dependencies assigned by the worker, so that it can send the changes since
+    # that version instead of all of them. Null for workers that don't send versions.
+    Column('dependencies_version', String(63), nullable=True),
     mysql_charset=TABLE_DEFAULT_CHARSET,
 )
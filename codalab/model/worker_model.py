@@ -1,10 +1,13 @@
 import asyncio
 from contextlib import closing
 import datetime
+import io
 import json
 import logging
 import os
 import socket
+import stat
+import threading
 import time
 import websockets
 
@@ -21,6 +24,67 @@ from codalab.model.tables import (
 
 logger = logging.getLogger(__name__)
 
+# Size of the buffer used to stream data to a socket.
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+# Seconds to wait before retrying to connect to a socket that isn't listening
+# yet. The delay doubles after every attempt, up to the maximum.
+MIN_RETRY_DELAY_SECS = 0.001
+MAX_SEND_STREAM_RETRY_DELAY_SECS = 0.05
+MAX_SEND_JSON_MESSAGE_RETRY_DELAY_SECS = 0.3
+
+# Seconds to wait for the ws-server to accept a ping.
+WS_PING_TIMEOUT_SECS = 5
+
+# A checkin that changes nothing about a worker only updates its checkin time if the stored
+# checkin time is at least this old. Must be well below the worker timeout of the bundle manager.
+CHECKIN_TIME_REFRESH_SECS = 15
+# Changes of the free disk space of a worker up to this fraction of the stored value are
+# only written when the checkin time is refreshed, since the free disk space changes a little on
+# nearly every checkin.
+FREE_DISK_BYTES_CHANGE_FRACTION = 0.01
+
+
+def _retry_delays(max_delay_secs):
+    """
+    Yields exponentially increasing delays, starting at MIN_RETRY_DELAY_SECS
+    and capped at max_delay_secs.
+    """
+    delay = MIN_RETRY_DELAY_SECS
+    while True:
+        yield delay
+        delay = min(delay * 2, max_delay_secs)
+
+
+def _send_fileobj(sock, fileobj):
+    """
+    Sends the contents of fileobj on sock. Regular files opened with open() are
+    sent with sendfile(), so the data never gets copied into Python. Other
+    file-like objects are read into a single reusable buffer: wrappers such as
+    GzipFile have a fileno(), but it is the one of the underlying file, whose
+    bytes are not the ones they read.
+    """
+    raw = fileobj.raw if isinstance(fileobj, io.BufferedReader) else fileobj
+    is_regular_file = isinstance(raw, io.FileIO) and stat.S_ISREG(os.fstat(raw.fileno()).st_mode)
+    if is_regular_file:
+        sock.sendfile(fileobj, offset=fileobj.tell())
+        return
+
+    if hasattr(fileobj, 'readinto'):
+        buf = bytearray(STREAM_BUFFER_SIZE)
+        view = memoryview(buf)
+        while True:
+            num_bytes = fileobj.readinto(buf)
+            if not num_bytes:
+                return
+            sock.sendall(view[:num_bytes])
+    else:
+        while True:
+            data = fileobj.read(STREAM_BUFFER_SIZE)
+            if not data:
+                return
+            sock.sendall(data)
+
 
 class WorkerModel(object):
     """
@@ -33,12 +97,21 @@ class WorkerModel(object):
        provides methods to allocate sockets (i.e. figure out unique paths in the
        socket directory), clean up sockets (i.e. delete the socket files),
        listen on these sockets for messages and send messages to these sockets.
+
+    Before a message is sent to a worker, the worker is pinged through the
+    ws-server so that it checks in and starts listening. Pings are sent over a
+    single websocket connection that is kept open by an event loop running in
+    a background thread.
     """
 
     def __init__(self, engine, socket_dir, ws_server):
         self._engine = engine
         self._socket_dir = socket_dir
         self._ws_server = ws_server
+        self._ws_loop = None
+        self._ws_loop_lock = threading.Lock()
+        self._ws_connection = None
+        self._ws_connection_lock = None
 
     def worker_checkin(
         self,
@@ -60,15 +133,21 @@ class WorkerModel(object):
         """
         Adds the worker to the database, if not yet there. Returns the socket ID
         that the worker should listen for messages on.
+
+        If dependencies is None, the dependencies of the worker are left as they are (see
+        update_worker_dependencies). If nothing about the worker changed, apart from small
+        changes of its free disk space (see FREE_DISK_BYTES_CHANGE_FRACTION), its row is only
+        written when its checkin time is older than CHECKIN_TIME_REFRESH_SECS.
         """
         with self._engine.begin() as conn:
+            now = datetime.datetime.utcnow()
             worker_row = {
                 'tag': tag,
                 'cpus': cpus,
                 'gpus': gpus,
                 'memory_bytes': memory_bytes,
                 'free_disk_bytes': free_disk_bytes,
-                'checkin_time': datetime.datetime.utcnow(),
+                'checkin_time': now,
                 'shared_file_system': shared_file_system,
                 'tag_exclusive': tag_exclusive,
                 'exit_after_num_runs': exit_after_num_runs,
@@ -90,11 +169,21 @@ class WorkerModel(object):
             ).fetchone()
             if existing_row:
                 socket_id = existing_row.socket_id
-                conn.execute(
-                    cl_worker.update()
-                    .where(and_(cl_worker.c.user_id == user_id, cl_worker.c.worker_id == worker_id))
-                    .values(worker_row)
-                )
+                unchanged = all(
+                    getattr(existing_row, key) == value
+                    for key, value in worker_row.items()
+                    if key not in ('checkin_time', 'free_disk_bytes')
+                ) and self._free_disk_bytes_unchanged(existing_row.free_disk_bytes, free_disk_bytes)
+                if not unchanged or now - existing_row.checkin_time >= datetime.timedelta(
+                    seconds=CHECKIN_TIME_REFRESH_SECS
+                ):
+                    conn.execute(
+                        cl_worker.update()
+                        .where(
+                            and_(cl_worker.c.user_id == user_id, cl_worker.c.worker_id == worker_id)
+                        )
+                        .values(worker_row)
+                    )
             else:
                 socket_id = self.allocate_socket(user_id, worker_id, conn)
                 worker_row.update(
@@ -102,6 +191,9 @@ class WorkerModel(object):
                 )
                 conn.execute(cl_worker.insert().values(worker_row))
 
+            if dependencies is None:
+                return socket_id
+
             # Update dependencies
             blob = self._serialize_dependencies(dependencies).encode()
             if existing_row:
@@ -124,6 +216,77 @@ class WorkerModel(object):
 
         return socket_id
 
+    @staticmethod
+    def _free_disk_bytes_unchanged(old_free_disk_bytes, free_disk_bytes):
+        if old_free_disk_bytes is None or free_disk_bytes is None:
+            return old_free_disk_bytes == free_disk_bytes
+        return (
+            abs(free_disk_bytes - old_free_disk_bytes)
+            <= old_free_disk_bytes * FREE_DISK_BYTES_CHANGE_FRACTION
+        )
+
+    def update_worker_dependencies(
+        self,
+        user_id,
+        worker_id,
+        version,
+        dependencies=None,
+        base_version=None,
+        added=None,
+        removed=None,
+    ):
+        """
+        Updates the dependencies of a worker that versions them, from one of:
+            - dependencies: the full list of dependencies
+            - added and removed: the changes since base_version
+            - neither: the dependencies haven't changed since version
+        Returns whether the stored dependencies are now at version. If they aren't (e.g. the
+        worker was cleaned up, or a previous checkin was lost), the worker should send the full
+        list. Nothing is written if the dependencies didn't change.
+        """
+        worker_condition = and_(
+            cl_worker_dependency.c.user_id == user_id,
+            cl_worker_dependency.c.worker_id == worker_id,
+        )
+        with self._engine.begin() as conn:
+            row = conn.execute(
+                select([cl_worker_dependency.c.dependencies_version]).where(worker_condition)
+            ).fetchone()
+            if dependencies is None:
+                if row is None:
+                    conn.execute(
+                        cl_worker_dependency.insert().values(
+                            user_id=user_id,
+                            worker_id=worker_id,
+                            dependencies=self._serialize_dependencies([]).encode(),
+                        )
+                    )
+                    return False
+                if added is None and removed is None:
+                    return row.dependencies_version == version
+                if row.dependencies_version != base_version:
+                    return False
+                blob = conn.execute(
+                    select([cl_worker_dependency.c.dependencies]).where(worker_condition)
+                ).scalar()
+                current = set(self._deserialize_dependencies(blob))
+                current.difference_update(map(tuple, removed or []))
+                current.update(map(tuple, added or []))
+                dependencies = sorted(current)
+            values = {
+                'dependencies': self._serialize_dependencies(dependencies).encode(),
+                'dependencies_version': version,
+            }
+            if row is None:
+                conn.execute(
+                    cl_worker_dependency.insert().values(
+                        user_id=user_id, worker_id=worker_id, **values
+                    )
+                )
+            else:
+                conn.execute(cl_worker_dependency.update().where(worker_condition).values(values))
+            return True
+
     @staticmethod
     def _serialize_dependencies(dependencies):
         return json.dumps(dependencies, separators=(',', ':'))
@@ -219,6 +382,18 @@ class WorkerModel(object):
             worker_dict[(row.user_id, row.worker_id)]['run_uuids'].append(row.run_uuid)
         return list(worker_dict.values())
 
+    def get_worker_run_uuids(self, user_id, worker_id):
+        """
+        Returns the uuids of the runs assigned to the given worker.
+        """
+        with self._engine.begin() as conn:
+            rows = conn.execute(
+                select([cl_worker_run.c.run_uuid]).where(
+                    and_(cl_worker_run.c.user_id == user_id, cl_worker_run.c.worker_id == worker_id)
+                )
+            ).fetchall()
+        return [row.run_uuid for row in rows]
+
     def update_workers(self, user_id, worker_id, update):
         """
         Update the designated worker with columns and values
@@ -339,6 +514,7 @@ class WorkerModel(object):
         return False. Otherwise, returns True.
         """
         start_time = time.time()
+        retry_delays = _retry_delays(MAX_SEND_STREAM_RETRY_DELAY_SECS)
         while time.time() - start_time < timeout_secs:
             with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as sock:
                 sock.settimeout(timeout_secs)
@@ -351,28 +527,57 @@ class WorkerModel(object):
                     logging.debug("socket error when calling send_stream")
 
                 if not success:
-                    # Shouldn't be too expensive just to keep retrying.
-                    time.sleep(0.003)
+                    time.sleep(next(retry_delays))
                     continue
 
-                while True:
-                    data = fileobj.read(4096)
-                    if not data:
-                        return True
-                    sock.sendall(data)
+                _send_fileobj(sock, fileobj)
+                return True
 
         return False
 
-    def _ping_worker_ws(self, worker_id):
-        async def ping_ws():
-            async with websockets.connect(f"{self._ws_server}/main") as websocket:
-                await websocket.send(worker_id)
+    def _get_ws_loop(self):
+        """
+        Returns the event loop used to ping workers, starting it in a daemon
+        thread the first time it is needed.
+        """
+        with self._ws_loop_lock:
+            if self._ws_loop is None:
+                self._ws_loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._ws_loop.run_forever, name='ws-ping', daemon=True
+                ).start()
+            return self._ws_loop
+
+    async def _send_ws_ping(self, worker_id):
+        """
+        Sends worker_id to the ws-server, reusing the open connection and
+        reconnecting once if the ws-server closed it.
+        """
+        if self._ws_connection_lock is None:
+            self._ws_connection_lock = asyncio.Lock()
+        async with self._ws_connection_lock:
+            for attempt in range(2):
+                if self._ws_connection is None or self._ws_connection.closed:
+                    self._ws_connection = await websockets.connect(f"{self._ws_server}/main")
+                try:
+                    await self._ws_connection.send(worker_id)
+                    return
+                except websockets.exceptions.ConnectionClosed:
+                    self._ws_connection = None
+                    if attempt > 0:
+                        raise
 
-        futures = [ping_ws()]
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(asyncio.wait(futures))
-        logging.warn(f"Pinged worker through websockets, worker id: {worker_id}")
+    def _ping_worker_ws(self, worker_id):
+        future = asyncio.run_coroutine_threadsafe(
+            self._send_ws_ping(worker_id), self._get_ws_loop()
+        )
+        try:
+            future.result(timeout=WS_PING_TIMEOUT_SECS)
+        except Exception as e:
+            future.cancel()
+            logging.error(f"Failed to ping worker through websockets, worker id: {worker_id}: {e}")
+            return
+        logging.debug(f"Pinged worker through websockets, worker id: {worker_id}")
 
     def send_json_message(self, socket_id, worker_id, message, timeout_secs, autoretry=True):
         """
@@ -387,6 +592,7 @@ class WorkerModel(object):
         """
         self._ping_worker_ws(worker_id)
         start_time = time.time()
+        retry_delays = _retry_delays(MAX_SEND_JSON_MESSAGE_RETRY_DELAY_SECS)
         while time.time() - start_time < timeout_secs:
             with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as sock:
                 sock.settimeout(timeout_secs)
@@ -408,13 +614,12 @@ class WorkerModel(object):
                     else:
                         success = True
                 except socket.error as e:
-                    logging.error(f"socket error when calling send_json_message: {e}")
+                    logging.debug(f"socket error when calling send_json_message: {e}")
 
                 if not success:
-                    # Shouldn't be too expensive just to keep retrying.
-                    # TODO: maybe exponential backoff
-                    logging.error("Sleeping for 0.1 seconds.")
-                    time.sleep(0.3)
+                    # The worker usually starts listening within a few
+                    # milliseconds of being pinged, so retry quickly at first.
+                    time.sleep(next(retry_delays))
                     continue
 
                 if not autoretry:
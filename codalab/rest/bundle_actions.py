@@ -44,5 +44,6 @@ def create_bundle_actions():
             local.model.update_bundle(
                 bundle, {'state': State.KILLED, 'metadata': {'actions': new_actions}}
             )
+            local.upload_manager.cleanup_staged_files(bundle.uuid)
 
     return BundleActionSchema(many=True).dump(actions).data
@@ -4,6 +4,7 @@ import mimetypes
 import os
 import re
 import sys
+import threading
 import traceback
 import time
 from io import BytesIO
@@ -104,6 +105,8 @@ def _fetch_bundles():
         - `.floating              ` : Match bundles that aren't on any worksheet.
         - `.count                 ` : Count the number of bundles.
         - `.limit=10              ` : Limit the number of results to the top 10.
+        - `.cursor                ` : Page through the results with a cursor (see below).
+        - `.cursor=<token>        ` : Fetch the page of results after the given cursor.
      - `include_display_metadata`: `1` to include additional metadata helpful
        for displaying the bundle info, `0` to omit them. Default is `0`.
      - `include`: comma-separated list of related resources to include, such as "owner"
@@ -117,6 +120,16 @@ def _fetch_bundles():
         }
     }
     ```
+    When the `.cursor` keyword is used, pages are fetched at a constant cost however deep they
+    are, and the token of the next page is returned as follows (`null` on the last page):
+    ```
+    {
+        "data": [...],
+        "meta": {
+            "next_cursor": <token>
+        }
+    }
+    ```
     2. By bundle `command` and/or `dependencies` (for `--memoized` option in cl [run/mimic] command).
     When `dependencies` is not defined, the searching result will include bundles that match with command only.
 
@@ -130,6 +143,7 @@ def _fetch_bundles():
     The returning result will be aggregated in the same way as 1.
     """
     keywords = query_get_list('keywords')
+    search_meta = {}
     specs = query_get_list('specs')
     worksheet_uuid = request.query.get('worksheet')
     descendant_depth = query_get_type(int, 'depth', None)
@@ -145,6 +159,8 @@ def _fetch_bundles():
             return json_api_meta({}, {'result': search_result['result']})
         # If not aggregate this is a list
         bundle_uuids = search_result['result']
+        if 'next_cursor' in search_result:
+            search_meta['next_cursor'] = search_result['next_cursor']
     elif specs:
         # Resolve bundle specs
         bundle_uuids = canonicalize.get_bundle_uuids(
@@ -162,7 +178,10 @@ def _fetch_bundles():
     if descendant_depth is not None:
         bundle_uuids = local.model.get_self_and_descendants(bundle_uuids, depth=descendant_depth)
 
-    return build_bundles_document(bundle_uuids)
+    document = build_bundles_document(bundle_uuids)
+    if search_meta:
+        json_api_meta(document, search_meta)
+    return document
 
 
 def build_bundles_document(bundle_uuids):
@@ -1120,6 +1139,96 @@ def _fetch_bundle_contents_blob(uuid, path=''):
     return fileobj
 
 
+# Maximum time a follow request stays open, after which the client makes a new one.
+MAX_FOLLOW_TIMEOUT_SECONDS = 20
+FOLLOW_CHUNK_SIZE = 64 * 1024
+# Maximum number of follow requests a server process serves at the same time. Each one holds a
+# server thread while it is open, so this keeps threads free for the other requests. Further
+# follow requests get a 503, and clients fall back to polling the file.
+MAX_CONCURRENT_FOLLOWS = 10
+_follow_slots = threading.BoundedSemaphore(MAX_CONCURRENT_FOLLOWS)
+
+
+class _FollowStream(object):
+    """Iterates over the chunks of a followed file, and frees its follow slot once the file
+    ends or the server closes the response (e.g. when the client disconnects)."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            while True:
+                data = self._fileobj.read(FOLLOW_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+        finally:
+            # Bottle doesn't close responses that end before their first chunk.
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._fileobj.close()
+        finally:
+            _follow_slots.release()
+
+
+@get(
+    '/bundles/<uuid:re:%s>/contents/follow/<path:path>' % spec_util.UUID_STR,
+    name='follow_bundle_contents_blob',
+    apply=ProtectedPlugin(),
+)
+def _follow_bundle_contents_blob(uuid, path):
+    """
+    API to follow a file of a running bundle, like `tail -f`: streams the file
+    from the given offset, then streams what is appended to it as soon as it is
+    written. The response ends once the bundle is no longer running (the rest of
+    the file can then be fetched with `GET /bundles/<uuid>/contents/blob/<path>`
+    and a `Range` header) or after `timeout` seconds, after which clients can
+    make a new request from the offset they reached. The response doesn't say
+    why it ended, so clients check the state of the bundle.
+
+    The response is not compressed, so that each chunk can be sent as soon as
+    it is read.
+
+    Each server process follows at most 10 files at a time, and responds with
+    503 Service Unavailable beyond that. Clients should then poll the file with
+    `GET /bundles/<uuid>/contents/blob/<path>` instead.
+
+    Query parameters:
+    - `offset`: byte offset in the file to start at. Default is 0.
+    - `timeout`: maximum number of seconds the response stays open. Default and
+      maximum is 20.
+    """
+    offset = query_get_type(int, 'offset', default=0)
+    timeout = query_get_type(float, 'timeout', default=MAX_FOLLOW_TIMEOUT_SECONDS)
+    if offset < 0:
+        abort(http.client.BAD_REQUEST, 'offset must be non-negative.')
+    timeout = max(0, min(timeout, MAX_FOLLOW_TIMEOUT_SECONDS))
+    check_bundles_have_read_permission(local.model, request.user, [uuid])
+
+    if not _follow_slots.acquire(blocking=False):
+        abort(http.client.SERVICE_UNAVAILABLE, 'Too many files are being followed, poll instead.')
+    try:
+        fileobj = local.download_manager.follow_file(BundleTarget(uuid, path), offset, timeout)
+    except NotFoundError as e:
+        _follow_slots.release()
+        abort(http.client.NOT_FOUND, str(e))
+    except Exception as e:
+        _follow_slots.release()
+        abort(http.client.BAD_REQUEST, str(e))
+
+    response.set_header('Content-Type', 'application/octet-stream')
+    response.set_header('Content-Encoding', 'identity')
+    response.set_header('Access-Control-Allow-Origin', '*')
+    return _FollowStream(fileobj)
+
+
 @put(
     '/bundles/<uuid:re:%s>/contents/blob/' % spec_util.UUID_STR,
     name='update_bundle_contents_blob',
@@ -1153,34 +1262,8 @@ def _update_bundle_contents_blob(uuid):
     - `store`: (optional) The name of the bundle store where the bundle should be uploaded to.
       If unspecified, the CLI will pick the optimal available bundle store.
     """
-    check_bundles_have_all_permission(local.model, request.user, [uuid])
-    bundle = local.model.get_bundle(uuid)
-    if bundle.state in State.FINAL_STATES:
-        abort(http.client.FORBIDDEN, 'Contents cannot be modified, bundle already finalized.')
-
-    # Get and validate query parameters
-    finalize_on_failure = query_get_bool('finalize_on_failure', default=False)
-    finalize_on_success = query_get_bool('finalize_on_success', default=True)
-    use_azure_blob_beta = query_get_bool('use_azure_blob_beta', default=False)
-    if os.getenv("CODALAB_ALWAYS_USE_AZURE_BLOB_BETA") == "1":
-        use_azure_blob_beta = True
-    store_name = request.query.get('store') or os.getenv('CODALAB_DEFAULT_BUNDLE_STORE_NAME')
-    store = (
-        local.model.get_bundle_store(request.user.user_id, name=store_name) if store_name else None
-    )
-    final_state = request.query.get('state_on_success', default=State.READY)
-    if finalize_on_success and final_state not in State.FINAL_STATES:
-        abort(
-            http.client.BAD_REQUEST,
-            'state_on_success must be one of %s' % '|'.join(State.FINAL_STATES),
-        )
 
-    # If this bundle already has data, remove it.
-    if local.upload_manager.has_contents(bundle):
-        local.upload_manager.cleanup_existing_contents(bundle)
-
-    # Store the data.
-    try:
+    def upload(bundle, use_azure_blob_beta, store):
         source = None
         if request.query.urls:
             sources = query_get_list('urls')
@@ -1210,6 +1293,138 @@ def _update_bundle_contents_blob(uuid):
             local.model.update_disk_metadata(bundle, bundle_location)
             local.model.enforce_disk_quota(bundle, bundle_location)
 
+    _update_bundle_contents(uuid, upload)
+
+
+@post(
+    '/bundles/<uuid:re:%s>/contents/staged/' % spec_util.UUID_STR,
+    name='get_missing_staged_files',
+    apply=AuthenticatedProtectedPlugin(),
+)
+def _get_missing_staged_files(uuid):
+    """
+    Return which files of a delta upload of the contents of the given running or
+    uploading bundle still have to be staged (see
+    `PUT /bundles/<uuid>/contents/manifest/`).
+
+    The request body should look like: `{"hashes": [<SHA-256 hash of a file>, ...]}`.
+    The response body looks like: `{"missing": [<SHA-256 hash of a file>, ...]}`.
+    """
+    bundle = _get_bundle_to_update_contents(uuid)
+    try:
+        return {
+            'missing': local.upload_manager.get_missing_staged_files(bundle, request.json['hashes'])
+        }
+    except UsageError as e:
+        abort(http.client.BAD_REQUEST, str(e))
+
+
+@put(
+    '/bundles/<uuid:re:%s>/contents/staged/<sha256:re:[0-9a-f]{64}>' % spec_util.UUID_STR,
+    name='stage_file',
+    apply=AuthenticatedProtectedPlugin(),
+)
+def _stage_file(uuid, sha256):
+    """
+    Stage a file for a delta upload of the contents of the given running or uploading
+    bundle. The request body is the contents of the file, whose SHA-256 hash must be `sha256`.
+
+    Staged files count against the disk quota of the owner of the bundle until the bundle
+    is finalized, and the total size of the files staged for a bundle is limited.
+    """
+    bundle = _get_bundle_to_update_contents(uuid)
+    try:
+        local.upload_manager.stage_file(bundle, sha256, request['wsgi.input'])
+    except UsageError as e:
+        abort(http.client.BAD_REQUEST, str(e))
+
+
+@put(
+    '/bundles/<uuid:re:%s>/contents/manifest/' % spec_util.UUID_STR,
+    name='update_bundle_contents_manifest',
+    apply=AuthenticatedProtectedPlugin(),
+)
+def _update_bundle_contents_manifest(uuid):
+    """
+    Update the contents of the given running or uploading bundle from files that were
+    staged with `PUT /bundles/<uuid>/contents/staged/<sha256>`.
+
+    A delta upload of a directory sends its manifest (the paths, types, modes and
+    hashes of its entries) to `POST /bundles/<uuid>/contents/staged/`, which returns the
+    files that the server doesn't have yet, stages only those files, and then sends the
+    manifest to this endpoint, which assembles the contents of the bundle. An upload
+    that is retried only sends the files that changed since the last attempt.
+
+    The request body should look like: `{"manifest": [<entry>, ...]}`, where each entry has
+    the keys `path`, `type` (`directory`, `file` or `link`), `mode`, `mtime`, and
+    `size` and `sha256` for files or `target` for links.
+
+    Query parameters: `finalize_on_failure`, `finalize_on_success`, `state_on_success`,
+    `use_azure_blob_beta` and `store`, as for `PUT /bundles/<uuid>/contents/blob/`.
+    """
+
+    def upload(bundle, use_azure_blob_beta, store):
+        local.upload_manager.upload_staged_contents_to_bundle_store(
+            bundle,
+            request.json['manifest'],
+            use_azure_blob_beta=use_azure_blob_beta,
+            destination_bundle_store=store,
+        )
+        bundle_location = local.bundle_store.get_bundle_location(bundle.uuid)
+        local.model.update_disk_metadata(bundle, bundle_location)
+        local.model.enforce_disk_quota(bundle, bundle_location)
+
+    _update_bundle_contents(uuid, upload)
+
+
+#############################################################
+#  BUNDLE HELPER FUNCTIONS
+#############################################################
+
+
+def _get_bundle_to_update_contents(uuid):
+    """
+    Returns the bundle with the given uuid if the user can update its contents.
+    """
+    check_bundles_have_all_permission(local.model, request.user, [uuid])
+    bundle = local.model.get_bundle(uuid)
+    if bundle.state in State.FINAL_STATES:
+        abort(http.client.FORBIDDEN, 'Contents cannot be modified, bundle already finalized.')
+    return bundle
+
+
+def _update_bundle_contents(uuid, upload):
+    """
+    Replaces the contents of the given running or uploading bundle by calling
+    upload(bundle, use_azure_blob_beta, store), and updates the state of the bundle according to
+    the query parameters of PUT /bundles/<uuid>/contents/blob/.
+    """
+    bundle = _get_bundle_to_update_contents(uuid)
+
+    # Get and validate query parameters
+    finalize_on_failure = query_get_bool('finalize_on_failure', default=False)
+    finalize_on_success = query_get_bool('finalize_on_success', default=True)
+    use_azure_blob_beta = query_get_bool('use_azure_blob_beta', default=False)
+    if os.getenv("CODALAB_ALWAYS_USE_AZURE_BLOB_BETA") == "1":
+        use_azure_blob_beta = True
+    store_name = request.query.get('store') or os.getenv('CODALAB_DEFAULT_BUNDLE_STORE_NAME')
+    store = (
+        local.model.get_bundle_store(request.user.user_id, name=store_name) if store_name else None
+    )
+    final_state = request.query.get('state_on_success', default=State.READY)
+    if finalize_on_success and final_state not in State.FINAL_STATES:
+        abort(
+            http.client.BAD_REQUEST,
+            'state_on_success must be one of %s' % '|'.join(State.FINAL_STATES),
+        )
+
+    # If this bundle already has data, remove it.
+    if local.upload_manager.has_contents(bundle):
+        local.upload_manager.cleanup_existing_contents(bundle)
+
+    # Store the data.
+    try:
+        upload(bundle, use_azure_blob_beta, store)
     except UsageError as err:
         # This is a user error (most likely disk quota overuser) so raise a client HTTP error
         msg = "Upload failed: %s" % err
@@ -1222,6 +1437,7 @@ def _update_bundle_contents_blob(uuid):
         )
         if local.upload_manager.has_contents(bundle):
             local.upload_manager.cleanup_existing_contents(bundle)
+        local.upload_manager.cleanup_staged_files(bundle.uuid)
         abort(http.client.BAD_REQUEST, msg)
 
     except Exception as e:
@@ -1242,6 +1458,7 @@ def _update_bundle_contents_blob(uuid):
                     'metadata': {'failure_message': msg, 'error_traceback': traceback.format_exc()},
                 },
             )
+            local.upload_manager.cleanup_staged_files(bundle.uuid)
         else:
             local.model.update_bundle(
                 bundle,
@@ -1257,11 +1474,7 @@ def _update_bundle_contents_blob(uuid):
         if finalize_on_success:
             # Upload succeeded: update state
             local.model.update_bundle(bundle, {'state': final_state})
-
-
-#############################################################
-#  BUNDLE HELPER FUNCTIONS
-#############################################################
+            local.upload_manager.cleanup_staged_files(bundle.uuid)
 
 
 def get_request_range():
@@ -1366,6 +1579,8 @@ def delete_bundles(uuids, force, recursive, data_only, dry_run):
         if not data_only:
             # Delete bundle metadata.
             local.model.delete_bundles(relevant_uuids)
+        for uuid in relevant_uuids:
+            local.upload_manager.cleanup_staged_files(uuid)
 
     # Delete the data.
     bundle_link_urls = local.model.get_bundle_metadata(relevant_uuids, "link_url")
@@ -124,7 +124,9 @@ def delete_user():
         '''
         error_messages = []
 
-        bundles = local.model.batch_get_bundles(owner_id=user_id)
+        bundles = local.model.batch_get_bundles(
+            columns=(), metadata_keys=(), load_dependencies=False, owner_id=user_id
+        )
         if bundles is not None and len(bundles) > 0:
             bundle_uuids = [bundle.uuid for bundle in bundles]
             error_messages.append(
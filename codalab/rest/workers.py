@@ -28,6 +28,9 @@ def checkin(worker_id):
     WAIT_TIME_SECS = 5.0
 
     # Old workers might not have all the fields, so allow subsets to be missing.
+    # Workers that send dependencies_version may send their dependencies as a delta
+    # (see CheckinDeltaEncoder), which is applied by update_worker_dependencies.
+    dependencies_version = request.json.get("dependencies_version")
     socket_id = local.worker_model.worker_checkin(
         request.user.user_id,
         worker_id,
@@ -37,7 +40,7 @@ def checkin(worker_id):
         request.json.get("gpus"),
         request.json.get("memory_bytes"),
         request.json.get("free_disk_bytes"),
-        request.json["dependencies"],
+        request.json["dependencies"] if dependencies_version is None else None,
         request.json.get("shared_file_system", False),
         request.json.get("tag_exclusive", False),
         request.json.get("exit_after_num_runs", DEFAULT_EXIT_AFTER_NUM_RUNS),
@@ -46,30 +49,18 @@ def checkin(worker_id):
     )
 
     messages = []
-    for run in request.json["runs"]:
-        try:
-            worker_run = BundleCheckinState.from_dict(run)
-            bundle = local.model.get_bundle(worker_run.uuid)
-            local.model.bundle_checkin(
-                bundle, worker_run, request.user.user_id, worker_id,
-            )
-
-            if local.model.get_user_time_quota_left(bundle.owner_id) <= 0:
-                # Then, user has gone over their time quota and we kill the job.
-                kill_message = (
-                    'Kill requested: User time quota exceeded. To apply for more quota, please visit the following link: '
-                    'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/#how-do-i-request-more-disk-quota-or-time-quota'
-                )
-                messages.append({'type': 'kill', 'uuid': bundle.uuid, 'kill_message': kill_message})
-            elif local.model.get_user_disk_quota_left(bundle.owner_id) <= 0:
-                # Then, user has gone over their disk quota and we kill the job.
-                kill_message = (
-                    'Kill requested: User disk quota exceeded. To apply for more quota, please visit the following link: '
-                    'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/#how-do-i-request-more-disk-quota-or-time-quota'
-                )
-                messages.append({'type': 'kill', 'uuid': bundle.uuid, 'kill_message': kill_message})
-        except Exception as e:
-            logger.info("Exception in REST checkin: {}".format(e))
+    if dependencies_version is not None:
+        in_sync = local.worker_model.update_worker_dependencies(
+            request.user.user_id,
+            worker_id,
+            dependencies_version,
+            dependencies=request.json.get("dependencies"),
+            base_version=request.json.get("dependencies_base_version"),
+            added=request.json.get("dependencies_added"),
+            removed=request.json.get("dependencies_removed"),
+        )
+        messages.append({'type': 'checkin_ack', 'in_sync': in_sync})
+    messages.extend(checkin_runs(worker_id, request.json["runs"]))
 
     with closing(local.worker_model.start_listening(socket_id)) as sock:
         messages.append(local.worker_model.get_json_message(sock, WAIT_TIME_SECS))
@@ -77,6 +68,63 @@ def checkin(worker_id):
     return json.dumps(messages)
 
 
+def checkin_runs(worker_id, runs):
+    """
+    Updates the bundles of the runs reported by a worker checkin, in a single transaction.
+    Returns kill messages for all the runs of the worker whose owners have gone over their time
+    or disk quota.
+    """
+    worker_runs = []
+    for run in runs:
+        try:
+            worker_runs.append(BundleCheckinState.from_dict(run))
+        except Exception as e:
+            logger.info("Exception in REST checkin: {}".format(e))
+    try:
+        bundles = local.model.batch_bundle_checkin(worker_runs, request.user.user_id, worker_id)
+    except Exception as e:
+        # Check in the runs one by one, so that a bad run doesn't prevent the others from being
+        # checked in.
+        logger.info("Exception in REST batch checkin, checking in runs one by one: {}".format(e))
+        bundles = []
+        for worker_run in worker_runs:
+            try:
+                bundle = local.model.get_bundle(worker_run.uuid)
+                local.model.bundle_checkin(
+                    bundle, worker_run, request.user.user_id, worker_id,
+                )
+                bundles.append(bundle)
+            except Exception as e:
+                logger.info("Exception in REST checkin: {}".format(e))
+
+    # Workers only send the runs whose state changed, so the quotas are checked for all the runs
+    # of the worker, once per owner.
+    run_uuids = set(local.worker_model.get_worker_run_uuids(request.user.user_id, worker_id)) | set(
+        bundle.uuid for bundle in bundles
+    )
+    owner_ids = local.model.get_bundle_owner_ids(list(run_uuids)) if run_uuids else {}
+    user_infos = local.model.batch_get_user_info(set(owner_ids.values()))
+    kill_messages = {}
+    for owner_id, user_info in user_infos.items():
+        if local.model.get_user_time_quota_left(owner_id, user_info) <= 0:
+            # Then, user has gone over their time quota and we kill the job.
+            kill_messages[owner_id] = (
+                'Kill requested: User time quota exceeded. To apply for more quota, please visit the following link: '
+                'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/#how-do-i-request-more-disk-quota-or-time-quota'
+            )
+        elif local.model.get_user_disk_quota_left(owner_id, user_info) <= 0:
+            # Then, user has gone over their disk quota and we kill the job.
+            kill_messages[owner_id] = (
+                'Kill requested: User disk quota exceeded. To apply for more quota, please visit the following link: '
+                'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/#how-do-i-request-more-disk-quota-or-time-quota'
+            )
+    return [
+        {'type': 'kill', 'uuid': uuid, 'kill_message': kill_messages[owner_id]}
+        for uuid, owner_id in sorted(owner_ids.items())
+        if owner_id in kill_messages
+    ]
+
+
 def check_reply_permission(worker_id, socket_id):
     """
     Checks if the authenticated user running a worker with the given ID can
@@ -182,7 +230,12 @@ def workers_info():
         )
         del worker["dependencies"]
 
-        running_bundles = local.model.batch_get_bundles(uuid=worker["run_uuids"])
+        running_bundles = local.model.batch_get_bundles(
+            columns=(),
+            metadata_keys=("request_cpus", "request_gpus"),
+            load_dependencies=False,
+            uuid=worker["run_uuids"],
+        )
         worker["cpus_in_use"] = sum(bundle.metadata.request_cpus for bundle in running_bundles)
         worker["gpus_in_use"] = sum(bundle.metadata.request_gpus for bundle in running_bundles)
 
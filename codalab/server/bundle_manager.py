@@ -1,5 +1,7 @@
 import copy
+import concurrent.futures
 import datetime
+import heapq
 import logging
 import os
 import random
@@ -12,6 +14,7 @@ import traceback
 
 from apache_beam.io.filesystems import FileSystems
 from collections import defaultdict
+from operator import itemgetter
 from typing import List
 
 from codalab.objects.permission import (
@@ -20,6 +23,8 @@ from codalab.objects.permission import (
 )
 from codalab.common import NotFoundError, PermissionError, parse_linked_bundle_url
 from codalab.lib import bundle_util, formatting, path_util, zip_util
+from codalab.server.staged_bundle_queue import StagedBundleQueue, staged_bundle_priority_key
+from codalab.server.worker_capacity_index import WorkerCapacityIndex, worker_sort_key
 from codalab.server.worker_info_accessor import WorkerInfoAccessor
 from codalab.worker.file_util import remove_path
 from codalab.worker.un_tar_directory import un_tar_directory
@@ -39,6 +44,14 @@ MINIMUM_REQUEST_MEMORY_BYTES = 4 * 1024 * 1024
 # Deduct DISK_QUOTA_SLACK_BYTES from the max user disk quota bytes when computing the default amount of disk space to
 # request. Then the default max disk quota that can be requested becomes disk quota left - DISK_QUOTA_SLACK_BYTES.
 DISK_QUOTA_SLACK_BYTES = 0.5 * 1024 * 1024 * 1024
+# While dispatching bundles, clean up dead workers at most this often.
+WORKER_CLEANUP_INTERVAL_SECONDS = 1
+# Look for files staged for delta uploads that were left behind at most this often, and remove
+# those of bundles whose uploads haven't been active for STAGED_FILES_MAX_AGE_SECONDS.
+STAGED_FILES_CLEANUP_INTERVAL_SECONDS = 10 * 60
+STAGED_FILES_MAX_AGE_SECONDS = SECONDS_PER_DAY
+# Look for bundles that have been unresponsive for BUNDLE_TIMEOUT_DAYS days at most this often.
+UNRESPONSIVE_BUNDLES_CHECK_INTERVAL_SECONDS = 60
 
 
 def normpath(path):
@@ -55,7 +68,16 @@ class BundleManager(object):
     Assigns run bundles to workers and makes make bundles.
     """
 
-    def __init__(self, codalab_manager, worker_timeout_seconds=60):
+    def __init__(
+        self,
+        codalab_manager,
+        worker_timeout_seconds=60,
+        incremental_scheduling=False,
+        reconcile_interval_seconds=60,
+        max_make_bundle_threads=4,
+        max_dependency_copy_threads=4,
+        make_bundle_link_mode='copy',
+    ):
         config = codalab_manager.config.get('workers')
         if not config:
             print('config.json file missing a workers section.', file=sys.stderr)
@@ -72,6 +94,30 @@ class BundleManager(object):
 
         self._make_uuids_lock = threading.Lock()
         self._make_uuids = set()
+        # Counters and timings of the make bundles made by this bundle manager, see
+        # make_bundle_stats(). Protected by _make_uuids_lock.
+        self._make_bundle_stats = {
+            'made': 0,
+            'failed': 0,
+            'bytes': 0,
+            # Time bundles waited for a free thread, spent preparing their dependencies, and
+            # spent storing them (copying, linking or uploading), in seconds.
+            'queue_seconds': 0.0,
+            'prepare_seconds': 0.0,
+            'store_seconds': 0.0,
+            'total_seconds': 0.0,
+        }
+        # Make bundles are made by a bounded pool of threads, so that a burst of make bundles
+        # doesn't saturate the disks. Bundles that don't fit in the pool stay STAGED.
+        self._max_make_bundle_threads = max_make_bundle_threads
+        self._make_bundle_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_make_bundle_threads, thread_name_prefix='make-bundle'
+        )
+        # The dependencies of a single make bundle are copied by up to this many threads.
+        self._max_dependency_copy_threads = max_dependency_copy_threads
+        # How dependencies on the same partition as the bundle are materialized, see
+        # path_util.link_or_copy.
+        self._make_bundle_link_mode = make_bundle_link_mode
 
         def parse(to_value, field):
             return to_value(config[field]) if field in config else None
@@ -84,9 +130,24 @@ class BundleManager(object):
         )
         self._max_request_disk = parse(formatting.parse_size, 'max_request_disk') or 0
 
+        # WorkerInfoAccessor of the workers, kept between scheduling passes.
+        self._workers = None
+
         self._default_cpu_image = config.get('default_cpu_image')
         self._default_gpu_image = config.get('default_gpu_image')
 
+        # In incremental scheduling mode, staged bundles are kept in an in-memory queue that is
+        # updated from state changes, and only fully reloaded from the database every
+        # reconcile_interval_seconds seconds.
+        self._staged_queue = StagedBundleQueue() if incremental_scheduling else None
+        self._reconcile_interval_seconds = reconcile_interval_seconds
+        self._last_reconcile_time = None
+        self._last_staged_files_cleanup_time = None
+        self._last_unresponsive_bundles_check_time = None
+        # The capacities of the workers at the end of the last scheduling pass, see
+        # _get_worker_capacities().
+        self._last_worker_capacities = None
+
         logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
 
     def run(self, sleep_time):
@@ -101,6 +162,8 @@ class BundleManager(object):
 
         while self._is_making_bundles():
             time.sleep(sleep_time)
+        self._make_bundle_executor.shutdown()
+        logger.info('Make bundle stats: %s', self.make_bundle_stats())
 
     def signal(self):
         with self._exiting_lock:
@@ -111,12 +174,43 @@ class BundleManager(object):
             return self._exiting
 
     def _run_iteration(self):
+        reconcile = self._should_reconcile()
         self._stage_bundles()
         self._make_bundles()
-        self._schedule_run_bundles()
-        self._fail_unresponsive_bundles()
+        self._schedule_run_bundles(reconcile)
+        self._check_unresponsive_bundles()
+        self._cleanup_stale_staged_files()
+
+    def _should_reconcile(self):
+        """
+        Returns True if this iteration should do a full pass over the database. This is always
+        the case, except in incremental scheduling mode, where it happens every
+        reconcile_interval_seconds seconds.
+        """
+        if self._staged_queue is None:
+            return True
+        now = time.time()
+        if (
+            self._last_reconcile_time is None
+            or now - self._last_reconcile_time >= self._reconcile_interval_seconds
+        ):
+            self._last_reconcile_time = now
+            return True
+        return False
+
+    def _note_staged(self, bundle):
+        """
+        In incremental scheduling mode, queues the bundle at the next scheduling pass if it was
+        moved to the STAGED state.
+        """
+        if self._staged_queue is not None and bundle.bundle_type == 'run':
+            self._staged_queue.note_staged(bundle.uuid)
 
     def _set_staged_status(self, bundle, staged_status):
+        if self._staged_queue is not None and not self._staged_queue.should_set_staged_status(
+            bundle.uuid, staged_status
+        ):
+            return
         self._model.update_bundle(bundle, {'metadata': {'staged_status': staged_status}})
 
     def _stage_bundles(self):
@@ -180,9 +274,7 @@ class BundleManager(object):
 
         for bundle, failure_message in bundles_to_fail:
             logger.info('Failing bundle %s: %s', bundle.uuid, failure_message)
-            self._model.update_bundle(
-                bundle, {'state': State.FAILED, 'metadata': {'failure_message': failure_message}}
-            )
+        self._model.batch_fail_bundles(bundles_to_fail)
         for bundle in bundles_to_stage:
             logger.info('Staging %s', bundle.uuid)
             self._model.update_bundle(
@@ -194,8 +286,9 @@ class BundleManager(object):
                     },
                 },
             )
+            self._note_staged(bundle)
 
-    def _make_bundles(self) -> List[threading.Thread]:
+    def _make_bundles(self) -> List[concurrent.futures.Future]:
         # Re-stage any stuck bundles. This would happen if the bundle manager
         # died.
         for bundle in self._model.batch_get_bundles(state=State.MAKING, bundle_type='make'):
@@ -203,18 +296,40 @@ class BundleManager(object):
                 logger.info('Re-staging make bundle %s', bundle.uuid)
                 self._model.update_bundle(bundle, {'state': State.STAGED})
 
-        threads = []
-        for bundle in self._model.batch_get_bundles(state=State.STAGED, bundle_type='make'):
+        with self._make_uuids_lock:
+            num_free_threads = self._max_make_bundle_threads - len(self._make_uuids)
+        if num_free_threads <= 0:
+            return []
+
+        # Only load the bundles that there are free threads for.
+        uuids = self._model.batch_get_bundle_uuids(
+            state=State.STAGED, bundle_type='make', limit=num_free_threads
+        )
+        futures = []
+        for bundle in self._model.batch_get_bundles(uuid=uuids) if uuids else []:
             logger.info('Making bundle %s', bundle.uuid)
             self._model.update_bundle(bundle, {'state': State.MAKING})
             with self._make_uuids_lock:
                 self._make_uuids.add(bundle.uuid)
             # Making a bundle could take time, so do the work in a separate
             # thread to ensure quick scheduling.
-            t = threading.Thread(target=self._make_bundle, args=[bundle])
-            threads.append(t)
-            t.start()
-        return threads
+            futures.append(
+                self._make_bundle_executor.submit(self._make_bundle, bundle, time.time())
+            )
+        return futures
+
+    def make_bundle_stats(self):
+        """
+        Returns the number of make bundles made and failed, the number of bytes made, and the
+        time spent in each phase of making them, in seconds, since the bundle manager started.
+        """
+        with self._make_uuids_lock:
+            return dict(self._make_bundle_stats)
+
+    def _record_make_bundle_stats(self, **increments):
+        with self._make_uuids_lock:
+            for key, value in increments.items():
+                self._make_bundle_stats[key] += value
 
     def _is_making_bundles(self):
         with self._make_uuids_lock:
@@ -224,7 +339,9 @@ class BundleManager(object):
         with self._make_uuids_lock:
             return uuid in self._make_uuids
 
-    def _make_bundle(self, bundle):
+    def _make_bundle(self, bundle, submit_time=None):
+        start_time = time.time()
+        prepare_seconds = store_seconds = 0.0
         try:
             bundle_link_url = getattr(bundle.metadata, "link_url", None)
             bundle_location = bundle_link_url or self._bundle_store.get_bundle_location(bundle.uuid)
@@ -232,73 +349,31 @@ class BundleManager(object):
             # Here the path might be a blob storage url or local file system path
             path = normpath(bundle_location)
 
-            deps = []
             parent_bundle_link_urls = self._model.get_bundle_metadata(
                 [dep.parent_uuid for dep in bundle.dependencies], "link_url"
             )
+            # A dependency can be copied into the key of another one, in which case dependencies
+            # are copied one at a time and in order.
+            child_paths = [os.path.normpath(dep.child_path) for dep in bundle.dependencies]
+            is_nested = any(
+                child_path == os.curdir or other.startswith(child_path + os.sep)
+                for i, child_path in enumerate(child_paths)
+                for j, other in enumerate(child_paths)
+                if i != j
+            )
+            max_copy_threads = 1 if is_nested else self._max_dependency_copy_threads
             with tempfile.TemporaryDirectory() as tempdir:
-                for dep in bundle.dependencies:
-                    parent_bundle_link_url = parent_bundle_link_urls.get(dep.parent_uuid)
-                    try:
-                        parent_bundle_path = parent_bundle_link_url or normpath(
-                            self._bundle_store.get_bundle_location(dep.parent_uuid)
-                        )
-                    except NotFoundError:
-                        raise Exception(
-                            'Invalid dependency %s'
-                            % (path_util.safe_join(dep.parent_uuid, dep.parent_path))
-                        )
-                    dependency_path = normpath(os.path.join(parent_bundle_path, dep.parent_path))
-                    if not dependency_path.startswith(parent_bundle_path) or (
-                        not os.path.islink(dependency_path)
-                        and not FileSystems.exists(dependency_path.rstrip("/"))
-                    ):
-                        raise Exception(
-                            'Invalid dependency %s'
-                            % (path_util.safe_join(dep.parent_uuid, dep.parent_path))
-                        )
-
-                    child_path = normpath(os.path.join(path, dep.child_path))
-                    if not child_path.startswith(path):
-                        raise Exception('Invalid key for dependency: %s' % (dep.child_path))
-
-                    # If source path is on Azure Blob Storage, we should download it to a temporary local directory first.
-                    if parse_linked_bundle_url(dependency_path).uses_beam:
-                        if dep.child_path != "":
-                            dependency_path = os.path.join(tempdir, dep.child_path)
-                        else:
-                            dependency_path = os.path.join(tempdir, dep.parent_uuid)
-
-                        target_info = self._download_manager.get_target_info(
-                            BundleTarget(dep.parent_uuid, dep.parent_path), 0
-                        )
-                        target = target_info['resolved_target']
-
-                        # Download the dependency to dependency_path (which is now in the temporary directory).
-                        # TODO (Ashwin): Unify some of the logic here with the code in DependencyManager._store_dependency()
-                        # into common utility functions.
-                        if target_info['type'] == 'directory':
-                            fileobj = self._download_manager.stream_tarred_gzipped_directory(target)
-                            un_tar_directory(fileobj, dependency_path, 'gz')
-                        else:
-                            fileobj = self._download_manager.stream_file(target, gzipped=False)
-
-                            with open(dependency_path, 'wb') as f:
-                                shutil.copyfileobj(fileobj, f)
-
-                    # If source is local file system and destination is blob storage,
-                    # need to copy everything into a temp folder and upload together
-                    elif parse_linked_bundle_url(path).uses_beam:
-                        tempdir_dependency_path = (
-                            os.path.join(tempdir, dep.child_path)
-                            if dep.child_path != ""
-                            else os.path.join(tempdir, dep.parent_uuid)
-                        )
-                        path_util.copy(
-                            dependency_path, tempdir_dependency_path, follow_symlinks=False
-                        )
-                        dependency_path = tempdir_dependency_path
-                    deps.append((dependency_path, child_path))
+                # Dependencies are downloaded or copied into the temporary directory concurrently;
+                # results are returned in the order of bundle.dependencies.
+                deps = self._map_dependencies(
+                    lambda dep: self._prepare_make_bundle_dependency(
+                        dep, path, tempdir, parent_bundle_link_urls
+                    ),
+                    bundle.dependencies,
+                    max_copy_threads,
+                )
+                store_start_time = time.time()
+                prepare_seconds = store_start_time - start_time
                 remove_path(path)  # delete the original bundle path
 
                 # Upload to destination bundle storage
@@ -316,19 +391,39 @@ class BundleManager(object):
                     )
                 else:  # The destination is using local filesystem
                     if len(deps) == 1 and deps[0][1] == path:
-                        path_util.copy(deps[0][0], path, follow_symlinks=False)
+                        path_util.link_or_copy(deps[0][0], path, self._make_bundle_link_mode)
                     else:
                         os.mkdir(path)
-                        for dependency_path, child_path in deps:
-                            path_util.copy(dependency_path, child_path, follow_symlinks=False)
+                        self._map_dependencies(
+                            lambda dep: path_util.link_or_copy(
+                                dep[0], dep[1], self._make_bundle_link_mode
+                            ),
+                            deps,
+                            max_copy_threads,
+                        )
+                store_seconds = time.time() - store_start_time
 
             # update the bundle location since we already change is_dir field
             bundle_location = bundle_link_url or self._bundle_store.get_bundle_location(bundle.uuid)
             self._model.enforce_disk_quota(bundle, bundle_location)
             self._model.update_disk_metadata(bundle, bundle_location)
-            logger.info('Finished making bundle %s', bundle.uuid)
+            elapsed = time.time() - start_time
+            data_size = getattr(bundle.metadata, 'data_size', None) or 0
+            logger.info(
+                'Finished making bundle %s: %s from %d dependencies in %.2fs (%s/s; '
+                'preparing %.2fs, storing %.2fs)',
+                bundle.uuid,
+                formatting.size_str(data_size),
+                len(bundle.dependencies),
+                elapsed,
+                formatting.size_str(data_size / elapsed if elapsed > 0 else 0),
+                prepare_seconds,
+                store_seconds,
+            )
             self._model.update_bundle(bundle, {'state': State.READY})
+            self._record_make_bundle_stats(made=1, bytes=data_size)
         except Exception as e:
+            self._record_make_bundle_stats(failed=1)
             logger.info('Failing bundle %s: %s', bundle.uuid, str(e))
             self._model.update_bundle(
                 bundle,
@@ -341,9 +436,95 @@ class BundleManager(object):
                 },
             )
         finally:
+            self._record_make_bundle_stats(
+                queue_seconds=start_time - submit_time if submit_time is not None else 0.0,
+                prepare_seconds=prepare_seconds,
+                store_seconds=store_seconds,
+                total_seconds=time.time() - start_time,
+            )
             with self._make_uuids_lock:
                 self._make_uuids.remove(bundle.uuid)
 
+    @staticmethod
+    def _map_dependencies(fn, items, max_threads):
+        """
+        Returns [fn(item) for item in items], computed by up to max_threads threads.
+        Raises the first exception raised by fn, in order.
+        """
+        if len(items) <= 1 or max_threads <= 1:
+            return [fn(item) for item in items]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_threads, len(items))
+        ) as executor:
+            return list(executor.map(fn, items))
+
+    def _prepare_make_bundle_dependency(self, dep, path, tempdir, parent_bundle_link_urls):
+        """
+        Validates a dependency of a make bundle at |path|. Dependencies on blob storage are
+        downloaded into |tempdir|, as well as all dependencies of a bundle that is itself on blob
+        storage, so that the temporary directory can be uploaded at once.
+        Returns a (dependency_path, child_path) tuple, where dependency_path is a local path.
+        """
+        parent_bundle_link_url = parent_bundle_link_urls.get(dep.parent_uuid)
+        try:
+            parent_bundle_path = parent_bundle_link_url or normpath(
+                self._bundle_store.get_bundle_location(dep.parent_uuid)
+            )
+        except NotFoundError:
+            raise Exception(
+                'Invalid dependency %s' % (path_util.safe_join(dep.parent_uuid, dep.parent_path))
+            )
+        dependency_path = normpath(os.path.join(parent_bundle_path, dep.parent_path))
+        if not dependency_path.startswith(parent_bundle_path) or (
+            not os.path.islink(dependency_path)
+            and not FileSystems.exists(dependency_path.rstrip("/"))
+        ):
+            raise Exception(
+                'Invalid dependency %s' % (path_util.safe_join(dep.parent_uuid, dep.parent_path))
+            )
+
+        child_path = normpath(os.path.join(path, dep.child_path))
+        if not child_path.startswith(path):
+            raise Exception('Invalid key for dependency: %s' % (dep.child_path))
+
+        # If source path is on Azure Blob Storage, we should download it to a temporary local directory first.
+        if parse_linked_bundle_url(dependency_path).uses_beam:
+            if dep.child_path != "":
+                dependency_path = os.path.join(tempdir, dep.child_path)
+            else:
+                dependency_path = os.path.join(tempdir, dep.parent_uuid)
+
+            target_info = self._download_manager.get_target_info(
+                BundleTarget(dep.parent_uuid, dep.parent_path), 0
+            )
+            target = target_info['resolved_target']
+
+            # Download the dependency to dependency_path (which is now in the temporary directory).
+            # TODO (Ashwin): Unify some of the logic here with the code in DependencyManager._store_dependency()
+            # into common utility functions.
+            if target_info['type'] == 'directory':
+                fileobj = self._download_manager.stream_tarred_gzipped_directory(target)
+                un_tar_directory(fileobj, dependency_path, 'gz')
+            else:
+                fileobj = self._download_manager.stream_file(target, gzipped=False)
+
+                with open(dependency_path, 'wb') as f:
+                    shutil.copyfileobj(fileobj, f)
+
+        # If source is local file system and destination is blob storage,
+        # need to copy everything into a temp folder and upload together
+        elif parse_linked_bundle_url(path).uses_beam:
+            tempdir_dependency_path = (
+                os.path.join(tempdir, dep.child_path)
+                if dep.child_path != ""
+                else os.path.join(tempdir, dep.parent_uuid)
+            )
+            path_util.link_or_copy(
+                dependency_path, tempdir_dependency_path, self._make_bundle_link_mode
+            )
+            dependency_path = tempdir_dependency_path
+        return dependency_path, child_path
+
     def _cleanup_dead_workers(self, workers):
         """
         Clean-up workers that we haven't heard from for more than WORKER_TIMEOUT_SECONDS seconds.
@@ -372,6 +553,7 @@ class BundleManager(object):
                 logger.info('Re-staging run bundle %s', bundle.uuid)
                 if self._model.transition_bundle_staged(bundle):
                     workers.restage(bundle.uuid)
+                    self._note_staged(bundle)
 
     def _acknowledge_recently_finished_bundles(self, workers):
         """
@@ -384,6 +566,8 @@ class BundleManager(object):
                     'Bringing bundle offline %s: %s', bundle.uuid, 'No worker claims bundle'
                 )
                 self._model.transition_bundle_worker_offline(bundle)
+                # Bundles on preemptible workers are moved back to the STAGED state.
+                self._note_staged(bundle)
             elif self._worker_model.send_json_message(
                 worker['socket_id'],
                 worker['worker_id'],
@@ -398,6 +582,7 @@ class BundleManager(object):
                 bundle_location = self._bundle_store.get_bundle_location(bundle.uuid)
                 # TODO(Ashwin): fix this -- bundle location could be linked.
                 self._model.transition_bundle_finished(bundle, bundle_location)
+                self._upload_manager.cleanup_staged_files(bundle.uuid)
 
     def _bring_offline_stuck_running_bundles(self, workers):
         """
@@ -418,6 +603,8 @@ class BundleManager(object):
             if failure_message is not None:
                 logger.info('Bringing bundle offline %s: %s', bundle.uuid, failure_message)
                 self._model.transition_bundle_worker_offline(bundle)
+                # Bundles on preemptible workers are moved back to the STAGED state.
+                self._note_staged(bundle)
 
     def _schedule_run_bundles_on_workers(self, workers, staged_bundles_to_run, user_info_cache):
         """
@@ -458,15 +645,7 @@ class BundleManager(object):
             # and (2) whether it requested to run on a specific worker (bundles
             # with a specified worker have higher priority).
             sorted_user_staged_bundles = sorted(
-                user_staged_bundles,
-                key=lambda b: (
-                    b[0].metadata.request_priority is not None
-                    and b[0].metadata.request_priority >= 0,
-                    b[0].metadata.request_priority is None,
-                    b[0].metadata.request_priority,
-                    b[0].metadata.request_queue is not None,
-                ),
-                reverse=True,
+                user_staged_bundles, key=lambda b: staged_bundle_priority_key(b[0]), reverse=True,
             )
             for queue_position, bundle in zip(queue_positions, sorted_user_staged_bundles):
                 staged_bundles_to_run[queue_position] = bundle
@@ -479,75 +658,65 @@ class BundleManager(object):
         # are attempting to run each staged bundle will respect the ordering of
         # staged_bundles_to_run (i.e., they won't be used immediately, and will be instead
         # assigned bundles on the next run of _run_iteration).
-        resource_deducted_user_workers = defaultdict(list)
+        user_worker_indexes = {}
         user_parallel_run_quota_left = {}
         for user in user_queue_positions.keys():
             # Skip for the root user as the user-owned workers will be the public CodaLab workers,
             # which are accounted for after this loop.
-            if user != self._model.root_user_id:
-                resource_deducted_user_workers[user] = self._deduct_worker_resources(
-                    workers.get_user_workers(user), running_bundles_info
-                )
+            user_worker_indexes[user] = WorkerCapacityIndex(
+                self._deduct_worker_resources(workers.get_user_workers(user), running_bundles_info)
+                if user != self._model.root_user_id
+                else []
+            )
             user_parallel_run_quota_left[user] = self._model.get_user_parallel_run_quota_left(
                 user, user_info_cache[user]
             )
-        resource_deducted_codalab_owned_workers = self._deduct_worker_resources(
-            workers.get_user_workers(self._model.root_user_id), running_bundles_info
+        codalab_owned_worker_index = WorkerCapacityIndex(
+            self._deduct_worker_resources(
+                workers.get_user_workers(self._model.root_user_id), running_bundles_info
+            )
         )
+        worker_indexes = list(user_worker_indexes.values()) + [codalab_owned_worker_index]
 
-        workers_list = []
-        # We store a running record of the workers that go offline while we're dispatching
-        # bundles, so if they come back online, we continue to ignore them in order in order to
-        # respect bundle prioritization. Such workers will be assigned bundles in the BundleManager's
-        # next iteration.
-        offline_workers = set()
+        last_cleanup_time = None
         # Dispatch bundles
         for bundle, bundle_resources in staged_bundles_to_run:
-            if user_parallel_run_quota_left[bundle.owner_id] > 0:
-                workers_list = (
-                    resource_deducted_user_workers[bundle.owner_id]
-                    + resource_deducted_codalab_owned_workers
-                )
-            else:
-                workers_list = resource_deducted_user_workers[bundle.owner_id]
             # Although we pre-compute the available workers, workers might go offline.
-            # As a result, we refresh the currently-online workers (by cleaning up the
-            # dead workers), and filter out the precomputed workers that are no longer online.
-            # If we don't do this, the workers might appear otherwise-eligible for runs, and we'll
-            # attempt to start every bundle on every such worker. This can take a long time (if there
-            # are many staged bundles, over an hour), and new bundles cannot be assigned to workers
-            # in the meantime.
-            self._cleanup_dead_workers(workers)
-            online_worker_ids = set(
-                worker["worker_id"]
-                for worker in (
-                    workers.get_user_workers(bundle.owner_id)
-                    + workers.get_user_workers(self._model.root_user_id)
-                )
-            )
-            # Store the worker IDs for workers that have gone offline.
-            offline_workers.update(
-                [
-                    worker["worker_id"]
-                    for worker in workers_list
-                    if worker["worker_id"] not in online_worker_ids
-                ]
-            )
-            # Filter worker that have gone offline. Note that we can't just use
-            # online_worker_ids here, since we want to also exclude workers that go
-            # offline, and then later come back online while we're still dispatching bundles.
-            workers_list = [
-                worker for worker in workers_list if worker["worker_id"] not in offline_workers
-            ]
+            # As a result, we periodically refresh the currently-online workers (by cleaning up the
+            # dead workers), and remove the precomputed workers that are no longer online from the
+            # indexes. If we don't do this, the workers might appear otherwise-eligible for runs, and
+            # we'll attempt to start every bundle on every such worker. This can take a long time (if
+            # there are many staged bundles, over an hour), and new bundles cannot be assigned to
+            # workers in the meantime. Workers that go offline and then later come back online while
+            # we're still dispatching bundles stay excluded, in order to respect bundle prioritization.
+            # Such workers will be assigned bundles in the BundleManager's next iteration.
+            now = time.time()
+            if (
+                last_cleanup_time is None
+                or now - last_cleanup_time >= WORKER_CLEANUP_INTERVAL_SECONDS
+            ):
+                last_cleanup_time = now
+                self._cleanup_dead_workers(workers)
+                online_worker_ids = set(worker["worker_id"] for worker in workers.workers())
+                for worker_index in worker_indexes:
+                    worker_index.retain(online_worker_ids)
 
-            workers_list = self._filter_and_sort_workers(workers_list, bundle, bundle_resources)
-            # Try starting bundles on the workers that have enough computing resources
-            for worker in workers_list:
+            bundle_worker_indexes = [user_worker_indexes[bundle.owner_id]]
+            if user_parallel_run_quota_left[bundle.owner_id] > 0:
+                bundle_worker_indexes.append(codalab_owned_worker_index)
+            # Try starting bundles on the workers that have enough computing resources, in order
+            # of preference. The workers are found lazily, so this stops at the first worker the
+            # bundle is started on.
+            has_workers = False
+            for worker in self._get_sorted_workers(bundle_worker_indexes, bundle, bundle_resources):
+                has_workers = True
                 if self._try_start_bundle(workers, worker, bundle, bundle_resources):
                     # If we successfully started a bundle on a codalab-owned worker,
                     # decrement the parallel run quota left.
                     if worker["user_id"] == self._model.root_user_id:
                         user_parallel_run_quota_left[bundle.owner_id] -= 1
+                    if self._staged_queue is not None:
+                        self._staged_queue.mark_started(bundle.uuid)
                     # Update available worker resources. This is a lower-bound,
                     # since resources released by jobs that finish are not used until
                     # the next call to _schedule_run_bundles_on_workers.
@@ -555,22 +724,36 @@ class BundleManager(object):
                     worker['gpus'] -= bundle_resources.gpus
                     worker['memory_bytes'] -= bundle_resources.memory
                     worker['exit_after_num_runs'] -= 1
+                    for worker_index in bundle_worker_indexes:
+                        worker_index.update(worker)
                     break
+            if not has_workers:
+                self._set_no_worker_staged_status(
+                    bundle,
+                    bundle_resources,
+                    [
+                        worker
+                        for worker_index in bundle_worker_indexes
+                        for worker in worker_index.workers()
+                    ],
+                )
 
         # To avoid the potential race condition between bundle manager's dispatch frequency and
         # worker's checkin frequency, update the column "exit_after_num_runs" in worker table
         # before bundle manager's next scheduling loop
-        for worker in workers_list:
-            # Update workers that have "exit_after_num_runs" manually set from CLI.
-            if (
-                worker['exit_after_num_runs']
-                < workers._workers[worker['worker_id']]['exit_after_num_runs']
-            ):
-                self._worker_model.update_workers(
-                    worker["user_id"],
-                    worker['worker_id'],
-                    {'exit_after_num_runs': worker['exit_after_num_runs']},
-                )
+        for worker_index in worker_indexes:
+            for worker in worker_index.workers():
+                # Update workers that have "exit_after_num_runs" manually set from CLI.
+                original_worker = workers._workers.get(worker['worker_id'])
+                if (
+                    original_worker is not None
+                    and worker['exit_after_num_runs'] < original_worker['exit_after_num_runs']
+                ):
+                    self._worker_model.update_workers(
+                        worker["user_id"],
+                        worker['worker_id'],
+                        {'exit_after_num_runs': worker['exit_after_num_runs']},
+                    )
 
     def _deduct_worker_resources(self, workers_list, running_bundles_info):
         """
@@ -657,6 +840,15 @@ class BundleManager(object):
             return f"Available resources: {', '.join(recommendations)}"
         return ''
 
+    def _set_no_worker_staged_status(self, bundle, bundle_resources, workers_list):
+        """
+        Sets the staged_status of a bundle that no worker can run, with resource recommendations
+        based on the workers in workers_list.
+        """
+        recommendations = self._get_resource_recommendations(bundle_resources, workers_list)
+        staged_status = f"No worker can meet your bundle's resource requirements. {recommendations}"
+        self._set_staged_status(bundle, staged_status)
+
     def _filter_and_sort_workers(self, workers_list, bundle, bundle_resources):
         """
         :param self: BundleManager
@@ -672,18 +864,10 @@ class BundleManager(object):
 
         # If no workers can meet the bundle's resource reqs, add resource recommendations to staged_status.
         if not dominating_workers:
-            recommendations = self._get_resource_recommendations(bundle_resources, workers_list)
-            staged_status = (
-                f"No worker can meet your bundle's resource requirements. {recommendations}"
-            )
-            self._set_staged_status(bundle, staged_status)
+            self._set_no_worker_staged_status(bundle, bundle_resources, workers_list)
             return []
 
-        # Sort workers list according to these keys in the following succession:
-        #  - whether the worker is a CPU-only worker, if the bundle doesn't request GPUs
-        #  - number of dependencies available, descending
-        #  - number of free cpus, descending
-        #  - random key
+        # Sort workers list according to worker_sort_key().
         #
         # Breaking ties randomly is important, since multiple workers frequently
         # have the same number of dependencies and free CPUs for a given bundle
@@ -694,33 +878,34 @@ class BundleManager(object):
         # in its cache.
         needed_deps = set([(dep.parent_uuid, dep.parent_path) for dep in bundle.dependencies])
 
-        def get_sort_key(worker):
-            if worker['shared_file_system']:
-                num_available_deps = len(needed_deps)
-            else:
-                deps = set(worker['dependencies'])
-                num_available_deps = len(needed_deps & deps)
-
-            # Subject to the worker meeting the resource requirements of the bundle, we also want to:
-            # 1. prioritize workers that are tag-exclusive.
-            # 2. prioritize workers with fewer GPUs (including zero).
-            # 3. prioritize workers that have more bundle dependencies.
-            # 4. prioritize workers with fewer CPUs.
-            # 5. prioritize workers with fewer running jobs.
-            # 6. break ties randomly by a random seed.
-            return (
-                not worker['tag_exclusive'],
-                worker['gpus'] or worker['has_gpus'],
-                -num_available_deps,
-                worker['cpus'],
-                len(worker['run_uuids']),
-                random.random(),
-            )
-
-        dominating_workers.sort(key=get_sort_key)
+        dominating_workers.sort(
+            key=lambda worker: worker_sort_key(worker, needed_deps, random.random())
+        )
 
         return dominating_workers
 
+    def _get_sorted_workers(self, worker_indexes, bundle, bundle_resources):
+        """
+        :param self: BundleManager
+        :param worker_indexes: list of WorkerCapacityIndexes
+        :param bundle: dict
+        :param bundle_resources: RunResources
+
+        Lazily yields the workers of the indexes that can run the given bundle, in the order of
+        _filter_and_sort_workers(), except that ties are broken by a random key drawn when a
+        worker is indexed instead of for each bundle.
+        """
+        needed_deps = set([(dep.parent_uuid, dep.parent_path) for dep in bundle.dependencies])
+        for _, worker in heapq.merge(
+            *[
+                worker_index.candidates(bundle_resources, needed_deps)
+                for worker_index in worker_indexes
+            ],
+            key=itemgetter(0),
+        ):
+            if self._worker_to_run_resources(worker).dominates(bundle_resources):
+                yield worker
+
     def _try_start_bundle(self, workers, worker, bundle, bundle_resources):
         """
         Tries to start running the bundle on the given worker, returning False
@@ -754,6 +939,7 @@ class BundleManager(object):
         else:
             self._model.transition_bundle_staged(bundle)
             workers.restage(bundle.uuid)
+            self._note_staged(bundle)
             return False
 
     @staticmethod
@@ -899,8 +1085,40 @@ class BundleManager(object):
                     bundle,
                     {'state': State.FAILED, 'metadata': {'failure_message': failure_message}},
                 )
+                self._upload_manager.cleanup_staged_files(bundle.uuid)
+
+    def _check_unresponsive_bundles(self):
+        """
+        Calls _fail_unresponsive_bundles() every UNRESPONSIVE_BUNDLES_CHECK_INTERVAL_SECONDS
+        seconds. Bundles only time out after days, so there's no need to load all the uploading,
+        staged and running bundles on every iteration.
+        """
+        now = time.time()
+        if (
+            self._last_unresponsive_bundles_check_time is not None
+            and now - self._last_unresponsive_bundles_check_time
+            < UNRESPONSIVE_BUNDLES_CHECK_INTERVAL_SECONDS
+        ):
+            return
+        self._last_unresponsive_bundles_check_time = now
+        self._fail_unresponsive_bundles()
+
+    def _cleanup_stale_staged_files(self):
+        """
+        Removes the files staged for delta uploads that were left behind, every
+        STAGED_FILES_CLEANUP_INTERVAL_SECONDS seconds.
+        """
+        now = time.time()
+        if (
+            self._last_staged_files_cleanup_time is not None
+            and now - self._last_staged_files_cleanup_time < STAGED_FILES_CLEANUP_INTERVAL_SECONDS
+        ):
+            return
+        self._last_staged_files_cleanup_time = now
+        for uuid in self._upload_manager.cleanup_stale_staged_files(STAGED_FILES_MAX_AGE_SECONDS):
+            logger.info('Removed staged files of bundle %s', uuid)
 
-    def _schedule_run_bundles(self):
+    def _schedule_run_bundles(self, reconcile=True):
         """
         This method implements a state machine. The states are:
 
@@ -912,10 +1130,19 @@ class BundleManager(object):
             Worker reported that the run has started.
         READY / FAILED, no worker_run DB entry:
             Finished.
+
+        :param reconcile: in incremental scheduling mode, whether to rebuild the staged bundle
+                          queue from the database instead of only applying state changes.
         """
-        workers = WorkerInfoAccessor(
-            self._model, self._worker_model, self._worker_timeout_seconds - 5
-        )
+        # The workers are fetched again at each pass, but the accessor is kept so that its
+        # indexes are only updated for the workers that changed.
+        if self._workers is None:
+            self._workers = WorkerInfoAccessor(
+                self._model, self._worker_model, self._worker_timeout_seconds - 5
+            )
+        else:
+            self._workers.refresh()
+        workers = self._workers
 
         # Handle some exceptional cases.
         self._cleanup_dead_workers(workers)
@@ -924,10 +1151,72 @@ class BundleManager(object):
         self._acknowledge_recently_finished_bundles(workers)
         # A dictionary structured as {user id : user information} to track those visited user information
         user_info_cache = {}
-        staged_bundles_to_run = self._get_staged_bundles_to_run(workers, user_info_cache)
+        if self._staged_queue is None:
+            staged_bundles_to_run = self._get_staged_bundles_to_run(workers, user_info_cache)
+        else:
+            self._update_staged_queue(reconcile, workers, user_info_cache)
+            if reconcile or self._workers_gained_capacity(workers):
+                staged_bundles_to_run = self._staged_queue.ordered()
+            else:
+                # The bundles that went through an earlier pass didn't fit on any worker then,
+                # and still won't, so only the newly queued bundles need to be scheduled.
+                staged_bundles_to_run = self._staged_queue.ordered_subset(
+                    self._staged_queue.unevaluated_uuids()
+                )
+            # Bundles queued in earlier iterations need their owner's information for scheduling.
+            for bundle, _ in staged_bundles_to_run:
+                if bundle.owner_id not in user_info_cache:
+                    user_info_cache[bundle.owner_id] = self._model.get_user_info(bundle.owner_id)
 
         # Schedule, preferring user-owned workers.
-        self._schedule_run_bundles_on_workers(workers, staged_bundles_to_run, user_info_cache)
+        if staged_bundles_to_run:
+            self._schedule_run_bundles_on_workers(workers, staged_bundles_to_run, user_info_cache)
+        if self._staged_queue is not None:
+            self._staged_queue.mark_evaluated(bundle.uuid for bundle, _ in staged_bundles_to_run)
+            self._last_worker_capacities = self._get_worker_capacities(workers)
+
+    @staticmethod
+    def _get_worker_capacities(workers):
+        """
+        Returns a dictionary mapping the id of each worker to a tuple of (1) what decides who can
+        use the worker, (2) its resources and runs left and (3) the set of its runs.
+        """
+        return {
+            worker['worker_id']: (
+                (worker['user_id'], worker['group_uuid'], worker['tag'], worker['tag_exclusive']),
+                (
+                    worker['cpus'],
+                    worker['gpus'],
+                    worker['memory_bytes'],
+                    worker['free_disk_bytes'],
+                    worker['exit_after_num_runs'],
+                ),
+                frozenset(worker['run_uuids']),
+            )
+            for worker in workers.workers()
+        }
+
+    def _workers_gained_capacity(self, workers):
+        """
+        Returns whether a worker may have become able to run a bundle that no worker could run at
+        the end of the last scheduling pass: a worker came online or changed who can use it, or
+        it has more resources or runs left, or one of its runs finished. Changes to the users'
+        quotas and groups are picked up when the bundle manager reconciles with the database.
+        """
+        if self._last_worker_capacities is None:
+            return True
+        for worker_id, (access, resources, run_uuids) in self._get_worker_capacities(
+            workers
+        ).items():
+            last = self._last_worker_capacities.get(worker_id)
+            if (
+                last is None
+                or access != last[0]
+                or any(value > last_value for value, last_value in zip(resources, last[1]))
+                or not last[2] <= run_uuids
+            ):
+                return True
+        return False
 
     @staticmethod
     def _check_resource_failure(
@@ -977,16 +1266,38 @@ class BundleManager(object):
         :param user_info_cache: a dictionary mapping user id to user information.
         :return: a list of tuple which contains valid staged bundles and their bundle_resources.
         """
+        return self._validate_staged_bundles(
+            self._model.batch_get_bundles(state=State.STAGED, bundle_type='run'), user_info_cache
+        )
+
+    def _validate_staged_bundles(self, bundles, user_info_cache):
+        """
+        Fails the given staged bundles that request more resources than available for their owner.
+        :param bundles: a list of staged run bundles.
+        :param user_info_cache: a dictionary mapping user id to user information.
+        :return: a list of tuple which contains valid staged bundles and their bundle_resources.
+        """
         # Keep track of staged bundles that have valid resources requested
         staged_bundles_to_run = []
+        # Failing bundles are collected and failed together at the end, so that a user submitting
+        # many bundles with invalid resource requests doesn't cost a transaction per bundle.
+        bundles_to_fail = []
+        # A dictionary structured as {user id : (disk quota left, time quota left)}
+        user_quota_left = {}
 
-        for bundle in self._model.batch_get_bundles(state=State.STAGED, bundle_type='run'):
+        for bundle in bundles:
             # Cache those visited user information
             if bundle.owner_id in user_info_cache:
                 user_info = user_info_cache[bundle.owner_id]
             else:
                 user_info = self._model.get_user_info(bundle.owner_id)
                 user_info_cache[bundle.owner_id] = user_info
+            if bundle.owner_id not in user_quota_left:
+                user_quota_left[bundle.owner_id] = (
+                    self._model.get_user_disk_quota_left(bundle.owner_id, user_info),
+                    self._model.get_user_time_quota_left(bundle.owner_id, user_info),
+                )
+            disk_quota_left, time_quota_left = user_quota_left[bundle.owner_id]
 
             bundle_resources = self._compute_bundle_resources(bundle, user_info)
 
@@ -996,8 +1307,7 @@ class BundleManager(object):
                     bundle_resources.disk,
                     user_fail_string='Requested more disk (%s) than user disk quota left (%s) by %s',
                     # The default max disk quota that can be requested is disk quota left - DISK_QUOTA_SLACK_BYTES.
-                    user_max=self._model.get_user_disk_quota_left(bundle.owner_id, user_info)
-                    - DISK_QUOTA_SLACK_BYTES,
+                    user_max=disk_quota_left - DISK_QUOTA_SLACK_BYTES,
                     global_fail_string='Maximum job disk size (%s) exceeded (%s)',
                     global_max=self._max_request_disk,
                     pretty_print=formatting.size_str,
@@ -1008,7 +1318,7 @@ class BundleManager(object):
                 self._check_resource_failure(
                     bundle_resources.time,
                     user_fail_string='Requested more time (%s) than user time quota left (%s) by %s',
-                    user_max=self._model.get_user_time_quota_left(bundle.owner_id, user_info),
+                    user_max=time_quota_left,
                     global_fail_string='Maximum job time (%s) exceeded (%s)',
                     global_max=self._max_request_time,
                     pretty_print=formatting.duration_str,
@@ -1039,16 +1349,44 @@ class BundleManager(object):
             if len(failures) > 0:
                 failure_message = '. '.join(failures)
                 logger.info('Failing %s: %s', bundle.uuid, failure_message)
-
-                self._model.update_bundle(
-                    bundle,
-                    {'state': State.FAILED, 'metadata': {'failure_message': failure_message}},
-                )
+                bundles_to_fail.append((bundle, failure_message))
             else:
                 staged_bundles_to_run.append((bundle, bundle_resources))
 
+        self._model.batch_fail_bundles(bundles_to_fail)
         return staged_bundles_to_run
 
+    def _update_staged_queue(self, reconcile, workers, user_info_cache):
+        """
+        Brings the staged bundle queue up to date in incremental scheduling mode. If reconcile is
+        True, the queue is rebuilt from the STAGED run bundles in the database. Otherwise, only
+        the bundles that may have entered the STAGED state since the last iteration are loaded
+        and validated: those the bundle manager staged or restaged itself, and the runs that left
+        a worker. Bundles that left the STAGED state outside of the bundle manager (e.g. killed or
+        deleted ones) stay queued until the next reconcile, and transition_bundle_starting()
+        refuses to start them.
+        :param reconcile: whether to rebuild the queue from the database.
+        :param workers: a WorkerInfoAccessor object containing worker related information e.g. running uuid.
+        :param user_info_cache: a dictionary mapping user id to user information.
+        """
+        self._staged_queue.update_run_uuids(set(workers._uuid_to_worker_id))
+        if reconcile:
+            self._staged_queue.clear()
+            new_bundles = self._model.batch_get_bundles(state=State.STAGED, bundle_type='run')
+        else:
+            pending_uuids = self._staged_queue.pop_pending()
+            if not pending_uuids:
+                return
+            new_bundles = []
+            for bundle in self._model.batch_get_bundles(uuid=list(pending_uuids)):
+                if bundle.state == State.STAGED and bundle.bundle_type == 'run':
+                    if bundle.uuid not in self._staged_queue:
+                        new_bundles.append(bundle)
+                else:
+                    self._staged_queue.remove(bundle.uuid)
+        for bundle, bundle_resources in self._validate_staged_bundles(new_bundles, user_info_cache):
+            self._staged_queue.add(bundle, bundle_resources)
+
     def _get_running_bundles_info(self, workers, staged_bundles_to_run):
         """
         Build a nested dictionary to store information (bundle and bundle_resources) including
@@ -1069,8 +1407,11 @@ class BundleManager(object):
                     }
                 }
         """
+        if self._staged_queue is not None:
+            return self._get_running_bundles_info_from_ledger(workers, staged_bundles_to_run)
+
         # Get uuid of all the running bundles from workers (a WorkerInfoAccessor object)
-        run_uuids = list(workers._uuid_to_worker.keys())
+        run_uuids = list(workers._uuid_to_worker_id.keys())
         staged_bundles_to_run_dict = {
             bundle.uuid: bundle_resources for (bundle, bundle_resources) in staged_bundles_to_run
         }
@@ -1094,3 +1435,24 @@ class BundleManager(object):
         }
 
         return running_bundles_info
+
+    def _get_running_bundles_info_from_ledger(self, workers, staged_bundles_to_run):
+        """
+        Incremental version of _get_running_bundles_info(). The resources of running bundles are
+        kept in the staged bundle queue's run ledger, so only bundles that appeared on a worker
+        since the last iteration are loaded from the database.
+        """
+        run_uuids = set(workers._uuid_to_worker_id.keys())
+        self._staged_queue.retain_run_resources(run_uuids)
+        missing_uuids = run_uuids - set(self._staged_queue.run_resources)
+        if missing_uuids:
+            for bundle in self._model.batch_get_bundles(uuid=list(missing_uuids)):
+                self._staged_queue.set_run_resources(bundle, self._compute_bundle_resources(bundle))
+
+        running_bundles_info = dict(self._staged_queue.run_resources)
+        for bundle, bundle_resources in staged_bundles_to_run:
+            running_bundles_info[bundle.uuid] = {
+                "bundle": bundle,
+                "bundle_resources": bundle_resources,
+            }
+        return running_bundles_info
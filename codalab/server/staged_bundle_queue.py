@@ -0,0 +1,225 @@
+import bisect
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+def staged_bundle_priority_key(bundle):
+    """
+    Returns the key used to order a single user's staged bundles. Sorting by this key in
+    reverse order puts bundles with (1) a higher priority and (2) a requested worker first.
+    Negative priority bundles are queued behind bundles with no specified priority (None priority).
+    """
+    return (
+        bundle.metadata.request_priority is not None and bundle.metadata.request_priority >= 0,
+        bundle.metadata.request_priority is None,
+        bundle.metadata.request_priority,
+        bundle.metadata.request_queue is not None,
+    )
+
+
+class _QueueEntry(object):
+    """
+    A staged bundle and its resources. Entries compare so that bisect keeps each user's list
+    in the same order as sorted(..., key=staged_bundle_priority_key, reverse=True) applied to
+    bundles in creation order, i.e. ties are broken by the bundle id.
+    """
+
+    __slots__ = ('bundle', 'bundle_resources', 'key')
+
+    def __init__(self, bundle, bundle_resources):
+        self.bundle = bundle
+        self.bundle_resources = bundle_resources
+        self.key = staged_bundle_priority_key(bundle)
+
+    def __lt__(self, other):
+        if self.key != other.key:
+            return self.key > other.key
+        return self.bundle.id < other.bundle.id
+
+
+class StagedBundleQueue(object):
+    """
+    In-memory priority queue of the STAGED run bundles that passed resource validation, used by
+    the BundleManager in incremental scheduling mode. It also keeps a ledger of the resources
+    requested by bundles that were dispatched to workers, so those don't have to be reloaded and
+    recomputed on every scheduling pass.
+
+    The queue is updated from deltas and is cleared whenever the BundleManager reconciles with the
+    database. Between reconciles, it only learns about bundles that may have entered the STAGED
+    state from note_staged() (for the transitions made by the BundleManager) and
+    update_run_uuids() (for the runs that left a worker, e.g. when the worker rejected them).
+    """
+
+    def __init__(self):
+        # uuid -> _QueueEntry
+        self._entries: Dict[str, _QueueEntry] = {}
+        # Sorted list of (bundle id, owner id), i.e. the order in which bundles were created.
+        self._positions: List[Tuple[int, str]] = []
+        # owner id -> sorted list of the ids of the owner's bundles, i.e. the owner's positions.
+        self._user_positions: Dict[str, List[int]] = defaultdict(list)
+        # owner id -> list of _QueueEntry, sorted in scheduling order.
+        self._user_entries: Dict[str, List[_QueueEntry]] = defaultdict(list)
+        # uuid -> last staged_status written for the bundle, to avoid rewriting the same value.
+        self._staged_statuses: Dict[str, str] = {}
+        # uuid -> resources of bundles that are starting or running on a worker.
+        self._run_resources: Dict[str, dict] = {}
+        # uuids of the queued bundles that haven't gone through a scheduling pass yet.
+        self._unevaluated: Set[str] = set()
+        # uuids of bundles that may have entered the STAGED state since the last pass.
+        self._pending: Set[str] = set()
+        # uuids of the runs of all workers at the last pass.
+        self._run_uuids: Set[str] = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uuid):
+        return uuid in self._entries
+
+    def uuids(self):
+        return set(self._entries)
+
+    def owner_ids(self):
+        return list(self._user_entries)
+
+    def add(self, bundle, bundle_resources):
+        if bundle.uuid in self._entries:
+            self.remove(bundle.uuid)
+        entry = _QueueEntry(bundle, bundle_resources)
+        self._entries[bundle.uuid] = entry
+        self._unevaluated.add(bundle.uuid)
+        bisect.insort(self._positions, (bundle.id, bundle.owner_id))
+        bisect.insort(self._user_positions[bundle.owner_id], bundle.id)
+        bisect.insort(self._user_entries[bundle.owner_id], entry)
+
+    def remove(self, uuid):
+        entry = self._entries.pop(uuid, None)
+        self._staged_statuses.pop(uuid, None)
+        self._unevaluated.discard(uuid)
+        if entry is None:
+            return
+        bundle = entry.bundle
+        self._positions.pop(bisect.bisect_left(self._positions, (bundle.id, bundle.owner_id)))
+        user_positions = self._user_positions[bundle.owner_id]
+        user_positions.pop(bisect.bisect_left(user_positions, bundle.id))
+        if not user_positions:
+            del self._user_positions[bundle.owner_id]
+        user_entries = self._user_entries[bundle.owner_id]
+        user_entries.remove(entry)
+        if not user_entries:
+            del self._user_entries[bundle.owner_id]
+
+    def ordered(self):
+        """
+        Returns a list of (bundle, bundle_resources) tuples in scheduling order: positions in the
+        queue are assigned to users in the order their bundles were created, and each user's
+        positions are filled with that user's bundles sorted by priority.
+        This takes linear time since both orders are maintained incrementally.
+        """
+        next_index = defaultdict(int)
+        result = []
+        for _, owner_id in self._positions:
+            entry = self._user_entries[owner_id][next_index[owner_id]]
+            next_index[owner_id] += 1
+            result.append((entry.bundle, entry.bundle_resources))
+        return result
+
+    def ordered_subset(self, uuids: Iterable[str]):
+        """
+        Like ordered(), but only returns the queued bundles with the given uuids. This takes
+        O(m log n) time for m uuids, since the position of each bundle is found by bisection:
+        the k-th bundle of a user in priority order takes the k-th position of that user.
+        """
+        positioned = []
+        for uuid in uuids:
+            entry = self._entries.get(uuid)
+            if entry is None:
+                continue
+            owner_id = entry.bundle.owner_id
+            rank = bisect.bisect_left(self._user_entries[owner_id], entry)
+            positioned.append((self._user_positions[owner_id][rank], entry))
+        positioned.sort(key=lambda item: item[0])
+        return [(entry.bundle, entry.bundle_resources) for _, entry in positioned]
+
+    def should_set_staged_status(self, uuid, staged_status):
+        """
+        Returns True if staged_status differs from the last status recorded for the bundle,
+        and records it.
+        """
+        if self._staged_statuses.get(uuid) == staged_status:
+            return False
+        self._staged_statuses[uuid] = staged_status
+        return True
+
+    def mark_evaluated(self, uuids: Iterable[str]):
+        """
+        Records that the queued bundles with the given uuids went through a scheduling pass.
+        """
+        self._unevaluated.difference_update(uuids)
+
+    def is_evaluated(self, uuid):
+        return uuid in self._entries and uuid not in self._unevaluated
+
+    def unevaluated_uuids(self):
+        return set(self._unevaluated)
+
+    def note_staged(self, uuid):
+        """
+        Records that the bundle may have entered the STAGED state, so that it is loaded at the
+        next pass.
+        """
+        self._pending.add(uuid)
+
+    def update_run_uuids(self, run_uuids: Set[str]):
+        """
+        Records the runs of all workers. Runs that left their worker may have been moved back to
+        the STAGED state, so they are loaded at the next pass.
+        """
+        self._pending.update(self._run_uuids - run_uuids)
+        self._run_uuids = set(run_uuids)
+
+    def pop_pending(self):
+        """
+        Returns the uuids of the bundles that may have entered the STAGED state since the last
+        call, and forgets them.
+        """
+        pending, self._pending = self._pending, set()
+        return pending
+
+    def mark_started(self, uuid):
+        """
+        Moves a bundle that was dispatched to a worker from the queue into the run ledger.
+        """
+        self._run_uuids.add(uuid)
+        entry = self._entries.get(uuid)
+        if entry is None:
+            return
+        self._run_resources[uuid] = {
+            "bundle": entry.bundle,
+            "bundle_resources": entry.bundle_resources,
+        }
+        self.remove(uuid)
+
+    @property
+    def run_resources(self):
+        return self._run_resources
+
+    def set_run_resources(self, bundle, bundle_resources):
+        self._run_resources[bundle.uuid] = {"bundle": bundle, "bundle_resources": bundle_resources}
+
+    def retain_run_resources(self, run_uuids):
+        """
+        Drops ledger entries of bundles that no worker is running anymore.
+        """
+        for uuid in set(self._run_resources) - set(run_uuids):
+            del self._run_resources[uuid]
+
+    def clear(self):
+        self._entries.clear()
+        self._positions.clear()
+        self._user_positions.clear()
+        self._user_entries.clear()
+        self._staged_statuses.clear()
+        self._run_resources.clear()
+        self._unevaluated.clear()
+        self._pending.clear()
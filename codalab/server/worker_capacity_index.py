@@ -0,0 +1,239 @@
+import bisect
+import heapq
+import random
+import re
+from collections import defaultdict
+from operator import itemgetter
+
+
+def worker_sort_key(worker, needed_deps, tie_breaker):
+    """
+    :param worker: worker dict
+    :param needed_deps: set of (parent_uuid, parent_path) tuples of the dependencies of a bundle
+    :param tie_breaker: random number
+
+    Returns the key by which workers that can run a bundle are sorted, in order of preference.
+    Subject to the worker meeting the resource requirements of the bundle, we want to:
+    1. prioritize workers that are tag-exclusive.
+    2. prioritize workers with fewer GPUs (including zero).
+    3. prioritize workers that have more bundle dependencies.
+    4. prioritize workers with fewer CPUs.
+    5. prioritize workers with fewer running jobs.
+    6. break ties randomly by a random seed.
+    """
+    if worker['shared_file_system']:
+        num_available_deps = len(needed_deps)
+    else:
+        num_available_deps = len(needed_deps.intersection(worker['dependencies']))
+    return (
+        not worker['tag_exclusive'],
+        worker['gpus'] or worker['has_gpus'],
+        -num_available_deps,
+        worker['cpus'],
+        len(worker['run_uuids']),
+        tie_breaker,
+    )
+
+
+def _memory_class(memory_bytes):
+    """
+    Workers are bucketed by the bit length of their free memory: all the workers of a bucket of a
+    higher class than a request have enough memory for it.
+    """
+    return max(memory_bytes, 0).bit_length()
+
+
+class WorkerCapacityIndex(object):
+    """
+    Index over a list of worker dicts that returns the workers that may be able to run a bundle
+    with given RunResources, in order of preference, without scanning and sorting every worker.
+
+    Workers that accept untagged bundles are bucketed by their number of free GPUs and the size
+    class of their free memory, and each bucket is kept sorted by the rest of worker_sort_key()
+    for a worker without any of the bundle's dependencies: free CPUs, number of runs and a random
+    tie breaker, drawn when the worker is indexed. Workers are also indexed by the dependencies
+    they have, which are few for a given bundle, so that they can be put first. Workers with a tag
+    are also indexed by that tag for bundles with a request_queue.
+
+    Disk and runs left are not indexed, so callers are expected to check that the workers
+    returned by candidates() dominate the requested resources. The worker dicts are not copied,
+    so after changing a worker's free resources, call update() to keep the index consistent.
+    """
+
+    def __init__(self, workers_list):
+        # worker_id -> worker dict
+        self._workers = {}
+        # worker_id -> random number used to break ties between workers
+        self._tie_breakers = {}
+        # worker_id -> (bucket key, entry) under which the worker is indexed in _buckets
+        self._positions = {}
+        # (not tag exclusive, free gpus, has gpus, memory class) ->
+        #     sorted list of (free cpus, number of runs, tie breaker, worker_id)
+        self._buckets = defaultdict(list)
+        # tag -> set of worker_ids
+        self._tags = defaultdict(set)
+        # (parent_uuid, parent_path) -> set of worker_ids of the bucketed workers that have it
+        self._dependencies = defaultdict(set)
+        # worker_ids of the bucketed workers on a shared file system, which have all dependencies
+        self._shared_file_system = set()
+        for worker in workers_list:
+            self.add(worker)
+
+    def __len__(self):
+        return len(self._workers)
+
+    def __contains__(self, worker_id):
+        return worker_id in self._workers
+
+    def workers(self):
+        return list(self._workers.values())
+
+    @staticmethod
+    def _bucket_key(worker):
+        return (
+            not worker['tag_exclusive'],
+            worker['gpus'],
+            bool(worker['has_gpus']),
+            _memory_class(worker['memory_bytes']),
+        )
+
+    def add(self, worker):
+        worker_id = worker['worker_id']
+        if worker_id in self._workers:
+            self.remove(worker_id)
+        self._workers[worker_id] = worker
+        tie_breaker = self._tie_breakers[worker_id] = random.random()
+        if worker['tag']:
+            self._tags[worker['tag']].add(worker_id)
+        # Tag-exclusive workers only run bundles that request their tag.
+        if not (worker['tag_exclusive'] and worker['tag']):
+            key = self._bucket_key(worker)
+            entry = (worker['cpus'], len(worker['run_uuids']), tie_breaker, worker_id)
+            bisect.insort(self._buckets[key], entry)
+            self._positions[worker_id] = (key, entry)
+            if worker['shared_file_system']:
+                self._shared_file_system.add(worker_id)
+            else:
+                for dependency in worker['dependencies']:
+                    self._dependencies[dependency].add(worker_id)
+
+    def remove(self, worker_id):
+        worker = self._workers.pop(worker_id, None)
+        if worker is None:
+            return
+        del self._tie_breakers[worker_id]
+        if worker['tag']:
+            self._tags[worker['tag']].discard(worker_id)
+            if not self._tags[worker['tag']]:
+                del self._tags[worker['tag']]
+        position = self._positions.pop(worker_id, None)
+        if position is not None:
+            key, entry = position
+            bucket = self._buckets[key]
+            del bucket[bisect.bisect_left(bucket, entry)]
+            if not bucket:
+                del self._buckets[key]
+            self._shared_file_system.discard(worker_id)
+            for dependency in worker['dependencies']:
+                worker_ids = self._dependencies.get(dependency)
+                if worker_ids is not None:
+                    worker_ids.discard(worker_id)
+                    if not worker_ids:
+                        del self._dependencies[dependency]
+
+    def update(self, worker):
+        """
+        Re-indexes a worker after its free resources changed. Does nothing if the given worker
+        dict is not the one held by this index.
+        """
+        if self._workers.get(worker['worker_id']) is not worker:
+            return
+        position = self._positions.get(worker['worker_id'])
+        if (
+            position is not None
+            and position[0] == self._bucket_key(worker)
+            and position[1][:2] == (worker['cpus'], len(worker['run_uuids']))
+        ):
+            return
+        self.add(worker)
+
+    def retain(self, worker_ids):
+        """
+        Removes all workers whose id is not in worker_ids, e.g. workers that went offline.
+        """
+        for worker_id in set(self._workers) - set(worker_ids):
+            self.remove(worker_id)
+
+    @staticmethod
+    def _fits(worker, run_resources):
+        return (
+            worker['gpus'] >= run_resources.gpus
+            and worker['cpus'] >= run_resources.cpus
+            and worker['memory_bytes'] >= run_resources.memory
+        )
+
+    def _sort_key(self, worker, needed_deps):
+        return worker_sort_key(worker, needed_deps, self._tie_breakers[worker['worker_id']])
+
+    def candidates(self, run_resources, needed_deps=frozenset()):
+        """
+        Lazily yields (worker_sort_key(), worker) pairs for the workers that have enough free
+        GPUs, CPUs and memory for run_resources and a matching tag, in ascending order of the
+        key, i.e. in order of preference for running a bundle with the given set of
+        (parent_uuid, parent_path) dependencies.
+        """
+        if run_resources.tag:
+            tag_match = re.match('(?:tag=)?(.+)', run_resources.tag)
+            worker_ids = self._tags.get(tag_match.group(1), ()) if tag_match else ()
+            workers = [self._workers[worker_id] for worker_id in worker_ids]
+            yield from sorted(
+                (
+                    (self._sort_key(worker, needed_deps), worker)
+                    for worker in workers
+                    if self._fits(worker, run_resources)
+                ),
+                key=itemgetter(0),
+            )
+            return
+
+        # The first two elements of the sort key, which are the same for all the workers of a
+        # bucket, -> keys of the buckets that may have workers with enough GPUs and memory.
+        memory_class = _memory_class(run_resources.memory)
+        rank_buckets = defaultdict(list)
+        for key in self._buckets:
+            not_tag_exclusive, gpus, has_gpus, worker_memory_class = key
+            if gpus >= run_resources.gpus and worker_memory_class >= memory_class:
+                rank_buckets[(not_tag_exclusive, gpus or has_gpus)].append(key)
+
+        # Workers with some of the dependencies go before the workers of the same rank that have
+        # none, which come out of the buckets already sorted.
+        rank_with_deps = defaultdict(list)
+        if needed_deps:
+            worker_ids = set(self._shared_file_system)
+            for dependency in needed_deps:
+                worker_ids.update(self._dependencies.get(dependency, ()))
+            for worker_id in worker_ids:
+                worker = self._workers[worker_id]
+                if self._fits(worker, run_resources):
+                    sort_key = self._sort_key(worker, needed_deps)
+                    rank_with_deps[sort_key[:2]].append((sort_key, worker))
+
+        for rank in sorted(set(rank_buckets) | set(rank_with_deps)):
+            with_deps = sorted(rank_with_deps.get(rank, ()), key=itemgetter(0))
+            yield from with_deps
+            yielded = set(worker['worker_id'] for _, worker in with_deps)
+            for cpus, num_runs, tie_breaker, worker_id in heapq.merge(
+                *[self._iter_bucket(key, run_resources.cpus) for key in rank_buckets.get(rank, ())]
+            ):
+                worker = self._workers[worker_id]
+                if worker_id in yielded or worker['memory_bytes'] < run_resources.memory:
+                    continue
+                yield rank + (0, cpus, num_runs, tie_breaker), worker
+
+    def _iter_bucket(self, key, cpus):
+        """
+        Yields the entries of the bucket with the given key that have at least cpus free CPUs.
+        """
+        bucket = self._buckets[key]
+        for i in range(bisect.bisect_left(bucket, (cpus,)), len(bucket)):
+            yield bucket[i]
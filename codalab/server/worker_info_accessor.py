@@ -25,6 +25,10 @@ def refresh_cache(
 class WorkerInfoAccessor(object):
     """
     Helps with accessing the list of workers returned by the worker model.
+
+    The indexes from users and run UUIDs to workers are updated incrementally: each fetch
+    compares the workers returned by the worker model to the previous ones, and only changes the
+    entries of the users and runs whose workers changed.
     """
 
     def __init__(self, model, worker_model, timeout_seconds):
@@ -32,31 +36,70 @@ class WorkerInfoAccessor(object):
         self._worker_model = worker_model
         self._timeout_seconds = timeout_seconds
         self._last_fetch = None
+        self._workers = {}
+        self._uuid_to_worker_id = {}
+        # Ordered sets (dicts with None values) of the workers each user owns or can use.
+        self._user_id_to_worker_ids = defaultdict(dict)
+        self._worker_id_to_user_ids = {}
+        self._fetch_workers()
+
+    def refresh(self):
+        """Fetches the workers from the worker model again, even if the cache is still fresh."""
         self._fetch_workers()
 
     def _fetch_workers(self):
-        self._workers = {worker['worker_id']: worker for worker in self._worker_model.get_workers()}
+        workers = {worker['worker_id']: worker for worker in self._worker_model.get_workers()}
         self._last_fetch = datetime.datetime.utcnow()
-        self._uuid_to_worker = {}
-        self._user_id_to_workers = defaultdict(list)
 
-        for worker in self._workers.values():
-            for uuid in worker['run_uuids']:
-                self._uuid_to_worker[uuid] = worker
+        # Load the members of the groups of all the workers at once.
+        group_uuids = set(worker['group_uuid'] for worker in workers.values())
+        group_uuids.discard(None)
+        group_user_ids = defaultdict(set)
+        if group_uuids:
+            for m in self._model.batch_get_user_in_group(group_uuid=list(group_uuids)):
+                group_user_ids[m['group_uuid']].add(m['user_id'])
 
-            owner_id = worker['user_id']
-            self._user_id_to_workers[owner_id].append(worker)
+        for worker_id in list(self._workers):
+            if worker_id not in workers:
+                self._remove_worker(worker_id)
 
-            # Add the worker to all the users of the worker's group except the owner
-            memberships = self._model.batch_get_user_in_group(group_uuid=worker['group_uuid'])
-            for m in memberships:
-                if m['user_id'] != owner_id:
-                    self._user_id_to_workers[m['user_id']].append(worker)
+        for worker_id, worker in workers.items():
+            # The worker is available to its owner and all the users of the worker's group.
+            user_ids = {worker['user_id']} | group_user_ids.get(worker['group_uuid'], set())
+            self._update_worker(worker, user_ids)
 
             # 'gpus' field contains the number of free GPUs that comes with each worker. Adding an additional
             # 'has_gpus' flag here to indicate if the current worker has GPUs or not.
             worker['has_gpus'] = True if worker['gpus'] > 0 else False
 
+    def _update_worker(self, worker, user_ids):
+        """Adds or replaces the worker in the indexes, only updating the entries that changed."""
+        worker_id = worker['worker_id']
+        old_worker = self._workers.get(worker_id)
+        old_run_uuids = set(old_worker['run_uuids']) if old_worker else set()
+        new_run_uuids = set(worker['run_uuids'])
+        for uuid in old_run_uuids - new_run_uuids:
+            if self._uuid_to_worker_id.get(uuid) == worker_id:
+                del self._uuid_to_worker_id[uuid]
+        for uuid in new_run_uuids - old_run_uuids:
+            self._uuid_to_worker_id[uuid] = worker_id
+
+        old_user_ids = self._worker_id_to_user_ids.get(worker_id, set())
+        for user_id in old_user_ids - user_ids:
+            del self._user_id_to_worker_ids[user_id][worker_id]
+        for user_id in user_ids - old_user_ids:
+            self._user_id_to_worker_ids[user_id][worker_id] = None
+        self._worker_id_to_user_ids[worker_id] = user_ids
+        self._workers[worker_id] = worker
+
+    def _remove_worker(self, worker_id):
+        worker = self._workers.pop(worker_id)
+        for uuid in worker['run_uuids']:
+            if self._uuid_to_worker_id.get(uuid) == worker_id:
+                del self._uuid_to_worker_id[uuid]
+        for user_id in self._worker_id_to_user_ids.pop(worker_id):
+            del self._user_id_to_worker_ids[user_id][worker_id]
+
     @refresh_cache
     def workers(self):
         return list(self._workers.values())
@@ -68,29 +111,24 @@ class WorkerInfoAccessor(object):
         :param user_id: ID of the user
         :return: List of workers
         """
-        return list(worker for worker in self._user_id_to_workers[user_id])
+        return [self._workers[worker_id] for worker_id in self._user_id_to_worker_ids[user_id]]
 
     @refresh_cache
     def remove(self, worker_id):
-        worker = self._workers[worker_id]
-        for uuid in worker['run_uuids']:
-            del self._uuid_to_worker[uuid]
-        self._user_id_to_workers[worker['user_id']].remove(worker)
-        del self._workers[worker_id]
+        self._remove_worker(worker_id)
 
     @refresh_cache
     def is_running(self, uuid):
-        return uuid in self._uuid_to_worker
+        return uuid in self._uuid_to_worker_id
 
     @refresh_cache
     def set_starting(self, uuid, worker_id):
         worker = self._workers[worker_id]
         worker['run_uuids'].append(uuid)
-        self._uuid_to_worker[uuid] = worker
+        self._uuid_to_worker_id[uuid] = worker_id
 
     @refresh_cache
     def restage(self, uuid):
-        if uuid in self._uuid_to_worker:
-            worker = self._uuid_to_worker[uuid]
+        if uuid in self._uuid_to_worker_id:
+            worker = self._workers[self._uuid_to_worker_id.pop(uuid)]
             worker['run_uuids'].remove(uuid)
-            del self._uuid_to_worker[uuid]
@@ -2,6 +2,7 @@ import base64
 from contextlib import closing
 import http.client
 import json
+import os
 import socket
 import threading
 import time
@@ -11,7 +12,8 @@ import urllib.error
 
 from .rest_client import RestClient, RestClientException
 from .file_util import tar_gzip_directory
-from codalab.common import URLOPEN_TIMEOUT_SECONDS, ensure_str, urlopen_with_retry
+from .upload_util import build_upload_manifest
+from codalab.common import URLOPEN_TIMEOUT_SECONDS, ensure_str
 
 
 def wrap_exception(message):
@@ -69,6 +71,12 @@ class BundleServiceClient(RestClient):
     def __init__(self, base_url, username, password):
         self._username = username
         self._password = password
+        # Size, modification time and hash of the files uploaded by update_bundle_contents, by
+        # bundle uuid and path, so that files that haven't changed aren't hashed again when an
+        # upload is retried. The files of a bundle are forgotten by discard_file_hashes().
+        self._file_hashes = {}
+        # Set once the bundle service turns out not to support delta uploads.
+        self._delta_upload_unsupported = False
 
         self._authorization_lock = threading.Lock()
         self._access_token = None
@@ -106,7 +114,7 @@ class BundleServiceClient(RestClient):
         for k, v in headers.items():
             request_to_send.add_unredirected_header(k, v)
 
-        with closing(urlopen_with_retry(request_to_send)) as response:
+        with closing(self._pool.urlopen_with_retry(request_to_send)) as response:
             response_data = response.read().decode()
         try:
             token = json.loads(response_data)
@@ -156,6 +164,25 @@ class BundleServiceClient(RestClient):
     def update_bundle_contents(
         self, worker_id, uuid, path, exclude_patterns, store, progress_callback
     ):
+        """
+        Uploads the contents of the directory at path as the contents of the bundle.
+
+        The contents are uploaded as a delta: the server is sent the manifest of the directory
+        and only receives the files that it hasn't been sent before for this bundle, so an
+        upload that is retried (e.g. after a network error) only sends the files that changed.
+        Falls back to uploading a .tar.gz archive of the whole directory if the bundle service
+        doesn't support delta uploads.
+        """
+        if os.path.isdir(path) and not self._delta_upload_unsupported:
+            try:
+                self._update_bundle_contents_delta(
+                    uuid, path, exclude_patterns, store, progress_callback
+                )
+                return
+            except urllib.error.HTTPError as e:
+                if e.code not in (http.client.NOT_FOUND, http.client.METHOD_NOT_ALLOWED):
+                    raise
+                self._delta_upload_unsupported = True
         with closing(tar_gzip_directory(path, exclude_patterns=exclude_patterns)) as fileobj:
             self._upload_with_chunked_encoding(
                 'PUT',
@@ -169,6 +196,54 @@ class BundleServiceClient(RestClient):
                 progress_callback=progress_callback,
             )
 
+    def _update_bundle_contents_delta(self, uuid, path, exclude_patterns, store, progress_callback):
+        file_hashes = self._file_hashes.setdefault(uuid, {})
+        manifest = build_upload_manifest(path, exclude_patterns, file_hashes)
+        files = {}
+        for entry in manifest:
+            if entry['type'] == 'file':
+                files.setdefault(entry['sha256'], entry['path'])
+        response = self._make_request(
+            'POST', '/bundles/' + uuid + '/contents/staged/', data={'hashes': list(files)}
+        )
+
+        bytes_uploaded = 0
+        for sha256 in response['missing']:
+
+            def file_progress_callback(file_bytes_uploaded, offset=bytes_uploaded):
+                return progress_callback(offset + file_bytes_uploaded)
+
+            file_path = os.path.join(path, files[sha256])
+            with open(file_path, 'rb') as fileobj:
+                self._upload_with_chunked_encoding(
+                    'PUT',
+                    '/bundles/' + uuid + '/contents/staged/' + sha256,
+                    query_params={},
+                    fileobj=fileobj,
+                    progress_callback=file_progress_callback if progress_callback else None,
+                )
+            bytes_uploaded += os.path.getsize(file_path)
+
+        self._make_request(
+            'PUT',
+            '/bundles/' + uuid + '/contents/manifest/',
+            query_params={'finalize_on_success': 0, 'store': store or ''},
+            data={'manifest': manifest},
+            timeout_seconds=URLOPEN_TIMEOUT_SECONDS * 10,
+        )
+        # Forget the hashes of files that were deleted since the last upload.
+        file_paths = set(os.path.join(path, entry['path']) for entry in manifest)
+        for file_path in list(file_hashes):
+            if file_path not in file_paths:
+                del file_hashes[file_path]
+
+    def discard_file_hashes(self, uuid):
+        """
+        Forgets the hashes of the files uploaded by update_bundle_contents for the bundle with
+        the given uuid, once its contents won't be uploaded again.
+        """
+        self._file_hashes.pop(uuid, None)
+
     @wrap_exception('Unable to get worker code')
     def get_code(self):
         return self._make_request(
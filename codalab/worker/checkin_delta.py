@@ -0,0 +1,105 @@
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class CheckinDeltaEncoder(object):
+    """
+    Encodes the dependencies and runs of a worker checkin as a delta of what the server last
+    acknowledged, so that a worker with many cached dependencies doesn't send all of them on
+    every checkin.
+
+    Dependencies are versioned. A checkin includes one of:
+        - dependencies, dependencies_version: the full list (a full sync)
+        - dependencies_base_version, dependencies_version, dependencies_added,
+          dependencies_removed: the changes since dependencies_base_version
+        - dependencies_version alone: the dependencies haven't changed since that version
+    A server that supports deltas replies with a checkin_ack message that says whether it
+    holds dependencies_version after the checkin. If it doesn't (e.g. the worker was cleaned up
+    after missing checkins), the next checkin is a full sync of dependencies and runs. Until
+    the first checkin_ack, e.g. with a server that doesn't support deltas, every checkin is a
+    full sync.
+
+    Only the runs whose state changed since the last acknowledged checkin are sent, and every
+    run is sent at least every RUN_RESEND_SECONDS, so that the server keeps seeing it as alive.
+    """
+
+    RUN_RESEND_SECONDS = 20
+
+    def __init__(self):
+        self._session = uuid.uuid4().hex[:12]
+        self._counter = 0
+        self._server_supports_deltas = False
+        self._acked_version = None  # type: Optional[str]
+        self._acked_dependencies = None  # type: Optional[Set[Tuple[str, str]]]
+        # uuid -> (run dict, time it was last acknowledged)
+        self._acked_runs = {}  # type: Dict[str, Tuple[dict, float]]
+
+    def _new_version(self) -> str:
+        self._counter += 1
+        return '%s-%d' % (self._session, self._counter)
+
+    def encode(self, request: dict, dependencies: List[Tuple[str, str]], runs: List[dict]):
+        """
+        Adds the dependencies and runs to the checkin request. Returns the state to pass to
+        ack() with the response of the server.
+        """
+        dependencies = set(map(tuple, dependencies))
+        now = time.time()
+        if not self._server_supports_deltas or self._acked_version is None:
+            version = self._new_version()
+            request['dependencies'] = sorted(dependencies)
+            request['dependencies_version'] = version
+            request['runs'] = runs
+        else:
+            if dependencies == self._acked_dependencies:
+                version = self._acked_version
+            else:
+                version = self._new_version()
+                request['dependencies_base_version'] = self._acked_version
+                request['dependencies_added'] = sorted(dependencies - self._acked_dependencies)
+                request['dependencies_removed'] = sorted(self._acked_dependencies - dependencies)
+            request['dependencies_version'] = version
+            request['runs'] = [
+                run
+                for run in runs
+                if run['uuid'] not in self._acked_runs
+                or self._acked_runs[run['uuid']][0] != run
+                or now - self._acked_runs[run['uuid']][1] >= self.RUN_RESEND_SECONDS
+            ]
+        return version, dependencies, runs, request['runs'], now
+
+    def ack(self, pending, response):
+        """Records what the server acknowledged in its response to the checkin encoded by
+        encode()."""
+        version, dependencies, runs, sent_runs, sent_time = pending
+        checkin_ack = next(
+            (
+                message
+                for message in response or []
+                if message and message.get('type') == 'checkin_ack'
+            ),
+            None,
+        )
+        if checkin_ack is None:
+            # The server doesn't support deltas.
+            self.reset()
+            return
+        self._server_supports_deltas = True
+        if not checkin_ack['in_sync']:
+            self.reset()
+            return
+        self._acked_version = version
+        self._acked_dependencies = dependencies
+        current_uuids = set(run['uuid'] for run in runs)
+        self._acked_runs = {
+            uuid: acked for uuid, acked in self._acked_runs.items() if uuid in current_uuids
+        }
+        for run in sent_runs:
+            self._acked_runs[run['uuid']] = (run, sent_time)
+
+    def reset(self):
+        """Makes the next checkin a full sync."""
+        self._acked_version = None
+        self._acked_dependencies = None
+        self._acked_runs = {}
@@ -0,0 +1,298 @@
+"""
+A thread-safe pool of persistent HTTP/1.1 connections, used by RestClient so that consecutive
+requests to the same server reuse a TCP connection (and TLS session) instead of opening a new one
+for every request, as urllib.request.urlopen does.
+
+ConnectionPool.urlopen is a drop-in replacement for urllib.request.urlopen for the requests
+RestClient makes: it follows redirects, raises urllib.error.HTTPError for error responses and
+urllib.error.URLError for network errors, and returns a file-like response.
+"""
+import http.client
+import io
+import os
+import select
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Tuple
+
+from retry import retry
+
+from codalab.common import URLOPEN_TIMEOUT_SECONDS
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTIONS = 10
+USER_AGENT = 'Python-urllib/%s' % urllib.request.__version__
+# Unread bodies up to this size are read when their response is closed, to reuse the connection.
+MAX_DRAIN_BYTES = 64 * 1024
+
+
+def _is_connection_dropped(connection: http.client.HTTPConnection) -> bool:
+    """
+    Returns whether an idle connection was closed by the server. An idle connection has no
+    pending response, so if its socket is readable, it is at EOF or in an unexpected state.
+    """
+    if connection.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class PooledResponse(object):
+    """
+    File-like response of a request made by ConnectionPool. Its connection goes back to the pool
+    once the body has been read to the end, or is closed if the response is closed before that.
+    """
+
+    def __init__(self, pool, key, connection, response, url):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.url = url
+        self.status = self.code = response.status
+        self.reason = self.msg = response.reason
+        self.headers = response.headers
+
+    def _release_if_done(self):
+        if self._connection is not None and self._response.isclosed():
+            connection, self._connection = self._connection, None
+            if self._response.will_close:
+                connection.close()
+            else:
+                self._pool._put_connection(self._key, connection)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        self._release_if_done()
+        return data
+
+    def read1(self, amt=-1):
+        data = self._response.read1(amt)
+        self._release_if_done()
+        return data
+
+    def readinto(self, b):
+        n = self._response.readinto(b)
+        self._release_if_done()
+        return n
+
+    def readline(self, limit=-1):
+        line = self._response.readline(limit)
+        self._release_if_done()
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def isclosed(self):
+        return self._response.isclosed()
+
+    @property
+    def length(self):
+        """Number of bytes of the body left to read, or None if unknown."""
+        return self._response.length
+
+    def close(self):
+        if self._connection is not None and not self._response.isclosed():
+            if self.length is not None and self.length <= MAX_DRAIN_BYTES:
+                # Read the rest of a short body, so that the connection can be reused.
+                try:
+                    self.read()
+                except (OSError, http.client.HTTPException):
+                    pass
+        self._release_if_done()
+        if self._connection is not None:
+            # The body wasn't read to the end, so the connection can't be reused.
+            connection, self._connection = self._connection, None
+            self._response.close()
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to max_connections_per_host idle keep-alive connections to each (scheme, host,
+    port). Requests check a connection out of the pool, or open a new one if there is no idle
+    connection, so the pool never blocks; connections are only kept if there is room when they
+    are returned.
+
+    A connection that was closed by the server while it was idle is discarded before use, and a
+    request that fails because the server closed a reused connection is sent again once on a
+    new connection. Requests that go through a proxy are made with urllib.request.urlopen.
+    """
+
+    def __init__(self, max_connections_per_host: int = 10):
+        self._max_connections_per_host = max_connections_per_host
+        self._lock = threading.Lock()
+        self._idle = {}  # type: Dict[Tuple[str, str], List[http.client.HTTPConnection]]
+        self._pid = os.getpid()
+
+    def _get_connection(
+        self, key: Tuple[str, str], timeout: float
+    ) -> Tuple[http.client.HTTPConnection, bool]:
+        """Returns a connection to the host, and whether it was reused."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections are not shared with a forked child process.
+                self._idle = {}
+                self._pid = os.getpid()
+            connections = self._idle.get(key, [])
+            while connections:
+                connection = connections.pop()
+                if _is_connection_dropped(connection):
+                    connection.close()
+                    continue
+                connection.timeout = timeout
+                connection.sock.settimeout(timeout)
+                return connection, True
+        scheme, host = key
+        connection_class = (
+            http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        )
+        return connection_class(host, timeout=timeout), False
+
+    def _put_connection(self, key: Tuple[str, str], connection: http.client.HTTPConnection):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if self._pid == os.getpid() and len(connections) < self._max_connections_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    @staticmethod
+    def _get_headers(request: urllib.request.Request) -> Dict[str, str]:
+        """Returns the headers urllib would send with the request, except Connection: close."""
+        headers = dict(request.unredirected_hdrs)
+        headers.update({k: v for k, v in request.headers.items() if k not in headers})
+        headers = {name.title(): value for name, value in headers.items()}
+        if request.data is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        headers.setdefault('User-Agent', USER_AGENT)
+        return headers
+
+    def _send(self, request: urllib.request.Request, timeout: float) -> PooledResponse:
+        key = (request.type, request.host)
+        headers = self._get_headers(request)
+        encode_chunked = 'Transfer-Encoding' in headers
+        while True:
+            connection, reused = self._get_connection(key, timeout)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                    # Small requests on a reused connection would otherwise wait for the
+                    # delayed ACK of the previous response.
+                    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.request(
+                    request.get_method(),
+                    request.selector,
+                    request.data,
+                    headers,
+                    encode_chunked=encode_chunked,
+                )
+                response = connection.getresponse()
+            except (ConnectionResetError, BrokenPipeError) as e:
+                connection.close()
+                if reused and not hasattr(request.data, 'read'):
+                    # The server closed the idle connection while the request was sent.
+                    continue
+                raise urllib.error.URLError(e)
+            except OSError as e:
+                connection.close()
+                raise urllib.error.URLError(e)
+            except BaseException:
+                connection.close()
+                raise
+            return PooledResponse(self, key, connection, response, request.full_url)
+
+    def urlopen(
+        self, request: urllib.request.Request, timeout: float = URLOPEN_TIMEOUT_SECONDS
+    ) -> PooledResponse:
+        """
+        Makes the request with a pooled connection. Like urllib.request.urlopen, follows
+        redirects, raises urllib.error.HTTPError for responses that aren't successful and
+        urllib.error.URLError for network errors.
+        """
+        if request.type not in ('http', 'https') or (
+            urllib.request.getproxies().get(request.type)
+            and not urllib.request.proxy_bypass(request.host)
+        ):
+            return urllib.request.urlopen(request, timeout=timeout)
+
+        for _ in range(MAX_REDIRECTIONS + 1):
+            response = self._send(request, timeout)
+            if 200 <= response.status < 300:
+                return response
+            location = response.headers.get('Location') or response.headers.get('URI')
+            if response.status not in REDIRECT_CODES or not location:
+                fp = response
+                if response.length is not None and response.length <= MAX_DRAIN_BYTES:
+                    # Read short error bodies right away, so that the connection is reused even
+                    # if the error is never read.
+                    fp = io.BytesIO(response.read())
+                raise urllib.error.HTTPError(
+                    request.full_url, response.status, response.reason, response.headers, fp
+                )
+            # Read the rest of the body, so that the connection can be reused.
+            response.read()
+            response.close()
+            new_url = urllib.parse.urljoin(request.full_url, location)
+            new_request = urllib.request.HTTPRedirectHandler().redirect_request(
+                request, response, response.status, response.reason, response.headers, new_url
+            )
+            if new_request is None:
+                raise urllib.error.HTTPError(
+                    request.full_url, response.status, response.reason, response.headers, None
+                )
+            request = new_request
+        raise urllib.error.HTTPError(
+            request.full_url,
+            response.status,
+            'The HTTP server returned a redirect error that would lead to an infinite loop.',
+            response.headers,
+            None,
+        )
+
+    @retry(urllib.error.URLError, tries=2, delay=1, backoff=2)
+    def urlopen_with_retry(
+        self, request: urllib.request.Request, timeout: float = URLOPEN_TIMEOUT_SECONDS
+    ) -> PooledResponse:
+        """
+        Like codalab.common.urlopen_with_retry, retries the request once after 1 second on
+        failure.
+        """
+        return self.urlopen(request, timeout=timeout)
+
+
+# Pool shared by the clients of a process that aren't given their own.
+default_pool = ConnectionPool()
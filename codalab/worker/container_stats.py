@@ -0,0 +1,328 @@
+"""
+Caches the resource usage and state of the Docker containers of running bundles, so that the
+worker can check on its runs without making Docker API calls for each of them.
+
+ContainerStatsCollector samples the cgroup files of all tracked containers in one pass on a
+background thread, and follows the Docker events stream to learn when containers stop.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Optional
+
+import psutil
+from dateutil import parser, tz
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOTS = ['/sys/fs/cgroup', '/cgroup']
+USER_HZ = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# A snapshot of the resource usage of a container:
+#   cpu_usage: number of CPUs used on average since the previous sample (1.0 is one full CPU)
+#   memory_usage: memory used as a fraction of the memory limit of the container
+#   memory: memory used, in bytes
+#   time_user, time_system: CPU time spent in user and kernel mode, in seconds
+ContainerStats = namedtuple(
+    'ContainerStats', ['cpu_usage', 'memory_usage', 'memory', 'time_user', 'time_system']
+)
+
+
+class CgroupReader(object):
+    """Reads the CPU and memory usage of Docker containers from cgroup v1 or v2 files."""
+
+    def __init__(self):
+        self.root = next((root for root in CGROUP_ROOTS if os.path.exists(root)), None)
+        self.v2 = self.root is not None and os.path.exists(
+            os.path.join(self.root, 'cgroup.controllers')
+        )
+        self._dirs = {}  # type: Dict[str, Dict[str, str]]
+
+    def _find_dir(self, candidates):
+        return next((path for path in candidates if os.path.isdir(path)), None)
+
+    def _get_dirs(self, container_id: str) -> Dict[str, str]:
+        """Returns the cgroup directories of the container, for both the cgroupfs and the
+        systemd cgroup drivers."""
+        dirs = self._dirs.get(container_id)
+        if dirs:
+            return dirs
+        scope = 'docker-%s.scope' % container_id
+        if self.v2:
+            path = self._find_dir(
+                [
+                    os.path.join(self.root, 'system.slice', scope),
+                    os.path.join(self.root, 'docker', container_id),
+                ]
+            )
+            dirs = {'cpu': path, 'memory': path} if path else {}
+        else:
+            dirs = {}
+            for controller, names in [('cpu', ['cpuacct', 'cpu,cpuacct']), ('memory', ['memory'])]:
+                path = self._find_dir(
+                    [
+                        os.path.join(self.root, name, parent)
+                        for name in names
+                        for parent in ['docker/' + container_id, 'system.slice/' + scope]
+                    ]
+                )
+                if path:
+                    dirs[controller] = path
+        if dirs:
+            self._dirs[container_id] = dirs
+        return dirs
+
+    def forget(self, container_id: str):
+        self._dirs.pop(container_id, None)
+
+    @staticmethod
+    def _read(path: str) -> str:
+        with open(path) as f:
+            return f.read()
+
+    def read(self, container_id: str) -> Optional[dict]:
+        """Returns a dict with the cumulative CPU time of the container in nanoseconds (cpu_ns),
+        its user and system CPU time in seconds, its memory usage and limit in bytes, or None
+        if its cgroup can't be found (e.g. it has stopped)."""
+        if self.root is None:
+            return None
+        dirs = self._get_dirs(container_id)
+        if not dirs:
+            return None
+        sample = {}
+        try:
+            if self.v2:
+                cpu_stat = dict(
+                    line.split()
+                    for line in self._read(os.path.join(dirs['cpu'], 'cpu.stat')).splitlines()
+                )
+                sample['cpu_ns'] = int(cpu_stat['usage_usec']) * 1000
+                sample['time_user'] = int(cpu_stat['user_usec']) / 1e6
+                sample['time_system'] = int(cpu_stat['system_usec']) / 1e6
+                sample['memory'] = int(self._read(os.path.join(dirs['memory'], 'memory.current')))
+                limit = self._read(os.path.join(dirs['memory'], 'memory.max')).strip()
+                sample['memory_limit'] = None if limit == 'max' else int(limit)
+            else:
+                if 'cpu' in dirs:
+                    sample['cpu_ns'] = int(self._read(os.path.join(dirs['cpu'], 'cpuacct.usage')))
+                    for line in self._read(os.path.join(dirs['cpu'], 'cpuacct.stat')).splitlines():
+                        key, value = line.split()
+                        if key in ('user', 'system'):
+                            sample['time_' + key] = int(value) / USER_HZ
+                if 'memory' in dirs:
+                    memory_dir = dirs['memory']
+                    sample['memory'] = int(
+                        self._read(os.path.join(memory_dir, 'memory.usage_in_bytes'))
+                    )
+                    sample['memory_limit'] = int(
+                        self._read(os.path.join(memory_dir, 'memory.limit_in_bytes'))
+                    )
+        except (OSError, ValueError, KeyError):
+            # The container stopped and its cgroup was removed.
+            self.forget(container_id)
+            return None
+        return sample
+
+
+class ContainerState(object):
+    """What the collector knows about a container."""
+
+    def __init__(self):
+        self.exists = True
+        self.started_at = None  # type: Optional[datetime.datetime]
+        self.finished_at = None  # type: Optional[datetime.datetime]
+        self.finished = False
+        self.stats = None  # type: Optional[ContainerStats]
+        self.last_sample = None  # type: Optional[tuple]  # (time in ns, cpu_ns)
+        # Whether track() was called for the container, and when it last inspected it. States of
+        # untracked containers are only created by die events.
+        self.tracked = False
+        self.inspected_at = None  # type: Optional[float]
+        self.created_at = time.monotonic()
+
+
+class ContainerStatsCollector(object):
+    """
+    Keeps a ContainerState for each tracked container, updated by two background threads:
+        - Every STATS_INTERVAL_SECONDS, the stats thread samples the cgroups of all tracked
+          containers and computes their CPU and memory usage.
+        - The events thread follows the Docker events stream and records when containers die
+          or are destroyed.
+    If the events stream fails, events_healthy is False until it is reconnected, and the
+    caller should ask Docker about the state of containers instead. Since a stream can also
+    stall without failing, track() inspects containers again every INSPECT_INTERVAL_SECONDS.
+    """
+
+    STATS_INTERVAL_SECONDS = 1.0
+    EVENTS_RECONNECT_SECONDS = 5.0
+    INSPECT_INTERVAL_SECONDS = 60.0
+    # How long the state of a container that died without being tracked is kept.
+    UNTRACKED_STATE_TTL_SECONDS = 60.0
+
+    def __init__(self, client, cgroup_reader=None):
+        self._client = client
+        self._cgroups = cgroup_reader or CgroupReader()
+        self._lock = threading.Lock()
+        self._containers = {}  # type: Dict[str, ContainerState]
+        self._started = False
+        self._start_time = None  # type: Optional[int]
+        self._stop = threading.Event()
+        self.events_healthy = False
+
+    def start(self):
+        """Starts the background threads, if they aren't running yet."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._start_time = int(time.time())
+        threading.Thread(target=self._stats_loop, daemon=True).start()
+        threading.Thread(target=self._events_loop, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def track(self, container_id: str) -> ContainerState:
+        """Returns the state of the container, loading it from Docker the first time and
+        refreshing it every INSPECT_INTERVAL_SECONDS."""
+        with self._lock:
+            state = self._containers.get(container_id)
+            if (
+                state is not None
+                and state.tracked
+                and time.monotonic() - state.inspected_at < self.INSPECT_INTERVAL_SECONDS
+            ):
+                return state
+        attrs_state = self._client.api.inspect_container(container_id)['State']
+        with self._lock:
+            # A die event may have been recorded while the container was inspected.
+            state = self._containers.setdefault(container_id, ContainerState())
+            state.tracked = True
+            state.inspected_at = time.monotonic()
+            started_at = parser.isoparse(attrs_state['StartedAt'])
+            # Docker reports 0001-01-01 for containers that haven't started yet.
+            if started_at.year > 1:
+                state.started_at = started_at
+            if attrs_state['Status'] not in ('running', 'created', 'restarting'):
+                state.finished = True
+                state.finished_at = state.finished_at or parser.isoparse(attrs_state['FinishedAt'])
+            return state
+
+    def untrack(self, container_id: str):
+        with self._lock:
+            self._containers.pop(container_id, None)
+        self._cgroups.forget(container_id)
+
+    def get(self, container_id: str) -> Optional[ContainerState]:
+        with self._lock:
+            return self._containers.get(container_id)
+
+    def sample(self):
+        """Samples the cgroups of all tracked running containers."""
+        with self._lock:
+            container_ids = [
+                container_id
+                for container_id, state in self._containers.items()
+                if state.tracked and state.started_at is not None and not state.finished
+            ]
+        host_memory = psutil.virtual_memory().total
+        for container_id in container_ids:
+            sample = self._cgroups.read(container_id)
+            if sample is None:
+                continue
+            now_ns = time.monotonic_ns()
+            with self._lock:
+                state = self._containers.get(container_id)
+                if state is None:
+                    continue
+                cpu_usage = 0.0
+                if 'cpu_ns' in sample:
+                    if state.last_sample is not None and now_ns > state.last_sample[0]:
+                        cpu_usage = max(sample['cpu_ns'] - state.last_sample[1], 0) / (
+                            now_ns - state.last_sample[0]
+                        )
+                    state.last_sample = (now_ns, sample['cpu_ns'])
+                memory = sample.get('memory', 0)
+                memory_limit = min(sample.get('memory_limit') or host_memory, host_memory)
+                state.stats = ContainerStats(
+                    cpu_usage=cpu_usage,
+                    memory_usage=memory / memory_limit,
+                    memory=memory,
+                    time_user=sample.get('time_user'),
+                    time_system=sample.get('time_system'),
+                )
+
+    def prune(self):
+        """Drops the states recorded by die events of containers that were never tracked, e.g.
+        containers on the same host that don't belong to the worker and aren't destroyed."""
+        now = time.monotonic()
+        with self._lock:
+            for container_id, state in list(self._containers.items()):
+                if not state.tracked and now - state.created_at >= self.UNTRACKED_STATE_TTL_SECONDS:
+                    del self._containers[container_id]
+
+    def _stats_loop(self):
+        while not self._stop.wait(self.STATS_INTERVAL_SECONDS):
+            try:
+                self.sample()
+                self.prune()
+            except Exception:
+                logger.exception('Unable to sample container stats')
+
+    def handle_event(self, event: dict):
+        container_id = event.get('id') or event.get('Actor', {}).get('ID')
+        if not container_id:
+            return
+        action = event.get('Action') or event.get('status')
+        if 'timeNano' in event:
+            event_time = datetime.datetime.fromtimestamp(event['timeNano'] / 1e9, tz.tzutc())
+        else:
+            event_time = datetime.datetime.now(tz.tzutc())
+        with self._lock:
+            if action == 'start':
+                state = self._containers.get(container_id)
+                if state is not None:
+                    state.started_at = event_time
+                    state.finished = False
+                    state.finished_at = None
+            elif action == 'die':
+                # Recorded even for containers that aren't tracked yet, in case they are being
+                # inspected by track() right now. Entries of untracked containers are dropped
+                # when the container is destroyed, or by prune().
+                state = self._containers.setdefault(container_id, ContainerState())
+                state.finished = True
+                state.finished_at = event_time
+            elif action == 'destroy':
+                state = self._containers.get(container_id)
+                if state is not None:
+                    if not state.tracked:
+                        del self._containers[container_id]
+                    else:
+                        state.exists = False
+                        state.finished = True
+                        state.finished_at = state.finished_at or event_time
+
+    def _events_loop(self):
+        # Containers may be tracked before the stream is connected, so ask for the events since
+        # the collector started. Duplicate events are harmless.
+        since = self._start_time
+        while not self._stop.is_set():
+            try:
+                events = self._client.events(
+                    decode=True,
+                    since=since,
+                    filters={'type': 'container', 'event': ['start', 'die', 'destroy']},
+                )
+                self.events_healthy = True
+                for event in events:
+                    since = event.get('time', since)
+                    self.handle_event(event)
+                    if self._stop.is_set():
+                        break
+            except Exception:
+                logger.warning('Docker events stream failed, reconnecting', exc_info=True)
+            self.events_healthy = False
+            self._stop.wait(self.EVENTS_RECONNECT_SECONDS)
@@ -1,23 +1,24 @@
+import itertools
 import logging
 import os
+import sqlite3
 import threading
 import traceback
 import time
 import shutil
 import uuid
-from collections import namedtuple
 from contextlib import closing
 from datetime import timedelta
-from typing import Dict, Set, Union, List
+from typing import Callable, Dict, Optional, List
 
-import codalab.worker.pyjson
 from .bundle_service_client import BundleServiceClient
 from codalab.lib.formatting import size_str
-from codalab.worker.file_util import remove_path
+from codalab.worker.file_util import get_path_size, hardlink_path, remove_path
 from codalab.worker.un_tar_directory import un_tar_directory
 from codalab.worker.fsm import BaseDependencyManager, DependencyStage, StateTransitioner
 from codalab.worker.worker_thread import ThreadDict
 from codalab.worker.bundle_state import DependencyKey
+from codalab.worker.dependency_state_store import DependencyState, DependencyStateStore
 from codalab.worker.state_committer import JsonStateCommitter
 
 from flufl.lock import Lock, AlreadyLockedError, NotLockedError  # noqa: E402
@@ -27,14 +28,6 @@ logging.getLogger('flufl.lock').setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
-DependencyState = namedtuple(
-    'DependencyState',
-    # downloading_by - worker id of which worker is downloading / has downloaded the dependency
-    'stage downloading_by dependency_key path size_bytes dependents last_used last_downloading message killed',
-)
-
-DependencyManagerState = Dict[str, Union[Dict[DependencyKey, DependencyState], Set[str]]]
-
 
 class DownloadAbortedException(Exception):
     """
@@ -45,6 +38,65 @@ class DownloadAbortedException(Exception):
         super(DownloadAbortedException, self).__init__(message)
 
 
+class DownloadSlots(object):
+    """
+    Limits the number of dependencies that are downloaded at once. Downloads wait for a free
+    slot, which goes to the waiting download with the highest priority, and among those to the
+    one that has been waiting the longest. The priority of a download is the highest priority
+    of the runs that requested it.
+    """
+
+    def __init__(self, max_downloads: int):
+        self._max_downloads = max_downloads
+        self._num_downloading = 0
+        self._priorities: Dict[DependencyKey, int] = {}
+        # DependencyKey -> (negated priority, arrival order), so that the minimum goes first.
+        self._waiting: Dict[DependencyKey, tuple] = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def set_priority(self, dependency_key: DependencyKey, priority: int):
+        """Raises the priority of the download of the dependency to priority, if it is lower."""
+        with self._condition:
+            if priority <= self._priorities.get(dependency_key, priority - 1):
+                return
+            self._priorities[dependency_key] = priority
+            if dependency_key in self._waiting:
+                self._waiting[dependency_key] = (-priority, self._waiting[dependency_key][1])
+                self._condition.notify_all()
+
+    def acquire(self, dependency_key: DependencyKey, should_abort: Callable[[], bool]):
+        """
+        Blocks until the dependency may be downloaded. should_abort() is called about every
+        second while the download waits, and DownloadAbortedException is raised if it returns True.
+        """
+        with self._condition:
+            self._waiting[dependency_key] = (
+                -self._priorities.get(dependency_key, 0),
+                next(self._counter),
+            )
+            try:
+                while (
+                    self._num_downloading >= self._max_downloads
+                    or min(self._waiting, key=self._waiting.get) != dependency_key
+                ):
+                    if should_abort():
+                        self._priorities.pop(dependency_key, None)
+                        raise DownloadAbortedException("Aborted while waiting to download")
+                    self._condition.wait(timeout=1)
+                self._num_downloading += 1
+            finally:
+                del self._waiting[dependency_key]
+                # The next download in line may be able to start.
+                self._condition.notify_all()
+
+    def release(self, dependency_key: DependencyKey):
+        with self._condition:
+            self._num_downloading -= 1
+            self._priorities.pop(dependency_key, None)
+            self._condition.notify_all()
+
+
 class NFSLock:
     def __init__(self, path):
         # Specify the path to a file that will be used to synchronize the lock.
@@ -94,6 +146,9 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
     to the local filesystem. It caches all downloaded dependencies but cleans up the
     old ones if the disk use hits the given threshold. It's also NFS-safe.
     In this class, dependencies are uniquely identified by DependencyKey.
+    The state of the dependencies is kept in an SQLite database next to commit_file, so that
+    single dependencies can be updated without rewriting the state of all of them. A JSON state
+    file left at commit_file by an older version of the worker is imported once and removed.
     """
 
     DEPENDENCIES_DIR_NAME = 'dependencies'
@@ -115,6 +170,7 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         worker_dir: str,
         max_cache_size_bytes: int,
         download_dependencies_max_retries: int,
+        max_concurrent_downloads: int = 4,
     ):
         super(DependencyManager, self).__init__()
         self.add_transition(DependencyStage.DOWNLOADING, self._transition_from_DOWNLOADING)
@@ -122,7 +178,9 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         self.add_terminal(DependencyStage.FAILED)
 
         self._id: str = "worker-dependency-manager-{}".format(uuid.uuid4().hex[:8])
-        self._state_committer = JsonStateCommitter(commit_file)
+        # The JSON state file that older versions of the dependency manager kept the state in.
+        self._legacy_state_committer = JsonStateCommitter(commit_file)
+        self._state_store_path = os.path.splitext(commit_file)[0] + '.sqlite'
         self._bundle_service = bundle_service
         self._max_cache_size_bytes = max_cache_size_bytes
         self.dependencies_dir = os.path.join(worker_dir, DependencyManager.DEPENDENCIES_DIR_NAME)
@@ -141,11 +199,14 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
             logger.info(f"A locks directory at {locks_claims_dir} already exists.")
         self._state_lock = NFSLock(os.path.join(locks_claims_dir, 'state.lock'))
 
-        # File paths that are currently being used to store dependencies. Used to prevent conflicts
-        self._paths: Set[str] = set()
+        with self._state_lock:
+            self._state_store = DependencyStateStore(self._state_store_path)
         # DependencyKey -> WorkerThread(thread, success, failure_message)
-        self._downloading = ThreadDict(fields={'success': False, 'failure_message': None})
-        # Sync states between dependency-state.json and dependency directories on the local file system.
+        self._downloading = ThreadDict(
+            fields={'success': False, 'failure_message': None, 'state': None, 'linked_size': None}
+        )
+        self._download_slots = DownloadSlots(max_concurrent_downloads)
+        # Sync states between the state store and dependency directories on the local file system.
         self._sync_state()
 
         self._stop = False
@@ -154,54 +215,49 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
 
     def _sync_state(self):
         """
-        Synchronize dependency states between dependencies-state.json and the local file system as follows:
-        1. dependencies and paths: populated from dependencies-state.json
+        Synchronize dependency states between the state store and the local file system as follows:
+        1. dependencies and paths: populated from the state store (after importing the legacy
+           JSON state file, if there is one)
         2. directories on the local file system: the bundle contents
         This function forces the 1 and 2 to be in sync by taking the intersection (e.g., deleting bundles from the
-        local file system that don't appear in the dependencies-state.json and vice-versa)
+        local file system that don't appear in the state store and vice-versa)
         """
         with self._state_lock:
-            # Load states from dependencies-state.json, which contains information about bundles (e.g., state,
-            # dependencies, last used, etc.).
-            if self._state_committer.state_file_exists:
-                # If the state file exists, do not pass in a default. It's critical that we read the contents
-                # of the state file, as this method prunes dependencies. If we can't read the contents of the
-                # state file, fail immediately.
-                dependencies, paths = self._fetch_state()
+            if self._legacy_state_committer.state_file_exists:
+                self._import_legacy_state()
+            with self._state_store.transaction():
+                dependencies = self._state_store.get_all()
+                paths = self._state_store.paths()
                 logger.info(
                     'Found {} dependencies, {} paths from cache.'.format(
                         len(dependencies), len(paths)
                     )
                 )
-            else:
-                dependencies: Dict[DependencyKey, DependencyState] = dict()
-                paths: Set[str] = set()
-                logger.info(
-                    f'State file did not exist. Will create one at path {self._state_committer.path}.'
-                )
 
-            # Get the paths that exist in dependency state, loaded path and
-            # the local file system (the dependency directories under self.dependencies_dir)
-            local_directories = set(os.listdir(self.dependencies_dir))
-            paths_in_loaded_state = [dep_state.path for dep_state in dependencies.values()]
-            paths = paths.intersection(paths_in_loaded_state).intersection(local_directories)
-
-            # Remove the orphaned dependencies if they don't exist in paths
-            # (intersection of paths in dependency state, loaded paths and the paths on the local file system)
-            dependencies_to_remove = [
-                dep for dep, dep_state in dependencies.items() if dep_state.path not in paths
-            ]
-            for dep in dependencies_to_remove:
-                logger.info(
-                    "Dependency {} in dependency state but its path {} doesn't exist on the local file system. "
-                    "Removing it from dependency state.".format(
-                        dep, os.path.join(self.dependencies_dir, dependencies[dep].path)
-                    )
+                # Get the paths that exist in dependency state, loaded path and
+                # the local file system (the dependency directories under self.dependencies_dir)
+                local_directories = set(os.listdir(self.dependencies_dir))
+                paths_in_loaded_state = [dep_state.path for dep_state in dependencies.values()]
+                synced_paths = paths.intersection(paths_in_loaded_state).intersection(
+                    local_directories
                 )
-                del dependencies[dep]
+                for path in paths - synced_paths:
+                    self._state_store.remove_path(path)
+
+                # Remove the orphaned dependencies if they don't exist in paths
+                # (intersection of paths in dependency state, loaded paths and the paths on the local file system)
+                for dep, dep_state in dependencies.items():
+                    if dep_state.path not in synced_paths:
+                        logger.info(
+                            "Dependency {} in dependency state but its path {} doesn't exist on the local file system. "
+                            "Removing it from dependency state.".format(
+                                dep, os.path.join(self.dependencies_dir, dep_state.path)
+                            )
+                        )
+                        self._state_store.delete(dep)
 
             # Remove the orphaned directories from the local file system
-            directories_to_remove = local_directories - paths
+            directories_to_remove = local_directories - synced_paths
             for directory in directories_to_remove:
                 full_path = os.path.join(self.dependencies_dir, directory)
                 if os.path.exists(full_path):
@@ -210,40 +266,47 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
                     )
                     remove_path(full_path)
 
-            # Save the current synced state back to the state file: dependency-state.json as
-            # the current state might have been changed during the state syncing phase
-            self._commit_state(dependencies, paths)
-
-    def _fetch_state(self, default=None):
-        """
-        Fetch state from JSON file stored on disk.
-        NOT NFS-SAFE - Caller should acquire self._state_lock before calling this method.
-        WARNING: If a value for `default` is specified, errors will be silently handled.
-        """
-        assert self._state_lock.is_locked
-        state: DependencyManagerState = self._state_committer.load(default)
-        dependencies: Dict[DependencyKey, DependencyState] = state['dependencies']
-        paths: Set[str] = state['paths']
-        return dependencies, paths
-
-    def _fetch_dependencies(self, default=None) -> Dict[DependencyKey, DependencyState]:
+    def _import_legacy_state(self):
         """
-        Fetch dependencies from JSON file stored on disk.
+        Imports the dependencies and paths of the JSON state file into the state store, and removes
+        the file once the import is committed.
         NOT NFS-SAFE - Caller should acquire self._state_lock before calling this method.
-        WARNING: If a value for `default` is specified, errors will be silently handled.
         """
         assert self._state_lock.is_locked
-        dependencies, _ = self._fetch_state(default)
-        return dependencies
+        # Don't pass in a default. It's critical that we read the contents of the state file, as
+        # _sync_state prunes dependencies. If we can't read the contents of the state file, fail
+        # immediately.
+        state = self._legacy_state_committer.load()
+        with self._state_store.transaction():
+            for dep_key, dep_state in state['dependencies'].items():
+                self._state_store.put(
+                    DependencyState(
+                        **dict(
+                            dep_state._asdict(),
+                            dependency_key=DependencyKey(
+                                parent_uuid=dep_key.parent_uuid, parent_path=dep_key.parent_path
+                            ),
+                        )
+                    )
+                )
+            for path in state['paths']:
+                self._state_store.add_path(path)
+        os.remove(self._legacy_state_committer.path)
+        logger.info(
+            'Imported {} dependencies from {} into {}.'.format(
+                len(state['dependencies']),
+                self._legacy_state_committer.path,
+                self._state_store.path,
+            )
+        )
 
-    def _commit_state(self, dependencies: Dict[DependencyKey, DependencyState], paths: Set[str]):
+    def _fetch_dependencies(self) -> Dict[DependencyKey, DependencyState]:
         """
-        Update state in dependencies JSON file stored on disk.
+        Fetch all the dependencies from the state store.
         NOT NFS-SAFE - Caller should acquire self._state_lock before calling this method.
         """
         assert self._state_lock.is_locked
-        state: DependencyManagerState = {'dependencies': dependencies, 'paths': paths}
-        self._state_committer.commit(state)
+        return self._state_store.get_all()
 
     def start(self):
         logger.info('Starting local dependency manager...')
@@ -271,16 +334,18 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
     def _transition_dependencies(self):
         with self._state_lock:
             try:
-                dependencies, paths = self._fetch_state()
-
-                # Update the class variable _paths as the transition function may update it
-                self._paths = paths
-                for dep_key, dep_state in dependencies.items():
-                    dependencies[dep_key] = self.transition(dep_state)
-                self._commit_state(dependencies, self._paths)
-            except (ValueError, EnvironmentError):
-                # Do nothing if an error is thrown while reading from the state file
-                logging.exception("Error reading from state file while transitioning dependencies")
+                with self._state_store.transaction():
+                    # READY and FAILED are terminal stages, so only downloading dependencies
+                    # need to be transitioned, and only the ones that changed are written.
+                    for dep_state in self._state_store.get_all(
+                        stage=DependencyStage.DOWNLOADING
+                    ).values():
+                        new_state = self.transition(dep_state)
+                        if new_state != dep_state:
+                            self._state_store.put(new_state)
+            except (sqlite3.Error, EnvironmentError):
+                # Do nothing if an error is thrown while reading from the state store
+                logging.exception("Error reading from state store while transitioning dependencies")
                 pass
 
     def _prune_failed_dependencies(self):
@@ -291,137 +356,129 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         """
         with self._state_lock:
             try:
-                dependencies, paths = self._fetch_state()
-                failed_deps: Dict[DependencyKey, DependencyState] = {
-                    dep_key: dep_state
-                    for dep_key, dep_state in dependencies.items()
-                    if dep_state.stage == DependencyStage.FAILED
-                    and time.time() - dep_state.last_used
-                    > DependencyManager.DEPENDENCY_FAILURE_COOLDOWN
-                }
-                if len(failed_deps) == 0:
-                    return
-
-                for dep_key, dep_state in failed_deps.items():
-                    self._delete_dependency(dep_key, dependencies, paths)
-                self._commit_state(dependencies, paths)
-            except (ValueError, EnvironmentError):
-                # Do nothing if an error is thrown while reading from the state file
+                with self._state_store.transaction():
+                    now = time.time()
+                    for dep_state in self._state_store.get_all(
+                        stage=DependencyStage.FAILED
+                    ).values():
+                        if (
+                            now - dep_state.last_used
+                            > DependencyManager.DEPENDENCY_FAILURE_COOLDOWN
+                        ):
+                            self._delete_dependency(dep_state)
+            except (sqlite3.Error, EnvironmentError):
+                # Do nothing if an error is thrown while reading from the state store
                 logging.exception(
-                    "Error reading from state file while pruning failed dependencies."
+                    "Error reading from state store while pruning failed dependencies."
                 )
                 pass
 
     def _cleanup(self):
         """
         Prune failed dependencies older than DEPENDENCY_FAILURE_COOLDOWN seconds.
-        Limit the disk usage of the dependencies (both the bundle files and the serialized state file size)
-        Deletes oldest failed dependencies first and then oldest finished dependencies.
+        Limit the disk usage of the dependencies (both the bundle files and the size of the list
+        of dependencies sent to the server at checkin)
+        Deletes oldest failed dependencies first and then oldest finished dependencies, as many
+        as needed to get under the limits at once.
         Doesn't touch downloading dependencies.
         """
         self._prune_failed_dependencies()
 
-        while True:
-            with self._state_lock:
-                try:
-                    dependencies, paths = self._fetch_state()
-                except (ValueError, EnvironmentError):
-                    # Do nothing if an error is thrown while reading from the state file
-                    logging.exception(
-                        "Error reading from state file when cleaning up dependencies. Trying again..."
-                    )
-                    continue
+        with self._state_lock:
+            try:
+                with self._state_store.transaction():
+                    bytes_used = self._state_store.total_size()
+                    serialized_length = self._state_store.serialized_keys_length()
+
+                    def over_quota():
+                        return (
+                            bytes_used > self._max_cache_size_bytes
+                            or serialized_length > DependencyManager.MAX_SERIALIZED_LEN
+                        )
 
-                bytes_used = sum(dep_state.size_bytes for dep_state in dependencies.values())
-                serialized_length = len(codalab.worker.pyjson.dumps(dependencies))
-                if (
-                    bytes_used > self._max_cache_size_bytes
-                    or serialized_length > DependencyManager.MAX_SERIALIZED_LEN
-                ):
+                    if not over_quota():
+                        return
                     logger.debug(
-                        '%d dependencies, disk usage: %s (max %s), serialized size: %s (max %s)',
-                        len(dependencies),
+                        'Disk usage: %s (max %s), serialized size: %s (max %s)',
                         size_str(bytes_used),
                         size_str(self._max_cache_size_bytes),
                         size_str(serialized_length),
                         DependencyManager.MAX_SERIALIZED_LEN,
                     )
-                    ready_deps = {
-                        dep_key: dep_state
-                        for dep_key, dep_state in dependencies.items()
-                        if dep_state.stage == DependencyStage.READY and not dep_state.dependents
-                    }
-                    failed_deps = {
-                        dep_key: dep_state
-                        for dep_key, dep_state in dependencies.items()
-                        if dep_state.stage == DependencyStage.FAILED
-                    }
-
-                    if failed_deps:
-                        dep_key_to_remove = min(
-                            failed_deps.items(), key=lambda dep: dep[1].last_used
-                        )[0]
-                    elif ready_deps:
-                        dep_key_to_remove = min(
-                            ready_deps.items(), key=lambda dep: dep[1].last_used
-                        )[0]
-                    else:
-                        logger.info(
-                            'Dependency quota full but there are only downloading dependencies, not cleaning up '
-                            'until downloads are over.'
+                    for dep_state in self._state_store.eviction_candidates():
+                        self._delete_dependency(dep_state)
+                        bytes_used -= dep_state.size_bytes
+                        # See DependencyStateStore.serialized_keys_length.
+                        serialized_length -= (
+                            len(dep_state.dependency_key.parent_uuid)
+                            + len(dep_state.dependency_key.parent_path)
+                            + 8
                         )
-                        break
-                    if dep_key_to_remove:
-                        self._delete_dependency(dep_key_to_remove, dependencies, paths)
-                        self._commit_state(dependencies, paths)
-                else:
-                    break
+                        if not over_quota():
+                            return
+                    logger.info(
+                        'Dependency quota full but there are only downloading dependencies, not cleaning up '
+                        'until downloads are over.'
+                    )
+            except (sqlite3.Error, EnvironmentError):
+                # Do nothing if an error is thrown while reading from the state store
+                logging.exception("Error reading from state store when cleaning up dependencies.")
 
-    def _delete_dependency(self, dep_key, dependencies, paths):
+    def _delete_dependency(self, dep_state: DependencyState):
         """
         Remove the given dependency from the manager's state
-        Modifies `dependencies` and `paths` that are passed in.
         Also deletes any known files on the filesystem if any exist.
 
         NOT NFS-SAFE - Caller should acquire self._state_lock before calling this method.
         """
         assert self._state_lock.is_locked
 
-        if dep_key in dependencies:
-            try:
-                path_to_remove = dependencies[dep_key].path
-                paths.remove(path_to_remove)
-                # Deletes dependency content from disk
-                remove_path(path_to_remove)
-            except Exception:
-                pass
-            finally:
-                del dependencies[dep_key]
-                logger.info(f"Deleted dependency {dep_key}.")
+        try:
+            with self._state_store.transaction():
+                # The path of a failed dependency is released when it fails, and may have been
+                # assigned to another dependency since, whose contents must stay.
+                if dep_state.stage != DependencyStage.FAILED or not self._state_store.has_path(
+                    dep_state.path
+                ):
+                    self._state_store.remove_path(dep_state.path)
+                    # Deletes dependency content from disk
+                    path_to_remove = os.path.join(self.dependencies_dir, dep_state.path)
+                    if os.path.lexists(path_to_remove):
+                        remove_path(path_to_remove)
+        except EnvironmentError:
+            logger.warning(
+                "Failed to remove the contents of dependency %s",
+                dep_state.dependency_key,
+                exc_info=True,
+            )
+        finally:
+            self._state_store.delete(dep_state.dependency_key)
+            logger.info(f"Deleted dependency {dep_state.dependency_key}.")
 
     def has(self, dependency_key):
         """
         Takes a DependencyKey and returns true if the manager has processed this dependency
         """
         with self._state_lock:
-            dependencies: Dict[DependencyKey, DependencyState] = self._fetch_dependencies()
-            return dependency_key in dependencies
+            return self._state_store.get(dependency_key) is not None
 
-    def get(self, uuid: str, dependency_key: DependencyKey) -> DependencyState:
+    def get(self, uuid: str, dependency_key: DependencyKey, priority: int = 0) -> DependencyState:
         """
-        Request the dependency for the run with uuid, registering uuid as a dependent of this dependency
+        Request the dependency for the run with uuid, registering uuid as a dependent of this dependency.
+        Dependencies requested with a higher priority are downloaded first.
         """
-        with self._state_lock:
-            dependencies, paths = self._fetch_state()
+        self._download_slots.set_priority(dependency_key, priority)
+        with self._state_lock, self._state_store.transaction():
+            dep_state = self._state_store.get(dependency_key)
 
             now = time.time()
             # Add dependency state if it does not exist
-            if dependency_key not in dependencies:
-                dependencies[dependency_key] = DependencyState(
+            if dep_state is None:
+                dep_state = DependencyState(
                     stage=DependencyStage.DOWNLOADING,
                     downloading_by=None,
                     dependency_key=dependency_key,
-                    path=self._assign_path(paths, dependency_key),
+                    path=self._assign_path(dependency_key),
                     size_bytes=0,
                     dependents={uuid},
                     last_used=now,
@@ -431,35 +488,34 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
                 )
 
             # Update last_used as long as it isn't in a FAILED stage
-            if dependencies[dependency_key].stage != DependencyStage.FAILED:
-                dependencies[dependency_key].dependents.add(uuid)
-                dependencies[dependency_key] = dependencies[dependency_key]._replace(last_used=now)
+            if dep_state.stage != DependencyStage.FAILED:
+                dep_state.dependents.add(uuid)
+                dep_state = dep_state._replace(last_used=now)
 
-            self._commit_state(dependencies, paths)
-            return dependencies[dependency_key]
+            self._state_store.put(dep_state)
+            return dep_state
 
     def release(self, uuid, dependency_key):
         """
         Register that the run with uuid is no longer dependent on this dependency
         If no more runs are dependent on this dependency, kill it.
         """
-        with self._state_lock:
-            dependencies, paths = self._fetch_state()
+        with self._state_lock, self._state_store.transaction():
+            dep_state = self._state_store.get(dependency_key)
 
-            if dependency_key in dependencies:
-                dep_state = dependencies[dependency_key]
+            if dep_state is not None:
                 if uuid in dep_state.dependents:
                     dep_state.dependents.remove(uuid)
                 if not dep_state.dependents:
                     dep_state = dep_state._replace(killed=True)
-                    dependencies[dependency_key] = dep_state
-                self._commit_state(dependencies, paths)
+                self._state_store.put(dep_state)
 
-    def _assign_path(self, paths: Set[str], dependency_key: DependencyKey) -> str:
+    def _assign_path(self, dependency_key: DependencyKey) -> str:
         """
-        Checks the current path against `paths`.
+        Checks the current path against the paths in the state store.
         Normalize the path for the dependency by replacing / with _, avoiding conflicts.
-        Adds the new path to `paths`.
+        Adds the new path to the state store.
+        NOT NFS-SAFE - Caller should acquire self._state_lock before calling this method.
         """
         path: str = (
             os.path.join(dependency_key.parent_uuid, dependency_key.parent_path)
@@ -469,10 +525,10 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         path = path.replace(os.path.sep, '_')
 
         # You could have a conflict between, for example a/b_c and a_b/c
-        while path in paths:
+        while self._state_store.has_path(path):
             path = path + '_'
 
-        paths.add(path)
+        self._state_store.add_path(path)
         return path
 
     def _store_dependency(self, dependency_path, fileobj, target_type):
@@ -499,13 +555,68 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         except Exception:
             raise
 
+    def _link_from_cache(self, cached_path: str, dependency_path: str) -> bool:
+        """
+        Hard links the contents of a dependency from cached_path, the same contents in another
+        cached dependency, to dependency_path. Returns whether this succeeded, e.g. not if the
+        cached dependency was removed in the meantime.
+        """
+        try:
+            if os.path.lexists(dependency_path):
+                remove_path(dependency_path)
+            if os.path.islink(cached_path) or not os.path.exists(cached_path):
+                return False
+            hardlink_path(cached_path, dependency_path)
+            logger.info('Linked dependency %s from %s', dependency_path, cached_path)
+            return True
+        except OSError:
+            logger.warning(
+                'Failed to link %s from %s, downloading it instead',
+                dependency_path,
+                cached_path,
+                exc_info=True,
+            )
+            if os.path.lexists(dependency_path):
+                remove_path(dependency_path)
+            return False
+
+    def _find_cached_parent(self, dependency_key: DependencyKey) -> Optional[str]:
+        """
+        Returns the path of the contents of the dependency inside a ready dependency on the same
+        bundle that contains it (e.g. the whole bundle, or a parent directory), or None if there
+        is no such dependency.
+        NOT NFS-SAFE - Caller should acquire self._state_lock before calling this method.
+        """
+        parent_path = (
+            os.path.normpath(dependency_key.parent_path) if dependency_key.parent_path else ''
+        )
+        best = None
+        ready_dependencies = self._state_store.get_all(
+            stage=DependencyStage.READY, parent_uuid=dependency_key.parent_uuid
+        )
+        for dep_key, dep_state in ready_dependencies.items():
+            cached_path = os.path.normpath(dep_key.parent_path) if dep_key.parent_path else ''
+            if cached_path and not parent_path.startswith(cached_path + os.path.sep):
+                continue
+            if best is None or len(cached_path) > len(best[0]):
+                best = (cached_path, dep_state.path)
+        if best is None:
+            return None
+        cached_path, path = best
+        return os.path.join(
+            self.dependencies_dir, path, os.path.relpath(parent_path or '.', cached_path or '.')
+        )
+
     @property
     def all_dependencies(self) -> List[DependencyKey]:
         with self._state_lock:
-            dependencies: Dict[DependencyKey, DependencyState] = self._fetch_dependencies(
-                default={'dependencies': {}, 'paths': set()}
-            )
-            return list(dependencies.keys())
+            try:
+                return self._state_store.keys()
+            except sqlite3.Error:
+                logger.warning(
+                    "Failed to read the dependencies from the state store", exc_info=True
+                )
+                return []
 
     def _transition_from_DOWNLOADING(self, dependency_state: DependencyState):
         """
@@ -514,31 +625,65 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         """
         assert self._state_lock.is_locked
 
-        def download():
+        def update_state_and_check_killed(bytes_downloaded):
             """
-            Runs in a separate thread. Only one worker should be running this in a thread at a time.
+            Callback method for bundle service client updates dependency state and
+            raises DownloadAbortedException if download is killed by dep. manager
+
+            Note: This function needs to be fast, since it's called every time fileobj.read is called.
+                  Therefore, we keep a copy of the state in memory (self._downloading) and copy over
+                  non-critical fields (last_downloading, size_bytes and message) when the download transition
+                  function is executed.
             """
+            state = self._downloading[dependency_state.dependency_key]['state']
+            if state.killed:
+                raise DownloadAbortedException("Aborted by user")
+            self._downloading[dependency_state.dependency_key]['state'] = state._replace(
+                last_downloading=time.time(),
+                size_bytes=bytes_downloaded,
+                message=f"Downloading dependency: {str(bytes_downloaded)} downloaded",
+            )
 
-            def update_state_and_check_killed(bytes_downloaded):
-                """
-                Callback method for bundle service client updates dependency state and
-                raises DownloadAbortedException if download is killed by dep. manager
-
-                Note: This function needs to be fast, since it's called every time fileobj.read is called.
-                      Therefore, we keep a copy of the state in memory (self._downloading) and copy over
-                      non-critical fields (last_downloading, size_bytes and message) when the download transition
-                      function is executed.
-                """
-                state = self._downloading[dependency_state.dependency_key]['state']
-                if state.killed:
-                    raise DownloadAbortedException("Aborted by user")
-                self._downloading[dependency_state.dependency_key]['state'] = state._replace(
-                    last_downloading=time.time(),
-                    size_bytes=bytes_downloaded,
-                    message=f"Downloading dependency: {str(bytes_downloaded)} downloaded",
+        def download(cached_path):
+            """
+            Runs in a separate thread. Only one worker should be running this in a thread at a time.
+            If cached_path is set, the dependency is linked from there instead of being downloaded.
+            """
+            dependency_key = dependency_state.dependency_key
+            dependency_path = os.path.join(self.dependencies_dir, dependency_state.path)
+            if cached_path is not None and self._link_from_cache(cached_path, dependency_path):
+                self._downloading[dependency_key]['linked_size'] = get_path_size(dependency_path)
+                self._downloading[dependency_key]['success'] = True
+                return
+
+            def should_abort():
+                state = self._downloading[dependency_key]['state']
+                if state is None:
+                    return self._stop
+                # Keep the download from looking stale to the other workers that share the work
+                # directory while it waits for a slot, so that they don't start downloading it too.
+                self._downloading[dependency_key]['state'] = state._replace(
+                    last_downloading=time.time()
                 )
+                return self._stop or state.killed
 
-            dependency_path = os.path.join(self.dependencies_dir, dependency_state.path)
+            try:
+                self._download_slots.acquire(dependency_key, should_abort)
+            except DownloadAbortedException as e:
+                self._downloading[dependency_key]['success'] = False
+                self._downloading[dependency_key][
+                    'failure_message'
+                ] = f"Dependency download failed: {e} "
+                return
+            try:
+                download_contents(dependency_path)
+            finally:
+                self._download_slots.release(dependency_key)
+
+        def download_contents(dependency_path):
+            """
+            Downloads the dependency to dependency_path, retrying on failure.
+            """
             logger.debug('Downloading dependency %s', dependency_state.dependency_key)
 
             attempt = 0
@@ -618,10 +763,16 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
                 )
 
             self._downloading.add_if_new(
-                dependency_state.dependency_key, threading.Thread(target=download, args=[])
+                dependency_state.dependency_key,
+                threading.Thread(
+                    target=download,
+                    args=[self._find_cached_parent(dependency_state.dependency_key)],
+                ),
+            )
+            dependency_state = dependency_state._replace(
+                downloading_by=self._id, last_downloading=now
             )
             self._downloading[dependency_state.dependency_key]['state'] = dependency_state
-            dependency_state = dependency_state._replace(downloading_by=self._id)
 
         # If there is already another worker downloading the dependency,
         # just return the dependency state as downloading is in progress.
@@ -641,6 +792,11 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
                 f"is downloading dependency: {dependency_state.dependency_key}"
             )
             state = self._downloading[dependency_state.dependency_key]['state']
+            if dependency_state.killed and not state.killed:
+                # Let the download thread know that no run needs the dependency anymore.
+                self._downloading[dependency_state.dependency_key]['state'] = state._replace(
+                    killed=True
+                )
             # Copy over the values of the non-critical fields of the state in memory
             # that is being updated by the download thread.
             return dependency_state._replace(
@@ -653,6 +809,9 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         # assigned to the current worker. Check if the download finished.
         success: bool = self._downloading[dependency_state.dependency_key]['success']
         failure_message: str = self._downloading[dependency_state.dependency_key]['failure_message']
+        linked_size: Optional[int] = self._downloading[dependency_state.dependency_key][
+            'linked_size'
+        ]
 
         dependency_state = dependency_state._replace(downloading_by=None)
         self._downloading.remove(dependency_state.dependency_key)
@@ -661,11 +820,17 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
         )
 
         if success:
+            if linked_size is not None:
+                return dependency_state._replace(
+                    stage=DependencyStage.READY,
+                    size_bytes=linked_size,
+                    message="Linked from a cached dependency",
+                )
             return dependency_state._replace(
                 stage=DependencyStage.READY, message="Download complete"
             )
         else:
-            self._paths.remove(dependency_state.path)
+            self._state_store.remove_path(dependency_state.path)
             logger.error(
                 f"Dependency {dependency_state.dependency_key} download failed: {failure_message}"
             )
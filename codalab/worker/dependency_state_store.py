@@ -0,0 +1,222 @@
+"""
+SQLite store for the state of the DependencyManager: the state of each dependency and the paths
+used to store them, with an index on the last time each dependency was used, so that single
+dependencies can be read and updated, and the least recently used ones found, without loading
+and rewriting the state of all the dependencies.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
+
+from codalab.worker.bundle_state import DependencyKey
+from codalab.worker.fsm import DependencyStage
+
+logger = logging.getLogger(__name__)
+
+DependencyState = namedtuple(
+    'DependencyState',
+    # downloading_by - worker id of which worker is downloading / has downloaded the dependency
+    'stage downloading_by dependency_key path size_bytes dependents last_used last_downloading message killed',
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dependency (
+    parent_uuid TEXT NOT NULL,
+    parent_path TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    downloading_by TEXT,
+    path TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    dependents TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    last_downloading REAL NOT NULL,
+    message TEXT,
+    killed INTEGER NOT NULL,
+    PRIMARY KEY (parent_uuid, parent_path)
+);
+CREATE INDEX IF NOT EXISTS dependency_stage_last_used ON dependency (stage, last_used);
+CREATE TABLE IF NOT EXISTS dependency_path (path TEXT PRIMARY KEY);
+'''
+
+COLUMNS = (
+    'parent_uuid, parent_path, stage, downloading_by, path, size_bytes, dependents, last_used, '
+    'last_downloading, message, killed'
+)
+
+
+class DependencyStateStore(object):
+    """
+    Stores DependencyStates in an SQLite database. Each method runs in its own transaction,
+    unless it is called in a transaction() block, which makes all the changes in the block
+    atomic.
+
+    The database is shared by the dependency managers of all the workers that share the work
+    directory, so callers must hold the NFSLock of the dependency manager, as they did for the
+    JSON state file: SQLite's own locking is not reliable over NFS.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        # Transactions are started explicitly, see transaction().
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth > 0:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._depth = 1
+            try:
+                yield
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            else:
+                self._connection.execute('COMMIT')
+            finally:
+                self._depth = 0
+
+    def _query(self, sql: str, params=()) -> List[tuple]:
+        with self.transaction():
+            return self._connection.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _to_state(row) -> DependencyState:
+        return DependencyState(
+            stage=row[2],
+            downloading_by=row[3],
+            dependency_key=DependencyKey(parent_uuid=row[0], parent_path=row[1]),
+            path=row[4],
+            size_bytes=row[5],
+            dependents=set(json.loads(row[6])),
+            last_used=row[7],
+            last_downloading=row[8],
+            message=row[9],
+            killed=bool(row[10]),
+        )
+
+    def get(self, dependency_key: DependencyKey) -> Optional[DependencyState]:
+        """Returns the state of the dependency, or None if there is none."""
+        rows = self._query(
+            'SELECT %s FROM dependency WHERE parent_uuid = ? AND parent_path = ?' % COLUMNS,
+            (dependency_key.parent_uuid, dependency_key.parent_path),
+        )
+        return self._to_state(rows[0]) if rows else None
+
+    def get_all(
+        self, stage: Optional[str] = None, parent_uuid: Optional[str] = None
+    ) -> Dict[DependencyKey, DependencyState]:
+        """
+        Returns the states of all the dependencies, or only of those in the given stage and/or
+        on the bundle with the given UUID, keyed by DependencyKey.
+        """
+        clauses, params = [], []
+        if stage is not None:
+            clauses.append('stage = ?')
+            params.append(stage)
+        if parent_uuid is not None:
+            clauses.append('parent_uuid = ?')
+            params.append(parent_uuid)
+        sql = 'SELECT %s FROM dependency' % COLUMNS
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        states = (self._to_state(row) for row in self._query(sql, params))
+        return {state.dependency_key: state for state in states}
+
+    def keys(self) -> List[DependencyKey]:
+        return [
+            DependencyKey(parent_uuid=row[0], parent_path=row[1])
+            for row in self._query('SELECT parent_uuid, parent_path FROM dependency')
+        ]
+
+    def put(self, state: DependencyState):
+        """Adds or replaces the state of a dependency."""
+        with self.transaction():
+            self._connection.execute(
+                'INSERT OR REPLACE INTO dependency (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+                % COLUMNS,
+                (
+                    state.dependency_key.parent_uuid,
+                    state.dependency_key.parent_path,
+                    state.stage,
+                    state.downloading_by,
+                    state.path,
+                    state.size_bytes,
+                    json.dumps(sorted(state.dependents)),
+                    state.last_used,
+                    state.last_downloading,
+                    state.message,
+                    int(state.killed),
+                ),
+            )
+
+    def delete(self, dependency_key: DependencyKey):
+        with self.transaction():
+            self._connection.execute(
+                'DELETE FROM dependency WHERE parent_uuid = ? AND parent_path = ?',
+                (dependency_key.parent_uuid, dependency_key.parent_path),
+            )
+
+    def paths(self) -> Set[str]:
+        return set(row[0] for row in self._query('SELECT path FROM dependency_path'))
+
+    def has_path(self, path: str) -> bool:
+        return bool(self._query('SELECT 1 FROM dependency_path WHERE path = ?', (path,)))
+
+    def add_path(self, path: str):
+        with self.transaction():
+            self._connection.execute('INSERT OR IGNORE INTO dependency_path VALUES (?)', (path,))
+
+    def remove_path(self, path: str):
+        with self.transaction():
+            self._connection.execute('DELETE FROM dependency_path WHERE path = ?', (path,))
+
+    def total_size(self) -> int:
+        """Returns the total size of the dependencies, in bytes."""
+        return self._query('SELECT COALESCE(SUM(size_bytes), 0) FROM dependency')[0][0]
+
+    def serialized_keys_length(self) -> int:
+        """
+        Returns the length of the list of dependency keys that the worker sends to the server
+        when it checks in, serialized as compact JSON: [["<uuid>","<path>"],...].
+        """
+        count, length = self._query(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(parent_uuid) + LENGTH(parent_path)), 0) '
+            'FROM dependency'
+        )[0]
+        return length + 8 * count + 1 if count else 2
+
+    def eviction_candidates(self) -> Iterator[DependencyState]:
+        """
+        Yields the dependencies that may be evicted from the cache, in the order in which they
+        should be: failed dependencies, then ready dependencies that no run depends on, each
+        from the least recently used. Uses the index on (stage, last_used).
+        """
+        for stage in (DependencyStage.FAILED, DependencyStage.READY):
+            rows = self._query(
+                'SELECT %s FROM dependency WHERE stage = ? ORDER BY last_used' % COLUMNS, (stage,)
+            )
+            for row in rows:
+                state = self._to_state(row)
+                if stage == DependencyStage.FAILED or not state.dependents:
+                    yield state
+
+    def close(self):
+        self._connection.close()
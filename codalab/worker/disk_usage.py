@@ -0,0 +1,354 @@
+"""
+Tracks the disk usage of the directories of running bundles.
+
+A single DiskUsageService per worker measures all running bundles on a small thread pool,
+instead of each run walking its whole directory in a thread of its own. Each directory is
+measured with a DirectorySizeTree, which caches the size of every subdirectory and only lists
+the directories whose mtime changed since the last scan, so the cost of a scan scales with
+the number of changes rather than with the number of files. Where the filesystem supports
+project quotas (XFS, or ext4 with the project feature), the service can instead read the usage
+of a directory from the quota of a project assigned to it, which costs a single syscall.
+"""
+import ctypes
+import ctypes.util
+import fcntl
+import logging
+import os
+import stat
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _DirectoryNode(object):
+    """Cached sizes of the entries of a directory."""
+
+    __slots__ = ('mtime_ns', 'size', 'files', 'hot_files', 'children', 'total')
+
+    def __init__(self):
+        self.mtime_ns = None  # type: Optional[int]
+        self.size = 0  # Size of the directory itself
+        self.files = {}  # type: Dict[str, int]  # name -> size of non-directory entries
+        self.hot_files = {}  # type: Dict[str, int]  # name -> mtime_ns of recently modified files
+        self.children = {}  # type: Dict[str, _DirectoryNode]
+        self.total = 0  # Size of the subtree
+
+
+class DirectorySizeTree(object):
+    """
+    Computes the size of a directory like file_util.get_path_size, caching the sizes of its
+    subtrees between calls to update().
+
+    The mtime of a directory only changes when entries are added, removed or renamed in it, so
+    a directory whose mtime is unchanged isn't listed again. Files that are written to don't
+    change the mtime of their directory, so update() also stats the files that were modified
+    within HOT_FILE_SECONDS of the previous scan: files that are being written to keep being
+    re-measured while files that were written once are not. A file that is written to again
+    after being idle for longer is picked up by the next full scan, which runs every
+    FULL_SCAN_INTERVAL_SECONDS and re-measures everything.
+    """
+
+    HOT_FILE_SECONDS = 60
+    FULL_SCAN_INTERVAL_SECONDS = 10 * 60
+
+    def __init__(self, path: str):
+        self.path = path
+        self._root = None  # type: Optional[_DirectoryNode]
+        self._last_full_scan = 0.0
+
+    def update(self) -> int:
+        """Returns the current size of the directory, in bytes."""
+        now = time.time()
+        full = now - self._last_full_scan >= self.FULL_SCAN_INTERVAL_SECONDS
+        if full:
+            self._last_full_scan = now
+        self._root = self._scan(self.path, self._root, full, int(now * 1e9))
+        return self._root.total if self._root else 0
+
+    def _scan(
+        self, path: str, node: Optional[_DirectoryNode], full: bool, now_ns: int
+    ) -> Optional[_DirectoryNode]:
+        try:
+            st = os.lstat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        hot_since_ns = now_ns - int(self.HOT_FILE_SECONDS * 1e9)
+        if node is None:
+            node = _DirectoryNode()
+        if full or st.st_mtime_ns != node.mtime_ns:
+            # Entries were added, removed or renamed: list the directory again. Subdirectories
+            # that are still there keep their cached nodes.
+            files = {}
+            hot_files = {}
+            children = {}
+            try:
+                entries = list(os.scandir(path))
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+            except OSError:
+                # Like get_path_size, ignore directories that can't be listed (e.g. stale handles).
+                logger.warning("Error when listing %s; ignoring the files under it", path)
+                entries = []
+            for entry in entries:
+                try:
+                    entry_st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if stat.S_ISDIR(entry_st.st_mode):
+                    child = self._scan(entry.path, node.children.get(entry.name), full, now_ns)
+                    if child is not None:
+                        children[entry.name] = child
+                else:
+                    files[entry.name] = entry_st.st_size
+                    if entry_st.st_mtime_ns >= hot_since_ns:
+                        hot_files[entry.name] = entry_st.st_mtime_ns
+            node.files = files
+            node.hot_files = hot_files
+            node.children = children
+        else:
+            for name, mtime_ns in list(node.hot_files.items()):
+                try:
+                    file_st = os.lstat(os.path.join(path, name))
+                except FileNotFoundError:
+                    # Removed, which also changes the mtime of the directory on the next scan.
+                    node.files.pop(name, None)
+                    del node.hot_files[name]
+                    continue
+                node.files[name] = file_st.st_size
+                if file_st.st_mtime_ns != mtime_ns:
+                    node.hot_files[name] = file_st.st_mtime_ns
+                elif mtime_ns < hot_since_ns:
+                    del node.hot_files[name]
+            for name, child in list(node.children.items()):
+                updated = self._scan(os.path.join(path, name), child, full, now_ns)
+                if updated is None:
+                    del node.children[name]
+        node.mtime_ns = st.st_mtime_ns
+        node.size = st.st_size
+        node.total = (
+            node.size
+            + sum(node.files.values())
+            + sum(child.total for child in node.children.values())
+        )
+        return node
+
+
+class _FsxAttr(ctypes.Structure):
+    _fields_ = [
+        ('fsx_xflags', ctypes.c_uint32),
+        ('fsx_extsize', ctypes.c_uint32),
+        ('fsx_nextents', ctypes.c_uint32),
+        ('fsx_projid', ctypes.c_uint32),
+        ('fsx_cowextsize', ctypes.c_uint32),
+        ('fsx_pad', ctypes.c_ubyte * 8),
+    ]
+
+
+class _DqBlk(ctypes.Structure):
+    _fields_ = [
+        ('dqb_bhardlimit', ctypes.c_uint64),
+        ('dqb_bsoftlimit', ctypes.c_uint64),
+        ('dqb_curspace', ctypes.c_uint64),
+        ('dqb_ihardlimit', ctypes.c_uint64),
+        ('dqb_isoftlimit', ctypes.c_uint64),
+        ('dqb_curinodes', ctypes.c_uint64),
+        ('dqb_btime', ctypes.c_uint64),
+        ('dqb_itime', ctypes.c_uint64),
+        ('dqb_valid', ctypes.c_uint32),
+    ]
+
+
+class ProjectQuota(object):
+    """
+    Measures the disk usage of a directory with Linux project quotas: the directory is assigned
+    a project ID that is inherited by everything created under it, and its usage is read from
+    the quota of the project. Requires a filesystem mounted with project quotas enabled and the
+    CAP_SYS_ADMIN capability; assign() and usage() raise OSError otherwise.
+
+    Unlike DirectorySizeTree, the usage counts allocated blocks rather than file sizes.
+    """
+
+    FS_IOC_FSGETXATTR = 0x801C581F
+    FS_IOC_FSSETXATTR = 0x401C5820
+    FS_XFLAG_PROJINHERIT = 0x00000200
+    Q_GETQUOTA = 0x800007
+    PRJQUOTA = 2
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    @staticmethod
+    def project_id(key: str) -> int:
+        """Returns the project ID to use for the directory tracked under key."""
+        return zlib.crc32(key.encode()) or 1
+
+    def _set_project_id(self, path: str, project_id: int):
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+        try:
+            attr = _FsxAttr()
+            fcntl.ioctl(fd, self.FS_IOC_FSGETXATTR, attr)
+            attr.fsx_projid = project_id
+            if stat.S_ISDIR(os.fstat(fd).st_mode):
+                attr.fsx_xflags |= self.FS_XFLAG_PROJINHERIT
+            fcntl.ioctl(fd, self.FS_IOC_FSSETXATTR, attr)
+        finally:
+            os.close(fd)
+
+    def assign(self, path: str, project_id: int):
+        """Assigns project_id to the directory at path and the entries that already exist in it.
+        Entries created later inherit the project ID."""
+        self._set_project_id(path, project_id)
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in dirnames + filenames:
+                entry_path = os.path.join(dirpath, name)
+                if not os.path.islink(entry_path):
+                    self._set_project_id(entry_path, project_id)
+
+    @staticmethod
+    def _get_device(path: str) -> str:
+        """Returns the device of the filesystem that path is on."""
+        path = os.path.realpath(path)
+        device, mount_point = None, ''
+        with open('/proc/self/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if (path == fields[1] or path.startswith(fields[1].rstrip('/') + '/')) and len(
+                    fields[1]
+                ) >= len(mount_point):
+                    device, mount_point = fields[0], fields[1]
+        if device is None:
+            raise OSError('Unable to find the filesystem of %s' % path)
+        return device
+
+    def usage(self, path: str, project_id: int) -> int:
+        """Returns the number of bytes used by project_id on the filesystem of path."""
+        dqblk = _DqBlk()
+        cmd = (self.Q_GETQUOTA << 8) | self.PRJQUOTA
+        if self._libc.quotactl(
+            cmd, self._get_device(path).encode(), project_id, ctypes.byref(dqblk)
+        ):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return dqblk.dqb_curspace
+
+
+class _TrackedPath(object):
+    def __init__(self, key: str, path: str):
+        self.key = key
+        self.path = path
+        self.tree = DirectorySizeTree(path)
+        self.project_id = None  # type: Optional[int]
+        self.size = 0
+        self.next_scan = 0.0
+        self.scanning = False
+
+
+class DiskUsageService(object):
+    """
+    Measures the disk usage of the directories registered with track() on a pool of
+    num_threads threads, shared by all runs on the worker.
+
+    Like the per-run threads it replaces, the service spends at most 10% of the time measuring
+    any one directory: a directory is measured again max(10 * duration of the last scan,
+    MIN_SCAN_INTERVAL_SECONDS) after its last scan finished.
+
+    If use_project_quotas is set, each directory is assigned a project quota when it's tracked
+    and measured with ProjectQuota, falling back to DirectorySizeTree if that fails.
+    """
+
+    MIN_SCAN_INTERVAL_SECONDS = 1.0
+
+    def __init__(self, num_threads: int = 2, use_project_quotas: bool = False):
+        self._num_threads = num_threads
+        self._project_quota = ProjectQuota() if use_project_quotas else None
+        self._tracked = {}  # type: Dict[str, _TrackedPath]
+        self._cond = threading.Condition()
+        self._stop = False
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        self._scheduler = None  # type: Optional[threading.Thread]
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(self._num_threads)
+        self._scheduler = threading.Thread(target=self._schedule_loop, daemon=True)
+        self._scheduler.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._scheduler:
+            self._scheduler.join()
+            self._executor.shutdown(wait=True)
+
+    def track(self, key: str, path: str):
+        """Starts measuring the directory at path under key. Does nothing if key is tracked."""
+        with self._cond:
+            if key not in self._tracked:
+                self._tracked[key] = _TrackedPath(key, path)
+                self._cond.notify_all()
+
+    def untrack(self, key: str):
+        """Stops measuring the directory tracked under key."""
+        with self._cond:
+            self._tracked.pop(key, None)
+
+    def get(self, key: str) -> int:
+        """Returns the last measured disk usage of the directory tracked under key, in bytes,
+        or 0 if it isn't tracked or hasn't been measured yet."""
+        with self._cond:
+            tracked = self._tracked.get(key)
+            return tracked.size if tracked else 0
+
+    def _schedule_loop(self):
+        with self._cond:
+            while not self._stop:
+                now = time.time()
+                next_scan = now + self.MIN_SCAN_INTERVAL_SECONDS
+                for tracked in self._tracked.values():
+                    if tracked.scanning:
+                        continue
+                    if tracked.next_scan <= now:
+                        tracked.scanning = True
+                        self._executor.submit(self._scan, tracked)
+                    else:
+                        next_scan = min(next_scan, tracked.next_scan)
+                self._cond.wait(next_scan - now)
+
+    def _measure(self, tracked: _TrackedPath) -> int:
+        if self._project_quota is not None:
+            try:
+                if tracked.project_id is None:
+                    project_id = ProjectQuota.project_id(tracked.key)
+                    self._project_quota.assign(tracked.path, project_id)
+                    tracked.project_id = project_id
+                return self._project_quota.usage(tracked.path, tracked.project_id)
+            except OSError as e:
+                logger.warning(
+                    'Unable to use project quotas to measure %s, falling back to scanning it: %s',
+                    tracked.path,
+                    e,
+                )
+                tracked.project_id = None
+                self._project_quota = None
+        return tracked.tree.update()
+
+    def _scan(self, tracked: _TrackedPath):
+        start_time = time.time()
+        try:
+            size = self._measure(tracked)
+        except Exception:
+            logger.error(traceback.format_exc())
+            size = tracked.size
+        end_time = time.time()
+        with self._cond:
+            tracked.size = size
+            tracked.scanning = False
+            tracked.next_scan = end_time + max(
+                (end_time - start_time) * 10, self.MIN_SCAN_INTERVAL_SECONDS
+            )
+            self._cond.notify_all()
@@ -15,6 +15,7 @@ import datetime
 import re
 import traceback
 from codalab.common import BundleRuntime
+from codalab.worker.container_stats import ContainerStatsCollector
 from codalab.worker.runtime import Runtime
 
 MIN_API_VERSION = '1.17'
@@ -117,6 +118,17 @@ class DockerRuntime(Runtime):
 
     def __init__(self):
         self.client = docker.from_env(timeout=DEFAULT_DOCKER_TIMEOUT)
+        # Started the first time a container is looked up, so that DockerRuntime objects that
+        # are only used to query GPUs don't start its threads.
+        self.stats_collector = ContainerStatsCollector(self.client)
+
+    def _get_container_state(self, container_id: str):
+        """Returns the cached ContainerState of the container, or None if it doesn't exist."""
+        self.stats_collector.start()
+        try:
+            return self.stats_collector.track(container_id)
+        except docker.errors.NotFound:
+            return None
 
     @wrap_exception('Unable to use Docker')
     def test_version(self):
@@ -298,96 +310,33 @@ class DockerRuntime(Runtime):
     @wrap_exception("Can't get container stats")
     def get_container_stats(self, container_id: str):
         # We don't use the stats API since it doesn't seem to be reliable, and
-        # is definitely slow. This doesn't work on Mac.
-        cgroup = None
-        for path in ['/sys/fs/cgroup', '/cgroup']:
-            if os.path.exists(path):
-                cgroup = path
-                break
-        if cgroup is None:
+        # is definitely slow. The cgroups of all containers are sampled in the background
+        # by self.stats_collector. This doesn't work on Mac.
+        state = self._get_container_state(container_id)
+        if state is None or state.stats is None:
             return {}
-
-        stats = {}
-
-        # Get CPU usage
-        try:
-            cpu_path = os.path.join(cgroup, 'cpuacct/docker', container_id, 'cpuacct.stat')
-            with open(cpu_path) as f:
-                for line in f:
-                    key, value = line.split(' ')
-                    # Convert jiffies to seconds
-                    if key == 'user':
-                        stats['time_user'] = int(value) / 100.0
-                    elif key == 'system':
-                        stats['time_system'] = int(value) / 100.0
-        except Exception:
-            pass
-
-        # Get memory usage
-        try:
-            memory_path = os.path.join(
-                cgroup, 'memory/docker', container_id, 'memory.usage_in_bytes'
-            )
-            with open(memory_path) as f:
-                stats['memory'] = int(f.read())
-        except Exception:
-            pass
-
+        stats = {'memory': state.stats.memory}
+        if state.stats.time_user is not None:
+            stats['time_user'] = state.stats.time_user
+        if state.stats.time_system is not None:
+            stats['time_system'] = state.stats.time_system
         return stats
 
     @wrap_exception('Unable to check Docker API for container')
     def get_container_stats_with_docker_stats(self, container_id: str):
-        """Returns the cpu usage and memory limit of a container using the Docker Stats API."""
-        if self.container_exists(container_id):
-            try:
-                container_stats: dict = self.client.containers.get(container_id).stats(stream=False)
-
-                cpu_usage: float = self.get_cpu_usage(container_stats)
-                memory_usage: float = self.get_memory_usage(container_stats)
-
-                return cpu_usage, memory_usage
-            except docker.errors.NotFound:
-                raise
-        else:
+        """Returns the cpu usage and memory usage (as a fraction of the memory limit) of a
+        container, from the last sample of its cgroup."""
+        state = self._get_container_state(container_id)
+        if state is None or state.stats is None:
             return 0.0, 0
-
-    def get_cpu_usage(self, container_stats: dict) -> float:
-        """Calculates CPU usage from container stats returned from the Docker Stats API.
-        The way of calculation comes from here:
-        https://www.jcham.com/2016/02/09/calculating-cpu-percent-and-memory-percentage-for-containers/
-        That method is also based on how the docker client calculates it:
-        https://github.com/moby/moby/blob/131e2bf12b2e1b3ee31b628a501f96bbb901f479/api/client/stats.go#L309"""
-        try:
-            cpu_delta: int = (
-                container_stats['cpu_stats']['cpu_usage']['total_usage']
-                - container_stats['precpu_stats']['cpu_usage']['total_usage']
-            )
-            system_delta: int = (
-                container_stats['cpu_stats']['system_cpu_usage']
-                - container_stats['precpu_stats']['system_cpu_usage']
-            )
-            if system_delta > 0 and cpu_delta > 0:
-                cpu_usage: float = float(cpu_delta / system_delta) * float(
-                    len(container_stats['cpu_stats']['cpu_usage']['percpu_usage'])
-                )
-                return cpu_usage
-            return 0.0
-        except KeyError:
-            # The stats returned may be missing some keys if the bundle is not fully ready or has exited.
-            # We can just skip for now and wait until this function is called the next time.
-            return 0.0
-
-    def get_memory_usage(self, container_stats: dict) -> float:
-        """Takes a dictionary of container stats returned by docker stats, returns memory usage"""
-        try:
-            memory_limit: float = container_stats['memory_stats']['limit']
-            current_memory_usage: float = container_stats['memory_stats']['usage']
-            return current_memory_usage / memory_limit
-        except KeyError:
-            return 0
+        return state.stats.cpu_usage, state.stats.memory_usage
 
     @wrap_exception('Unable to check Docker API for container')
     def container_exists(self, container_id):
+        if self.stats_collector.events_healthy:
+            state = self.stats_collector.get(container_id)
+            if state is not None and state.tracked:
+                return state.exists
         try:
             self.client.containers.get(container_id)
             return True
@@ -396,6 +345,14 @@ class DockerRuntime(Runtime):
 
     @wrap_exception('Unable to check Docker container status')
     def check_finished(self, container_id: str) -> Tuple[bool, Optional[str], Optional[str]]:
+        # Containers are only inspected once they have died, unless the Docker events stream
+        # is down. The cached state is refreshed every INSPECT_INTERVAL_SECONDS, so runs still
+        # finish if the stream stalls without failing.
+        state = self._get_container_state(container_id)
+        if state is None:
+            return (True, None, 'Docker container not found')
+        if self.stats_collector.events_healthy and not state.finished:
+            return (False, None, None)
         try:
             container = self.client.containers.get(container_id)
         except docker.errors.NotFound:
@@ -419,6 +376,15 @@ class DockerRuntime(Runtime):
 
     @wrap_exception('Unable to check Docker container running time')
     def get_container_running_time(self, container_id: str):
+        state = self._get_container_state(container_id)
+        if state is None:
+            # This usually happens when container gets accidentally removed or deleted
+            return DEFAULT_CONTAINER_RUNNING_TIME
+        if self.stats_collector.events_healthy:
+            if state.started_at is None:
+                return DEFAULT_CONTAINER_RUNNING_TIME
+            end_time = state.finished_at if state.finished else datetime.datetime.now(tz.tzutc())
+            return (end_time - state.started_at).total_seconds()
         # Get the current container
         try:
             container = self.client.containers.get(container_id)
@@ -450,6 +416,7 @@ class DockerRuntime(Runtime):
         container.kill()
 
     def remove(self, container_id: str):
+        self.stats_collector.untrack(container_id)
         try:
             container = self.client.containers.get(container_id)
         except docker.errors.NotFound:
@@ -1,6 +1,7 @@
 from contextlib import closing
 from io import BytesIO, TextIOWrapper
 import gzip
+import io
 import logging
 import os
 import shutil
@@ -8,12 +9,18 @@ import subprocess
 import bz2
 import hashlib
 import stat
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from codalab.common import BINARY_PLACEHOLDER, UsageError
 from codalab.common import parse_linked_bundle_url
 from codalab.worker.un_gzip_stream import BytesBuffer
 from codalab.worker.tar_subdir_stream import TarSubdirStream
 from codalab.worker.tar_file_stream import TarFileStream
+from codalab.worker.index_cache import get_index_cache
 from apache_beam.io.filesystem import CompressionTypes
 from apache_beam.io.filesystems import FileSystems
 import tempfile
@@ -28,6 +35,21 @@ NONE_PLACEHOLDER = '<none>'
 # Patterns to always ignore when zipping up directories
 ALWAYS_IGNORE_PATTERNS = ['.git', '._*', '__MACOSX']
 
+# Number of compressed bytes between the gzip seek points that are stored in the index of an
+# archive on Blob Storage when it is uploaded. Reading from a given offset of an archive starts
+# decompressing at the seek point before it.
+GZIP_SEEK_POINT_SPACING = 4 * 1024 * 1024
+
+# Size of the read buffers used when opening an archive on Blob Storage with its index. Each seek
+# discards them, so a small read from an archive fetches and decompresses about this much data
+# past the seek point, instead of the 16 MiB that Beam and indexed_gzip read ahead by default.
+ARCHIVE_READ_BUFFER_SIZE = 1024 * 1024
+
+# Compression level and number of threads used by GzipStream, which compresses blocks of a
+# stream in parallel.
+GZIP_COMPRESSION_LEVEL = int(os.environ.get('CODALAB_GZIP_LEVEL') or 6)
+GZIP_NUM_THREADS = int(os.environ.get('CODALAB_GZIP_THREADS') or os.cpu_count() or 1)
+
 
 def get_tar_version_output():
     """
@@ -65,7 +87,8 @@ def tar_gzip_directory(
                       the directory structure are excluded.
     ignore_file: Name of the file where exclusion patterns are read from.
     """
-    args = ['tar', 'czf', '-', '-C', directory_path]
+    # The archive is compressed by GzipStream, which uses several cores, rather than by tar.
+    args = ['tar', 'cf', '-', '-C', directory_path]
 
     # If the BSD tar library is being used, append --disable-copy to prevent creating ._* files
     if 'bsdtar' in get_tar_version_output():
@@ -90,7 +113,7 @@ def tar_gzip_directory(
     args.append('.')
     try:
         proc = subprocess.Popen(args, stdout=subprocess.PIPE)
-        return proc.stdout
+        return GzipStream(proc.stdout)
     except subprocess.CalledProcessError as e:
         raise IOError(e.output)
 
@@ -201,21 +224,43 @@ class OpenIndexedArchiveFile(object):
     needing to download the entire archive file.
 
     Returns the SQLiteIndexedTar object.
+
+    By default, the index is opened read-only from the local index cache, so opening the same
+    bundle again doesn't download its index again. If writable is True, the index is copied
+    into a private temporary file instead, which can be modified.
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, writable: bool = False):
         self.f = FileSystems.open(path, compression_type=CompressionTypes.UNCOMPRESSED)
+        if isinstance(self.f, io.BufferedReader):
+            # Fetch ranges of ARCHIVE_READ_BUFFER_SIZE bytes from Blob Storage after each seek.
+            self.f = io.BufferedReader(self.f.detach(), buffer_size=ARCHIVE_READ_BUFFER_SIZE)
         self.path = path
-        with tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False) as index_fileobj:
-            self.index_file_name = index_fileobj.name
+        self.writable = writable
+        linked_bundle_path = parse_linked_bundle_url(self.path)
+        index_path = linked_bundle_path.index_path
+
+        def fetch_index(index_fileobj):
             shutil.copyfileobj(
-                FileSystems.open(
-                    parse_linked_bundle_url(self.path).index_path,
-                    compression_type=CompressionTypes.UNCOMPRESSED,
-                ),
+                FileSystems.open(index_path, compression_type=CompressionTypes.UNCOMPRESSED),
                 index_fileobj,
             )
 
+        if writable:
+            self.index_cache_entry = None
+            with tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False) as index_fileobj:
+                self.index_file_name = index_fileobj.name
+                fetch_index(index_fileobj)
+        else:
+            # Cached indexes are downloaded again if the checksum of the index file on
+            # Blob Storage (its etag on Azure) changes. Looking up the checksum is still one
+            # metadata request per open. It isn't cached, since update_file_size() rewrites
+            # the index and other processes must not read the archive with the old one.
+            self.index_cache_entry = get_index_cache().acquire(
+                linked_bundle_path.bundle_uuid, FileSystems.checksum(index_path), fetch_index
+            )
+            self.index_file_name = self.index_cache_entry.path
+
     def __enter__(self) -> SQLiteIndexedTar:
         return SQLiteIndexedTar(
             fileObject=self.f,
@@ -223,10 +268,16 @@ class OpenIndexedArchiveFile(object):
             writeIndex=False,
             clearIndexCache=False,
             indexFilePath=self.index_file_name,
+            readOnlyIndex=not self.writable,
+            gzipSeekPointSpacing=GZIP_SEEK_POINT_SPACING,
+            gzipBufferSize=ARCHIVE_READ_BUFFER_SIZE,
         )
 
     def __exit__(self, type, value, traceback):
-        os.remove(self.index_file_name)
+        if self.index_cache_entry is not None:
+            self.index_cache_entry.release()
+        else:
+            os.remove(self.index_file_name)
 
 
 class OpenFile(object):
@@ -309,25 +360,91 @@ class OpenFile(object):
         pass
 
 
+_gzip_thread_pool = None
+_gzip_thread_pool_lock = threading.Lock()
+
+
+def _get_gzip_thread_pool() -> ThreadPoolExecutor:
+    """Returns the thread pool shared by all GzipStreams of this process."""
+    global _gzip_thread_pool
+    with _gzip_thread_pool_lock:
+        if _gzip_thread_pool is None:
+            _gzip_thread_pool = ThreadPoolExecutor(
+                GZIP_NUM_THREADS, thread_name_prefix='gzip-stream'
+            )
+        return _gzip_thread_pool
+
+
+def _deflate_block(block: bytes, dictionary: bytes, level: int) -> bytes:
+    """Compresses block into raw deflate data that can be appended to the deflate data of the
+    blocks before it, given the last 32 KiB of those blocks as dictionary."""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # A sync flush ends the data on a byte boundary without marking it as the last block.
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
 class GzipStream(BytesIO):
     """A stream that gzips a file in chunks.
+
+    Like pigz, the file is split into blocks of BLOCK_SIZE bytes that are compressed in parallel
+    on a thread pool (zlib releases the GIL while it compresses). Each block is primed with the
+    last 32 KiB of the block before it, and the compressed blocks are concatenated into a
+    single gzip member, so the output is a regular gzip file with about the same compression
+    ratio as gzip's.
     """
 
-    def __init__(self, fileobj: IO[bytes]):
+    BLOCK_SIZE = 1024 * 1024
+    # Size of the window of a deflate stream, which a block can refer back to.
+    WINDOW_SIZE = 32 * 1024
+
+    def __init__(self, fileobj: IO[bytes], level: Optional[int] = None):
         self.__input = fileobj
         self.__buffer = BytesBuffer()
-        self.__gzip = gzip.GzipFile(None, mode='wb', fileobj=self.__buffer)
         self.__size = 0
         self.__input_read_size = 0
+        self.__level = GZIP_COMPRESSION_LEVEL if level is None else level
+        # Blocks being compressed, in order. At most twice as many as there are threads are
+        # buffered, so that the input is never read too far ahead of the output.
+        self.__pending: deque = deque()
+        self.__max_pending = 2 * GZIP_NUM_THREADS
+        self.__dictionary = b''
+        self.__crc = 0
+        self.__input_eof = False
+        self.__finished = False
+        # Header of a gzip member without a file name or modification time (like gzip -n).
+        self.__buffer.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', 0) + b'\x00\xff')
+
+    def _submit_block(self):
+        """Reads the next block of the input and starts compressing it."""
+        block = self.__input.read(self.BLOCK_SIZE)
+        if not block:
+            self.__input_eof = True
+            return
+        self.__input_read_size += len(block)
+        self.__crc = zlib.crc32(block, self.__crc)
+        self.__pending.append(
+            _get_gzip_thread_pool().submit(_deflate_block, block, self.__dictionary, self.__level)
+        )
+        self.__dictionary = (self.__dictionary + block[-self.WINDOW_SIZE :])[-self.WINDOW_SIZE :]
 
     def _fill_buf_bytes(self, num_bytes=None):
-        while num_bytes is None or len(self.__buffer) < num_bytes:
-            s = self.__input.read(num_bytes)
-            self.__input_read_size += len(s)
-            if not s:
-                self.__gzip.close()
-                break
-            self.__gzip.write(s)  # gzip the current file
+        while not self.__finished and (num_bytes is None or len(self.__buffer) < num_bytes):
+            while not self.__input_eof and len(self.__pending) < self.__max_pending:
+                self._submit_block()
+            if self.__pending:
+                self.__buffer.write(self.__pending.popleft().result())
+            else:
+                # Last (empty) block, followed by the gzip trailer.
+                self.__buffer.write(
+                    zlib.compressobj(self.__level, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+                )
+                self.__buffer.write(
+                    struct.pack('<II', self.__crc, self.__input_read_size & 0xFFFFFFFF)
+                )
+                self.__finished = True
 
     def read(self, num_bytes=None):
         try:
@@ -363,8 +480,8 @@ class GzipStream(BytesIO):
 def gzip_file(file_path: str) -> IO[bytes]:
     """
     Returns a file-like object containing the gzipped version of the given file.
-    Note: For right now, it's important for gzip to run in a separate process,
-    otherwise things on CodaLab grind to a halt!
+    Note: the file is compressed on GzipStream's thread pool, outside of the GIL, so that
+    gzipping doesn't make things on CodaLab grind to a halt.
     """
 
     if parse_linked_bundle_url(file_path).uses_beam:
@@ -374,14 +491,7 @@ def gzip_file(file_path: str) -> IO[bytes]:
         except Exception as e:
             raise IOError(e)
 
-    args = ['gzip', '-c', '-n', file_path]
-    try:
-        proc = subprocess.Popen(args, stdout=subprocess.PIPE)
-        if proc.stdout is None:
-            raise IOError("Stdout is empty")
-        return proc.stdout
-    except subprocess.CalledProcessError as e:
-        raise IOError(e.output)
+    return GzipStream(open(file_path, 'rb'))
 
 
 def un_bz2_file(source, dest_path):
@@ -605,6 +715,19 @@ def remove_path(path):
         FileSystems.delete([path])
 
 
+def hardlink_path(source_path, dest_path):
+    """
+    Recreates the file or directory at source_path at dest_path, hard linking every file to the
+    file under source_path instead of copying its contents. Symlinks are copied as symlinks.
+    Both paths must be on the same file system, and the linked files must not be modified in
+    place, since they share their contents.
+    """
+    if os.path.isdir(source_path) and not os.path.islink(source_path):
+        shutil.copytree(source_path, dest_path, symlinks=True, copy_function=os.link)
+    else:
+        os.link(source_path, dest_path, follow_symlinks=False)
+
+
 def path_is_parent(parent_path, child_path):
     """
     Given a parent_path and a child_path, determine if the child path
@@ -650,7 +773,7 @@ def update_file_size(bundle_path, file_size):
         parse_linked_bundle_url(bundle_path).uses_beam
         and not parse_linked_bundle_url(bundle_path).is_archive_dir
     ):
-        with OpenIndexedArchiveFile(bundle_path) as tf:
+        with OpenIndexedArchiveFile(bundle_path, writable=True) as tf:
             # tf is a SQLiteTar file, which is a copy of original index file
             finfo = tf._getFileInfoRow('/contents')
             finfo = dict(finfo)
@@ -671,3 +794,5 @@ def update_file_size(bundle_path, file_size):
                     if not to_send:
                         break
                     f.write(to_send)
+        # Drop the old index from the cache right away instead of waiting for the next checksum lookup.
+        get_index_cache().invalidate(parse_linked_bundle_url(bundle_path).bundle_uuid)
@@ -0,0 +1,122 @@
+"""
+Follows a file that is being appended to, such as the stdout of a running bundle, so that its new
+contents can be streamed as soon as they are written instead of being polled for.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from typing import Callable
+
+# inotify events that mean a file may have been written to or replaced.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+
+
+class FileWatcher(object):
+    """
+    Waits for a file to change. Uses inotify on Linux, and otherwise compares the size and
+    modification time of the file every POLL_INTERVAL_SECONDS.
+    """
+
+    POLL_INTERVAL_SECONDS = 0.2
+
+    def __init__(self, path: str):
+        self._path = path
+        self._fd = None
+        self._last_stat = self._stat()
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return
+            if libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK) < 0:
+                os.close(fd)
+                return
+            self._fd = fd
+        except (AttributeError, OSError, TypeError):
+            # No inotify on this platform, so poll.
+            pass
+
+    def _stat(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def wait(self, timeout: float):
+        """Returns when the file may have changed, or after timeout seconds."""
+        if self._fd is not None:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if readable:
+                # Drain the events; callers only need to know that something happened.
+                try:
+                    while os.read(self._fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            return
+        deadline = time.time() + timeout
+        while True:
+            stat = self._stat()
+            if stat != self._last_stat:
+                self._last_stat = stat
+                return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(self.POLL_INTERVAL_SECONDS, remaining))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class FileFollower(object):
+    """
+    File-like object that reads a file from the given offset and, once it reaches the end of the
+    file, waits for more data to be appended to it, like tail -f. read() returns the bytes that
+    are available as soon as there are some, and returns b'' (the end of the stream) once
+    is_running() returns False and the rest of the file has been read, or after timeout seconds.
+    """
+
+    # How often is_running is checked while no data is written.
+    CHECK_INTERVAL_SECONDS = 1.0
+
+    def __init__(self, path: str, offset: int, is_running: Callable[[], bool], timeout: float):
+        self._file = open(path, 'rb')
+        self._file.seek(offset)
+        self._watcher = FileWatcher(path)
+        self._is_running = is_running
+        self._deadline = time.time() + timeout
+        self._done = False
+
+    def read(self, num_bytes: int = -1) -> bytes:
+        if num_bytes is None or num_bytes < 0:
+            num_bytes = 1024 * 1024
+        while True:
+            data = self._file.read(num_bytes)
+            if data or self._done:
+                return data
+            if not self._is_running():
+                # The file won't change anymore, but it may have been written to since the last
+                # read, so read the rest of it before ending the stream.
+                self._done = True
+                continue
+            remaining = self._deadline - time.time()
+            if remaining <= 0:
+                return b''
+            self._watcher.wait(min(remaining, self.CHECK_INTERVAL_SECONDS))
+
+    read1 = read
+
+    def close(self):
+        self._watcher.close()
+        self._file.close()
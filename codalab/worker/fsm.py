@@ -50,10 +50,11 @@ class BaseDependencyManager(object):
         """ Return whether or not the corresponding DependencyState exists in the manager """
         raise NotImplementedError
 
-    def get(self, uuid, dependency):
+    def get(self, uuid, dependency, priority=0):
         """
         Start downloading the corresponding dependency if not already in progress.
         Register that the given uuid is a dependent of this dependency.
+        Dependencies requested with a higher priority are downloaded first.
         Return the corresponding DependencyState.
         """
         raise NotImplementedError
@@ -0,0 +1,250 @@
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, IO
+
+from codalab.lib.formatting import parse_size, size_str
+
+logger = logging.getLogger(__name__)
+
+# Suffix of cached index files. Other files in the cache directory (lock files, temporary
+# files written by SQLiteIndexedTar when it loads a gzip index) are never evicted.
+INDEX_SUFFIX = '.sqlite'
+LOCK_SUFFIX = '.lock'
+TMP_SUFFIX = '.tmp'
+# Age after which temporary files of downloads (e.g. of crashed processes) and lock files of
+# entries that are no longer cached are removed.
+STALE_FILE_SECONDS = 60 * 60
+
+
+class IndexCacheEntry(object):
+    """A cached index file. The entry holds a shared lock on the file until it is released,
+    so that the file is not evicted while it is being opened.
+    """
+
+    def __init__(self, path: str, fd: int):
+        self.path = path
+        self._fd = fd
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)  # Also releases the lock.
+            self._fd = None
+
+
+class IndexCache(object):
+    """
+    Size-bounded LRU cache of index.sqlite files on local disk, shared by all processes that
+    use the same cache directory.
+
+    Entries are keyed by bundle uuid and a version string for the index file (e.g. its
+    checksum on Blob Storage), so an index that changes is downloaded again.
+    A hit only costs an open() and a stat() (callers may still need a request to find out the
+    version). The modification time of an entry is updated on every hit and used as its
+    recency for eviction.
+
+    Processes coordinate with file locks:
+        - A download holds an exclusive lock on <entry>.lock, so only one process downloads
+          a given index at a time. The index is written to a temporary file and renamed into place.
+        - An entry handed out by acquire() holds a shared lock on the index file. Eviction
+          only removes entries it can lock exclusively, along with their <entry>.lock file
+          unless a download holds it.
+    Eviction also removes stale lock files and temporary files left by crashed downloads.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry_path(self, key: str, version: str) -> str:
+        version_hash = hashlib.sha1(version.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, '%s-%s%s' % (key, version_hash, INDEX_SUFFIX))
+
+    def _lock_path(self, path: str) -> str:
+        return path[: -len(INDEX_SUFFIX)] + LOCK_SUFFIX
+
+    def _open_locked(self, path: str):
+        """Opens the file at path and takes a shared lock on it. Returns the file descriptor,
+        or None if the file does not exist or was evicted before it could be locked."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        if os.fstat(fd).st_nlink == 0:
+            # Evicted between open() and flock().
+            os.close(fd)
+            return None
+        return fd
+
+    def acquire(
+        self, key: str, version: str, fetch: Callable[[IO[bytes]], None]
+    ) -> IndexCacheEntry:
+        """
+        Returns the cache entry for the given key and version, calling fetch(fileobj) to write
+        the index into fileobj if it isn't cached yet. The caller must release() the entry
+        once it has opened the index.
+        """
+        path = self._entry_path(key, version)
+        fd = self._open_locked(path)
+        if fd is not None:
+            os.utime(path)
+            with self._stats_lock:
+                self.hits += 1
+            return IndexCacheEntry(path, fd)
+
+        with open(self._lock_path(path), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another process may have downloaded the index while we were waiting for the lock.
+            fd = self._open_locked(path)
+            if fd is None:
+                with tempfile.NamedTemporaryFile(
+                    dir=self.cache_dir, suffix=TMP_SUFFIX, delete=False
+                ) as tmp_file:
+                    try:
+                        fetch(tmp_file)
+                    except Exception:
+                        os.remove(tmp_file.name)
+                        raise
+                # Lock the new file before it is visible, so it can't be evicted before it is used.
+                fd = self._open_locked(tmp_file.name)
+                os.rename(tmp_file.name, path)
+                with self._stats_lock:
+                    self.misses += 1
+            else:
+                with self._stats_lock:
+                    self.hits += 1
+        self._evict()
+        return IndexCacheEntry(path, fd)
+
+    def invalidate(self, key: str):
+        """Removes all cached versions of the index for the given key. Processes that are
+        still using one of them keep reading the removed file."""
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith(key + '-') and entry.name.endswith(INDEX_SUFFIX):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def _remove_lock_file(self, lock_path: str):
+        """Removes the lock file at lock_path, unless a download holds it. A process that
+        opened the file just before it is removed may download the index at the same time as
+        another one, which only costs a download."""
+        try:
+            fd = os.open(lock_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pass  # A download is in progress
+        else:
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+        finally:
+            os.close(fd)
+
+    def _evict(self):
+        """
+        Removes the least recently used index files until the cache fits in max_size_bytes.
+        Skips files that are in use, and does nothing if another process is already evicting.
+        Also removes lock files of entries that are no longer cached and temporary files that
+        are older than STALE_FILE_SECONDS.
+        """
+        with open(os.path.join(self.cache_dir, '.evict.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            entries = []
+            total_size = 0
+            stale_lock_paths = []
+            index_paths = set()
+            stale_time = time.time() - STALE_FILE_SECONDS
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.endswith(INDEX_SUFFIX):
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                        index_paths.add(entry.path)
+                        total_size += st.st_size
+                    elif entry.name.endswith(TMP_SUFFIX) and st.st_mtime < stale_time:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+                    elif (
+                        entry.name.endswith(LOCK_SUFFIX)
+                        and entry.name != '.evict.lock'
+                        and st.st_mtime < stale_time
+                    ):
+                        stale_lock_paths.append(entry.path)
+            for lock_path in stale_lock_paths:
+                if lock_path[: -len(LOCK_SUFFIX)] + INDEX_SUFFIX not in index_paths:
+                    self._remove_lock_file(lock_path)
+            if total_size <= self.max_size_bytes:
+                return
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size_bytes:
+                    break
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                except FileNotFoundError:
+                    continue
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # In use
+                else:
+                    os.remove(path)
+                    self._remove_lock_file(self._lock_path(path))
+                    total_size -= size
+                    with self._stats_lock:
+                        self.evictions += 1
+                finally:
+                    os.close(fd)
+            logger.info(
+                "Evicted index files; index cache is now %s (hits=%d, misses=%d, evictions=%d)",
+                size_str(total_size),
+                self.hits,
+                self.misses,
+                self.evictions,
+            )
+
+    def stats(self):
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+_index_cache = None
+_index_cache_lock = threading.Lock()
+
+
+def get_index_cache() -> IndexCache:
+    """Returns this process's IndexCache, configured by the CODALAB_INDEX_CACHE_DIR and
+    CODALAB_INDEX_CACHE_SIZE environment variables."""
+    global _index_cache
+    with _index_cache_lock:
+        if _index_cache is None:
+            _index_cache = IndexCache(
+                os.environ.get('CODALAB_INDEX_CACHE_DIR')
+                or os.path.join(tempfile.gettempdir(), 'codalab-index-cache'),
+                parse_size(os.environ.get('CODALAB_INDEX_CACHE_SIZE') or '10g'),
+            )
+        return _index_cache
@@ -194,6 +194,13 @@ def parse_args():
         default=3,
         help='The number of times to retry downloading dependencies after a failure (defaults to 3).',
     )
+    parser.add_argument(
+        '--max-concurrent-dependency-downloads',
+        type=int,
+        default=4,
+        help='The maximum number of dependencies downloaded at the same time (defaults to 4). '
+        'Dependencies of runs with a higher request_priority are downloaded first.',
+    )
     parser.add_argument(
         '--shared-memory-size-gb',
         type=int,
@@ -203,6 +210,18 @@ def parse_args():
     parser.add_argument(
         '--preemptible', action='store_true', help='Whether the worker is preemptible.',
     )
+    parser.add_argument(
+        '--disk-usage-threads',
+        type=int,
+        default=2,
+        help='Number of threads that measure the disk usage of running bundles (defaults to 2).',
+    )
+    parser.add_argument(
+        '--use-project-quotas',
+        action='store_true',
+        help='Measure the disk usage of running bundles with project quotas. Requires a work '
+        'directory on a filesystem with project quotas enabled and the CAP_SYS_ADMIN capability.',
+    )
     parser.add_argument(
         '--kubernetes-cluster-host',
         type=str,
@@ -304,6 +323,7 @@ def main():
             args.work_dir,
             args.max_work_dir_size,
             args.download_dependencies_max_retries,
+            args.max_concurrent_dependency_downloads,
         )
 
     # TODO: Remove Singularity code (https://github.com/codalab/codalab-worksheets/issues/4408).
@@ -392,6 +412,8 @@ def main():
         shared_memory_size_gb=args.shared_memory_size_gb,
         preemptible=args.preemptible,
         bundle_runtime=bundle_runtime_class,
+        disk_usage_threads=args.disk_usage_threads,
+        use_project_quotas=args.use_project_quotas,
     )
 
     # Register a signal handler to ensure safe shutdown.
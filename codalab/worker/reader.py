@@ -2,9 +2,11 @@ from contextlib import closing
 import http.client
 import os
 import threading
+from typing import Callable, Optional
 
 import codalab.worker.download_util as download_util
 from codalab.worker.download_util import get_target_path, PathException, BundleTarget
+from codalab.worker.file_watcher import FileFollower
 from codalab.worker.file_util import (
     gzip_file,
     gzip_bytestring,
@@ -15,13 +17,20 @@ from codalab.worker.file_util import (
 
 
 class Reader(object):
-    def __init__(self):
+    def __init__(self, is_running=None):
+        # type: (Optional[Callable[[str], bool]]) -> None
+        """
+        is_running is called with the UUID of a bundle and returns whether its files may still
+        change. Without it, followed files end as soon as they have been read.
+        """
+        self.is_running = is_running or (lambda uuid: False)
         self.read_handlers = {
             'get_target_info': self.get_target_info,
             'stream_directory': self.stream_directory,
             'stream_file': self.stream_file,
             'read_file_section': self.read_file_section,
             'summarize_file': self.summarize_file,
+            'follow_file': self.follow_file,
         }
         self.read_threads = []  # Threads
 
@@ -147,3 +156,26 @@ class Reader(object):
             reply_fn(None, {}, bytestring)
 
         self._threaded_read(run_state, path, summarize_file_thread, reply_fn)
+
+    def follow_file(self, run_state, path, args, reply_fn):
+        """
+        Read the section of file at path of length args['length'] starting at
+        args['offset'] (bytes) like read_file_section, but if the file doesn't extend past
+        args['offset'] yet and the bundle is running, first wait up to args['timeout'] seconds
+        for data to be appended to it, using a separate thread
+        """
+        uuid = run_state.bundle.uuid
+
+        def follow_file_thread(final_path):
+            try:
+                follower = FileFollower(
+                    final_path, args['offset'], lambda: self.is_running(uuid), args['timeout']
+                )
+            except OSError as e:
+                reply_fn((http.client.NOT_FOUND, str(e)), None, None)
+                return
+            with closing(follower):
+                bytestring = gzip_bytestring(follower.read(args['length']))
+            reply_fn(None, {}, bytestring)
+
+        self._threaded_read(run_state, path, follow_file_thread, reply_fn)
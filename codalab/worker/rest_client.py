@@ -6,7 +6,8 @@ import urllib.error
 from typing import Dict
 
 from .un_gzip_stream import un_gzip_stream
-from codalab.common import URLOPEN_TIMEOUT_SECONDS, urlopen_with_retry
+from codalab.common import URLOPEN_TIMEOUT_SECONDS
+from codalab.worker import connection_pool
 from codalab.worker.upload_util import upload_with_chunked_encoding
 
 
@@ -32,8 +33,13 @@ class RestClient(object):
     """
     _extra_headers: Dict[str, str] = {}
 
-    def __init__(self, base_url):
+    def __init__(self, base_url, pool=None):
+        """
+        :param pool: ConnectionPool used to make requests. By default, the clients of a process
+                     share connection_pool.default_pool, so they reuse each other's connections.
+        """
         self._base_url = base_url
+        self._pool = pool or connection_pool.default_pool
 
     def _get_access_token(self):
         """
@@ -93,7 +99,7 @@ class RestClient(object):
             # Return a file-like object containing the contents of the response
             # body, transparently decoding gzip streams if indicated by the
             # Content-Encoding header.
-            response = urlopen_with_retry(request, timeout=timeout_seconds)
+            response = self._pool.urlopen_with_retry(request, timeout=timeout_seconds)
             encoding = response.headers.get('Content-Encoding')
             if not encoding or encoding == 'identity':
                 return response
@@ -102,7 +108,7 @@ class RestClient(object):
             else:
                 raise RestClientException('Unsupported Content-Encoding: ' + encoding, False)
 
-        with closing(urlopen_with_retry(request, timeout=timeout_seconds)) as response:
+        with closing(self._pool.urlopen_with_retry(request, timeout=timeout_seconds)) as response:
             # If the response is a JSON document, as indicated by the
             # Content-Type header, try to deserialize it and return the result.
             # Otherwise, just ignore the response body and return None.
@@ -57,7 +57,7 @@ class Runtime:
         raise NotImplementedError
 
     def get_container_stats_with_docker_stats(self, container_id: str):
-        """Returns the cpu usage and memory limit of a container using the Docker Stats API."""
+        """Returns the cpu usage and memory usage (as a fraction of the memory limit) of a container."""
         raise NotImplementedError
 
     def container_exists(self, container_id: str) -> bool:
@@ -242,6 +242,7 @@ class BytesBuffer(BytesIO):
         self.__buf = deque()
         self.__size = 0
         self.__pos = 0
+        self.__offset = 0  # Number of bytes of the first chunk of self.__buf that were read
 
     def __len__(self):
         return self.__size
@@ -255,14 +256,15 @@ class BytesBuffer(BytesIO):
             size = self.__size
         ret_list = []
         while size > 0 and len(self.__buf):
-            s = self.__buf.popleft()
-            size -= len(s)
-            ret_list.append(s)
-        if size < 0:
-            ret_list[-1], remainder = ret_list[-1][:size], ret_list[-1][size:]
-            self.__buf.appendleft(remainder)
-            size += len(remainder)
-            assert size == 0
+            s = self.__buf[0]
+            # Only the bytes that are returned are copied, not the rest of the chunk.
+            part = s[self.__offset : self.__offset + size]
+            ret_list.append(part)
+            size -= len(part)
+            self.__offset += len(part)
+            if self.__offset == len(s):
+                self.__buf.popleft()
+                self.__offset = 0
 
         ret = b''.join(ret_list)
         self.__size -= len(ret)
@@ -271,9 +273,13 @@ class BytesBuffer(BytesIO):
 
     def peek(self, size: int):
         b = bytearray()
-        for i in range(0, min(size, len(self.__buf))):
-            b.extend(self.__buf[i])
-        return bytes(b)[:size]
+        offset = self.__offset
+        for s in self.__buf:
+            if len(b) >= size:
+                break
+            b.extend(s[offset : offset + size - len(b)])
+            offset = 0
+        return bytes(b)
 
     def flush(self):
         pass
@@ -1,9 +1,106 @@
 from contextlib import closing
+import fnmatch
+import hashlib
 import urllib.parse
 import http.client
 import logging
+import os
 import socket
+import stat
+import threading
 from io import StringIO
+from typing import Dict, List, Optional, Tuple
+
+QUOTA_EXCEEDED_MESSAGE = (
+    'Upload aborted. User disk quota exceeded. '
+    'To apply for more quota, please visit the following link: '
+    'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/'
+    '#how-do-i-request-more-disk-quota-or-time-quota'
+)
+
+
+class DiskQuotaLease(object):
+    """
+    Enforces the disk quota of the user who is uploading a bundle without blocking the upload on
+    REST calls.
+
+    The lease starts with the user's remaining disk quota as its budget. Uploaded bytes are
+    counted locally by consume(), which raises once they exceed the budget. Every
+    REPORT_INTERVAL_BYTES, the bytes uploaded since the last report are sent to the
+    /user/increment_disk_used endpoint in a background thread, and its response renews the
+    budget from the user's current disk usage (which includes their other uploads).
+    finish() reports the remaining bytes once the upload is done.
+    """
+
+    REPORT_INTERVAL_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, json_api_client, bundle_uuid, report_interval_bytes=None):
+        self._client = json_api_client
+        self._bundle_uuid = bundle_uuid
+        self._report_interval_bytes = report_interval_bytes or self.REPORT_INTERVAL_BYTES
+        self._lock = threading.Lock()
+        self._consumed = 0  # Bytes uploaded so far
+        self._reported = 0  # Bytes reported to the server, or being reported
+        self._report_thread = None
+        self._error = None  # Error of the last background report
+        self._budget = self._remaining_quota(json_api_client.fetch('user'))
+
+    @staticmethod
+    def _remaining_quota(user_info):
+        return max(0, user_info['disk_quota'] - user_info['disk_used'])
+
+    def consume(self, num_bytes):
+        """Accounts for num_bytes more uploaded bytes. Raises if the user is over their quota."""
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            self._consumed += num_bytes
+            if self._consumed > self._budget:
+                raise Exception(QUOTA_EXCEEDED_MESSAGE)
+            if (
+                self._report_thread is None
+                and self._consumed - self._reported >= self._report_interval_bytes
+            ):
+                self._report_thread = threading.Thread(
+                    target=self._report_in_background,
+                    args=(self._consumed - self._reported,),
+                    daemon=True,
+                )
+                self._reported = self._consumed
+                self._report_thread.start()
+
+    def _report(self, increment):
+        user_info = self._client.update(
+            'user/increment_disk_used',
+            {'disk_used_increment': increment, 'bundle_uuid': self._bundle_uuid},
+        )
+        with self._lock:
+            # The user's disk usage now includes all the bytes reported by this lease.
+            self._budget = self._reported + self._remaining_quota(user_info)
+
+    def _report_in_background(self, increment):
+        try:
+            self._report(increment)
+        except Exception as e:
+            logging.warning("Failed to report disk usage of bundle %s: %s", self._bundle_uuid, e)
+            with self._lock:
+                self._error = e
+        finally:
+            with self._lock:
+                self._report_thread = None
+
+    def finish(self):
+        """Waits for the background report, then reports the rest of the uploaded bytes."""
+        report_thread = self._report_thread
+        if report_thread is not None:
+            report_thread.join()
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            increment = self._consumed - self._reported
+            self._reported = self._consumed
+        if increment > 0:
+            self._report(increment)
 
 
 def upload_with_chunked_encoding(
@@ -65,34 +162,23 @@ def upload_with_chunked_encoding(
 
         # Use chunked transfer encoding to send the data through.
         bytes_uploaded = 0
-        ITERATIONS_PER_DISK_CHECK = 2000
-        iteration = 0
+        # Check if client has gone over disk usage, and update it.
+        quota_lease = DiskQuotaLease(json_api_client, bundle_uuid) if json_api_client else None
         while True:
             to_send = fileobj.read(CHUNK_SIZE)
             if not to_send:
                 break
+            if quota_lease:
+                quota_lease.consume(len(to_send))
             conn.send(b'%X\r\n%s\r\n' % (len(to_send), to_send))
             bytes_uploaded += len(to_send)
 
-            # Update disk and check if client has gone over disk usage.
-            if json_api_client and iteration % ITERATIONS_PER_DISK_CHECK == 0:
-                json_api_client.update(
-                    'user/increment_disk_used',
-                    {'disk_used_increment': len(to_send), 'bundle_uuid': bundle_uuid},
-                )
-                user_info = json_api_client.fetch('user')
-                if user_info['disk_used'] >= user_info['disk_quota']:
-                    raise Exception(
-                        'Upload aborted. User disk quota exceeded. '
-                        'To apply for more quota, please visit the following link: '
-                        'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/'
-                        '#how-do-i-request-more-disk-quota-or-time-quota'
-                    )
             if progress_callback is not None:
                 should_resume = progress_callback(bytes_uploaded)
                 if not should_resume:
                     raise Exception('Upload aborted by client')
-            iteration += 1
+        if quota_lease:
+            quota_lease.finish()
         conn.send(b'0\r\n\r\n')
 
         if not need_response:
@@ -123,3 +209,80 @@ def upload_with_chunked_encoding(
                 dict(response.getheaders()),
                 StringIO(response.read().decode()),
             )
+
+
+def _is_excluded(path: str, exclude_patterns: List[str]) -> bool:
+    """Returns whether tar --exclude=<pattern> would exclude the entry at the given relative
+    path for any of exclude_patterns. Like tar, patterns are unanchored: they can match the path
+    starting at any of its components."""
+    components = path.split('/')
+    for pattern in exclude_patterns:
+        if fnmatch.fnmatchcase('./' + path, pattern):
+            return True
+        for i in range(len(components)):
+            if fnmatch.fnmatchcase('/'.join(components[i:]), pattern):
+                return True
+    return False
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_upload_manifest(
+    directory_path: str,
+    exclude_patterns: Optional[List[str]] = None,
+    file_hashes: Optional[Dict[str, Tuple[int, int, str]]] = None,
+) -> List[Dict]:
+    """
+    Returns the manifest of the directory at directory_path that is sent for a delta upload of
+    its contents. The manifest lists the directories, files and symbolic links in the directory,
+    each directory followed by its entries sorted by name, as dicts with the following keys:
+        - path: path relative to directory_path ('.' for directory_path itself)
+        - type: 'directory', 'file' or 'link'
+        - mode, mtime: permission bits and modification time
+        - size, sha256: size and SHA-256 hash of the contents of a file
+        - target: target of a link
+    Entries matching exclude_patterns are left out, like tar_gzip_directory does.
+
+    file_hashes: if given, caches the size, modification time and hash of files by path, so
+                 that files that haven't changed since the last call aren't hashed again.
+    """
+    exclude_patterns = exclude_patterns or []
+    manifest = []
+
+    def add_entry(path: str, rel_path: str):
+        st = os.lstat(path)
+        entry = {'path': rel_path, 'mode': stat.S_IMODE(st.st_mode), 'mtime': int(st.st_mtime)}
+        if stat.S_ISLNK(st.st_mode):
+            entry.update(type='link', target=os.readlink(path))
+        elif stat.S_ISDIR(st.st_mode):
+            entry.update(type='directory')
+        elif stat.S_ISREG(st.st_mode):
+            cached = file_hashes.get(path) if file_hashes is not None else None
+            if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+                sha256 = cached[2]
+            else:
+                sha256 = _sha256(path)
+                if file_hashes is not None:
+                    file_hashes[path] = (st.st_size, st.st_mtime_ns, sha256)
+            entry.update(type='file', size=st.st_size, sha256=sha256)
+        else:
+            # Sockets, devices, etc. aren't uploaded.
+            return
+        manifest.append(entry)
+        if entry['type'] == 'directory':
+            for name in sorted(os.listdir(path)):
+                child_rel_path = name if rel_path == '.' else rel_path + '/' + name
+                if not _is_excluded(child_rel_path, exclude_patterns):
+                    add_entry(os.path.join(path, name), child_rel_path)
+
+    add_entry(directory_path, '.')
+    return manifest
@@ -23,7 +23,9 @@ from codalab.worker.runtime import Runtime
 import requests
 
 from .bundle_service_client import BundleServiceException, BundleServiceClient
+from .checkin_delta import CheckinDeltaEncoder
 from .dependency_manager import DependencyManager
+from .disk_usage import DiskUsageService
 from .docker_utils import DEFAULT_DOCKER_TIMEOUT, DEFAULT_RUNTIME
 from .image_manager import ImageManager
 from .download_util import BUNDLE_NO_LONGER_RUNNING_MESSAGE
@@ -90,10 +92,14 @@ class Worker:
         exit_on_exception=False,  # type: bool
         shared_memory_size_gb=1,  # type: int
         preemptible=False,  # type: bool
+        # Number of threads that measure the disk usage of running bundles.
+        disk_usage_threads=2,  # type: int
+        # A flag indicating if the disk usage of running bundles is measured with project quotas.
+        use_project_quotas=False,  # type: bool
     ):
         self.image_manager = image_manager
         self.dependency_manager = dependency_manager
-        self.reader = Reader()
+        self.reader = Reader(is_running=self._is_running)
         self.state_committer = JsonStateCommitter(commit_file)
         self.bundle_service = bundle_service
 
@@ -129,6 +135,7 @@ class Worker:
         self.bundle_runtime = bundle_runtime
 
         self.checkin_frequency_seconds = checkin_frequency_seconds
+        self.checkin_delta_encoder = CheckinDeltaEncoder()
         self.last_checkin = None
         self.last_checkin_successful = False
         self.listen_thread = None
@@ -139,6 +146,9 @@ class Worker:
         self.runs = {}  # type: Dict[str, RunState]
         self.docker_network_prefix = docker_network_prefix
         self.init_docker_networks(docker_network_prefix)
+        self.disk_usage_service = DiskUsageService(
+            num_threads=disk_usage_threads, use_project_quotas=use_project_quotas
+        )
         self.run_state_manager = RunStateMachine(
             image_manager=self.image_manager,
             dependency_manager=self.dependency_manager,
@@ -151,6 +161,7 @@ class Worker:
             shared_file_system=self.shared_file_system,
             shared_memory_size_gb=shared_memory_size_gb,
             bundle_runtime=bundle_runtime,
+            disk_usage_service=self.disk_usage_service,
         )
         if using_sentry:
             self.monitoring = WorkerMonitoring()
@@ -300,6 +311,7 @@ class Worker:
         self.image_manager.start()
         if not self.shared_file_system:
             self.dependency_manager.start()
+        self.disk_usage_service.start()
 
         async def listen(self):
             logger.warning("Started websocket listening thread")
@@ -400,6 +412,7 @@ class Worker:
         if not self.shared_file_system:
             self.dependency_manager.stop()
         self.run_state_manager.stop()
+        self.disk_usage_service.stop()
         self.save_state()
         if self.delete_work_dir_on_exit:
             shutil.rmtree(self.work_dir)
@@ -491,9 +504,7 @@ class Worker:
                 'gpus': len(self.gpuset),
                 'memory_bytes': self.max_memory,
                 'free_disk_bytes': self.free_disk_bytes,
-                'dependencies': self.cached_dependencies,
                 'hostname': socket.gethostname(),
-                'runs': [run.as_dict for run in self.all_runs],
                 'shared_file_system': self.shared_file_system,
                 'tag_exclusive': self.tag_exclusive,
                 'exit_after_num_runs': self.exit_after_num_runs - self.num_runs,
@@ -511,10 +522,16 @@ class Worker:
                         'free_disk_bytes': stats['free_disk_bytes'],
                     },
                 )
+            pending_delta = self.checkin_delta_encoder.encode(
+                request, self.cached_dependencies, [run.as_dict for run in self.all_runs]
+            )
             try:
                 response = self.bundle_service.checkin(self.id, request)
                 logger.info('Connected! Successful check in!')
                 self.last_checkin_successful = True
+                self.checkin_delta_encoder.ack(
+                    pending_delta, response if type(response) is list else [response]
+                )
             except BundleServiceException as ex:
                 logger.warning("Disconnected from server! Failed check in: %s", ex)
                 if not self.last_checkin_successful:
@@ -534,6 +551,9 @@ class Worker:
                     continue
                 action_type = action['type']
                 logger.debug('Received %s message: %s', action_type, action)
+                if action_type == 'checkin_ack':
+                    # Handled by self.checkin_delta_encoder.
+                    continue
                 if action_type == 'run':
                     self.initialize_run(action['bundle'], action['resources'])
                 else:
@@ -790,6 +810,11 @@ class Worker:
         """
         self.runs[uuid] = self.runs[uuid]._replace(finalized=True)
 
+    def _is_running(self, uuid):
+        """Returns whether the run with uuid is preparing or running, so its files may change."""
+        run_state = self.runs.get(uuid)
+        return run_state is not None and run_state.stage in (RunStage.PREPARING, RunStage.RUNNING)
+
     def read(self, socket_id, uuid, path, args):
         def reply(err, message={}, data=None):
             self.bundle_service_reply(socket_id, err, message, data)
@@ -860,11 +885,15 @@ class Worker:
     def upload_bundle_contents(
         self, bundle_uuid, bundle_path, exclude_patterns, store, update_status
     ):
-        self.execute_bundle_service_command_with_retry(
-            lambda: self.bundle_service.update_bundle_contents(
-                self.id, bundle_uuid, bundle_path, exclude_patterns, store, update_status
+        try:
+            self.execute_bundle_service_command_with_retry(
+                lambda: self.bundle_service.update_bundle_contents(
+                    self.id, bundle_uuid, bundle_path, exclude_patterns, store, update_status
+                )
             )
-        )
+        finally:
+            # The contents of a run are uploaded once, with retries, when it finishes.
+            self.bundle_service.discard_file_hashes(bundle_uuid)
 
     def read_run_missing(self, socket_id):
         message = {
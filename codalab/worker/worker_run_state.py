@@ -12,7 +12,7 @@ from pathlib import Path
 
 from codalab.worker.runtime import RuntimeAPIError
 from codalab.lib.formatting import size_str, duration_str
-from codalab.worker.file_util import remove_path, get_path_size, path_is_parent
+from codalab.worker.file_util import remove_path, path_is_parent
 from codalab.worker.bundle_state import State, DependencyKey
 from codalab.worker.fsm import DependencyStage, StateTransitioner
 from codalab.worker.worker_thread import ThreadDict
@@ -171,6 +171,7 @@ class RunStateMachine(StateTransitioner):
         shared_file_system,  # If True, bundle mount is shared with server
         shared_memory_size_gb,  # Shared memory size for the run container (in GB)
         bundle_runtime,  # Runtime used to run bundles (docker or kubernetes)
+        disk_usage_service,  # Service that measures the disk usage of running bundles
     ):
         super(RunStateMachine, self).__init__()
         self.add_transition(RunStage.PREPARING, self._transition_from_PREPARING)
@@ -190,19 +191,13 @@ class RunStateMachine(StateTransitioner):
         self.bundle_runtime = bundle_runtime
         # bundle.uuid -> {'thread': Thread, 'run_status': str}
         self.uploading = ThreadDict(fields={'run_status': 'Upload started.', 'success': False})
-        # bundle.uuid -> {'thread': Thread, 'disk_utilization': int, 'running': bool}
-        self.disk_utilization = ThreadDict(
-            fields={'disk_utilization': 0, 'running': True, 'lock': None}
-        )
+        self.disk_usage_service = disk_usage_service
         self.upload_bundle_callback = upload_bundle_callback
         self.assign_cpu_and_gpu_sets_fn = assign_cpu_and_gpu_sets_fn
         self.shared_file_system = shared_file_system
         self.shared_memory_size_gb = shared_memory_size_gb
 
     def stop(self):
-        for uuid in self.disk_utilization.keys():
-            self.disk_utilization[uuid]['running'] = False
-        self.disk_utilization.stop()
         self.uploading.stop()
 
     def _transition_from_PREPARING(self, run_state):
@@ -263,7 +258,11 @@ class RunStateMachine(StateTransitioner):
                 try:
                     # Fetching dependencies from the Dependency Manager can fail.
                     # Just update the download status on the next iteration of this transition function.
-                    dependency_state = self.dependency_manager.get(run_state.bundle.uuid, dep_key)
+                    dependency_state = self.dependency_manager.get(
+                        run_state.bundle.uuid,
+                        dep_key,
+                        priority=run_state.bundle.metadata.get('request_priority') or 0,
+                    )
                     dependency_keys_to_paths[dep_key] = os.path.join(
                         self.dependency_manager.dependencies_dir, dependency_state.path
                     )
@@ -496,7 +495,7 @@ class RunStateMachine(StateTransitioner):
                 max_memory=max(run_state.max_memory, run_stats.get('memory', 0))
             )
             run_state = run_state._replace(
-                disk_utilization=self.disk_utilization[run_state.bundle.uuid]['disk_utilization']
+                disk_utilization=self.disk_usage_service.get(run_state.bundle.uuid)
             )
 
             container_time_total = self.bundle_runtime.get_container_running_time(
@@ -532,27 +531,7 @@ class RunStateMachine(StateTransitioner):
                 run_state = run_state._replace(kill_message=' '.join(kill_messages), is_killed=True)
             return run_state
 
-        def check_disk_utilization():
-            running = True
-            while running:
-                start_time = time.time()
-                try:
-                    disk_utilization = get_path_size(run_state.bundle_path)
-                    self.disk_utilization[run_state.bundle.uuid][
-                        'disk_utilization'
-                    ] = disk_utilization
-                    running = self.disk_utilization[run_state.bundle.uuid]['running']
-                except Exception:
-                    logger.error(traceback.format_exc())
-                end_time = time.time()
-
-                # To ensure that we don't hammer the disk for this computation when
-                # there are lots of files, we run it at most 10% of the time.
-                time.sleep(max((end_time - start_time) * 10, 1.0))
-
-        self.disk_utilization.add_if_new(
-            run_state.bundle.uuid, threading.Thread(target=check_disk_utilization, args=[])
-        )
+        self.disk_usage_service.track(run_state.bundle.uuid, run_state.bundle_path)
         run_state = check_and_report_finished(run_state)
         run_state = check_resource_utilization(run_state)
 
@@ -570,8 +549,7 @@ class RunStateMachine(StateTransitioner):
                     finished, _, _ = self.bundle_runtime.check_finished(run_state.container_id)
                     if not finished:
                         logger.error(traceback.format_exc())
-            self.disk_utilization[run_state.bundle.uuid]['running'] = False
-            self.disk_utilization.remove(run_state.bundle.uuid)
+            self.disk_usage_service.untrack(run_state.bundle.uuid)
             return run_state._replace(stage=RunStage.CLEANING_UP)
         if run_state.finished:
             logger.debug(
@@ -581,8 +559,7 @@ class RunStateMachine(StateTransitioner):
                 run_state.exitcode,
                 run_state.failure_message,
             )
-            self.disk_utilization[run_state.bundle.uuid]['running'] = False
-            self.disk_utilization.remove(run_state.bundle.uuid)
+            self.disk_usage_service.untrack(run_state.bundle.uuid)
             return run_state._replace(stage=RunStage.CLEANING_UP, run_status='Uploading results.')
         else:
             return run_state
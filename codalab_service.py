@@ -314,6 +314,35 @@ CODALAB_ARGUMENTS = [
         type=int,
         default=60,
     ),
+    CodalabArg(
+        name='bundle_manager_incremental_scheduling',
+        help='Keep staged bundles in an in-memory queue that is updated from state changes, instead of reloading all staged bundles from the database on every iteration',
+        type=bool,
+        default=False,
+    ),
+    CodalabArg(
+        name='bundle_manager_reconcile_interval_seconds',
+        help='Number of seconds between full reloads of the staged bundle queue from the database when incremental scheduling is enabled',
+        type=int,
+        default=60,
+    ),
+    CodalabArg(
+        name='bundle_manager_max_make_bundle_threads',
+        help='Maximum number of make bundles that are made at the same time',
+        type=int,
+        default=4,
+    ),
+    CodalabArg(
+        name='bundle_manager_max_dependency_copy_threads',
+        help='Maximum number of dependencies of a single make bundle that are copied at the same time',
+        type=int,
+        default=4,
+    ),
+    CodalabArg(
+        name='bundle_manager_make_bundle_link_mode',
+        help='How to materialize make bundle dependencies that are on the same partition as the bundle (copy, reflink or hardlink)',
+        default='copy',
+    ),
     # Worker manager
     CodalabArg(
         name='worker_manager_type',
@@ -409,6 +438,22 @@ CODALAB_ARGUMENTS = [
         default='/tmp/codalab/link-mounts',
     ),
     CodalabArg(name='azure_blob_connection_string', help='Azure Blob storage connection string'),
+    CodalabArg(
+        name='index_cache_size',
+        help='Maximum size of the local cache of index.sqlite files of bundles on Blob Storage',
+        default='10g',
+    ),
+    CodalabArg(
+        name='gzip_level',
+        help='Compression level of the bundle archives and gzipped files that are uploaded or downloaded',
+        type=int,
+        default=6,
+    ),
+    CodalabArg(
+        name='gzip_threads',
+        help='Number of threads used to gzip bundle archives and files (defaults to the number of CPUs)',
+        type=int,
+    ),
     CodalabArg(
         name='google_application_credentials',
         help='Path to Google Application Credentials file.',
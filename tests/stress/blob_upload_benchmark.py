@@ -0,0 +1,89 @@
+"""
+Benchmark for the throughput of BlobStorageUploader, which stages the blocks of a blob with
+concurrent requests, as a function of the number of upload threads.
+
+By default, Blob Storage is simulated by a client whose stage_block() calls take a fixed latency
+plus the time to send the block at a fixed per-connection bandwidth, so no storage account is
+needed. Pass --connection-string to upload to a real Blob Storage account or to Azurite instead.
+Run from the repository root:
+
+    python -m tests.stress.blob_upload_benchmark --size-mb 1024
+"""
+import argparse
+import os
+import threading
+import time
+
+from codalab.lib.beam.blobstorageuploader import BlobStorageUploader
+
+MB = 1024 * 1024
+
+
+class SimulatedBlobClient:
+    """Blob client whose requests take latency seconds plus len(data) / bandwidth seconds."""
+
+    def __init__(self, latency, bandwidth):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.bytes_in_flight = 0
+        self.max_bytes_in_flight = 0
+
+    def get_blob_client(self, container, blob):
+        return self
+
+    def stage_block(self, block_id, data):
+        with self.lock:
+            self.bytes_in_flight += len(data)
+            self.max_bytes_in_flight = max(self.max_bytes_in_flight, self.bytes_in_flight)
+        time.sleep(self.latency + len(data) / self.bandwidth)
+        with self.lock:
+            self.bytes_in_flight -= len(data)
+
+    def commit_block_list(self, block_list, content_settings=None):
+        time.sleep(self.latency)
+
+
+def run(client, path, size, num_upload_threads):
+    block = memoryview(os.urandom(MB))
+    uploader = BlobStorageUploader(client, path, num_upload_threads=num_upload_threads)
+    start = time.time()
+    for _ in range(size // MB):
+        uploader.put(block)
+    uploader.finish()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--bandwidth-mb', type=float, default=50, help='Per-connection MiB/s')
+    parser.add_argument('--connection-string', help='Upload to this storage account instead')
+    parser.add_argument('--container', default='bundles')
+    args = parser.parse_args()
+
+    size = args.size_mb * MB
+    for num_upload_threads in args.threads:
+        if args.connection_string:
+            from azure.storage.blob import BlobServiceClient
+
+            client = BlobServiceClient.from_connection_string(args.connection_string)
+            path = 'azfs://%s/%s/upload-benchmark' % (client.account_name, args.container)
+        else:
+            client = SimulatedBlobClient(args.latency_ms / 1000, args.bandwidth_mb * MB)
+            path = 'azfs://account/%s/upload-benchmark' % args.container
+        elapsed = run(client, path, size, num_upload_threads)
+        print(
+            '%2d threads: %d MiB in %6.2f s (%6.1f MiB/s)'
+            % (num_upload_threads, args.size_mb, elapsed, args.size_mb / elapsed),
+            end='',
+        )
+        if isinstance(client, SimulatedBlobClient):
+            print(', at most %d MiB in flight' % (client.max_bytes_in_flight // MB), end='')
+        print()
+
+
+if __name__ == '__main__':
+    main()
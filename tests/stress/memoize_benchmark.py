@@ -0,0 +1,182 @@
+"""
+Benchmark comparing memoized bundle lookups (cl run --memoize) through the bundle_memo table with
+the previous lookup, which grouped bundle_dependency rows joined with bundles with the same command.
+
+Run bundles are inserted directly into an in-memory SQLite database. Run from the repository root:
+
+    python -m tests.stress.memoize_benchmark --num-bundles 1000000
+"""
+import argparse
+import json
+import random
+import time
+
+from sqlalchemy import and_, func, or_, select
+
+from codalab.lib.spec_util import generate_uuid
+from codalab.model.bundle_model import get_memo_key
+from codalab.model.sqlite_model import SQLiteModel
+from codalab.model.tables import (
+    bundle as cl_bundle,
+    bundle_dependency as cl_bundle_dependency,
+    bundle_memo as cl_bundle_memo,
+)
+
+# Number of bundles inserted at once.
+BATCH_SIZE = 10000
+
+
+def legacy_get_memoized_bundles(model, user_id, command, dependencies):
+    """
+    The lookup that BundleModel.get_memoized_bundles did before memo keys were stored.
+    """
+    dependencies = json.loads(dependencies)
+    if len(dependencies) == 0:
+        query = (
+            select([cl_bundle.c.uuid])
+            .where(
+                and_(
+                    cl_bundle.c.command == command,
+                    cl_bundle.c.owner_id == user_id,
+                    cl_bundle.c.uuid.notin_(select([cl_bundle_dependency.c.child_uuid])),
+                )
+            )
+            .order_by(cl_bundle.c.id)
+        )
+        return model._execute_query(query)
+    command_filter = (
+        select([cl_bundle_dependency.c.child_uuid])
+        .select_from(
+            cl_bundle.join(
+                cl_bundle_dependency, cl_bundle.c.uuid == cl_bundle_dependency.c.child_uuid
+            )
+        )
+        .where(and_(cl_bundle.c.command == command, cl_bundle.c.owner_id == user_id))
+        .group_by(cl_bundle_dependency.c.child_uuid)
+        .having(func.count(cl_bundle_dependency.c.child_path) == len(dependencies))
+    )
+    uuids = model._execute_query(command_filter)
+    query = (
+        select([cl_bundle_dependency.c.child_uuid])
+        .where(
+            and_(
+                cl_bundle_dependency.c.child_uuid.in_(uuids),
+                or_(
+                    *[
+                        and_(
+                            cl_bundle_dependency.c.child_path == dep['child_path'],
+                            cl_bundle_dependency.c.parent_uuid == dep['parent_uuid'],
+                        )
+                        for dep in dependencies
+                    ]
+                ),
+            )
+        )
+        .group_by(cl_bundle_dependency.c.child_uuid)
+        .having(func.count(cl_bundle_dependency.c.child_path) == len(dependencies))
+        .order_by(cl_bundle_dependency.c.id)
+    )
+    return model._execute_query(query)
+
+
+def insert_bundles(model, num_bundles, num_commands, num_parents, num_users, rng):
+    """
+    Inserts run bundles with random commands and dependencies, and returns the
+    (user_id, command, dependencies) of some of them to look up.
+    """
+    parents = [generate_uuid() for _ in range(num_parents)]
+    lookups = []
+    for start in range(0, num_bundles, BATCH_SIZE):
+        bundle_rows, dependency_rows, memo_rows = [], [], []
+        for _ in range(min(BATCH_SIZE, num_bundles - start)):
+            uuid = generate_uuid()
+            owner_id = str(rng.randrange(num_users))
+            command = 'python train.py --seed %d' % rng.randrange(num_commands)
+            dependencies = [
+                ('dep%d' % i, rng.choice(parents)) for i in range(rng.choice([0, 1, 1, 2, 3]))
+            ]
+            bundle_rows.append(
+                {
+                    'uuid': uuid,
+                    'bundle_type': 'run',
+                    'command': command,
+                    'state': 'ready',
+                    'owner_id': owner_id,
+                    'is_anonymous': False,
+                    'is_dir': True,
+                }
+            )
+            dependency_rows.extend(
+                {
+                    'child_uuid': uuid,
+                    'child_path': child_path,
+                    'parent_uuid': parent_uuid,
+                    'parent_path': '',
+                }
+                for child_path, parent_uuid in dependencies
+            )
+            memo_rows.append(
+                {
+                    'bundle_uuid': uuid,
+                    'owner_id': owner_id,
+                    'memo_key': get_memo_key(command, dependencies),
+                }
+            )
+            if rng.random() < 0.001:
+                lookups.append(
+                    (
+                        owner_id,
+                        command,
+                        json.dumps(
+                            [
+                                {'child_path': child_path, 'parent_uuid': parent_uuid}
+                                for child_path, parent_uuid in dependencies
+                            ]
+                        ),
+                    )
+                )
+        with model.engine.begin() as connection:
+            model.do_multirow_insert(connection, cl_bundle, bundle_rows)
+            model.do_multirow_insert(connection, cl_bundle_dependency, dependency_rows)
+            model.do_multirow_insert(connection, cl_bundle_memo, memo_rows)
+    return lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-bundles', type=int, default=1000000)
+    parser.add_argument('--num-commands', type=int, default=1000)
+    parser.add_argument('--num-parents', type=int, default=10000)
+    parser.add_argument('--num-users', type=int, default=100)
+    parser.add_argument('--num-lookups', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    model = SQLiteModel(default_user_info={}, root_user_id='0', system_user_id='-1')
+    rng = random.Random(args.seed)
+    start_time = time.time()
+    lookups = insert_bundles(
+        model, args.num_bundles, args.num_commands, args.num_parents, args.num_users, rng
+    )[: args.num_lookups]
+    print('Inserted %d run bundles in %.1fs' % (args.num_bundles, time.time() - start_time))
+
+    results = {}
+    for name, get_memoized_bundles in [
+        ('legacy', lambda *lookup: legacy_get_memoized_bundles(model, *lookup)),
+        ('memo key', model.get_memoized_bundles),
+    ]:
+        start_time = time.time()
+        results[name] = [get_memoized_bundles(*lookup) for lookup in lookups]
+        elapsed = time.time() - start_time
+        print(
+            '%-8s: %d lookups in %.2fs (%.2f ms/lookup)'
+            % (name, len(lookups), elapsed, elapsed / len(lookups) * 1000)
+        )
+    mismatches = sum(
+        set(legacy) != set(memo) for legacy, memo in zip(results['legacy'], results['memo key'])
+    )
+    print('%d/%d lookups returned different bundles' % (mismatches, len(lookups)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark comparing the throughput of MultiReaderFileStream, which stores its window in a
+preallocated ring buffer, with the previous implementation, which appended every chunk read from
+the source to an immutable bytes buffer and trimmed it by slicing.
+
+The two readers mimic BlobStorageUploader.write_fileobj: one reader uploads the stream in 1 MiB
+chunks and the other reads it in smaller chunks, like the indexer does. The source stream is
+generated in memory, so no disk or blob storage is needed. Run from the repository root:
+
+    python -m tests.stress.multireaderfilestream_benchmark --size-gb 4
+"""
+import argparse
+import os
+import time
+from io import BytesIO, SEEK_SET, SEEK_END
+from threading import Lock, Thread
+
+from codalab.lib.beam.MultiReaderFileStream import MultiReaderFileStream
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+class GeneratedStream:
+    """
+    File object that returns size bytes built by repeating a random 1 MiB block.
+    """
+
+    def __init__(self, size):
+        self._block = os.urandom(MB)
+        self._remaining = size
+        self._offset = 0
+
+    def read(self, num_bytes):
+        num_bytes = min(num_bytes, self._remaining, MB - self._offset)
+        s = self._block[self._offset : self._offset + num_bytes]
+        self._offset = (self._offset + num_bytes) % MB
+        self._remaining -= num_bytes
+        return s
+
+
+class LegacyMultiReaderFileStream(BytesIO):
+    """
+    MultiReaderFileStream as it was before the ring buffer was added.
+    """
+
+    NUM_READERS = 2
+
+    def __init__(self, fileobj, lookback_length=32 * MB):
+        self._buffer = bytes()
+        self._buffer_start_pos = 0
+        self._pos = [0 for _ in range(self.NUM_READERS)]
+        self._fileobj = fileobj
+        self._lock = Lock()
+
+        class FileStreamReader(BytesIO):
+            def __init__(s, index):
+                s._index = index
+
+            def read(s, num_bytes=None):
+                return self.read(s._index, num_bytes)
+
+            def close(s):
+                pass
+
+        self.readers = [FileStreamReader(i) for i in range(0, self.NUM_READERS)]
+        self.LOOKBACK_LENGTH = lookback_length
+        self.MAX_THRESHOLD = self.LOOKBACK_LENGTH * 2
+
+    def _fill_buf_bytes(self, num_bytes=0):
+        s = self._fileobj.read(num_bytes)
+        if not s:
+            return
+        self._buffer += s
+
+    def read(self, index, num_bytes):  # type: ignore
+        s = self.peek(index, num_bytes)
+        with self._lock:
+            self._pos[index] += len(s)
+            diff = (min(self._pos) - self.LOOKBACK_LENGTH) - self._buffer_start_pos
+            if diff > 0:
+                self._buffer = self._buffer[diff:]
+                self._buffer_start_pos += diff
+        return s
+
+    def peek(self, index, num_bytes):  # type: ignore
+        new_pos = self._pos[index] + num_bytes
+        while new_pos - self._buffer_start_pos > self.MAX_THRESHOLD:
+            time.sleep(0.1)
+        with self._lock:
+            new_bytes_needed = new_pos - max(self._pos)
+            if new_bytes_needed > 0:
+                self._fill_buf_bytes(new_bytes_needed)
+            buffer_index = self._pos[index] - self._buffer_start_pos
+            s = self._buffer[buffer_index : buffer_index + num_bytes]
+        return s
+
+    def seek(self, index, offset, whence=SEEK_SET):
+        if whence != SEEK_END:
+            self._pos[index] = offset
+
+
+def run(stream_cls, size, index_chunk_size):
+    stream = stream_cls(GeneratedStream(size))
+    upload_reader, index_reader = stream.readers
+    bytes_read = [0, 0]
+
+    def read_all(i, reader, chunk_size):
+        while True:
+            s = reader.read(chunk_size)
+            if not s:
+                break
+            bytes_read[i] += len(s)
+        reader.close()
+
+    threads = [
+        Thread(target=read_all, args=(0, upload_reader, MB)),
+        Thread(target=read_all, args=(1, index_reader, index_chunk_size)),
+    ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    assert bytes_read == [size, size], bytes_read
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-gb', type=float, default=4)
+    parser.add_argument('--index-chunk-kb', type=int, default=64)
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    size = int(args.size_gb * GB)
+    index_chunk_size = args.index_chunk_kb * 1024
+    implementations = [('ring buffer', MultiReaderFileStream)]
+    if not args.skip_legacy:
+        implementations.append(('legacy', LegacyMultiReaderFileStream))
+    for name, stream_cls in implementations:
+        elapsed = run(stream_cls, size, index_chunk_size)
+        print(
+            '%-12s %.2f GiB in %.2f s (%.0f MiB/s)'
+            % (name, size / GB, elapsed, size / MB / elapsed)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark comparing sequential JsonApiClient.fetch('bundles', uuid) calls made with a new
+connection for each request, as RestClient used to do with urllib.request.urlopen, and with
+the keep-alive connections of a ConnectionPool.
+
+The requests go to a local HTTP/1.1 server that returns a small bundle document, so the
+benchmark measures the client and connection overhead. With --tls, the server uses a
+self-signed certificate made with the openssl command, like an HTTPS CodaLab server; over a
+real network, each new connection also costs several round trips. Run from the repository root:
+
+    python -m tests.stress.rest_client_benchmark --num-requests 1000 --tls
+"""
+import argparse
+import http.server
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from codalab.client.json_api_client import JsonApiClient
+from codalab.common import urlopen_with_retry
+from codalab.lib.spec_util import generate_uuid
+from codalab.worker.connection_pool import ConnectionPool
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        uuid = self.path.split('?')[0].rsplit('/', 1)[-1]
+        body = json.dumps(
+            {
+                'data': {
+                    'type': 'bundles',
+                    'id': uuid,
+                    'attributes': {'uuid': uuid, 'name': 'run', 'state': 'ready'},
+                }
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LegacyTransport(object):
+    """Opens a new connection for every request, like RestClient used to."""
+
+    @staticmethod
+    def urlopen_with_retry(request, timeout):
+        return urlopen_with_retry(request, timeout=timeout)
+
+
+def use_self_signed_certificate(server, directory):
+    """Serves HTTPS with a new certificate for 127.0.0.1, which clients are made to trust."""
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    subprocess.check_call(
+        [
+            'openssl',
+            'req',
+            '-x509',
+            '-newkey',
+            'rsa:2048',
+            '-nodes',
+            '-days',
+            '1',
+            '-subj',
+            '/CN=127.0.0.1',
+            '-addext',
+            'subjectAltName=IP:127.0.0.1',
+            '-keyout',
+            key_path,
+            '-out',
+            cert_path,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    os.environ['SSL_CERT_FILE'] = cert_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-requests', type=int, default=1000)
+    parser.add_argument('--tls', action='store_true', help='Serve HTTPS instead of HTTP.')
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    directory = tempfile.mkdtemp()
+    if args.tls:
+        use_self_signed_certificate(server, directory)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = '%s://127.0.0.1:%d' % ('https' if args.tls else 'http', server.server_address[1])
+    uuids = [generate_uuid() for _ in range(args.num_requests)]
+    try:
+        for name, pool in [('new connections', LegacyTransport()), ('pooled', ConnectionPool())]:
+            client = JsonApiClient(address, lambda: None)
+            client._pool = pool
+            start = time.time()
+            for uuid in uuids:
+                assert client.fetch('bundles', uuid)['uuid'] == uuid
+            elapsed = time.time() - start
+            print(
+                '%-16s %d fetches in %.2f s (%.2f ms/fetch)'
+                % (name + ':', args.num_requests, elapsed, elapsed / args.num_requests * 1000)
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
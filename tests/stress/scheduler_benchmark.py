@@ -0,0 +1,148 @@
+"""
+Benchmark comparing the two ways the BundleManager can look up the workers that fit a staged
+bundle: filtering and sorting the full list of workers for every bundle, and taking the
+workers from a WorkerCapacityIndex in order of preference until the first one that fits.
+
+No database is needed; workers and bundles are synthetic. Both paths dispatch the same bundles
+to identical copies of the workers. Run from the repository root:
+
+    python -m tests.stress.scheduler_benchmark --num-workers 5000 --num-bundles 50000
+
+The full scan takes about ten minutes at this scale; pass --skip-full-scan to only time the
+index, or a smaller --num-bundles to compare both quickly.
+"""
+import argparse
+import random
+import time
+from collections import namedtuple
+from unittest.mock import Mock
+
+from codalab.lib.codalab_manager import CodaLabManager
+from codalab.server.bundle_manager import BundleManager
+from codalab.server.worker_capacity_index import WorkerCapacityIndex
+from codalab.worker.bundle_state import RunResources
+
+GB = 1024 * 1024 * 1024
+Dependency = namedtuple('Dependency', ['parent_uuid', 'parent_path'])
+
+
+def make_workers(num_workers, num_datasets, rng):
+    workers = []
+    for i in range(num_workers):
+        tag = 'queue-%d' % rng.randrange(10) if rng.random() < 0.05 else None
+        gpus = rng.choice([0, 0, 0, 0, 1, 2, 4, 8])
+        workers.append(
+            {
+                'worker_id': 'worker-%d' % i,
+                'user_id': 'root',
+                # Most workers of a busy instance only have a few CPUs left.
+                'cpus': rng.choice([0, 0, 0, 1, 2, 4, 8, 16]),
+                'gpus': gpus,
+                'has_gpus': gpus > 0,
+                'memory_bytes': rng.choice([4, 8, 16, 32, 64]) * GB,
+                'free_disk_bytes': rng.choice([10, 100, 1000]) * GB,
+                'exit_after_num_runs': 999999999,
+                'tag': tag,
+                'tag_exclusive': tag is not None and rng.random() < 0.5,
+                'run_uuids': ['run-%d-%d' % (i, j) for j in range(rng.randrange(4))],
+                'dependencies': [
+                    ('dataset-%d' % rng.randrange(num_datasets), '') for _ in range(5)
+                ],
+                'shared_file_system': False,
+            }
+        )
+    return workers
+
+
+def make_bundles(num_bundles, num_datasets, rng):
+    bundles = []
+    for i in range(num_bundles):
+        bundle = Mock(uuid='bundle-%d' % i)
+        bundle.dependencies = [
+            Dependency('dataset-%d' % rng.randrange(num_datasets), '')
+            for _ in range(rng.randrange(3))
+        ]
+        bundle_resources = RunResources(
+            cpus=rng.choice([1, 1, 2, 4, 8]),
+            gpus=rng.choice([0, 0, 0, 1, 2]),
+            docker_image='codalab/default-cpu:latest',
+            time=3600,
+            memory=rng.choice([2, 4, 8, 16]) * GB,
+            disk=rng.choice([1, 10]) * GB,
+            network=False,
+            tag='queue-%d' % rng.randrange(10) if rng.random() < 0.02 else None,
+            tag_exclusive=False,
+            runs_left=None,
+        )
+        bundles.append((bundle, bundle_resources))
+    return bundles
+
+
+def start_bundle(worker, bundle_resources):
+    worker['cpus'] -= bundle_resources.cpus
+    worker['gpus'] -= bundle_resources.gpus
+    worker['memory_bytes'] -= bundle_resources.memory
+    worker['exit_after_num_runs'] -= 1
+
+
+def dispatch_full_scan(bundle_manager, workers, bundles):
+    started = 0
+    for bundle, bundle_resources in bundles:
+        workers_list = bundle_manager._filter_and_sort_workers(workers, bundle, bundle_resources)
+        if workers_list:
+            start_bundle(workers_list[0], bundle_resources)
+            started += 1
+    return started
+
+
+def dispatch_indexed(bundle_manager, workers, bundles):
+    worker_index = WorkerCapacityIndex(workers)
+    started = 0
+    for bundle, bundle_resources in bundles:
+        for worker in bundle_manager._get_sorted_workers([worker_index], bundle, bundle_resources):
+            start_bundle(worker, bundle_resources)
+            worker_index.update(worker)
+            started += 1
+            break
+    return started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-workers', type=int, default=5000)
+    parser.add_argument('--num-bundles', type=int, default=50000)
+    parser.add_argument('--num-datasets', type=int, default=1000)
+    parser.add_argument(
+        '--skip-full-scan', action='store_true', help='Only time the WorkerCapacityIndex path.'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    codalab_manager = Mock(CodaLabManager)
+    codalab_manager.config = {'workers': {'default_cpu_image': 'codalab/default-cpu:latest'}}
+    bundle_manager = BundleManager(codalab_manager)
+    # Recommendations for bundles that don't fit anywhere are only written to the database.
+    bundle_manager._set_staged_status = lambda bundle, staged_status: None
+    bundle_manager._get_resource_recommendations = lambda run_resources, workers_list: ''
+
+    rng = random.Random(args.seed)
+    workers = make_workers(args.num_workers, args.num_datasets, rng)
+    bundles = make_bundles(args.num_bundles, args.num_datasets, rng)
+    print('%d workers, %d staged bundles' % (len(workers), len(bundles)))
+
+    paths = [('full scan', dispatch_full_scan), ('indexed', dispatch_indexed)]
+    if args.skip_full_scan:
+        paths = paths[1:]
+    for name, dispatch in paths:
+        workers_copy = [dict(worker) for worker in workers]
+        start_time = time.time()
+        started = dispatch(bundle_manager, workers_copy, bundles)
+        elapsed = time.time() - start_time
+        print(
+            '%-9s: dispatched %d/%d bundles in %.2fs (%.3f ms/bundle)'
+            % (name, started, len(bundles), elapsed, elapsed / len(bundles) * 1000)
+        )
+
+
+if __name__ == '__main__':
+    main()
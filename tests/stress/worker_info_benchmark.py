@@ -0,0 +1,122 @@
+"""
+Benchmark comparing the two ways WorkerInfoAccessor can index the workers of the bundle manager:
+rebuilding its indexes on each fetch with one group membership query per worker, as it used to
+do, and updating them incrementally with a single membership query for all the workers' groups.
+
+Workers, each in one of a few groups with a few members, are checked in to an in-memory SQLite
+database. Run from the repository root:
+
+    python -m tests.stress.worker_info_benchmark --num-workers 100 1000
+"""
+import argparse
+import datetime
+import tempfile
+import time
+from collections import defaultdict
+
+from codalab.lib.spec_util import generate_uuid
+from codalab.model.sqlite_model import SQLiteModel
+from codalab.model.worker_model import WorkerModel
+from codalab.server.worker_info_accessor import WorkerInfoAccessor
+
+ROOT_USER_ID = '0'
+DEFAULT_USER_INFO = {
+    'time_quota': 10 ** 9,
+    'disk_quota': 10 ** 15,
+    'parallel_run_quota': 3,
+}
+
+
+class LegacyWorkerInfoAccessor(WorkerInfoAccessor):
+    """Rebuilds the indexes on each fetch, with one membership query per worker."""
+
+    def _fetch_workers(self):
+        self._workers = {worker['worker_id']: worker for worker in self._worker_model.get_workers()}
+        self._last_fetch = datetime.datetime.utcnow()
+        self._uuid_to_worker_id = {}
+        self._user_id_to_worker_ids = defaultdict(dict)
+
+        for worker_id, worker in self._workers.items():
+            for uuid in worker['run_uuids']:
+                self._uuid_to_worker_id[uuid] = worker_id
+
+            owner_id = worker['user_id']
+            self._user_id_to_worker_ids[owner_id][worker_id] = None
+
+            memberships = self._model.batch_get_user_in_group(group_uuid=worker['group_uuid'])
+            for m in memberships:
+                if m['user_id'] != owner_id:
+                    self._user_id_to_worker_ids[m['user_id']][worker_id] = None
+
+            worker['has_gpus'] = True if worker['gpus'] > 0 else False
+
+
+def make_models(num_workers, num_groups, members_per_group, socket_dir):
+    model = SQLiteModel(
+        default_user_info=DEFAULT_USER_INFO, root_user_id=ROOT_USER_ID, system_user_id='-1'
+    )
+    worker_model = WorkerModel(model.engine, socket_dir, None)
+    user_ids = []
+    for i in range(num_groups * members_per_group):
+        user_id = generate_uuid()
+        model.add_user(
+            'user%d' % i, 'user%d@example.com' % i, 'Test', 'User', 'password', '', user_id=user_id
+        )
+        user_ids.append(user_id)
+    for i in range(num_groups):
+        group = model.create_group(
+            {'name': 'group%d' % i, 'user_defined': True, 'owner_id': ROOT_USER_ID}
+        )
+        for user_id in user_ids[i * members_per_group : (i + 1) * members_per_group]:
+            model.add_user_in_group(user_id, group['uuid'], False)
+    for i in range(num_workers):
+        worker_model.worker_checkin(
+            user_ids[i % len(user_ids)],
+            'worker-%d' % i,
+            None,
+            'group%d' % (i % num_groups),
+            4,
+            0,
+            16 * 1024 ** 3,
+            100 * 1024 ** 3,
+            [],
+            False,
+            False,
+            1000,
+            False,
+            False,
+        )
+    return model, worker_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-workers', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--num-groups', type=int, default=10)
+    parser.add_argument('--members-per-group', type=int, default=5)
+    parser.add_argument('--refreshes', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        for num_workers in args.num_workers:
+            model, worker_model = make_models(
+                num_workers, args.num_groups, args.members_per_group, socket_dir
+            )
+            times = {}
+            for name, accessor_class in [
+                ('per-worker', LegacyWorkerInfoAccessor),
+                ('batched', WorkerInfoAccessor),
+            ]:
+                accessor = accessor_class(model, worker_model, timeout_seconds=3600)
+                start = time.time()
+                for _ in range(args.refreshes):
+                    accessor.refresh()
+                times[name] = (time.time() - start) / args.refreshes
+            print(
+                '%5d workers: per-worker queries %.1f ms/refresh, batched %.1f ms/refresh'
+                % (num_workers, times['per-worker'] * 1000, times['batched'] * 1000)
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import threading
+import time
+import unittest
+
+from codalab.lib.beam.blobstorageuploader import BlobStorageUploader
+
+MB = 1024 * 1024
+
+
+class FakeBlobClient:
+    """Records the blocks staged and committed to a blob. Staging a block takes delay seconds."""
+
+    def __init__(self, delay=0, fail_block=None):
+        self.delay = delay
+        self.fail_block = fail_block
+        self.blocks = {}
+        self.committed = None
+        self.lock = threading.Lock()
+        self.bytes_in_flight = 0
+        self.max_bytes_in_flight = 0
+
+    def get_blob_client(self, container, blob):
+        return self
+
+    def stage_block(self, block_id, data):
+        with self.lock:
+            self.bytes_in_flight += len(data)
+            self.max_bytes_in_flight = max(self.max_bytes_in_flight, self.bytes_in_flight)
+            block_number = len(self.blocks) + 1
+        try:
+            time.sleep(self.delay)
+            if block_number == self.fail_block:
+                raise IOError('stage_block failed')
+            with self.lock:
+                self.blocks[block_id] = data
+        finally:
+            with self.lock:
+                self.bytes_in_flight -= len(data)
+
+    def commit_block_list(self, block_list, content_settings=None):
+        self.committed = b''.join(self.blocks[block.id] for block in block_list)
+
+
+class BlobStorageUploaderTest(unittest.TestCase):
+    def upload(self, client, data, **kwargs):
+        uploader = BlobStorageUploader(client, 'azfs://account/bundles/uuid/contents.gz', **kwargs)
+        view = memoryview(data)
+        for i in range(0, len(data), MB):
+            uploader.put(view[i : i + MB])
+        uploader.finish()
+
+    def test_blocks_committed_in_order(self):
+        client = FakeBlobClient()
+        data = bytes(i % 251 for i in range(130 * MB // 64)) * 64
+        self.upload(client, data)
+        self.assertEqual(data, client.committed)
+        self.assertGreater(len(client.blocks), 1)
+
+    def test_concurrent_blocks_bounded_by_memory(self):
+        """Blocks are staged concurrently, but no more than max_buffered_bytes at a time."""
+        client = FakeBlobClient(delay=0.05)
+        data = b'a' * (200 * MB)
+        self.upload(
+            client,
+            data,
+            num_upload_threads=8,
+            max_buffered_bytes=2 * BlobStorageUploader.MIN_WRITE_SIZE,
+        )
+        self.assertEqual(data, client.committed)
+        self.assertEqual(2 * BlobStorageUploader.MIN_WRITE_SIZE, client.max_bytes_in_flight)
+
+    def test_error_raised(self):
+        """An error staging a block fails the upload instead of committing an incomplete blob."""
+        client = FakeBlobClient(fail_block=2)
+        with self.assertRaises(IOError):
+            self.upload(client, b'a' * (100 * MB))
+        self.assertIsNone(client.committed)
@@ -1,13 +1,15 @@
+import os
 import tempfile
 import time
 import unittest
 
+from io import BytesIO
 from threading import Thread
 
 from codalab.lib.beam.MultiReaderFileStream import MultiReaderFileStream
 
 FILESIZE = 100000000
-CHUNKSIZE = FILESIZE/10
+CHUNKSIZE = FILESIZE // 10
 
 class MultiReaderFileStreamTest(unittest.TestCase):
     def test_reader_distance(self):
@@ -19,6 +21,7 @@ class MultiReaderFileStreamTest(unittest.TestCase):
         with tempfile.NamedTemporaryFile(delete=True) as f:
             f.seek(FILESIZE - 1)
             f.write(b"\0")
+            f.seek(0)
 
             m_stream = MultiReaderFileStream(f)
             reader_1 = m_stream.readers[0]
@@ -51,19 +54,26 @@ class MultiReaderFileStreamTest(unittest.TestCase):
             # Sleep a little for thread 2 to start reading
             time.sleep(.5)
 
-            # Assert that the first reader is at 100000000, second reader is at 40000000
-            self.assertEqual(FILESIZE, m_stream._pos[0])
+            # Assert that the second reader is at 40000000, and the first reader is at 70000000,
+            # since reading up to 80000000 would put it more than MAX_THRESHOLD past the buffer start
+            self.assertEqual(70000000, m_stream._pos[0])
             self.assertEqual(40000000, m_stream._pos[1])
 
             # Assert that the buffer is at 6445568 (40000000 - LOOKBACK_LENGTH)
             calculated_buffer_start_pos = 40000000 - m_stream.LOOKBACK_LENGTH
             self.assertEqual(calculated_buffer_start_pos, m_stream._buffer_start_pos)
 
-            # Assert that the buffer is length 100000000 - 6445568 
-            self.assertEqual(FILESIZE - calculated_buffer_start_pos, len(m_stream._buffer))
+            # Assert that the buffer holds 70000000 - 6445568 bytes
+            self.assertEqual(
+                70000000 - calculated_buffer_start_pos,
+                m_stream._buffer_end_pos - m_stream._buffer_start_pos,
+            )
 
+            # Closing the second reader lets the first reader read to the end
+            reader_2.close()
             t1.join()
             t2.join()
+            self.assertEqual(FILESIZE, m_stream._pos[0])
     
     def test_backwards_seek(self):
         """
@@ -73,12 +83,14 @@ class MultiReaderFileStreamTest(unittest.TestCase):
         with tempfile.NamedTemporaryFile(delete=True) as f:
             f.seek(FILESIZE - 1)
             f.write(b"\0")
+            f.seek(0)
 
             m_stream = MultiReaderFileStream(f)
             reader_1 = m_stream.readers[0]
             reader_2 = m_stream.readers[1]
 
             result = None
+            buffer_start_pos = None
 
             def thread1():
                 while True:
@@ -87,17 +99,20 @@ class MultiReaderFileStreamTest(unittest.TestCase):
                         break
 
             def thread2():
+                nonlocal result, buffer_start_pos
                 # This reader will only read 4/10 of the file, then seek to 10000000 and read another 4/10 of the file
                 for _ in range(4):
                     reader_2.read(CHUNKSIZE)
-                
+
                 try:
                     reader_2.seek(10000000)
-                except AssertionError as e: 
+                except AssertionError as e:
                     result = e
 
                 for _ in range(4):
                     reader_2.read(CHUNKSIZE)
+                buffer_start_pos = m_stream._buffer_start_pos
+                reader_2.close()
 
             t1 = Thread(target=thread1)
             t2 = Thread(target=thread2)
@@ -111,7 +126,7 @@ class MultiReaderFileStreamTest(unittest.TestCase):
 
             # Check that reader 2 is at 50000000 and buffer position is correct
             self.assertEqual(50000000, m_stream._pos[1])
-            self.assertEqual(50000000 - m_stream.LOOKBACK_LENGTH, m_stream._buffer_start_pos)
+            self.assertEqual(50000000 - m_stream.LOOKBACK_LENGTH, buffer_start_pos)
 
 
     def test_too_far_seek(self):
@@ -123,6 +138,7 @@ class MultiReaderFileStreamTest(unittest.TestCase):
         with tempfile.NamedTemporaryFile(delete=True) as f:
             f.seek(FILESIZE - 1)
             f.write(b"\0")
+            f.seek(0)
 
             m_stream = MultiReaderFileStream(f)
             reader_1 = m_stream.readers[0]
@@ -137,14 +153,16 @@ class MultiReaderFileStreamTest(unittest.TestCase):
                         break
 
             def thread2():
+                nonlocal result
                 # This reader will only read 4/10 of the file, then seek to the beginning
                 for _ in range(4):
                     reader_2.read(CHUNKSIZE)
-                
+
                 try:
                     reader_2.seek(0)
-                except AssertionError as e: 
+                except AssertionError as e:
                     result = e
+                reader_2.close()
 
             t1 = Thread(target=thread1)
             t2 = Thread(target=thread2)
@@ -155,3 +173,58 @@ class MultiReaderFileStreamTest(unittest.TestCase):
             t2.join()
 
             self.assertIsInstance(result, AssertionError)
+
+    def test_wraparound_contents(self):
+        """
+        This test verifies that readers reading at different speeds get the
+        exact contents of the file, including reads that wrap around the end
+        of the ring buffer.
+        """
+        data = os.urandom(1000003)
+        m_stream = MultiReaderFileStream(BytesIO(data), lookback_length=4096, num_readers=3)
+        results = [bytearray() for _ in m_stream.readers]
+
+        def read_all(index, chunk_size):
+            reader = m_stream.readers[index]
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    break
+                results[index] += chunk
+
+        def readinto_all(index, chunk_size):
+            reader = m_stream.readers[index]
+            buf = bytearray(chunk_size)
+            while True:
+                n = reader.readinto(buf)
+                if not n:
+                    break
+                results[index] += buf[:n]
+
+        threads = [
+            Thread(target=read_all, args=(0, 1000)),
+            Thread(target=read_all, args=(1, 3001)),
+            Thread(target=readinto_all, args=(2, 777)),
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for result in results:
+            self.assertEqual(data, bytes(result))
+        self.assertEqual(8192, len(m_stream._buffer))
+
+    def test_peek(self):
+        """
+        This test verifies that peek returns the next bytes without moving the reader.
+        """
+        m_stream = MultiReaderFileStream(BytesIO(b"abcdefgh"), lookback_length=8)
+        reader_1 = m_stream.readers[0]
+        reader_2 = m_stream.readers[1]
+        self.assertEqual(b"abc", reader_1.peek(3))
+        self.assertEqual(b"abcd", reader_1.read(4))
+        self.assertEqual(b"ab", reader_2.read(2))
+        self.assertEqual(b"efgh", reader_1.read(10))
+        self.assertEqual(b"", reader_1.read(10))
+        self.assertEqual(b"cdefgh", reader_2.read(10))
@@ -51,6 +51,25 @@ class PathUtilFSTest(unittest.TestCase):
             # Test idempotency. An absolute path be a fixed point of normalize.
             self.assertEqual(path_util.normalize(actual_result), actual_result)
 
+    def test_link_or_copy_hardlink(self):
+        dest_path = os.path.join(self.temp_directory, 'linked_bundle')
+        self.assertEqual(
+            path_util.link_or_copy(self.bundle_path, dest_path, 'hardlink'), 'hardlink'
+        )
+        (directories, files) = path_util.recursive_ls(dest_path)
+        self.assertEqual(
+            set(files),
+            {file_name.replace(self.bundle_path, dest_path) for file_name in self.bundle_files},
+        )
+        for file_name in self.bundle_files:
+            self.assertTrue(
+                os.path.samefile(file_name, file_name.replace(self.bundle_path, dest_path))
+            )
+
+    def test_link_or_copy_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            path_util.link_or_copy(self.bundle_path, os.path.join(self.temp_directory, 'x'), 'move')
+
     def test_recursive_ls(self):
         '''
     Test that recursive_ls lists all absolute paths within a directory.
@@ -1,6 +1,7 @@
 import tests.unit.azure_blob_mock  # noqa: F401
 
 import gzip
+import hashlib
 import os
 import tarfile
 import tempfile
@@ -12,10 +13,13 @@ from apache_beam.io.filesystems import FileSystems
 from io import BytesIO
 from memory_profiler import memory_usage
 from typing import IO, cast
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from urllib.response import addinfourl
 
+from codalab.common import UsageError
+from codalab.worker.bundle_state import State
 from codalab.worker.file_util import gzip_bytestring, remove_path, tar_gzip_directory
+from codalab.worker.upload_util import build_upload_manifest
 from tests.unit.server.bundle_manager import TestBase
 
 urlopen_real = urllib.request.urlopen
@@ -198,6 +202,154 @@ class UploadManagerTestBase(TestBase):
         )
         self.assertEqual(max(mem_usage) < 100000000, True)
 
+    def do_staged_upload(self, source):
+        """Uploads the directory at source with a delta upload, staging only the files that
+        the server is missing. Returns the hashes of the files that were staged."""
+        manifest = build_upload_manifest(source)
+        files = {entry['sha256']: entry['path'] for entry in manifest if entry['type'] == 'file'}
+        missing = self.upload_manager.get_missing_staged_files(self.bundle, list(files))
+        for sha256 in missing:
+            with open(os.path.join(source, files[sha256]), 'rb') as f:
+                self.upload_manager.stage_file(self.bundle, sha256, f)
+        # Like PUT /bundles/<uuid>/contents/manifest/, remove the contents of a previous upload
+        # first. Uploads to Blob Storage overwrite the contents blob instead.
+        if not self.use_azure_blob_beta and self.upload_manager.has_contents(self.bundle):
+            self.upload_manager.cleanup_existing_contents(self.bundle)
+        self.upload_manager.upload_staged_contents_to_bundle_store(
+            self.bundle, manifest, use_azure_blob_beta=self.use_azure_blob_beta
+        )
+        return missing
+
+    def test_staged_contents(self):
+        source = os.path.join(self.temp_dir, 'source_dir')
+        os.makedirs(os.path.join(source, 'subdir'))
+        self.write_string_to_file('testing', os.path.join(source, 'file1'))
+        self.write_string_to_file('testing', os.path.join(source, 'subdir', 'file2'))
+        self.write_string_to_file('other', os.path.join(source, 'file3'))
+        self.assertEqual(2, len(self.do_staged_upload(source)))
+        self.assertTrue({'file1', 'file3', 'subdir'} <= set(self.listdir()))
+        self.check_file_equals_string('subdir/file2', 'testing')
+        self.check_file_equals_string('file3', 'other')
+
+        # Uploading again only stages the file that changed.
+        self.write_string_to_file('changed', os.path.join(source, 'file3'))
+        self.assertEqual(
+            [hashlib.sha256(b'changed').hexdigest()], self.do_staged_upload(source)
+        )
+        self.check_file_equals_string('file3', 'changed')
+
+        self.upload_manager.cleanup_staged_files(self.bundle.uuid)
+        self.assertEqual(2, len(self.do_staged_upload(source)))
+
+    def test_staged_file_hash_mismatch(self):
+        with self.assertRaises(UsageError):
+            self.upload_manager.stage_file(
+                self.bundle, hashlib.sha256(b'testing').hexdigest(), BytesIO(b'other')
+            )
+        self.assertEqual(
+            [hashlib.sha256(b'testing').hexdigest()],
+            self.upload_manager.get_missing_staged_files(
+                self.bundle, [hashlib.sha256(b'testing').hexdigest()]
+            ),
+        )
+
+    def test_staged_files_count_against_disk_quota(self):
+        """Staged files should count against the owner's disk quota, across their bundles."""
+        model = self.codalab_manager.model()
+        user_info = model.get_user_info(self.user_id)
+        user_info['disk_quota'] = user_info['disk_used'] + 10
+        model.update_user_info(user_info)
+        self.upload_manager.stage_file(
+            self.bundle, hashlib.sha256(b'123456').hexdigest(), BytesIO(b'123456')
+        )
+        other_bundle = self.create_run_bundle()
+        self.save_bundle(other_bundle)
+        with self.assertRaises(UsageError):
+            self.upload_manager.stage_file(
+                other_bundle, hashlib.sha256(b'123456').hexdigest(), BytesIO(b'123456')
+            )
+        self.assertEqual(
+            [hashlib.sha256(b'123456').hexdigest()],
+            self.upload_manager.get_missing_staged_files(
+                other_bundle, [hashlib.sha256(b'123456').hexdigest()]
+            ),
+        )
+        # Staging a file again doesn't count it twice.
+        self.upload_manager.stage_file(
+            self.bundle, hashlib.sha256(b'123456').hexdigest(), BytesIO(b'123456')
+        )
+        self.upload_manager.stage_file(
+            other_bundle, hashlib.sha256(b'1234').hexdigest(), BytesIO(b'1234')
+        )
+
+    def test_staged_bytes_per_bundle_limit(self):
+        """The bytes staged for a bundle should be limited."""
+        self.upload_manager._max_staged_bytes_per_bundle = 10
+        self.upload_manager.stage_file(
+            self.bundle, hashlib.sha256(b'123456').hexdigest(), BytesIO(b'123456')
+        )
+        with self.assertRaises(UsageError):
+            self.upload_manager.stage_file(
+                self.bundle, hashlib.sha256(b'abcdef').hexdigest(), BytesIO(b'abcdef')
+            )
+
+    def test_staged_contents_invalid_manifest(self):
+        """A manifest whose entries don't match the staged files should be rejected."""
+        source = os.path.join(self.temp_dir, 'source_dir')
+        os.mkdir(source)
+        self.write_string_to_file('testing', os.path.join(source, 'file'))
+        self.do_staged_upload(source)
+        manifest = build_upload_manifest(source)
+        for key, value in [('size', 3), ('mode', None), ('mtime', '0')]:
+            invalid_manifest = [
+                dict(entry, **{key: value}) if entry['type'] == 'file' else entry
+                for entry in manifest
+            ]
+            with self.assertRaises(UsageError):
+                self.upload_manager.upload_staged_contents_to_bundle_store(
+                    self.bundle, invalid_manifest, use_azure_blob_beta=self.use_azure_blob_beta
+                )
+
+    def test_staged_contents_archive_error(self):
+        """An error while the archive is built should fail the upload."""
+        source = os.path.join(self.temp_dir, 'source_dir')
+        os.mkdir(source)
+        self.write_string_to_file('testing', os.path.join(source, 'file'))
+        with patch.object(tarfile.TarFile, 'addfile', side_effect=OSError('Disk error')):
+            with self.assertRaises(OSError):
+                self.do_staged_upload(source)
+
+    def test_cleanup_stale_staged_files(self):
+        """Files staged for bundles that were finalized, deleted or left inactive should be
+        removed."""
+        sha256 = hashlib.sha256(b'testing').hexdigest()
+        ready_bundle = self.create_run_bundle(State.READY)
+        self.save_bundle(ready_bundle)
+        deleted_bundle = self.create_run_bundle()
+        for bundle in (self.bundle, ready_bundle, deleted_bundle):
+            self.upload_manager.stage_file(bundle, sha256, BytesIO(b'testing'))
+
+        removed_uuids = self.upload_manager.cleanup_stale_staged_files(3600)
+        self.assertIn(ready_bundle.uuid, removed_uuids)
+        self.assertIn(deleted_bundle.uuid, removed_uuids)
+        self.assertNotIn(self.bundle.uuid, removed_uuids)
+        self.assertEqual([], self.upload_manager.get_missing_staged_files(self.bundle, [sha256]))
+        self.assertEqual(
+            [sha256], self.upload_manager.get_missing_staged_files(ready_bundle, [sha256])
+        )
+        self.assertIn(self.bundle.uuid, self.upload_manager.cleanup_stale_staged_files(-1))
+
+    def test_staged_contents_missing_file(self):
+        source = os.path.join(self.temp_dir, 'source_dir')
+        os.mkdir(source)
+        self.write_string_to_file('testing', os.path.join(source, 'file'))
+        with self.assertRaises(IOError):
+            self.upload_manager.upload_staged_contents_to_bundle_store(
+                self.bundle,
+                build_upload_manifest(source),
+                use_azure_blob_beta=self.use_azure_blob_beta,
+            )
+
     def write_string_to_file(self, string, file_path):
         with open(file_path, 'w') as f:
             f.write(string)
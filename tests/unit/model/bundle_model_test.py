@@ -1,5 +1,8 @@
+import json
 import unittest
-from tests.unit.server.bundle_manager import TestBase
+from tests.unit.server.bundle_manager import BASE_METADATA, TestBase
+from codalab.lib.spec_util import generate_uuid
+from codalab.objects.dependency import Dependency
 from codalab.worker.bundle_state import State
 from codalab.model.bundle_model import is_academic_email
 
@@ -23,6 +26,234 @@ class BundleModelTest(TestBase, unittest.TestCase):
         bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
         self.assertEqual(bundle.state, State.WORKER_OFFLINE)
 
+    def test_batch_fail_bundles(self):
+        """batch_fail_bundles should fail every bundle with its own failure message."""
+        bundles = [self.create_run_bundle(State.STAGED) for _ in range(3)]
+        for bundle in bundles:
+            self.save_bundle(bundle)
+        self.bundle_manager._model.batch_fail_bundles(
+            [(bundle, 'failure %d' % i) for i, bundle in enumerate(bundles[:2])]
+        )
+        for i, bundle in enumerate(bundles[:2]):
+            bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
+            self.assertEqual(bundle.state, State.FAILED)
+            self.assertEqual(bundle.metadata.failure_message, 'failure %d' % i)
+        bundle = self.bundle_manager._model.get_bundle(bundles[2].uuid)
+        self.assertEqual(bundle.state, State.STAGED)
+        self.assertEqual(bundle.metadata.failure_message, '')
+
+    def test_batch_bundle_checkin(self):
+        """batch_bundle_checkin should update every run and add up the usage of each owner."""
+        model = self.bundle_manager._model
+        running = self.create_run_bundle(State.RUNNING)
+        finalizing = self.create_run_bundle(State.RUNNING)
+        offline = self.create_run_bundle(State.WORKER_OFFLINE)
+        deleted = self.create_run_bundle(State.RUNNING)
+        self.save_bundle(running)
+        self.save_bundle(finalizing)
+        self.save_bundle(offline)
+        user_info = model.get_user_info(self.user_id)
+
+        worker_id = self.mock_worker_checkin(cpus=1)
+        checked_in = model.batch_bundle_checkin(
+            [
+                self.mock_worker_run(running, container_time_total=10, disk_utilization=100),
+                self.mock_worker_run(
+                    finalizing, State.FINALIZING, container_time_total=20, disk_utilization=50
+                ),
+                self.mock_worker_run(offline, State.RUNNING),
+                self.mock_worker_run(deleted),
+            ],
+            self.root_user_id,
+            worker_id,
+        )
+
+        self.assertEqual(
+            [running.uuid, finalizing.uuid, offline.uuid], [bundle.uuid for bundle in checked_in]
+        )
+        self.assertEqual(model.get_bundle(running.uuid).state, State.RUNNING)
+        self.assertEqual(model.get_bundle(running.uuid).metadata.time, 10)
+        finalizing = model.get_bundle(finalizing.uuid)
+        self.assertEqual(finalizing.state, State.FINALIZING)
+        self.assertEqual(finalizing.metadata.exitcode, 0)
+        self.assertEqual(model.get_bundle(offline.uuid).state, State.RUNNING)
+        self.assertEqual(model.get_bundle_worker(offline.uuid)['worker_id'], worker_id)
+        # The usage of each bundle is the difference with the usage in BASE_METADATA.
+        new_user_info = model.batch_get_user_info([self.user_id])[self.user_id]
+        self.assertAlmostEqual(
+            new_user_info['time_used'], user_info['time_used'] + 30 - 3 * BASE_METADATA['time'],
+        )
+        self.assertEqual(
+            new_user_info['disk_used'],
+            user_info['disk_used'] + 150 - 3 * BASE_METADATA['data_size'],
+        )
+
+    def test_batch_get_bundles_projection(self):
+        """batch_get_bundles should only load the requested columns, metadata keys and dependencies."""
+        bundle, parent = self.create_bundle_single_dep()
+        bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
+
+        (projected,) = self.bundle_manager._model.batch_get_bundles(
+            columns=('state',),
+            metadata_keys=('name', 'request_cpus'),
+            load_dependencies=False,
+            uuid=bundle.uuid,
+        )
+        self.assertEqual(projected.uuid, bundle.uuid)
+        self.assertEqual(projected.bundle_type, bundle.bundle_type)
+        self.assertEqual(projected.state, bundle.state)
+        self.assertFalse(hasattr(projected, 'command'))
+        self.assertEqual(
+            projected.metadata.to_dict(),
+            {'name': bundle.metadata.name, 'request_cpus': bundle.metadata.request_cpus},
+        )
+        self.assertEqual(projected.dependencies, [])
+
+        (projected,) = self.bundle_manager._model.batch_get_bundles(
+            columns=(), metadata_keys=(), uuid=bundle.uuid
+        )
+        self.assertEqual(projected.metadata.to_dict(), {})
+        self.assertEqual(
+            [dep.to_dict() for dep in projected.dependencies],
+            [dep.to_dict() for dep in bundle.dependencies],
+        )
+
+    def test_search_bundles_cursor(self):
+        """Paging through search results with .cursor should return every bundle once, in order."""
+        model = self.bundle_manager._model
+        bundles = [self.create_run_bundle(State.READY) for _ in range(5)]
+        for bundle in bundles:
+            self.save_bundle(bundle)
+        uuids = [bundle.uuid for bundle in bundles]
+
+        for keywords, expected_uuids in [
+            (['state=ready'], uuids),
+            (['state=ready', '.last'], uuids[::-1]),
+        ]:
+            result = model.search_bundles(model.root_user_id, keywords + ['.limit=2', '.cursor'])
+            pages = [result['result']]
+            while result['next_cursor'] is not None:
+                result = model.search_bundles(
+                    model.root_user_id,
+                    keywords + ['.limit=2', '.cursor=%s' % result['next_cursor']],
+                )
+                pages.append(result['result'])
+            self.assertEqual([len(page) for page in pages], [2, 2, 1])
+            self.assertEqual([uuid for page in pages for uuid in page], expected_uuids)
+
+    def test_search_bundles_search_index(self):
+        """Searches routed to the bundle_search table should return the same bundles as searches
+        on bundle_metadata, also after the metadata is updated."""
+        model = self.bundle_manager._model
+        bundles = []
+        for name, created, data_size in [
+            ('alpha', 1600000000, 30),
+            ('beta', 1700000000, 10),
+            ('alphabet', 1800000000, 20),
+        ]:
+            bundle = self.create_run_bundle(State.READY, {'name': name, 'data_size': data_size})
+            self.save_bundle(bundle)
+            # The created time is set when the bundle is constructed.
+            self.update_bundle(bundle, {'metadata': {'created': created}})
+            bundles.append(bundle)
+        self.update_bundle(bundles[1], {'metadata': {'name': 'alpha-2', 'data_size': 40}})
+
+        def search(keywords, use_search_index):
+            model.use_search_index = use_search_index
+            return model.search_bundles(model.root_user_id, keywords + ['.limit=10'])['result']
+
+        for keywords in [
+            ['alpha'],
+            ['name=alpha'],
+            ['name=alpha%'],
+            ['size=.sort'],
+            ['size=.sort-'],
+            ['created=.sort-', '.after=2022-01-01'],
+            ['.before=2025-01-01'],
+            ['alpha', 'size=.sort-'],
+            ['size=.sum'],
+        ]:
+            with_index, without_index = search(keywords, True), search(keywords, False)
+            if isinstance(with_index, list) and not any('.sort' in k for k in keywords):
+                # The order of unsorted results is unspecified.
+                with_index, without_index = sorted(with_index), sorted(without_index)
+            self.assertEqual(with_index, without_index, keywords)
+        self.assertEqual(
+            search(['alpha', 'size=.sort'], True),
+            [bundles[2].uuid, bundles[0].uuid, bundles[1].uuid],
+        )
+
+    def test_search_index_update_keeps_other_columns(self):
+        """Updating some search index keys through one bundle object shouldn't overwrite the
+        columns updated through another, stale object of the same bundle."""
+        model = self.bundle_manager._model
+        bundle = self.create_run_bundle(State.READY, {'name': 'before', 'data_size': 10})
+        self.save_bundle(bundle)
+        first, second = model.get_bundle(bundle.uuid), model.get_bundle(bundle.uuid)
+        self.update_bundle(first, {'metadata': {'name': 'after'}})
+        self.update_bundle(second, {'metadata': {'data_size': 20}})
+
+        model.use_search_index = True
+        self.assertEqual(
+            model.search_bundles(model.root_user_id, ['name=after'])['result'], [bundle.uuid]
+        )
+        self.assertEqual(model.search_bundles(model.root_user_id, ['name=before'])['result'], [])
+        self.assertEqual(
+            model.search_bundles(model.root_user_id, ['name=after', 'size=.sum'])['result'], 20
+        )
+
+    def test_get_memoized_bundles(self):
+        """get_memoized_bundles should return the bundles of the user with the same command and
+        the same set of dependencies, in the order they were created."""
+        model = self.bundle_manager._model
+        parent1, parent2 = generate_uuid(), generate_uuid()
+
+        def create(command, dependencies, owner_id=None):
+            bundle = self.create_run_bundle(State.READY)
+            bundle.command = command
+            bundle.owner_id = owner_id or self.user_id
+            bundle.dependencies = [
+                Dependency(
+                    {
+                        'child_uuid': bundle.uuid,
+                        'child_path': child_path,
+                        'parent_uuid': parent_uuid,
+                        'parent_path': '',
+                    }
+                )
+                for child_path, parent_uuid in dependencies
+            ]
+            self.save_bundle(bundle)
+            return bundle.uuid
+
+        def lookup(command, dependencies):
+            return model.get_memoized_bundles(
+                self.user_id,
+                command,
+                json.dumps(
+                    [
+                        {'child_path': child_path, 'parent_uuid': parent_uuid}
+                        for child_path, parent_uuid in dependencies
+                    ]
+                ),
+            )
+
+        no_deps = create('echo hello', [])
+        a_b = create('echo hello', [('a', parent1), ('b', parent2)])
+        a_b_again = create('echo hello', [('b', parent2), ('a', parent1)])
+        a = create('echo hello', [('a', parent1)])
+        create('echo hello2', [('a', parent1), ('b', parent2)])
+        create('echo hello', [('a', parent1), ('b', parent2)], owner_id=model.root_user_id)
+
+        self.assertEqual(lookup('echo hello', []), [no_deps])
+        self.assertEqual(lookup('echo hello', [('b', parent2), ('a', parent1)]), [a_b, a_b_again])
+        self.assertEqual(lookup('echo hello', [('a', parent2), ('b', parent1)]), [])
+        # Duplicate dependencies are ignored.
+        self.assertEqual(lookup('echo hello', [('a', parent1), ('a', parent1)]), [a])
+
+        model.delete_bundles([a_b])
+        self.assertEqual(lookup('echo hello', [('a', parent1), ('b', parent2)]), [a_b_again])
+
     def test_is_academic_email(self):
         """Unit test to check is_academic_email function."""
         test_cases = {
@@ -0,0 +1,205 @@
+import asyncio
+import gzip
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import closing
+
+import websockets
+
+from codalab.model.worker_model import STREAM_BUFFER_SIZE, WorkerModel
+from codalab.worker.bundle_state import State
+from tests.unit.server.bundle_manager import TestBase
+
+
+class WorkerModelSendStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.worker_model = WorkerModel(None, self.socket_dir, None)
+        self.data = os.urandom(2 * STREAM_BUFFER_SIZE + 17)
+
+    def tearDown(self):
+        shutil.rmtree(self.socket_dir)
+
+    def assertSent(self, fileobj, data):
+        """Checks that send_stream succeeds in sending fileobj, and that data is received."""
+        received = []
+        with closing(self.worker_model.start_listening('socket')) as sock:
+
+            def receive():
+                with closing(self.worker_model.get_stream(sock, 5)) as stream:
+                    received.append(stream.read())
+
+            thread = threading.Thread(target=receive)
+            thread.start()
+            self.assertTrue(self.worker_model.send_stream('socket', fileobj, 5))
+            thread.join()
+        self.assertEqual(len(received[0]), len(data))
+        self.assertTrue(received[0] == data)
+
+    def test_send_stream_buffer(self):
+        """send_stream should send all the data of a file-like object in memory."""
+        self.assertSent(io.BytesIO(self.data), self.data)
+
+    def test_send_stream_file(self):
+        """send_stream should send all the data of a regular file, starting at its current position."""
+        path = os.path.join(self.socket_dir, 'file')
+        with open(path, 'wb') as f:
+            f.write(self.data)
+        with open(path, 'rb') as f:
+            f.read(10)
+            self.assertSent(f, self.data[10:])
+
+    def test_send_stream_file_wrapper(self):
+        """send_stream should send the data read from a wrapper of a regular file, such as a
+        GzipFile, not the contents of the underlying file."""
+        path = os.path.join(self.socket_dir, 'file.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(self.data)
+        with gzip.open(path, 'rb') as f:
+            self.assertSent(f, self.data)
+
+    def test_send_stream_timeout(self):
+        """send_stream should give up if nothing listens on the socket."""
+        self.assertFalse(self.worker_model.send_stream('missing', io.BytesIO(self.data), 0.05))
+
+
+class WorkerModelWsPingTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = queue.Queue()
+        self.connections = []
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+        async def handler(websocket, path):
+            self.connections.append(websocket)
+            async for message in websocket:
+                self.messages.put((path, message))
+
+        async def serve():
+            return await websockets.serve(handler, 'localhost', 0)
+
+        self.server = self.run_in_loop(serve())
+        port = self.server.sockets[0].getsockname()[1]
+        self.worker_model = WorkerModel(None, None, 'ws://localhost:%d' % port)
+
+    def tearDown(self):
+        if self.worker_model._ws_connection is not None:
+            asyncio.run_coroutine_threadsafe(
+                self.worker_model._ws_connection.close(), self.worker_model._get_ws_loop()
+            ).result(5)
+        self.worker_model._get_ws_loop().call_soon_threadsafe(self.worker_model._get_ws_loop().stop)
+        self.server.close()
+        self.run_in_loop(self.server.wait_closed())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def run_in_loop(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(5)
+
+    def test_pings_share_connection(self):
+        """Pings should be sent on a single connection, from the same event loop."""
+        loop = self.worker_model._get_ws_loop()
+        self.worker_model._ping_worker_ws('worker1')
+        self.worker_model._ping_worker_ws('worker2')
+
+        self.assertIs(loop, self.worker_model._get_ws_loop())
+        self.assertTrue(loop.is_running())
+        self.assertEqual(self.messages.get(timeout=5), ('/main', 'worker1'))
+        self.assertEqual(self.messages.get(timeout=5), ('/main', 'worker2'))
+        self.assertEqual(len(self.connections), 1)
+
+    def test_ping_reconnects(self):
+        """A ping should reconnect to the ws-server if the ws-server closed the connection."""
+        self.worker_model._ping_worker_ws('worker1')
+        self.assertEqual(self.messages.get(timeout=5), ('/main', 'worker1'))
+        self.run_in_loop(self.connections[0].close())
+
+        self.worker_model._ping_worker_ws('worker2')
+        self.assertEqual(self.messages.get(timeout=5), ('/main', 'worker2'))
+        self.assertEqual(len(self.connections), 2)
+
+
+class WorkerModelCheckinTest(TestBase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.worker_model = self.bundle_manager._worker_model
+        self.user_id = self.bundle_manager._model.root_user_id
+        self.worker_id = self.mock_worker_checkin(cpus=1)
+
+    def get_dependencies(self):
+        (worker,) = [
+            worker
+            for worker in self.worker_model.get_workers()
+            if worker['worker_id'] == self.worker_id
+        ]
+        return sorted(worker['dependencies'])
+
+    def update(self, version, **kwargs):
+        return self.worker_model.update_worker_dependencies(
+            self.user_id, self.worker_id, version, **kwargs
+        )
+
+    def test_dependency_deltas(self):
+        self.assertTrue(self.update('v1', dependencies=[['0x1', 'a'], ['0x2', 'b']]))
+        self.assertTrue(self.update('v1'))
+        self.assertTrue(
+            self.update('v2', base_version='v1', added=[['0x3', 'c']], removed=[['0x1', 'a']])
+        )
+        self.assertEqual([('0x2', 'b'), ('0x3', 'c')], self.get_dependencies())
+
+    def test_dependencies_out_of_sync(self):
+        self.assertTrue(self.update('v1', dependencies=[['0x1', 'a']]))
+        # The server missed version v2.
+        self.assertFalse(self.update('v3', base_version='v2', added=[['0x3', 'c']], removed=[]))
+        self.assertFalse(self.update('v2'))
+        self.assertEqual([('0x1', 'a')], self.get_dependencies())
+
+    def test_dependencies_of_new_worker_out_of_sync(self):
+        self.worker_model.worker_cleanup(self.user_id, self.worker_id)
+        self.worker_id = self.mock_worker_checkin(cpus=1)
+        self.assertFalse(self.update('v1'))
+        self.assertEqual([], self.get_dependencies())
+
+    def checkin(self, cpus=1, free_disk_bytes=0):
+        self.worker_model.worker_checkin(
+            self.user_id,
+            self.worker_id,
+            None,
+            None,
+            cpus,
+            0,
+            0,
+            free_disk_bytes,
+            None,
+            False,
+            False,
+            999999999,
+            False,
+            False,
+        )
+        (worker,) = [w for w in self.worker_model.get_workers() if w['worker_id'] == self.worker_id]
+        return worker
+
+    def test_unchanged_checkin_skips_write(self):
+        (worker,) = [w for w in self.worker_model.get_workers() if w['worker_id'] == self.worker_id]
+        self.assertEqual(worker['checkin_time'], self.checkin(cpus=1)['checkin_time'])
+        self.assertLess(worker['checkin_time'], self.checkin(cpus=2)['checkin_time'])
+
+    def test_small_free_disk_change_skips_write(self):
+        worker = self.checkin(free_disk_bytes=1000)
+        self.assertEqual(1000, worker['free_disk_bytes'])
+        self.assertEqual(worker, self.checkin(free_disk_bytes=1005))
+        self.assertEqual(2000, self.checkin(free_disk_bytes=2000)['free_disk_bytes'])
+
+    def test_get_worker_run_uuids(self):
+        bundle = self.create_run_bundle(State.STAGED)
+        self.save_bundle(bundle)
+        self.assertEqual([], self.worker_model.get_worker_run_uuids(self.user_id, self.worker_id))
+        self.bundle_manager._model.transition_bundle_starting(bundle, self.user_id, self.worker_id)
+        self.assertEqual(
+            [bundle.uuid], self.worker_model.get_worker_run_uuids(self.user_id, self.worker_id)
+        )
@@ -1,4 +1,8 @@
+import io
+import unittest
+
 from .base import BaseTestCase
+from codalab.rest import bundles
 from freezegun import freeze_time
 
 
@@ -87,3 +91,20 @@ class BundlesTest(BaseTestCase):
                 }
             ],
         )
+
+
+class FollowStreamTest(unittest.TestCase):
+    def test_frees_follow_slot(self):
+        slots = bundles._follow_slots._value
+        for contents in [b'', b'x' * (bundles.FOLLOW_CHUNK_SIZE + 1)]:
+            bundles._follow_slots.acquire()
+            self.assertEqual(contents, b''.join(bundles._FollowStream(io.BytesIO(contents))))
+            self.assertEqual(slots, bundles._follow_slots._value)
+
+        # The client disconnected after the first chunk.
+        bundles._follow_slots.acquire()
+        stream = bundles._FollowStream(io.BytesIO(b'data'))
+        next(iter(stream))
+        stream.close()
+        stream.close()
+        self.assertEqual(slots, bundles._follow_slots._value)
@@ -274,21 +274,28 @@ class TestBase:
             worker_id ([type]): worker id of the worker that performs the checkin.
             user_id (optional): user id that performs the checkin. Defaults to the default user id.
         """
-        worker_run = BundleCheckinState(
+        worker_run = self.mock_worker_run(bundle)
+        self.bundle_manager._model.bundle_checkin(
+            bundle, worker_run, user_id or self.user_id, worker_id
+        )
+
+    def mock_worker_run(self, bundle, state=None, container_time_total=0, disk_utilization=0):
+        """Returns the BundleCheckinState of a bundle, as reported by a worker checkin."""
+        return BundleCheckinState(
             uuid=bundle.uuid,
             run_status="",
             bundle_start_time=0,
-            container_time_total=0,
+            container_time_total=container_time_total,
             container_time_user=0,
             container_time_system=0,
             docker_image="",
-            state=bundle.state,
+            state=state or bundle.state,
             remote="",
             exitcode=0,
             failure_message="",
             cpu_usage=0.0,
             memory_usage=0.0,
-            disk_utilization=0,
+            disk_utilization=disk_utilization,
             bundle_profile_stats={
                 RunStage.PREPARING: {'start': 15, 'end': 20, 'elapsed': 5},
                 RunStage.RUNNING: {'start': 15, 'end': 20, 'elapsed': 5},
@@ -297,9 +304,6 @@ class TestBase:
                 RunStage.FINALIZING: {'start': 15, 'end': 20, 'elapsed': 5},
             },
         )
-        self.bundle_manager._model.bundle_checkin(
-            bundle, worker_run, user_id or self.user_id, worker_id
-        )
 
 
 class BaseBundleManagerTest(TestBase, unittest.TestCase):
@@ -1,3 +1,6 @@
+from unittest.mock import Mock
+
+from codalab.server.bundle_manager import UNRESPONSIVE_BUNDLES_CHECK_INTERVAL_SECONDS
 from codalab.worker.bundle_state import State
 from freezegun import freeze_time
 from tests.unit.server.bundle_manager import BaseBundleManagerTest
@@ -23,3 +26,16 @@ class BundleManagerFailUnresponsiveBundlesTest(BaseBundleManagerTest):
             "Bundle has been stuck in uploading state for more than 60 days",
             bundle.metadata.failure_message,
         )
+
+    @freeze_time("2012-01-14", as_kwarg='frozen_time')
+    def test_check_interval(self, frozen_time):
+        """Unresponsive bundles are looked for at most every
+        UNRESPONSIVE_BUNDLES_CHECK_INTERVAL_SECONDS seconds."""
+        self.bundle_manager._fail_unresponsive_bundles = Mock()
+        self.bundle_manager._check_unresponsive_bundles()
+        self.bundle_manager._check_unresponsive_bundles()
+        self.assertEqual(self.bundle_manager._fail_unresponsive_bundles.call_count, 1)
+
+        frozen_time.tick(UNRESPONSIVE_BUNDLES_CHECK_INTERVAL_SECONDS)
+        self.bundle_manager._check_unresponsive_bundles()
+        self.assertEqual(self.bundle_manager._fail_unresponsive_bundles.call_count, 2)
@@ -29,10 +29,10 @@ class BundleManagerMakeBundlesTest(BaseBundleManagerTest):
     def make_bundles_and_wait(self):
         """Helper function to run _make_bundles() and wait for the bundles to be
         fully made."""
-        threads = self.bundle_manager._make_bundles()
+        futures = self.bundle_manager._make_bundles()
         self.assertTrue(self.bundle_manager._is_making_bundles())
-        for t in threads:
-            t.join()
+        for future in futures:
+            future.result()
         self.assertFalse(self.bundle_manager._is_making_bundles())
 
     def test_restage_stuck_bundle(self):
@@ -51,6 +51,45 @@ class BundleManagerMakeBundlesTest(BaseBundleManagerTest):
         bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
         self.assertEqual(bundle.state, State.MAKING)
 
+    def test_bounded_make_bundle_threads(self):
+        """Only as many bundles as there are make bundle threads should be made at once; the
+        others should stay STAGED until a thread is free."""
+        self.bundle_manager._max_make_bundle_threads = 1
+        self.bundle_manager._make_bundle = Mock()
+        bundle1 = self.create_make_bundle(state=State.STAGED)
+        self.save_bundle(bundle1)
+        bundle2 = self.create_make_bundle(state=State.STAGED)
+        self.save_bundle(bundle2)
+
+        self.bundle_manager._make_bundles()
+        self.bundle_manager._make_bundles()
+
+        # The bundles are made in the order they were created.
+        self.assertEqual(self.bundle_manager._model.get_bundle(bundle1.uuid).state, State.MAKING)
+        self.assertEqual(self.bundle_manager._model.get_bundle(bundle2.uuid).state, State.STAGED)
+
+    def test_make_bundle_stats(self):
+        """Made and failed bundles should be counted."""
+        bundle = self.create_make_bundle(state=State.STAGED)
+        self.save_bundle(bundle)
+        self.make_bundles_and_wait()
+        stats = self.bundle_manager.make_bundle_stats()
+        self.assertEqual((stats['made'], stats['failed']), (1, 0))
+        self.assertGreater(stats['total_seconds'], 0)
+
+        bundle = self.create_make_bundle(state=State.STAGED)
+        self.save_bundle(bundle)
+        self.bundle_manager._bundle_store.get_bundle_location = Mock(side_effect=OSError('full'))
+        self.make_bundles_and_wait()
+        stats = self.bundle_manager.make_bundle_stats()
+        self.assertEqual((stats['made'], stats['failed']), (1, 1))
+
+    def test_run_shuts_down_make_bundle_threads(self):
+        self.bundle_manager.signal()
+        self.bundle_manager.run(0)
+        with self.assertRaises(RuntimeError):
+            self.bundle_manager._make_bundle_executor.submit(lambda: None)
+
     def test_bundle_no_dependencies(self):
         """A MakeBundle with no dependencies should be made."""
         bundle = self.create_make_bundle(state=State.STAGED)
@@ -87,6 +126,18 @@ class BundleManagerMakeBundlesTest(BaseBundleManagerTest):
         self.assertEqual(self.read_bundle(bundle, "src1"), FILE_CONTENTS_1)
         self.assertEqual(self.read_bundle(bundle, "src2"), FILE_CONTENTS_2)
 
+    def test_multiple_dependencies_hardlink(self):
+        """A MakeBundle with two dependencies on the same partition can be made with hardlinks."""
+        self.bundle_manager._make_bundle_link_mode = 'hardlink'
+        bundle, parent1, parent2 = self.create_bundle_two_deps()
+
+        self.make_bundles_and_wait()
+
+        bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
+        self.assertEqual(bundle.state, State.READY)
+        self.assertEqual(self.read_bundle(bundle, "src1"), FILE_CONTENTS_1)
+        self.assertEqual(self.read_bundle(bundle, "src2"), FILE_CONTENTS_2)
+
     def test_fail_invalid_dependency_path(self):
         """A MakeBundle with an invalid dependency specified should fail."""
         bundle = self.create_make_bundle(state=State.STAGED)
@@ -1,3 +1,6 @@
+from unittest.mock import Mock
+
+from codalab.server.bundle_manager import BundleManager
 from codalab.worker.bundle_state import State
 from freezegun import freeze_time
 from tests.unit.server.bundle_manager import BaseBundleManagerTest
@@ -32,6 +35,28 @@ class BundleManagerScheduleRunBundlesTest(BaseBundleManagerTest):
         bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
         self.assertEqual(bundle.state, State.STARTING)
 
+    def test_fail_bundles_over_quota(self):
+        """Bundles requesting more than the user's quota should all be failed, in a single batch."""
+        self.bundle_manager._model.update_user_info(
+            {'user_id': self.user_id, 'time_quota': 100, 'time_used': 0}
+        )
+        bundles = [
+            self.create_run_bundle(State.STAGED, metadata=dict(request_time=request_time))
+            for request_time in ["50", "200", "300"]
+        ]
+        for bundle in bundles:
+            self.save_bundle(bundle)
+        batch_fail_bundles = self.bundle_manager._model.batch_fail_bundles
+        self.bundle_manager._model.batch_fail_bundles = Mock(wraps=batch_fail_bundles)
+
+        self.bundle_manager._schedule_run_bundles()
+
+        self.bundle_manager._model.batch_fail_bundles.assert_called_once()
+        states = [self.bundle_manager._model.get_bundle(b.uuid).state for b in bundles]
+        self.assertEqual(states, [State.STAGED, State.FAILED, State.FAILED])
+        bundle = self.bundle_manager._model.get_bundle(bundles[1].uuid)
+        self.assertIn('than user time quota left', bundle.metadata.failure_message)
+
     @freeze_time("2020-02-01", as_kwarg='frozen_time')
     def test_cleanup_dead_workers(self, frozen_time):
         """If workers don't check in for a long enough time period, they should be removed."""
@@ -129,3 +154,143 @@ class BundleManagerScheduleRunBundlesTest(BaseBundleManagerTest):
             ],
             '5',
         )
+
+
+class BundleManagerIncrementalScheduleRunBundlesTest(BaseBundleManagerTest):
+    def setUp(self):
+        super().setUp()
+        self.bundle_manager = BundleManager(self.codalab_manager, incremental_scheduling=True)
+
+    def test_schedule_new_staged_bundle(self):
+        """A bundle staged after the queue was built should be picked up without a reconcile."""
+        self.mock_worker_checkin(cpus=1, user_id=self.user_id)
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+
+        bundle = self.create_run_bundle(State.CREATED)
+        self.save_bundle(bundle)
+        self.bundle_manager._stage_bundles()
+        self.bundle_manager._schedule_run_bundles(reconcile=False)
+
+        bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
+        self.assertEqual(bundle.state, State.STARTING)
+        self.assertEqual(len(self.bundle_manager._staged_queue), 0)
+        self.assertIn(bundle.uuid, self.bundle_manager._staged_queue.run_resources)
+
+    def test_requeue_bundle_rejected_by_worker(self):
+        """A run that a worker moved back to the STAGED state should be queued again."""
+        bundle = self.create_run_bundle(State.STAGED)
+        self.save_bundle(bundle)
+        worker_id = self.mock_worker_checkin(cpus=1, user_id=self.user_id)
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+        bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
+        self.assertEqual(bundle.state, State.STARTING)
+
+        self.bundle_manager._model.bundle_checkin(
+            bundle, self.mock_worker_run(bundle, state=State.STAGED), self.user_id, worker_id
+        )
+        self.assertEqual(self.bundle_manager._model.get_bundle(bundle.uuid).state, State.STAGED)
+        self.bundle_manager._schedule_run_bundles(reconcile=False)
+        self.assertEqual(self.bundle_manager._model.get_bundle(bundle.uuid).state, State.STARTING)
+
+    def test_bundles_that_left_staged_are_not_started(self):
+        """Bundles that leave the STAGED state outside of the bundle manager should not be
+        started, and should be dequeued at the next reconcile."""
+        bundle = self.create_run_bundle(State.STAGED, metadata=dict(request_cpus=4))
+        self.save_bundle(bundle)
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+        self.assertIn(bundle.uuid, self.bundle_manager._staged_queue)
+
+        self.update_bundle(bundle, {'state': State.KILLED})
+        self.mock_worker_checkin(cpus=4, user_id=self.user_id)
+        self.bundle_manager._schedule_run_bundles(reconcile=False)
+        self.assertEqual(self.bundle_manager._model.get_bundle(bundle.uuid).state, State.KILLED)
+
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+        self.assertNotIn(bundle.uuid, self.bundle_manager._staged_queue)
+
+    def test_no_staged_bundle_queries_between_reconciles(self):
+        """Passes without changes shouldn't load the staged bundles from the database."""
+        bundle = self.create_run_bundle(State.STAGED, metadata=dict(request_cpus=4))
+        self.save_bundle(bundle)
+        self.mock_worker_checkin(cpus=1, user_id=self.user_id)
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+
+        batch_get_bundles = self.bundle_manager._model.batch_get_bundles
+        staged_queries = []
+
+        def record_batch_get_bundles(*args, **kwargs):
+            if kwargs.get('state') == State.STAGED or kwargs.get('uuid'):
+                staged_queries.append(kwargs)
+            return batch_get_bundles(*args, **kwargs)
+
+        self.bundle_manager._model.batch_get_bundles = record_batch_get_bundles
+        self.bundle_manager._model.batch_get_bundle_uuids = None
+        self.bundle_manager._schedule_run_bundles(reconcile=False)
+        self.assertEqual(staged_queries, [])
+
+    def test_staged_status_written_once(self):
+        """An unchanged staged_status should not be rewritten on every pass."""
+        bundle = self.create_run_bundle(State.STAGED, metadata=dict(request_cpus=4))
+        self.save_bundle(bundle)
+        self.mock_worker_checkin(cpus=1, user_id=self.user_id)
+        update_bundle = self.bundle_manager._model.update_bundle
+        staged_status_updates = []
+
+        def record_update_bundle(bundle, update, *args, **kwargs):
+            if 'staged_status' in update.get('metadata', {}):
+                staged_status_updates.append(bundle.uuid)
+            return update_bundle(bundle, update, *args, **kwargs)
+
+        self.bundle_manager._model.update_bundle = record_update_bundle
+
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+        self.bundle_manager._schedule_run_bundles(reconcile=False)
+
+        self.assertEqual(len(staged_status_updates), 1)
+
+    def test_queued_bundles_skipped_until_workers_gain_capacity(self):
+        """Bundles that didn't fit on any worker should only be scheduled again once a worker
+        gained capacity."""
+        bundle = self.create_run_bundle(State.STAGED, metadata=dict(request_cpus=4))
+        self.save_bundle(bundle)
+        self.mock_worker_checkin(cpus=1, user_id=self.user_id)
+        schedule = self.bundle_manager._schedule_run_bundles_on_workers
+        scheduled_uuids = []
+
+        def record_schedule(workers, staged_bundles_to_run, user_info_cache):
+            scheduled_uuids.append([b.uuid for b, _ in staged_bundles_to_run])
+            return schedule(workers, staged_bundles_to_run, user_info_cache)
+
+        self.bundle_manager._schedule_run_bundles_on_workers = record_schedule
+
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+        self.bundle_manager._schedule_run_bundles(reconcile=False)
+        self.assertEqual(scheduled_uuids, [[bundle.uuid]])
+
+        self.mock_worker_checkin(cpus=4, user_id=self.user_id)
+        self.bundle_manager._schedule_run_bundles(reconcile=False)
+        self.assertEqual(scheduled_uuids, [[bundle.uuid], [bundle.uuid]])
+        bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
+        self.assertEqual(bundle.state, State.STARTING)
+
+    def test_queue_order_matches_full_scheduling_order(self):
+        """The queue should order bundles like the non-incremental scheduler does."""
+        priorities = [1, 2, None, -1, 3]
+        bundles = []
+        for priority in priorities:
+            bundle = self.create_run_bundle(State.STAGED, metadata=dict(request_priority=priority))
+            self.save_bundle(bundle)
+            bundles.append(bundle)
+        self.bundle_manager._schedule_run_bundles(reconcile=True)
+
+        ordered_uuids = [b.uuid for b, _ in self.bundle_manager._staged_queue.ordered()]
+        expected = [bundles[i].uuid for i in (4, 1, 0, 2, 3)]
+        self.assertEqual(ordered_uuids, expected)
+
+        subset_uuids = [
+            b.uuid
+            for b, _ in self.bundle_manager._staged_queue.ordered_subset(
+                [bundles[i].uuid for i in (0, 2, 3, 4)]
+            )
+        ]
+        self.assertEqual(subset_uuids, [uuid for uuid in expected if uuid != bundles[1].uuid])
@@ -3,6 +3,7 @@ from unittest.mock import Mock
 
 from codalab.objects.metadata_spec import MetadataSpec
 from codalab.server.bundle_manager import BundleManager
+from codalab.server.worker_capacity_index import WorkerCapacityIndex
 from codalab.worker.bundle_state import RunResources
 from codalab.bundles.run_bundle import RunBundle
 from codalab.lib.codalab_manager import CodaLabManager
@@ -338,3 +339,94 @@ class BundleManagerMockedManagerTest(unittest.TestCase):
         self.assertEqual(worker['memory_bytes'], worker_resources.memory)
         self.assertEqual(worker['free_disk_bytes'], worker_resources.disk)
         self.assertEqual(worker['exit_after_num_runs'], worker_resources.runs_left)
+
+    def candidate_workers(self, worker_index):
+        return [worker for _, worker in worker_index.candidates(self.bundle_resources)]
+
+    def test_worker_capacity_index_matches_dominating_workers(self):
+        worker_index = WorkerCapacityIndex(self.workers_list)
+        for cpus, gpus, tag in [
+            (0, 0, None),
+            (1, 1, None),
+            (5, 0, None),
+            (4, 2, None),
+            (0, 0, 'tag=worker_X'),
+            (6, 1, 'worker_X'),
+            (0, 0, 'worker_Y'),
+        ]:
+            self.bundle_resources.cpus = cpus
+            self.bundle_resources.gpus = gpus
+            self.bundle_resources.tag = tag
+            expected = self.bundle_manager._get_dominating_workers(
+                self.bundle_resources, self.workers_list
+            )
+            actual = self.bundle_manager._get_dominating_workers(
+                self.bundle_resources, self.candidate_workers(worker_index)
+            )
+            self.assertCountEqual(
+                [worker['worker_id'] for worker in actual],
+                [worker['worker_id'] for worker in expected],
+            )
+
+    def test_worker_capacity_index_memory(self):
+        worker_index = WorkerCapacityIndex(self.workers_list)
+        self.bundle_resources.memory = 3000
+        self.assertCountEqual(
+            [worker['worker_id'] for worker in self.candidate_workers(worker_index)],
+            [0, 1, 2, 3, 4],
+        )
+        self.bundle_resources.memory = 4001
+        self.assertEqual(self.candidate_workers(worker_index), [])
+
+    def test_sorted_workers_match_filter_and_sort_workers(self):
+        # Split the workers between two indexes, whose candidates are merged.
+        worker_indexes = [
+            WorkerCapacityIndex(self.workers_list[::2]),
+            WorkerCapacityIndex(self.workers_list[1::2]),
+        ]
+        for cpus, gpus, memory, tag in [
+            (0, 0, 1000, None),
+            (1, 0, 1000, None),
+            (1, 1, 1000, None),
+            (5, 0, 3000, None),
+            (0, 0, 1000, 'tag=worker_X'),
+        ]:
+            self.bundle_resources.cpus = cpus
+            self.bundle_resources.gpus = gpus
+            self.bundle_resources.memory = memory
+            self.bundle_resources.tag = tag
+            expected = self.bundle_manager._filter_and_sort_workers(
+                self.workers_list, self.bundle, self.bundle_resources
+            )
+            actual = self.bundle_manager._get_sorted_workers(
+                worker_indexes, self.bundle, self.bundle_resources
+            )
+            self.assertEqual(
+                [worker['worker_id'] for worker in actual],
+                [worker['worker_id'] for worker in expected],
+            )
+
+    def test_worker_capacity_index_update(self):
+        worker_index = WorkerCapacityIndex(self.workers_list)
+        self.bundle_resources.cpus = 6
+        self.assertCountEqual(
+            [worker['worker_id'] for worker in self.candidate_workers(worker_index)], [3, 4, 5],
+        )
+        worker = self.workers_list[3]
+        worker['cpus'] -= 2
+        worker_index.update(worker)
+        self.assertCountEqual(
+            [worker['worker_id'] for worker in self.candidate_workers(worker_index)], [4, 5],
+        )
+
+    def test_worker_capacity_index_retain(self):
+        worker_index = WorkerCapacityIndex(self.workers_list)
+        worker_index.retain([0, 6])
+        self.assertEqual(len(worker_index), 2)
+        self.assertEqual(
+            [worker['worker_id'] for worker in self.candidate_workers(worker_index)], [0],
+        )
+        self.bundle_resources.tag = 'worker_X'
+        self.assertEqual(
+            [worker['worker_id'] for worker in self.candidate_workers(worker_index)], [6],
+        )
@@ -0,0 +1,101 @@
+import unittest
+from unittest.mock import Mock
+
+from codalab.server.worker_info_accessor import WorkerInfoAccessor
+
+
+def make_worker(worker_id, user_id, group_uuid=None, run_uuids=()):
+    return {
+        'worker_id': worker_id,
+        'user_id': user_id,
+        'group_uuid': group_uuid,
+        'gpus': 0,
+        'run_uuids': list(run_uuids),
+    }
+
+
+class WorkerInfoAccessorTest(unittest.TestCase):
+    def setUp(self):
+        self.workers = []
+        self.memberships = []
+        self.worker_model = Mock()
+        self.worker_model.get_workers.side_effect = lambda: [dict(w) for w in self.workers]
+        self.model = Mock()
+        self.model.batch_get_user_in_group.side_effect = lambda group_uuid: [
+            m for m in self.memberships if m['group_uuid'] in group_uuid
+        ]
+
+    def make_accessor(self):
+        return WorkerInfoAccessor(self.model, self.worker_model, timeout_seconds=3600)
+
+    def user_worker_ids(self, accessor, user_id):
+        return [worker['worker_id'] for worker in accessor.get_user_workers(user_id)]
+
+    def test_group_memberships_are_fetched_at_once(self):
+        self.workers = [
+            make_worker('w1', 'owner1', 'g1'),
+            make_worker('w2', 'owner2', 'g2'),
+            make_worker('w3', 'owner3'),
+        ]
+        self.memberships = [
+            {'group_uuid': 'g1', 'user_id': 'owner1'},
+            {'group_uuid': 'g1', 'user_id': 'member'},
+            {'group_uuid': 'g2', 'user_id': 'member'},
+        ]
+        accessor = self.make_accessor()
+
+        self.model.batch_get_user_in_group.assert_called_once()
+        self.assertEqual(
+            {'g1', 'g2'}, set(self.model.batch_get_user_in_group.call_args[1]['group_uuid'])
+        )
+        self.assertEqual(['w1'], self.user_worker_ids(accessor, 'owner1'))
+        self.assertEqual(['w1', 'w2'], self.user_worker_ids(accessor, 'member'))
+        self.assertEqual(['w3'], self.user_worker_ids(accessor, 'owner3'))
+        self.assertEqual([], self.user_worker_ids(accessor, 'other'))
+
+    def test_refresh_updates_indexes(self):
+        self.workers = [
+            make_worker('w1', 'owner1', 'g1', run_uuids=['r1', 'r2']),
+            make_worker('w2', 'owner2', run_uuids=['r3']),
+        ]
+        self.memberships = [{'group_uuid': 'g1', 'user_id': 'member'}]
+        accessor = self.make_accessor()
+        self.assertTrue(accessor.is_running('r1'))
+
+        # r1 finished, r4 started, the member left the group and w2 went away.
+        self.workers = [
+            make_worker('w1', 'owner1', 'g1', run_uuids=['r2', 'r4']),
+            make_worker('w3', 'owner2', 'g1'),
+        ]
+        self.memberships = [{'group_uuid': 'g1', 'user_id': 'member2'}]
+        accessor.refresh()
+
+        self.assertEqual(['w1', 'w3'], sorted(w['worker_id'] for w in accessor.workers()))
+        self.assertFalse(accessor.is_running('r1'))
+        self.assertTrue(accessor.is_running('r2'))
+        self.assertFalse(accessor.is_running('r3'))
+        self.assertTrue(accessor.is_running('r4'))
+        self.assertEqual([], self.user_worker_ids(accessor, 'member'))
+        self.assertEqual(['w1', 'w3'], self.user_worker_ids(accessor, 'member2'))
+        self.assertEqual(['w3'], self.user_worker_ids(accessor, 'owner2'))
+        # The accessor returns the latest version of each worker.
+        self.assertEqual(['r2', 'r4'], accessor.get_user_workers('owner1')[0]['run_uuids'])
+
+    def test_set_starting_restage_and_remove(self):
+        self.workers = [make_worker('w1', 'owner1', 'g1')]
+        self.memberships = [{'group_uuid': 'g1', 'user_id': 'member'}]
+        accessor = self.make_accessor()
+
+        accessor.set_starting('r1', 'w1')
+        self.assertTrue(accessor.is_running('r1'))
+        self.assertEqual(['r1'], accessor.workers()[0]['run_uuids'])
+        accessor.restage('r1')
+        self.assertFalse(accessor.is_running('r1'))
+        self.assertEqual([], accessor.workers()[0]['run_uuids'])
+
+        accessor.set_starting('r2', 'w1')
+        accessor.remove('w1')
+        self.assertEqual([], accessor.workers())
+        self.assertFalse(accessor.is_running('r2'))
+        self.assertEqual([], self.user_worker_ids(accessor, 'owner1'))
+        self.assertEqual([], self.user_worker_ids(accessor, 'member'))
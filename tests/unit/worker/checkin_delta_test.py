@@ -0,0 +1,66 @@
+import unittest
+
+from codalab.worker.checkin_delta import CheckinDeltaEncoder
+
+IN_SYNC = [{'type': 'checkin_ack', 'in_sync': True}, None]
+OUT_OF_SYNC = [{'type': 'checkin_ack', 'in_sync': False}, None]
+
+
+class CheckinDeltaEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = CheckinDeltaEncoder()
+        self.dependencies = [('0x1', 'a'), ('0x2', 'b')]
+        self.runs = [{'uuid': '0xr1', 'run_status': 'Running'}]
+
+    def checkin(self, response=IN_SYNC):
+        request = {}
+        pending = self.encoder.encode(request, self.dependencies, self.runs)
+        self.encoder.ack(pending, response)
+        return request
+
+    def test_full_sync_then_deltas(self):
+        request = self.checkin()
+        self.assertEqual(self.dependencies, request['dependencies'])
+        self.assertEqual(self.runs, request['runs'])
+        version = request['dependencies_version']
+
+        # Nothing changed.
+        request = self.checkin()
+        self.assertEqual({'dependencies_version': version, 'runs': []}, request)
+
+        self.dependencies = [('0x2', 'b'), ('0x3', 'c')]
+        self.runs = [{'uuid': '0xr1', 'run_status': 'Uploading'}, {'uuid': '0xr2'}]
+        request = self.checkin()
+        self.assertEqual(version, request['dependencies_base_version'])
+        self.assertNotEqual(version, request['dependencies_version'])
+        self.assertEqual([('0x3', 'c')], request['dependencies_added'])
+        self.assertEqual([('0x1', 'a')], request['dependencies_removed'])
+        self.assertEqual(self.runs, request['runs'])
+
+    def test_unchanged_runs_are_resent(self):
+        self.checkin()
+        self.encoder.RUN_RESEND_SECONDS = 0
+        self.assertEqual(self.runs, self.checkin()['runs'])
+
+    def test_out_of_sync(self):
+        self.checkin()
+        self.checkin(OUT_OF_SYNC)
+        request = self.checkin()
+        self.assertEqual(self.dependencies, request['dependencies'])
+        self.assertEqual(self.runs, request['runs'])
+
+    def test_server_without_deltas(self):
+        self.checkin([None])
+        request = self.checkin([None])
+        self.assertEqual(self.dependencies, request['dependencies'])
+        self.assertEqual(self.runs, request['runs'])
+
+    def test_lost_checkin(self):
+        self.checkin()
+        self.dependencies = [('0x3', 'c')]
+        # The response to this checkin is lost, so the next delta is from the same base version.
+        first = {}
+        self.encoder.encode(first, self.dependencies, self.runs)
+        second = self.checkin()
+        self.assertEqual(first['dependencies_base_version'], second['dependencies_base_version'])
+        self.assertEqual([('0x3', 'c')], second['dependencies_added'])
@@ -0,0 +1,118 @@
+import http.server
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from codalab.worker.connection_pool import ConnectionPool
+from codalab.worker.rest_client import RestClient
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/ok')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/missing':
+            self.send_body(404, b'Not found', 'text/plain')
+        elif self.path == '/close':
+            # Answer, then close the connection without saying so, like a server whose
+            # keep-alive timeout expired.
+            self.send_body(200, b'{}')
+            self.close_connection = True
+        else:
+            self.send_body(200, json.dumps({'path': self.path}).encode())
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_body(200, body)
+
+
+class LocalRestClient(RestClient):
+    def _get_access_token(self):
+        return None
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.connections = set()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.pool = ConnectionPool()
+        self.addCleanup(self.pool.clear)
+        self.client = LocalRestClient(self.base_url, pool=self.pool)
+
+    def test_connections_are_reused(self):
+        for i in range(5):
+            self.assertEqual(
+                {'path': '/item/%d' % i}, self.client._make_request('GET', '/item/%d' % i)
+            )
+        self.assertEqual(
+            {'a': 1}, self.client._make_request('POST', '/echo', data={'a': 1}),
+        )
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_concurrent_requests(self):
+        results = []
+
+        def fetch():
+            results.append(self.client._make_request('GET', '/item'))
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([{'path': '/item'}] * 8, results)
+
+    def test_redirect(self):
+        self.assertEqual({'path': '/ok'}, self.client._make_request('GET', '/redirect'))
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_http_error(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.client._make_request('GET', '/missing')
+        self.assertEqual(404, cm.exception.code)
+        self.assertEqual(b'Not found', cm.exception.read())
+        # The connection is still usable after the error body was read.
+        self.client._make_request('GET', '/item')
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_connection_closed_by_server(self):
+        self.client._make_request('GET', '/close')
+        self.assertEqual({'path': '/item'}, self.client._make_request('GET', '/item'))
+        self.assertEqual(2, len(self.server.connections))
+
+    def test_streamed_response(self):
+        with self.client._make_request('GET', '/item', return_response=True) as response:
+            self.assertEqual(b'{"path": "/item"}', response.read())
+        self.client._make_request('GET', '/item')
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_connection_refused(self):
+        self.server.shutdown()
+        self.server.server_close()
+        request = urllib.request.Request(self.base_url + '/item')
+        with self.assertRaises(urllib.error.URLError):
+            self.pool.urlopen(request, timeout=5)
@@ -0,0 +1,195 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import docker
+
+from codalab.worker import container_stats
+from codalab.worker.container_stats import CgroupReader, ContainerStatsCollector
+
+CONTAINER_ID = 'abc123'
+
+
+class FakeDockerClient:
+    """Docker client whose inspect_container returns the states in self.containers."""
+
+    def __init__(self):
+        self.containers = {}
+        self.api = SimpleNamespace(inspect_container=self.inspect_container)
+
+    def inspect_container(self, container_id):
+        if container_id not in self.containers:
+            raise docker.errors.NotFound('No such container')
+        return {'State': self.containers[container_id]}
+
+
+def write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+class CgroupReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def make_reader(self):
+        old_roots = container_stats.CGROUP_ROOTS
+        container_stats.CGROUP_ROOTS = [self.root]
+        try:
+            return CgroupReader()
+        finally:
+            container_stats.CGROUP_ROOTS = old_roots
+
+    def test_v1(self):
+        cpu_dir = os.path.join(self.root, 'cpuacct', 'docker', CONTAINER_ID)
+        write(os.path.join(cpu_dir, 'cpuacct.usage'), '5000000000\n')
+        write(os.path.join(cpu_dir, 'cpuacct.stat'), 'user 300\nsystem 200\n')
+        memory_dir = os.path.join(self.root, 'memory', 'docker', CONTAINER_ID)
+        write(os.path.join(memory_dir, 'memory.usage_in_bytes'), '1024\n')
+        write(os.path.join(memory_dir, 'memory.limit_in_bytes'), '4096\n')
+        reader = self.make_reader()
+        self.assertFalse(reader.v2)
+        sample = reader.read(CONTAINER_ID)
+        self.assertEqual(5000000000, sample['cpu_ns'])
+        self.assertEqual(300 / container_stats.USER_HZ, sample['time_user'])
+        self.assertEqual(1024, sample['memory'])
+        self.assertEqual(4096, sample['memory_limit'])
+
+    def test_v2_systemd(self):
+        write(os.path.join(self.root, 'cgroup.controllers'), 'cpu memory\n')
+        scope_dir = os.path.join(self.root, 'system.slice', 'docker-%s.scope' % CONTAINER_ID)
+        write(
+            os.path.join(scope_dir, 'cpu.stat'),
+            'usage_usec 5000000\nuser_usec 3000000\nsystem_usec 2000000\n',
+        )
+        write(os.path.join(scope_dir, 'memory.current'), '1024\n')
+        write(os.path.join(scope_dir, 'memory.max'), 'max\n')
+        reader = self.make_reader()
+        self.assertTrue(reader.v2)
+        sample = reader.read(CONTAINER_ID)
+        self.assertEqual(5000000000, sample['cpu_ns'])
+        self.assertEqual(3.0, sample['time_user'])
+        self.assertEqual(2.0, sample['time_system'])
+        self.assertEqual(1024, sample['memory'])
+        self.assertIsNone(sample['memory_limit'])
+
+        shutil.rmtree(scope_dir)
+        self.assertIsNone(reader.read(CONTAINER_ID))
+
+
+class FakeCgroupReader:
+    def __init__(self):
+        self.samples = {}
+
+    def read(self, container_id):
+        return self.samples.get(container_id)
+
+    def forget(self, container_id):
+        pass
+
+
+class ContainerStatsCollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDockerClient()
+        self.cgroups = FakeCgroupReader()
+        self.collector = ContainerStatsCollector(self.client, cgroup_reader=self.cgroups)
+        self.client.containers[CONTAINER_ID] = {
+            'Status': 'running',
+            'StartedAt': '2020-01-01T00:00:00.000000000Z',
+            'FinishedAt': '0001-01-01T00:00:00Z',
+        }
+
+    def test_sample(self):
+        self.collector.track(CONTAINER_ID)
+        self.cgroups.samples[CONTAINER_ID] = {
+            'cpu_ns': 0,
+            'memory': 1024,
+            'memory_limit': 4096,
+            'time_user': 1.0,
+            'time_system': 0.5,
+        }
+        self.collector.sample()
+        stats = self.collector.get(CONTAINER_ID).stats
+        self.assertEqual(0.0, stats.cpu_usage)
+        self.assertEqual(0.25, stats.memory_usage)
+        self.assertEqual(1.0, stats.time_user)
+
+        # Two full CPUs' worth of CPU time since the last sample.
+        state = self.collector.get(CONTAINER_ID)
+        state.last_sample = (state.last_sample[0] - 10 ** 9, state.last_sample[1])
+        self.cgroups.samples[CONTAINER_ID]['cpu_ns'] = 2 * 10 ** 9
+        self.collector.sample()
+        self.assertAlmostEqual(2.0, self.collector.get(CONTAINER_ID).stats.cpu_usage, places=1)
+
+    def test_events(self):
+        state = self.collector.track(CONTAINER_ID)
+        self.assertFalse(state.finished)
+        self.collector.handle_event(
+            {'Action': 'die', 'id': CONTAINER_ID, 'timeNano': 1577836810 * 10 ** 9}
+        )
+        self.assertTrue(state.finished)
+        self.assertEqual(10, (state.finished_at - state.started_at).total_seconds())
+        self.collector.handle_event({'Action': 'destroy', 'id': CONTAINER_ID})
+        self.assertFalse(state.exists)
+
+    def test_die_event_before_track(self):
+        self.collector.handle_event({'Action': 'die', 'id': CONTAINER_ID})
+        # The container was inspected before it died.
+        self.assertTrue(self.collector.track(CONTAINER_ID).finished)
+
+    def test_untracked_containers_are_forgotten(self):
+        self.collector.handle_event({'Action': 'die', 'id': 'other'})
+        self.collector.handle_event({'Action': 'destroy', 'id': 'other'})
+        self.assertIsNone(self.collector.get('other'))
+
+    def test_track_missing_container(self):
+        with self.assertRaises(docker.errors.NotFound):
+            self.collector.track('missing')
+
+    def test_track_refreshes_state(self):
+        self.client.containers[CONTAINER_ID] = {
+            'Status': 'created',
+            'StartedAt': '0001-01-01T00:00:00Z',
+            'FinishedAt': '0001-01-01T00:00:00Z',
+        }
+        state = self.collector.track(CONTAINER_ID)
+        self.assertIsNone(state.started_at)
+
+        # The container started and then died, but the events stream missed both.
+        self.client.containers[CONTAINER_ID] = {
+            'Status': 'exited',
+            'StartedAt': '2020-01-01T00:00:00.000000000Z',
+            'FinishedAt': '2020-01-01T00:00:10.000000000Z',
+        }
+        self.assertFalse(self.collector.track(CONTAINER_ID).finished)
+        state.inspected_at -= ContainerStatsCollector.INSPECT_INTERVAL_SECONDS
+        state = self.collector.track(CONTAINER_ID)
+        self.assertTrue(state.finished)
+        self.assertEqual(10, (state.finished_at - state.started_at).total_seconds())
+
+    def test_start_event_sets_started_at(self):
+        state = self.collector.track(CONTAINER_ID)
+        self.collector.handle_event(
+            {'Action': 'start', 'id': CONTAINER_ID, 'timeNano': 1577836805 * 10 ** 9}
+        )
+        self.assertEqual(5, state.started_at.second)
+
+    def test_untracked_die_events_are_pruned(self):
+        self.collector.track(CONTAINER_ID)
+        self.collector.handle_event({'Action': 'die', 'id': 'other'})
+        self.collector.prune()
+        self.assertIsNotNone(self.collector.get('other'))
+
+        self.collector.get(
+            'other'
+        ).created_at -= ContainerStatsCollector.UNTRACKED_STATE_TTL_SECONDS
+        self.collector.get(
+            CONTAINER_ID
+        ).created_at -= ContainerStatsCollector.UNTRACKED_STATE_TTL_SECONDS
+        self.collector.prune()
+        self.assertIsNone(self.collector.get('other'))
+        self.assertIsNotNone(self.collector.get(CONTAINER_ID))
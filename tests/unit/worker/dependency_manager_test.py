@@ -1,4 +1,5 @@
 import os
+import threading
 import time
 import unittest
 import shutil
@@ -7,9 +8,16 @@ from concurrent.futures import ProcessPoolExecutor
 from unittest.mock import MagicMock
 
 from codalab.worker.bundle_state import DependencyKey
+from codalab.worker.file_util import get_path_size, tar_gzip_directory
 
 try:
-    from codalab.worker.dependency_manager import DependencyManager
+    from codalab.worker.dependency_manager import (
+        DependencyManager,
+        DependencyState,
+        DownloadAbortedException,
+        DownloadSlots,
+    )
+    from codalab.worker.state_committer import JsonStateCommitter
 
     module_failed = False
 except ImportError:
@@ -72,6 +80,179 @@ class DependencyManagerTest(unittest.TestCase):
         dependency_keys = self.dependency_manager.all_dependencies
         self.assertEqual(len(dependency_keys), 2)
 
+    def transition_until_done(self, dependency_key):
+        for _ in range(100):
+            self.dependency_manager._transition_dependencies()
+            with self.dependency_manager._state_lock:
+                state = self.dependency_manager._fetch_dependencies()[dependency_key]
+            if state.stage != "DOWNLOADING":
+                return state
+            time.sleep(0.05)
+        self.fail("Dependency %s wasn't downloaded" % (dependency_key,))
+
+    def test_subpath_linked_from_cached_bundle(self):
+        bundle_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bundle_dir)
+        os.makedirs(os.path.join(bundle_dir, "data"))
+        with open(os.path.join(bundle_dir, "data", "file"), "w") as f:
+            f.write("contents")
+        bundle_service = MagicMock()
+        bundle_service.get_bundle_info.return_value = {'type': "directory"}
+        bundle_service.get_bundle_contents.side_effect = lambda *args: tar_gzip_directory(
+            bundle_dir
+        )
+        self.dependency_manager._bundle_service = bundle_service
+
+        bundle_key = DependencyKey(parent_uuid="0x1", parent_path="")
+        self.dependency_manager.get("0x2", bundle_key)
+        bundle_state = self.transition_until_done(bundle_key)
+        self.assertEqual(bundle_state.stage, "READY")
+
+        subpath_key = DependencyKey(parent_uuid="0x1", parent_path="data")
+        self.dependency_manager.get("0x3", subpath_key)
+        subpath_state = self.transition_until_done(subpath_key)
+        self.assertEqual(subpath_state.stage, "READY")
+
+        # The subpath was linked from the cached bundle instead of being downloaded again.
+        bundle_service.get_bundle_contents.assert_called_once()
+        dependencies_dir = self.dependency_manager.dependencies_dir
+        self.assertEqual(
+            subpath_state.size_bytes,
+            get_path_size(os.path.join(dependencies_dir, subpath_state.path)),
+        )
+        self.assertTrue(
+            os.path.samefile(
+                os.path.join(dependencies_dir, bundle_state.path, "data", "file"),
+                os.path.join(dependencies_dir, subpath_state.path, "file"),
+            )
+        )
+
+    def add_ready_dependency(self, parent_uuid, size_bytes, last_used, dependents=()):
+        dependency_key = DependencyKey(parent_uuid=parent_uuid, parent_path="")
+        with self.dependency_manager._state_lock:
+            path = self.dependency_manager._assign_path(dependency_key)
+            self.dependency_manager._state_store.put(
+                DependencyState(
+                    stage="READY",
+                    downloading_by=None,
+                    dependency_key=dependency_key,
+                    path=path,
+                    size_bytes=size_bytes,
+                    dependents=set(dependents),
+                    last_used=last_used,
+                    last_downloading=last_used,
+                    message="Download complete",
+                    killed=False,
+                )
+            )
+        with open(os.path.join(self.dependency_manager.dependencies_dir, path), "wb") as f:
+            f.write(b"0" * size_bytes)
+        return dependency_key
+
+    def test_cleanup_evicts_least_recently_used(self):
+        oldest = self.add_ready_dependency("0x1", 400, last_used=1)
+        in_use = self.add_ready_dependency("0x2", 400, last_used=2, dependents=["0x9"])
+        older = self.add_ready_dependency("0x3", 400, last_used=3)
+        newest = self.add_ready_dependency("0x4", 400, last_used=4)
+
+        # 1600 bytes are used out of 1024, so the two least recently used dependencies that no
+        # run depends on are evicted at once.
+        self.dependency_manager._cleanup()
+        self.assertEqual(set(self.dependency_manager.all_dependencies), {in_use, newest})
+        self.assertEqual(
+            sorted(os.listdir(self.dependency_manager.dependencies_dir)), ["0x2", "0x4"]
+        )
+        self.assertFalse(self.dependency_manager._state_store.has_path("0x1"))
+        self.assertNotIn(oldest, self.dependency_manager.all_dependencies)
+        self.assertNotIn(older, self.dependency_manager.all_dependencies)
+
+    def test_legacy_state_file_is_imported(self):
+        dependency_key = DependencyKey(parent_uuid="0x1", parent_path="parent")
+        self.dependency_manager.get("0x2", dependency_key)
+        os.makedirs(os.path.join(self.dependency_manager.dependencies_dir, "0x1_parent"))
+        with self.dependency_manager._state_lock:
+            dependencies = self.dependency_manager._fetch_dependencies()
+            paths = self.dependency_manager._state_store.paths()
+        JsonStateCommitter(self.state_path).commit({'dependencies': dependencies, 'paths': paths})
+        os.remove(self.dependency_manager._state_store.path)
+
+        dependency_manager = DependencyManager(
+            commit_file=self.state_path,
+            bundle_service=None,
+            worker_dir=self.work_dir,
+            max_cache_size_bytes=1024,
+            download_dependencies_max_retries=1,
+        )
+        self.assertFalse(os.path.exists(self.state_path))
+        self.assertTrue(dependency_manager.has(dependency_key))
+        state = dependency_manager.get("0x3", dependency_key)
+        self.assertEqual(state.path, "0x1_parent")
+        self.assertEqual(state.dependents, {"0x2", "0x3"})
+
+    def test_download_slots_go_to_highest_priority(self):
+        slots = DownloadSlots(max_downloads=1)
+        first = DependencyKey(parent_uuid="0x1", parent_path="")
+        slots.acquire(first, lambda: False)
+        order = []
+
+        def download(dependency_key):
+            slots.acquire(dependency_key, lambda: False)
+            order.append(dependency_key.parent_uuid)
+            slots.release(dependency_key)
+
+        threads = []
+        for uuid, priority in [("0x2", 0), ("0x3", 5), ("0x4", 0)]:
+            dependency_key = DependencyKey(parent_uuid=uuid, parent_path="")
+            slots.set_priority(dependency_key, priority)
+            thread = threading.Thread(target=download, args=[dependency_key])
+            thread.start()
+            threads.append(thread)
+            # Make sure the downloads start waiting in order.
+            while len(slots._waiting) < len(threads):
+                time.sleep(0.01)
+        slots.release(first)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ["0x3", "0x2", "0x4"])
+
+    def test_aborted_download_forgets_priority(self):
+        slots = DownloadSlots(max_downloads=1)
+        first = DependencyKey(parent_uuid="0x1", parent_path="")
+        second = DependencyKey(parent_uuid="0x2", parent_path="")
+        slots.acquire(first, lambda: False)
+        slots.set_priority(second, 5)
+        with self.assertRaises(DownloadAbortedException):
+            slots.acquire(second, lambda: True)
+        self.assertEqual({}, slots._waiting)
+        self.assertNotIn(second, slots._priorities)
+
+    def test_waiting_download_is_not_stale(self):
+        """A download waiting for a slot should keep refreshing its last_downloading time, so
+        that other workers don't take it over, and stop once it is killed."""
+        self.dependency_manager._download_slots = DownloadSlots(max_downloads=1)
+        self.dependency_manager._download_slots.acquire(
+            DependencyKey(parent_uuid="0x0", parent_path=""), lambda: False
+        )
+        dependency_key = DependencyKey(parent_uuid="0x1", parent_path="parent")
+        state = self.dependency_manager.get("0x2", dependency_key)
+
+        def transition(state):
+            time.sleep(0.1)
+            with self.dependency_manager._state_lock:
+                return self.dependency_manager._transition_from_DOWNLOADING(state)
+
+        state = transition(state)
+        start_time = state.last_downloading
+        while state.last_downloading == start_time:
+            state = transition(state)
+        self.assertGreater(state.last_downloading, start_time)
+
+        state = transition(state._replace(killed=True))
+        while state.downloading_by:
+            state = transition(state)
+        self.assertEqual(state.stage, "FAILED")
+        self.assertIn("Aborted while waiting", state.message)
+
     @unittest.skip(
         "Flufl.lock doesn't seem to work on GHA for some reason, "
         "even though this test passes on other machines."
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from codalab.worker.bundle_state import DependencyKey
+from codalab.worker.dependency_state_store import DependencyState, DependencyStateStore
+
+
+def make_state(parent_uuid, parent_path, stage, last_used, dependents=()):
+    return DependencyState(
+        stage=stage,
+        downloading_by=None,
+        dependency_key=DependencyKey(parent_uuid=parent_uuid, parent_path=parent_path),
+        path=parent_uuid,
+        size_bytes=10,
+        dependents=set(dependents),
+        last_used=last_used,
+        last_downloading=last_used,
+        message=None,
+        killed=False,
+    )
+
+
+class DependencyStateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.store = DependencyStateStore(os.path.join(self.work_dir, 'state.sqlite'))
+        self.addCleanup(self.store.close)
+
+    def test_put_get_delete(self):
+        state = make_state('0x1', 'a/b', 'READY', 1, dependents=['0x2'])
+        self.store.put(state)
+        self.assertEqual(state, self.store.get(state.dependency_key))
+        self.store.put(state._replace(stage='FAILED'))
+        self.assertEqual('FAILED', self.store.get(state.dependency_key).stage)
+        self.assertEqual([state.dependency_key], self.store.keys())
+        self.store.delete(state.dependency_key)
+        self.assertIsNone(self.store.get(state.dependency_key))
+
+    def test_transaction_rolls_back(self):
+        with self.assertRaises(ValueError):
+            with self.store.transaction():
+                self.store.put(make_state('0x1', '', 'READY', 1))
+                self.store.add_path('0x1')
+                raise ValueError()
+        self.assertEqual([], self.store.keys())
+        self.assertFalse(self.store.has_path('0x1'))
+
+    def test_eviction_candidates(self):
+        for state in [
+            make_state('0x1', '', 'READY', 1),
+            make_state('0x2', '', 'READY', 2, dependents=['0x9']),
+            make_state('0x3', '', 'FAILED', 5),
+            make_state('0x4', '', 'DOWNLOADING', 0),
+            make_state('0x5', '', 'READY', 0),
+        ]:
+            self.store.put(state)
+        self.assertEqual(
+            ['0x3', '0x5', '0x1'],
+            [state.dependency_key.parent_uuid for state in self.store.eviction_candidates()],
+        )
+        self.assertEqual(50, self.store.total_size())
+
+    def test_serialized_keys_length(self):
+        self.assertEqual(len(json.dumps([])), self.store.serialized_keys_length())
+        keys = [('0x1', ''), ('0x2', 'a/b'), ('0x3', 'c')]
+        for parent_uuid, parent_path in keys:
+            self.store.put(make_state(parent_uuid, parent_path, 'READY', 1))
+        self.assertEqual(
+            len(json.dumps(keys, separators=(',', ':'))), self.store.serialized_keys_length()
+        )
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from codalab.worker.disk_usage import DirectorySizeTree, DiskUsageService
+from codalab.worker.file_util import get_path_size
+
+
+class DirectorySizeTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'a', 'b'))
+        self.write('file', 10)
+        self.write('a/file', 20)
+        self.write('a/b/file', 30)
+        os.symlink('/nonexistent', os.path.join(self.directory, 'a', 'link'))
+        self.tree = DirectorySizeTree(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, size, mode='wb'):
+        with open(os.path.join(self.directory, path), mode) as f:
+            f.write(b'x' * size)
+
+    def test_matches_get_path_size(self):
+        self.assertEqual(get_path_size(self.directory), self.tree.update())
+
+    def test_incremental_updates(self):
+        self.tree.update()
+        os.makedirs(os.path.join(self.directory, 'a', 'c'))
+        self.write('a/c/new', 40)
+        os.remove(os.path.join(self.directory, 'a', 'b', 'file'))
+        self.write('file', 5, mode='ab')
+        self.assertEqual(get_path_size(self.directory), self.tree.update())
+        shutil.rmtree(os.path.join(self.directory, 'a'))
+        self.assertEqual(get_path_size(self.directory), self.tree.update())
+
+    def test_unchanged_directories_are_not_listed(self):
+        self.tree.update()
+        self.write('a/b/new', 40)
+        with patch('os.scandir', wraps=os.scandir) as scandir:
+            self.assertEqual(get_path_size(self.directory), self.tree.update())
+        self.assertEqual(
+            [os.path.join(self.directory, 'a', 'b')],
+            [call.args[0] for call in scandir.call_args_list],
+        )
+
+    def test_idle_files_are_measured_by_full_scans(self):
+        path = os.path.join(self.directory, 'a', 'file')
+        old = time.time() - 2 * DirectorySizeTree.HOT_FILE_SECONDS
+        os.utime(path, (old, old))
+        self.tree.update()
+        # Write to the idle file and make it look idle again, so only a full scan notices.
+        self.write('a/file', 100, mode='ab')
+        os.utime(path, (old, old))
+        self.assertEqual(get_path_size(self.directory) - 100, self.tree.update())
+        self.tree._last_full_scan = 0
+        self.assertEqual(get_path_size(self.directory), self.tree.update())
+
+
+class DiskUsageServiceTest(unittest.TestCase):
+    def test_track(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'file'), 'wb') as f:
+            f.write(b'x' * 100)
+        service = DiskUsageService(num_threads=1)
+        service.start()
+        self.addCleanup(service.stop)
+        service.track('uuid', directory)
+        deadline = time.time() + 10
+        while service.get('uuid') == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(get_path_size(directory), service.get('uuid'))
+        service.untrack('uuid')
+        self.assertEqual(0, service.get('uuid'))
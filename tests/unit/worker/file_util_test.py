@@ -5,10 +5,16 @@ import tempfile
 import unittest
 import bz2
 import gzip
+import io
 
 from io import BytesIO
+from unittest.mock import patch
+
+from apache_beam.io.filesystems import FileSystems
 
 from codalab.worker.file_util import (
+    ARCHIVE_READ_BUFFER_SIZE,
+    GZIP_SEEK_POINT_SPACING,
     gzip_file,
     get_file_size,
     gzip_bytestring,
@@ -20,7 +26,9 @@ from codalab.worker.file_util import (
     zip_directory,
     unzip_directory,
     OpenFile,
+    OpenIndexedArchiveFile,
     summarize_file,
+    GzipStream,
 )
 from codalab.worker.un_gzip_stream import un_gzip_stream, ZipToTarStream, BytesBuffer
 from codalab.worker.un_tar_directory import un_tar_directory
@@ -136,6 +144,24 @@ class FileUtilTest(unittest.TestCase):
 
         self.assertEqual(un_gzip_stream(gzip_file(name)).read(), b'contents')
 
+    def test_gzip_stream_blocks(self):
+        """Blocks compressed in parallel form a single valid gzip member."""
+        contents = b''.join(b'line %d\n' % i for i in range(200000)) + os.urandom(100000)
+        self.assertGreater(len(contents), 2 * GzipStream.BLOCK_SIZE)
+        for chunk_size in [1000, GzipStream.BLOCK_SIZE, None]:
+            stream = GzipStream(BytesIO(contents))
+            chunks = []
+            while True:
+                chunk = stream.read(chunk_size)
+                chunks.append(chunk)
+                if not chunk or chunk_size is None:
+                    break
+            compressed = b''.join(chunks)
+            self.assertEqual(gzip.decompress(compressed), contents)
+            self.assertEqual(un_gzip_stream(BytesIO(compressed)).read(), contents)
+            self.assertEqual(stream.tell(), len(compressed))
+        self.assertEqual(gzip.decompress(GzipStream(BytesIO(b'')).read()), b'')
+
     def test_bz2_file(self):
         source_write = tempfile.NamedTemporaryFile(delete=False)
         self.addCleanup(lambda: os.remove(source_write.name))
@@ -342,6 +368,41 @@ class FileUtilTestAzureBlob(AzureBlobTestBase, unittest.TestCase):
                 ['.', './a', './a/b', './a/b/test2.sh'],
             )
 
+    def test_open_indexed_archive_file_buffer_size(self):
+        """Archives on Blob Storage should be read and decompressed in
+        ARCHIVE_READ_BUFFER_SIZE chunks."""
+        _, fname = self.create_file()
+        read_sizes = []
+
+        class RecordingRaw(io.BytesIO):
+            def readinto(self, b):
+                read_sizes.append(len(b))
+                return super().readinto(b)
+
+        # Blob Storage returns the archive as a BufferedReader with a small default buffer size.
+        open_file = FileSystems.open
+
+        def open_buffered(path, **kwargs):
+            if path == fname:
+                return io.BufferedReader(RecordingRaw(b"archive"))
+            return open_file(path, **kwargs)
+
+        with patch('codalab.worker.file_util.FileSystems.open', open_buffered), patch(
+            'codalab.worker.file_util.SQLiteIndexedTar'
+        ) as tar_class:
+            with OpenIndexedArchiveFile(fname):
+                pass
+        kwargs = tar_class.call_args.kwargs
+        self.assertEqual(kwargs['gzipBufferSize'], ARCHIVE_READ_BUFFER_SIZE)
+        self.assertEqual(kwargs['gzipSeekPointSpacing'], GZIP_SEEK_POINT_SPACING)
+        self.assertEqual(kwargs['fileObject'].read(1), b"a")
+        self.assertEqual(read_sizes, [ARCHIVE_READ_BUFFER_SIZE])
+
+        # The archive is still readable with the larger buffers.
+        with OpenIndexedArchiveFile(fname) as tf:
+            finfo = tf.getFileInfo("/contents")
+            self.assertEqual(tf.read(finfo, finfo.size, 0), b"hello world")
+
 
 class ArchiveTestBase:
     """Base for archive tests -- tests both archiving and unarchiving directories.
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import closing
+from unittest.mock import patch
+
+from codalab.worker.file_watcher import FileFollower, FileWatcher
+
+
+class FileWatcherTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def append_later(self, data, delay=0.2):
+        def append():
+            time.sleep(delay)
+            with open(self.path, 'ab') as f:
+                f.write(data)
+
+        thread = threading.Thread(target=append)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def check_wakes_up_on_write(self, watcher):
+        self.addCleanup(watcher.close)
+        self.append_later(b'data')
+        start = time.time()
+        watcher.wait(10)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wakes_up_on_write(self):
+        self.check_wakes_up_on_write(FileWatcher(self.path))
+
+    def test_wakes_up_on_write_without_inotify(self):
+        with patch('ctypes.CDLL', side_effect=OSError):
+            watcher = FileWatcher(self.path)
+        self.assertIsNone(watcher._fd)
+        self.check_wakes_up_on_write(watcher)
+
+    def test_wait_times_out(self):
+        watcher = FileWatcher(self.path)
+        self.addCleanup(watcher.close)
+        start = time.time()
+        watcher.wait(0.3)
+        self.assertGreaterEqual(time.time() - start, 0.25)
+
+    def test_follower_streams_appended_data(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'skipped:first')
+        running = True
+        with closing(FileFollower(self.path, 8, lambda: running, timeout=30)) as follower:
+            self.assertEqual(b'first', follower.read())
+            self.append_later(b'second')
+            self.assertEqual(b'second', follower.read())
+            with open(self.path, 'ab') as f:
+                f.write(b'last')
+            running = False
+            self.assertEqual(b'la', follower.read(2))
+            self.assertEqual(b'st', follower.read())
+            self.assertEqual(b'', follower.read())
+
+    def test_follower_ends_at_timeout(self):
+        start = time.time()
+        follower = FileFollower(self.path, 0, lambda: True, timeout=0.3)
+        self.addCleanup(follower.close)
+        self.assertEqual(b'', follower.read())
+        self.assertLess(time.time() - start, 5)
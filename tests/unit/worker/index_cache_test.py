@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from threading import Thread
+
+from codalab.worker.index_cache import STALE_FILE_SECONDS, IndexCache
+
+
+class IndexCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = IndexCache(self.cache_dir, max_size_bytes=100)
+        self.fetches = []
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def fetch(self, contents):
+        def fetch_index(fileobj):
+            self.fetches.append(contents)
+            fileobj.write(contents)
+
+        return fetch_index
+
+    def read(self, key, version, contents=b'index'):
+        entry = self.cache.acquire(key, version, self.fetch(contents))
+        try:
+            with open(entry.path, 'rb') as f:
+                return f.read()
+        finally:
+            entry.release()
+
+    def test_hit_and_miss(self):
+        """Repeated opens of the same index only download it once."""
+        self.assertEqual(b'index', self.read('uuid1', 'v1'))
+        self.assertEqual(b'index', self.read('uuid1', 'v1'))
+        self.assertEqual(b'index', self.read('uuid1', 'v1'))
+        self.assertEqual([b'index'], self.fetches)
+        self.assertEqual({'hits': 2, 'misses': 1, 'evictions': 0}, self.cache.stats())
+
+    def test_new_version(self):
+        """A new version of an index is downloaded again."""
+        self.assertEqual(b'old', self.read('uuid1', 'v1', b'old'))
+        self.assertEqual(b'new', self.read('uuid1', 'v2', b'new'))
+        self.assertEqual([b'old', b'new'], self.fetches)
+
+    def test_failed_fetch(self):
+        """A failed download doesn't leave an entry behind."""
+
+        def fetch_index(fileobj):
+            fileobj.write(b'partial')
+            raise IOError('download failed')
+
+        with self.assertRaises(IOError):
+            self.cache.acquire('uuid1', 'v1', fetch_index)
+        self.assertEqual(b'index', self.read('uuid1', 'v1'))
+        self.assertEqual([b'index'], self.fetches)
+        self.assertFalse([name for name in os.listdir(self.cache_dir) if name.endswith('.tmp')])
+
+    def test_evicts_least_recently_used(self):
+        """Once the cache is over its size, the least recently used indexes are removed."""
+        self.read('uuid1', 'v1', b'1' * 40)
+        time.sleep(0.01)
+        self.read('uuid2', 'v1', b'2' * 40)
+        time.sleep(0.01)
+        # A hit makes uuid1 the most recently used index.
+        self.read('uuid1', 'v1')
+        time.sleep(0.01)
+        self.read('uuid3', 'v1', b'3' * 40)
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+        self.fetches = []
+        self.read('uuid1', 'v1')
+        self.read('uuid3', 'v1')
+        self.assertEqual([], self.fetches)
+        self.read('uuid2', 'v1')
+        self.assertEqual([b'index'], self.fetches)
+
+    def test_does_not_evict_entries_in_use(self):
+        """Indexes that are being opened are not evicted."""
+        entry = self.cache.acquire('uuid1', 'v1', self.fetch(b'1' * 80))
+        self.read('uuid2', 'v1', b'2' * 80)
+        self.assertTrue(os.path.exists(entry.path))
+        entry.release()
+
+    def test_evicts_lock_files(self):
+        """Lock files are removed with their entry."""
+        self.read('uuid1', 'v1', b'1' * 80)
+        self.read('uuid2', 'v1', b'2' * 80)
+        self.assertEqual(
+            ['uuid2'],
+            [
+                name.split('-')[0]
+                for name in os.listdir(self.cache_dir)
+                if name.startswith('uuid') and name.endswith('.lock')
+            ],
+        )
+
+    def test_removes_stale_files(self):
+        """Temporary files of crashed downloads and lock files of invalidated entries are
+        removed once they are old."""
+        self.read('uuid1', 'v1')
+        self.cache.invalidate('uuid1')
+        tmp_path = os.path.join(self.cache_dir, 'crashed.tmp')
+        open(tmp_path, 'w').close()
+        new_tmp_path = os.path.join(self.cache_dir, 'downloading.tmp')
+        open(new_tmp_path, 'w').close()
+        stale_time = time.time() - STALE_FILE_SECONDS - 1
+        for name in os.listdir(self.cache_dir):
+            if name != 'downloading.tmp':
+                os.utime(os.path.join(self.cache_dir, name), (stale_time, stale_time))
+
+        self.read('uuid2', 'v1')
+        self.assertEqual(
+            ['downloading.tmp', 'uuid2'],
+            sorted(
+                name.split('-')[0]
+                for name in os.listdir(self.cache_dir)
+                if name.endswith(('.lock', '.tmp')) and not name.startswith('.')
+            ),
+        )
+
+    def test_invalidate(self):
+        self.read('uuid1', 'v1')
+        self.cache.invalidate('uuid1')
+        self.read('uuid1', 'v1')
+        self.assertEqual([b'index', b'index'], self.fetches)
+
+    def test_concurrent_misses(self):
+        """Concurrent opens of an index that isn't cached download it once."""
+        results = []
+
+        def fetch_index(fileobj):
+            time.sleep(0.1)
+            self.fetches.append(b'index')
+            fileobj.write(b'index')
+
+        def read():
+            entry = self.cache.acquire('uuid1', 'v1', fetch_index)
+            with open(entry.path, 'rb') as f:
+                results.append(f.read())
+            entry.release()
+
+        threads = [Thread(target=read) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([b'index'] * 5, results)
+        self.assertEqual([b'index'], self.fetches)
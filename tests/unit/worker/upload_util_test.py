@@ -0,0 +1,130 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from codalab.worker.upload_util import DiskQuotaLease, build_upload_manifest
+
+
+class FakeJsonApiClient:
+    """Keeps track of a user's disk usage like the /user and /user/increment_disk_used endpoints."""
+
+    def __init__(self, disk_used, disk_quota):
+        self.disk_used = disk_used
+        self.disk_quota = disk_quota
+        self.increments = []
+        self.fetches = 0
+        self.report_started = threading.Event()
+        self.unblock_report = threading.Event()
+        self.unblock_report.set()
+
+    def fetch(self, resource_type):
+        self.fetches += 1
+        return {'disk_used': self.disk_used, 'disk_quota': self.disk_quota}
+
+    def update(self, resource_type, data):
+        self.report_started.set()
+        self.unblock_report.wait()
+        self.increments.append(data['disk_used_increment'])
+        self.disk_used += data['disk_used_increment']
+        return {'disk_used': self.disk_used, 'disk_quota': self.disk_quota}
+
+
+class DiskQuotaLeaseTest(unittest.TestCase):
+    def test_reports_all_bytes(self):
+        """All uploaded bytes are reported, in increments of about report_interval_bytes."""
+        client = FakeJsonApiClient(disk_used=0, disk_quota=1000)
+        lease = DiskQuotaLease(client, 'uuid', report_interval_bytes=100)
+        for _ in range(45):
+            lease.consume(10)
+            if lease._report_thread:
+                lease._report_thread.join()
+        lease.finish()
+        self.assertEqual(450, client.disk_used)
+        self.assertEqual([100, 100, 100, 100, 50], client.increments)
+        self.assertEqual(1, client.fetches)
+
+    def test_quota_exceeded(self):
+        client = FakeJsonApiClient(disk_used=900, disk_quota=1000)
+        lease = DiskQuotaLease(client, 'uuid', report_interval_bytes=100)
+        lease.consume(60)
+        lease.consume(40)
+        with self.assertRaisesRegex(Exception, 'quota exceeded'):
+            lease.consume(1)
+
+    def test_already_over_quota(self):
+        client = FakeJsonApiClient(disk_used=1200, disk_quota=1000)
+        lease = DiskQuotaLease(client, 'uuid')
+        with self.assertRaisesRegex(Exception, 'quota exceeded'):
+            lease.consume(1)
+
+    def test_renewal_accounts_for_other_uploads(self):
+        """A renewal shrinks the budget by the bytes the user has uploaded elsewhere."""
+        client = FakeJsonApiClient(disk_used=0, disk_quota=1000)
+        lease = DiskQuotaLease(client, 'uuid', report_interval_bytes=100)
+        client.disk_used += 800  # Another upload
+        lease.consume(100)
+        lease._report_thread.join()
+        lease.consume(100)
+        with self.assertRaisesRegex(Exception, 'quota exceeded'):
+            lease.consume(1)
+
+    def test_consume_does_not_wait_for_report(self):
+        client = FakeJsonApiClient(disk_used=0, disk_quota=1000)
+        client.unblock_report.clear()
+        lease = DiskQuotaLease(client, 'uuid', report_interval_bytes=100)
+        lease.consume(100)
+        client.report_started.wait()
+        # The report is in flight, so these bytes are only accounted locally.
+        lease.consume(100)
+        lease.consume(100)
+        self.assertEqual([], client.increments)
+        client.unblock_report.set()
+        lease.finish()
+        self.assertEqual([100, 200], client.increments)
+
+
+class BuildUploadManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'subdir', 'cache'))
+        for path, contents in [('file', b'testing'), ('subdir/file.pyc', b''), ('subdir/x', b'x')]:
+            with open(os.path.join(self.directory, path), 'wb') as f:
+                f.write(contents)
+        os.symlink('file', os.path.join(self.directory, 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_manifest(self):
+        manifest = build_upload_manifest(self.directory, exclude_patterns=['*.pyc', 'cache'])
+        self.assertEqual(
+            ['.', 'file', 'link', 'subdir', 'subdir/x'], [entry['path'] for entry in manifest]
+        )
+        entries = {entry['path']: entry for entry in manifest}
+        self.assertEqual('directory', entries['.']['type'])
+        self.assertEqual(hashlib.sha256(b'testing').hexdigest(), entries['file']['sha256'])
+        self.assertEqual(7, entries['file']['size'])
+        self.assertEqual(
+            {'type': 'link', 'target': 'file'},
+            {key: entries['link'][key] for key in ('type', 'target')},
+        )
+
+    def test_file_hashes_are_cached(self):
+        file_hashes = {}
+        build_upload_manifest(self.directory, file_hashes=file_hashes)
+        path = os.path.join(self.directory, 'file')
+        size, mtime_ns, _ = file_hashes[path]
+        # A cached hash is reused as long as the size and modification time are the same.
+        file_hashes[path] = (size, mtime_ns, 'cached')
+        entries = {
+            e['path']: e for e in build_upload_manifest(self.directory, file_hashes=file_hashes)
+        }
+        self.assertEqual('cached', entries['file']['sha256'])
+        os.utime(path, ns=(mtime_ns + 10 ** 9, mtime_ns + 10 ** 9))
+        entries = {
+            e['path']: e for e in build_upload_manifest(self.directory, file_hashes=file_hashes)
+        }
+        self.assertEqual(hashlib.sha256(b'testing').hexdigest(), entries['file']['sha256'])